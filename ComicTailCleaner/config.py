@@ -106,6 +106,10 @@ default_config = {
     # --- 比對模式與閾值 ---
     'comparison_mode': 'ad_comparison',
     'similarity_threshold': 95,
+    # 旋轉容差比對：90/180/270 度變體由 DCT 係數推導，不重新旋轉整張圖。180 度與實際旋轉後計算的結果逐位元相同；
+    # 90/270 度因縮圖兩趟捨入順序不同，主 pHash 可接受至多 10 bits、紋理格子每格至多 8 bits 的差異
+    # (漸層格子平均至多 8 bits)，預算見 tests/test_rotation_hashes.py
+    'enable_rotation_matching': False,
 
     # --- 時間篩選設定 ---
     'enable_time_filter': False,
@@ -115,12 +119,29 @@ default_config = {
     # --- QR Code 相關設定 ---
     'enable_qr_hybrid_mode': True,
     'enable_qr_color_filter': False,
+    'enable_qr_fused_color_filter': True,
     'qr_resize_size': 1000,
     'qr_pages_per_archive': 10,
     'qr_global_cap': 20000,
+    # 偵測階段順序 (finder = 定位圖案快篩；移除即停用)，可用 processors.qr_cascade.benchmark_stage_orders 比較
+    # 含 roi 時，縮圖上被 finder 拒絕的頁面會再以原圖原解析度檢查定位圖案，小型 QR 不會被閘門擋掉
+    'qr_stage_order': ['finder', 'pyzbar', 'opencv', 'clahe', 'adaptive', 'roi'],
+    'qr_finder_min_candidates': 1,
 
     # --- 性能與進階設定 ---
     'worker_processes': 0,
+    'dispatch_target_chunk_seconds': 0.5,
+    'dispatch_max_chunk': 64,
+    'worker_max_tasks_per_child': 200,
+    'cache_validation_tier': 'sampled',
+    'cache_validation_sample_rate': 0.02,
+    'cache_trust_full_verify_below': 0.25,
+    'cache_trust_reduced_sampling_above': 0.9,
+    'enable_io_scheduler': True,
+    'io_rotational_concurrency': 1,
+    'io_solid_state_concurrency': 0,
+    'io_unknown_as_rotational': False,
+    'io_device_concurrency': {},
     'ux_scan_start_delay': 0.1,
     'enable_inter_folder_only': True,
     'enable_ad_cross_comparison': True,
@@ -141,6 +162,30 @@ default_config = {
     "first_scan_extract_count": 0,
     'enable_quarantine': True,
     'enable_quick_digest': True,
+    # 以 (內容大小, qd64) 與選項簽章定址的全域特徵庫：其他根目錄掃過的同一檔案、同磁碟內改名 / 搬移的圖片免重新解碼
+    'enable_content_feature_store': True,
+    # 快取生命週期：age/size/entries 預算為 0 表示不限制；淘汰以資料夾為單位，依 last_seen 由舊到新
+    # 年齡預算預設不啟用：離線的外接磁碟 / 暫時未掃描的根目錄不應因久未見而失去快取
+    'enable_cache_lifecycle': True,
+    'cache_max_age_days': 0,
+    'cache_max_size_mb': 0,
+    'cache_max_entries': 0,
+    'cache_eviction_protect_hours': 24,
+    'cache_maintenance_time_budget': 5.0,
+    # 整檔依路徑順序重寫 (耗時與資料庫大小成正比，且須無其他連線開啟同一快取)；預設關閉，只做 incremental_vacuum
+    'enable_cache_compaction': False,
+    'cache_compaction_interval_days': 30,
+    # 相似度比對以 memmap 欄式快照載入圖庫雜湊 (快照存於快取資料庫旁的 .snapshot 資料夾)
+    'enable_hash_snapshot': True,
+    # 互比模式 Phase A 全配對核心：tile 邊長 (每執行緒暫存約 13 * tile² 位元組) 與執行緒數 (0 = CPU 核心數)
+    'mutual_pair_tile_size': 1024,
+    'mutual_pair_workers': 0,
+
+    # --- 解碼加速 (JPEG draft 縮放解碼) ---
+    'enable_draft_decode': True,
+    'draft_decode_oversample': 4,
+    'draft_verify_rate': 0.02,
+    'draft_bit_budget': 2,
 
     # --- UI 顯示設定 ---
     'page_size': 'all',
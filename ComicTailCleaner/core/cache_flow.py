@@ -4,14 +4,22 @@
 # ======================================================================
 
 import os
-import sys
 import time
-from multiprocessing import Pool, set_start_method
+from collections import defaultdict
+from multiprocessing import Manager
 from os import cpu_count
 
-from processors.scanner import ScannedImageCacheManager
+from core.cache_lifecycle import CacheLifecyclePolicy, merge_lifecycle_stats
+from core.cache_validation import CacheValidationPolicy, merge_validation_stats
+from core.dispatch import StreamingDispatcher
+from core.features import DRAFT_REPORT_KEY, phash_feature_version
+from core.io_scheduler import IoScheduler, format_io_report, log_io_plan, merge_io_stats
+from core.pool_service import worker_pool_service
+from processors.qr_cascade import QR_STAGE_STATS_KEY, format_stage_stats, merge_stage_stats
+from processors.scanner import ContentFeatureStore, FolderStateCacheManager, ScannedImageCacheManager, file_ident
 from utils import (
     _calculate_quick_digest,
+    _get_file_stat,
     _is_virtual_path,
     _norm_key,
     _parse_virtual_path,
@@ -25,73 +33,251 @@ class CacheFlowMixin:
     """Cache-flow helpers for ImageComparisonEngine.
 
     This mixin is intentionally narrow for the first O1 split. It only hosts
-    helpers that were already extracted from the main flow and does not change
-    the multiprocessing model or cache semantics.
+    helpers that were already extracted from the main flow; worker jobs are
+    streamed through core.dispatch.StreamingDispatcher without changing cache
+    semantics.
     """
 
     def _ensure_worker_pool(self) -> int:
         user_proc_setting = self.config.get('worker_processes', 0)
         pool_size = max(1, min(user_proc_setting, cpu_count())) if user_proc_setting > 0 else max(1, min(cpu_count() // 2, 8))
         if not self.pool:
-            if sys.platform.startswith('win'):
-                try:
-                    set_start_method('spawn', force=True)
-                except RuntimeError:
-                    pass
-            self.pool = Pool(processes=pool_size)
+            self.pool = worker_pool_service.acquire(pool_size, self.config.get('worker_max_tasks_per_child', 200))
         return pool_size
 
-    def _submit_worker_jobs(self, paths_to_recalc: list[str], worker_function: callable) -> tuple[list, dict]:
-        async_results = []
-        path_map = {}
+    def _build_dispatcher(self, worker_function: callable, jobs: list, pool_size: int) -> StreamingDispatcher:
+        return StreamingDispatcher(
+            self.pool,
+            worker_function,
+            jobs,
+            pool_size,
+            control=self._check_control,
+            target_chunk_seconds=float(self.config.get('dispatch_target_chunk_seconds', 0.5)),
+            max_chunk=int(self.config.get('dispatch_max_chunk', 64)),
+            io_plan=self._plan_io(jobs),
+        )
+
+    def _io_manager(self):
+        # 跨進程 Semaphore 由 Manager 提供；只有需要限流的裝置存在時才建立，掃描結束由 _release_manager 回收
+        if not getattr(self, 'manager', None):
+            self.manager = Manager()
+        return self.manager
+
+    def _plan_io(self, jobs: list):
+        if not self.config.get('enable_io_scheduler', True):
+            return None
+        try:
+            plan = IoScheduler(self.config, self._io_manager).plan(key for key, _ in jobs)
+        except Exception as e:
+            log_warning(f"[I/O 排程] 規劃失敗，改為不限流: {e}")
+            return None
+        log_io_plan(plan)
+        return plan
+
+    def _log_io_throughput(self, dispatcher: StreamingDispatcher, description: str) -> None:
+        if not dispatcher.io_stats or dispatcher.started_at is None:
+            return
+        wall_seconds = time.perf_counter() - dispatcher.started_at
+        labelled = {}
+        for dev, values in dispatcher.io_stats.items():
+            label = dispatcher.io_plan.label(dev) if dispatcher.io_plan else f"dev {dev}"
+            merge_io_stats(labelled, {label: values})
+        log_info(f"[I/O 吞吐] {description}: {format_io_report(labelled, wall_seconds)}")
+        merge_io_stats(self.cache_stats.setdefault('io_devices', {}), labelled)
+        self.cache_stats['io_wall_seconds'] = self.cache_stats.get('io_wall_seconds', 0.0) + wall_seconds
+
+    def _build_worker_jobs(self, paths_to_recalc: list[str], worker_function: callable) -> list[tuple]:
+        jobs = []
         for path in paths_to_recalc:
             payload = self._build_worker_payload(worker_function, path)
-            args_to_pass = payload if isinstance(payload, tuple) else (payload,)
-            res = self.pool.apply_async(worker_function, args=args_to_pass)
-            async_results.append(res)
-            path_map[res] = path
-        return async_results, path_map
+            jobs.append((path, payload if isinstance(payload, tuple) else (payload,)))
+        return jobs
 
-    def _handle_ready_worker_result(
+    def _handle_worker_outcome(
         self,
-        res,
-        path_map: dict,
+        job_path: str,
+        ok: bool,
+        value,
         cache_manager: ScannedImageCacheManager,
         local_file_data: dict,
+        prior_features: dict,
         progress_scope: str,
         local_completed: int,
     ) -> int:
         try:
-            path_done, data = res.get()
+            if not ok:
+                raise RuntimeError(value)
+            path_done, data = value
             if data.get('error'):
                 self.failed_tasks.append((path_done, data['error']))
                 if "不存在" in data['error']:
                     cache_manager.remove_data(path_done)
             else:
-                if self.config.get('enable_quick_digest', True):
-                    data['qd64'] = _calculate_quick_digest(path_done)
-
-                feature_bit = self._feature_bits_from_result(data)
-                existing = cache_manager.get_data(path_done) or {}
-                data['features_at'] = existing.get('features_at', 0) | feature_bit
+                self._record_draft_report(data.pop(DRAFT_REPORT_KEY, None))
+                merge_stage_stats(self.cache_stats.setdefault('qr_stages', {}), data.pop(QR_STAGE_STATS_KEY, None))
+                # qd64 由 worker 以開圖時已讀入的檔頭計算；worker 未回傳時留空，不在主執行緒重讀檔案 (或重新解壓成員)，
+                # 之後由快取驗證策略在需要時補算
+                qd64 = data.pop('qd64', None)
+                content_size = data.pop('content_size', None)
+                if qd64 and self.config.get('enable_quick_digest', True):
+                    data['qd64'] = qd64
+
+                identity = self.file_identity_map.get(path_done)
+                if identity and identity[1]:
+                    data['inode'] = identity[1]
+
+                data['features_at'] = prior_features.get(path_done, 0) | self._feature_bits_from_result(data)
                 local_file_data.setdefault(path_done, {}).update(data)
                 cache_manager.update_data(path_done, data)
+                self._publish_content_features(path_done, data, content_size)
 
             if progress_scope == 'global':
                 self.completed_task_count += 1
             else:
                 local_completed += 1
         except Exception as e:
-            path_done = path_map.get(res, "未知路徑")
             error_msg = f"工作進程處理失敗: {e}"
             log_error(error_msg, True)
-            self.failed_tasks.append((path_done, error_msg))
+            self.failed_tasks.append((job_path, error_msg))
             if progress_scope == 'global':
                 self.completed_task_count += 1
             else:
                 local_completed += 1
         return local_completed
 
+    def _content_store(self):
+        """全域內容特徵庫 (整個引擎共用一個連線)；停用或未啟用 qd64 時回傳 None。"""
+        if not self.config.get('enable_content_feature_store', True) or not self.config.get('enable_quick_digest', True):
+            return None
+        store = getattr(self, 'content_store', None)
+        if store is None:
+            store = self.content_store = ContentFeatureStore()
+        return store
+
+    def _content_signature(self) -> str:
+        """影響特徵值的選項簽章 (pHash 版本、前處理、雜湊解析度、旋轉)；內容特徵庫依此分開存放。"""
+        use_rotation, use_preprocess, hash_resolution = self._hash_options()
+        return f"v{phash_feature_version()}-p{int(use_preprocess)}-r{hash_resolution}-o{int(use_rotation)}"
+
+    def _content_ident(self, path: str, mtime) -> str:
+        size, inode = self.file_identity_map.get(path) or (None, None)
+        return file_ident(path, size, mtime, inode)
+
+    def _publish_content_features(self, path: str, data: dict, content_size) -> None:
+        store = self._content_store()
+        if store is None or not data.get('qd64'):
+            return
+        # 一般檔案的 size 即內容大小；壓縮檔內圖片的 size 是壓縮檔大小，只能用 worker 回報的成員大小
+        if content_size is None and not _is_virtual_path(path):
+            content_size = data.get('size')
+        store.publish(
+            content_size, data['qd64'], data, self._content_signature(),
+            path=path, ident=self._content_ident(path, data.get('mtime')),
+        )
+
+    def _reuse_content_features(
+        self,
+        paths_to_recalc: list[str],
+        cache_manager: ScannedImageCacheManager,
+        local_file_data: dict,
+        data_key: str,
+        progress_scope: str,
+        local_completed: int,
+        file_mtimes: dict,
+    ) -> tuple[list[str], int, int]:
+        """
+        快取未命中的檔案先查全域內容特徵庫的路徑對照表 (以盤點時的 size / mtime / inode 確認檔案未變)，
+        不讀取任何圖片；命中且選項簽章相同、特徵足夠者直接寫回本根目錄快取，不再派發解碼。
+        回傳 (仍需重算的路徑, local_completed, 重用筆數)。
+        """
+        store = self._content_store()
+        if store is None or not paths_to_recalc:
+            return paths_to_recalc, local_completed, 0
+        idents = {path: self._content_ident(path, file_mtimes.get(path)) for path in paths_to_recalc}
+        movable = {path for path in paths_to_recalc if (self.file_identity_map.get(path) or (None, None))[1]}
+        cids = store.lookup_content_keys(idents, movable)
+        if not cids:
+            return paths_to_recalc, local_completed, 0
+
+        signature = self._content_signature()
+        found = store.get_many(store.store_key(cid, signature) for cid in set(cids.values()))
+        remaining, reused = [], 0
+        for path in paths_to_recalc:
+            cid = cids.get(path)
+            key = _norm_key(store.store_key(cid, signature)) if cid else None
+            features = found.get(key) if key else None
+            if not features or not self._has_required_features(features, data_key):
+                remaining.append(path)
+                continue
+            size, ctime, mtime = _get_file_stat(path)
+            if mtime is None:
+                remaining.append(path)
+                continue
+            data = dict(features)
+            data.update({'size': size, 'ctime': ctime, 'mtime': mtime, 'qd64': cid.split(":", 1)[1]})
+            identity = self.file_identity_map.get(path)
+            if identity and identity[1]:
+                data['inode'] = identity[1]
+            existing = local_file_data.get(path) or {}
+            data['features_at'] = existing.get('features_at', 0) | self._feature_bits_from_entry(data)
+            cache_manager.update_data(path, data)
+            local_file_data.setdefault(path, {}).update(self._normalize_cached_hashes(data))
+            # 以身分命中的新路徑 (改名 / 搬移) 記入對照表，下次直接以路徑命中
+            store.record_path(path, idents[path], cid)
+            store.touch((key,))
+            reused += 1
+            if progress_scope == 'global':
+                self.completed_task_count += 1
+            else:
+                local_completed += 1
+        return remaining, local_completed, reused
+
+    def _identity_backfill(self, path: str, cached_data: dict) -> dict:
+        """舊快取缺少 size / inode 時，以本輪盤點結果補寫 (不需讀檔)，之後即可用 stat 分級驗證。"""
+        identity = self.file_identity_map.get(path)
+        if not identity:
+            return {}
+        backfill = {}
+        size, inode = identity
+        if size is not None and cached_data.get('size') is None:
+            backfill['size'] = size
+        if inode and not cached_data.get('inode'):
+            backfill['inode'] = inode
+        return backfill
+
+    def _finish_validation_run(self, policy: CacheValidationPolicy, cache_manager: ScannedImageCacheManager, description: str) -> None:
+        cache_manager.save_folder_trust(policy.finish_run())
+        merge_validation_stats(self.cache_stats.setdefault('validation', {}), policy.stats)
+        log_info(f"[快取驗證] {description}: 策略={policy.tier}, {policy.describe()}")
+
+    def _record_draft_report(self, report) -> None:
+        if not report or not report.get('checked'):
+            return
+        stats = self.cache_stats
+        stats['draft_checked'] = stats.get('draft_checked', 0) + 1
+        if report.get('over_budget'):
+            stats['draft_over_budget'] = stats.get('draft_over_budget', 0) + 1
+        stats['draft_max_phash_drift'] = max(stats.get('draft_max_phash_drift', 0), report.get('phash_bits') or 0)
+        stats['draft_max_grid_drift'] = max(stats.get('draft_max_grid_drift', 0), report.get('grid_max_bits') or 0)
+
+    def _log_draft_fidelity(self, description: str, checked_before: int) -> None:
+        checked = self.cache_stats.get('draft_checked', 0)
+        if checked <= checked_before:
+            return
+        log_info(
+            f"[Draft 解碼] {description}: 抽驗 {checked - checked_before} 張, "
+            f"超出預算 {self.cache_stats.get('draft_over_budget', 0)} 張 (已改用完整解碼), "
+            f"pHash 最大漂移 {self.cache_stats.get('draft_max_phash_drift', 0)} bits, "
+            f"Grid 單格最大漂移 {self.cache_stats.get('draft_max_grid_drift', 0)} bits"
+        )
+
+    def _qr_stage_calls(self) -> int:
+        return sum(entry.get('calls', 0) for entry in self.cache_stats.get('qr_stages', {}).values())
+
+    def _log_qr_stage_stats(self, description: str, calls_before: int) -> None:
+        if self._qr_stage_calls() > calls_before:
+            log_info(f"[QR 階段統計] {description} (累計): {format_stage_stats(self.cache_stats['qr_stages'])}")
+
     def _update_processing_progress(self, progress_scope: str, description: str, local_completed: int, local_total: int) -> None:
         if progress_scope == 'global':
             if self.total_task_count > 0:
@@ -136,12 +322,12 @@ class CacheFlowMixin:
             local_total,
         )
 
-    def _process_async_worker_loop(
+    def _process_streaming_results(
         self,
-        async_results: list,
-        path_map: dict,
+        dispatcher: StreamingDispatcher,
         cache_manager: ScannedImageCacheManager,
         local_file_data: dict,
+        prior_features: dict,
         progress_scope: str,
         description: str,
         local_completed: int,
@@ -149,26 +335,18 @@ class CacheFlowMixin:
     ) -> tuple[bool, int]:
         last_qr_heartbeat = time.time()
 
-        while async_results:
-            if self._check_control() == 'cancel':
-                self._cleanup_pool()
-                return False, local_completed
-
-            remaining_results = []
-            for res in async_results:
-                if res.ready():
-                    local_completed = self._handle_ready_worker_result(
-                        res,
-                        path_map,
-                        cache_manager,
-                        local_file_data,
-                        progress_scope,
-                        local_completed,
-                    )
-                else:
-                    remaining_results.append(res)
-
-            async_results = remaining_results
+        for batch in dispatcher.iter_batches():
+            for job_path, ok, value in batch:
+                local_completed = self._handle_worker_outcome(
+                    job_path,
+                    ok,
+                    value,
+                    cache_manager,
+                    local_file_data,
+                    prior_features,
+                    progress_scope,
+                    local_completed,
+                )
             self._update_processing_progress(progress_scope, description, local_completed, local_total)
             last_qr_heartbeat = self._emit_qr_processing_heartbeat(
                 description,
@@ -177,8 +355,10 @@ class CacheFlowMixin:
                 local_total,
                 last_qr_heartbeat,
             )
-            time.sleep(0.05)
 
+        if dispatcher.cancelled:
+            self._cleanup_pool()
+            return False, local_completed
         return True, local_completed
 
     def _process_images_with_cache(
@@ -195,8 +375,8 @@ class CacheFlowMixin:
         time.sleep(self.config.get('ux_scan_start_delay', 0.1))
         self._update_progress(text=f"📂 正在檢查 {len(current_task_list)} 個{description}的快取...")
 
-        use_quick_digest = self.config.get('enable_quick_digest', True)
-        file_mtimes = self._collect_file_mtimes(current_task_list, description)
+        policy = CacheValidationPolicy.from_config(self.config, cache_manager.load_folder_trust())
+        file_mtimes = self._collect_file_mtimes(current_task_list, description, with_inode=policy.needs_inode)
         if self._check_control() == 'cancel':
             return False, {}
 
@@ -206,8 +386,10 @@ class CacheFlowMixin:
             data_key,
             progress_scope,
             file_mtimes,
-            use_quick_digest,
+            policy,
         )
+        self._finish_validation_run(policy, cache_manager, description)
+        cache_manager.touch([path for path in current_task_list if file_mtimes.get(path) is not None])
         if not hasattr(self, 'cache_stats'):
             self.cache_stats = {'hit': 0, 'recalc': 0, 'purge': 0, 'rescan_folders': 0}
         self.cache_stats['hit'] += cache_hits
@@ -231,8 +413,23 @@ class CacheFlowMixin:
             local_total,
         )
 
+        paths_to_recalc, local_completed, reused = self._reuse_content_features(
+            paths_to_recalc,
+            cache_manager,
+            local_file_data,
+            data_key,
+            progress_scope,
+            local_completed,
+            file_mtimes,
+        )
+        if reused:
+            self.cache_stats['content_reuse'] = self.cache_stats.get('content_reuse', 0) + reused
+            self.cache_stats['recalc'] = max(0, self.cache_stats['recalc'] - reused)
+            log_info(f"[內容特徵庫] {description}: 由內容定址特徵庫取回 {reused} 筆，免重新解碼")
+
         if not paths_to_recalc:
-            cache_manager.save_cache()
+            cache_manager.save_cache(durable=True)
+            self._flush_content_store()
             return True, local_file_data
 
         continue_processing, local_completed = self._run_recalc_jobs(
@@ -246,11 +443,43 @@ class CacheFlowMixin:
             local_total,
         )
         if not continue_processing:
+            self._flush_content_store()
             return False, {}
 
-        cache_manager.save_cache()
+        cache_manager.save_cache(durable=True)
+        self._flush_content_store()
         return True, local_file_data
 
+    def _run_cache_maintenance(self) -> None:
+        """掃描結束後依生命週期策略淘汰 / 回收 / 重寫圖片快取與內容特徵庫。"""
+        if not self.config.get('enable_cache_lifecycle', True):
+            return
+        policy = CacheLifecyclePolicy.from_config(self.config)
+        total = self.cache_stats.setdefault('lifecycle', {})
+        scan_cache_manager = self.scan_cache_manager
+
+        def forget_folder_states(folders: list) -> None:
+            # 資料夾狀態快取若仍記為「未變更」，下次會從 (已淘汰的) 圖片快取恢復檔案清單而漏掉圖片
+            folder_cache = FolderStateCacheManager(self.config.get('root_scan_folder'))
+            try:
+                folder_cache.remove_folders(folders)
+            finally:
+                folder_cache.close()
+
+        targets = [(scan_cache_manager, forget_folder_states)]
+        if getattr(self, 'content_store', None) is not None:
+            targets.append((self.content_store, None))
+        for manager, on_evicted in targets:
+            try:
+                merge_lifecycle_stats(total, policy.run(manager, on_evicted))
+            except Exception as e:
+                log_warning(f"[快取維護] {manager.db_path} 維護失敗: {e}")
+
+    def _flush_content_store(self) -> None:
+        store = getattr(self, 'content_store', None)
+        if store is not None:
+            store.save_cache(durable=True)
+
     def _run_recalc_jobs(
         self,
         paths_to_recalc: list[str],
@@ -264,17 +493,40 @@ class CacheFlowMixin:
     ) -> tuple[bool, int]:
         pool_size = self._ensure_worker_pool()
         self._update_progress(text=f"⚙️ 啟動 {pool_size} 個工作進程，處理 {len(paths_to_recalc)} 筆{description}...")
-        async_results, path_map = self._submit_worker_jobs(paths_to_recalc, worker_function)
-        return self._process_async_worker_loop(
-            async_results,
-            path_map,
+        dispatcher = self._build_dispatcher(
+            worker_function,
+            self._build_worker_jobs(paths_to_recalc, worker_function),
+            pool_size,
+        )
+        draft_checked_before = self.cache_stats.get('draft_checked', 0)
+        qr_calls_before = self._qr_stage_calls()
+        result = self._process_streaming_results(
+            dispatcher,
             cache_manager,
             local_file_data,
+            self._prior_feature_bits(paths_to_recalc, local_file_data, cache_manager),
             progress_scope,
             description,
             local_completed,
             local_total,
         )
+        self._log_draft_fidelity(description, draft_checked_before)
+        self._log_qr_stage_stats(description, qr_calls_before)
+        self._log_io_throughput(dispatcher, description)
+        return result
+
+    def _prior_feature_bits(self, paths: list[str], local_file_data: dict, cache_manager: ScannedImageCacheManager) -> dict:
+        """
+        重算前既有的 features_at (重算結果須與之 OR)：工作計畫已預取的快取直接沿用，
+        計畫外的路徑 (例如重新掃描資料夾新增的) 以一次 get_many 補讀，不在每筆結果回來時各查一次。
+        """
+        prior = {path: local_file_data[path].get('features_at', 0) for path in paths if path in local_file_data}
+        missing = [path for path in paths if path not in prior]
+        if missing:
+            found = cache_manager.get_many(missing)
+            for path in missing:
+                prior[path] = (found.get(_norm_key(path)) or {}).get('features_at', 0)
+        return prior
 
     def _collect_cache_work_plan(
         self,
@@ -283,7 +535,7 @@ class CacheFlowMixin:
         data_key: str,
         progress_scope: str,
         file_mtimes: dict,
-        use_quick_digest: bool,
+        policy: CacheValidationPolicy,
     ) -> tuple[dict, list[str], set[str], set[str], int, int, int]:
         local_file_data = {}
         paths_to_recalc, cache_hits = [], 0
@@ -291,13 +543,15 @@ class CacheFlowMixin:
         paths_to_purge = set()
         local_total = len(current_task_list)
         local_completed = 0
+        # 一次批次預取整個任務清單的快取，取代逐筆 get_data 的 SQLite 往返
+        cached_map = cache_manager.get_many(current_task_list)
 
         for path in list(current_task_list):
             mt = file_mtimes.get(path)
+            cached_data = cached_map.get(_norm_key(path))
 
             if mt is None:
-                cached_data_for_purge = cache_manager.get_data(path)
-                if cached_data_for_purge:
+                if cached_data:
                     paths_to_purge.add(path)
 
                 parent_folder = os.path.dirname(path if not _is_virtual_path(path) else _parse_virtual_path(path)[0])
@@ -310,13 +564,12 @@ class CacheFlowMixin:
                     local_total = max(0, local_total - 1)
                 continue
 
-            cached_data = cache_manager.get_data(path)
             is_hit, needs_qd64_upgrade = self._is_cached_feature_hit(
                 cached_data,
                 mt,
                 path,
                 data_key,
-                use_quick_digest,
+                policy,
             )
 
             if is_hit:
@@ -331,13 +584,18 @@ class CacheFlowMixin:
                     cached_data['features_at'] = merged_features
                     cache_manager.update_data(_norm_key(path), {'features_at': merged_features, 'mtime': mt})
 
-                if use_quick_digest and needs_qd64_upgrade:
+                backfill = self._identity_backfill(path, cached_data)
+                if needs_qd64_upgrade:
                     try:
                         qd64_now = _calculate_quick_digest(path)
                         if qd64_now:
-                            cache_manager.update_data(_norm_key(path), {'qd64': qd64_now, 'mtime': mt, 'features_at': cached_data.get('features_at', 0)})
+                            backfill['qd64'] = qd64_now
                     except Exception as e:
-                        log_warning(f"[快取升級] 寫入 qd64 失敗: {path}: {e}")
+                        log_warning(f"[快取升級] 計算 qd64 失敗: {path}: {e}")
+                if backfill:
+                    cached_data.update(backfill)
+                    backfill.update({'mtime': mt, 'features_at': cached_data.get('features_at', 0)})
+                    cache_manager.update_data(_norm_key(path), backfill)
 
                 if progress_scope == 'global':
                     self.completed_task_count += 1
@@ -0,0 +1,131 @@
+# ======================================================================
+# 檔案名稱：core/cache_lifecycle.py
+# 模組目的：快取生命週期策略 (容量 / 年齡預算的 LRU 淘汰、空間回收、定期依路徑順序重寫)
+# ======================================================================
+
+import time
+from typing import Callable, List, Optional
+
+from utils import log_info
+
+DAY_SECONDS = 86400.0
+# 超出容量 / 筆數預算時淘汰到預算的此比例，避免每次執行都在邊界上反覆淘汰
+LOW_WATERMARK = 0.9
+# 不具 incremental auto_vacuum 的舊檔，空頁超過此比例 (且至少 MIN_FREE_BYTES) 時提前重寫
+COMPACT_FREE_RATIO = 0.25
+COMPACT_MIN_FREE_BYTES = 64 * 1024 * 1024
+
+
+class CacheLifecyclePolicy:
+    """
+    快取的 last_seen 以單位記錄 (圖片快取為資料夾，內容特徵庫為單筆)，每次掃描看見即戳記。
+    執行結束時依序：
+      1. 年齡預算：超過 max_age_days 未見的單位淘汰 (預設 0 = 不依年齡淘汰)；
+      2. 容量 / 筆數預算：仍超出時由最久未見的單位開始淘汰到預算的 LOW_WATERMARK；
+         protect_hours 內見過的單位 (含本輪) 永不淘汰；
+      3. 啟用整檔重寫 (compaction，預設關閉) 且距上次重寫超過 compaction_interval_days (或舊檔空頁過多) 時
+         整檔依路徑順序重寫，否則在 time_budget 內以 incremental_vacuum 歸還空頁；
+         整檔重寫耗時與資料庫大小成正比且不受 time_budget 限制，因此不在每次掃描結束時預設執行；
+      4. wal_checkpoint(TRUNCATE)。
+    """
+
+    def __init__(
+        self,
+        max_age_days: float = 0.0,
+        max_size_mb: float = 0.0,
+        max_entries: int = 0,
+        time_budget: float = 5.0,
+        compaction_interval_days: float = 30.0,
+        protect_hours: float = 24.0,
+        compaction: bool = False,
+    ):
+        self.max_age_days = max(0.0, float(max_age_days or 0))
+        self.max_bytes = max(0.0, float(max_size_mb or 0)) * 1024 * 1024
+        self.max_entries = max(0, int(max_entries or 0))
+        self.time_budget = max(0.0, float(time_budget or 0))
+        self.compaction_interval_days = max(0.0, float(compaction_interval_days or 0))
+        self.protect_seconds = max(0.0, float(protect_hours or 0)) * 3600.0
+        self.compaction = bool(compaction)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "CacheLifecyclePolicy":
+        return cls(
+            max_age_days=config.get('cache_max_age_days', 0),
+            max_size_mb=config.get('cache_max_size_mb', 0),
+            max_entries=config.get('cache_max_entries', 0),
+            time_budget=config.get('cache_maintenance_time_budget', 5.0),
+            compaction_interval_days=config.get('cache_compaction_interval_days', 30),
+            protect_hours=config.get('cache_eviction_protect_hours', 24),
+            compaction=config.get('enable_cache_compaction', False),
+        )
+
+    def plan_evictions(self, units: List[tuple], used_bytes: int, now: Optional[float] = None) -> List[str]:
+        """units 為 lifecycle_units() 的輸出 (由舊到新)；回傳應淘汰的單位。"""
+        now = time.time() if now is None else now
+        total_rows = sum(rows for _, _, rows in units)
+        if not total_rows:
+            return []
+        bytes_per_row = used_bytes / total_rows
+        age_cutoff = now - self.max_age_days * DAY_SECONDS if self.max_age_days else None
+        protect_cutoff = now - self.protect_seconds
+        row_target = self.max_entries * LOW_WATERMARK if self.max_entries and total_rows > self.max_entries else None
+        byte_target = self.max_bytes * LOW_WATERMARK if self.max_bytes and used_bytes > self.max_bytes else None
+
+        victims = []
+        remaining_rows = total_rows
+        for unit, last_seen, rows in units:
+            if last_seen >= protect_cutoff:
+                break
+            expired = age_cutoff is not None and last_seen < age_cutoff
+            over_rows = row_target is not None and remaining_rows > row_target
+            over_bytes = byte_target is not None and remaining_rows * bytes_per_row > byte_target
+            if not (expired or over_rows or over_bytes):
+                break
+            victims.append(unit)
+            remaining_rows -= rows
+        return victims
+
+    def compaction_due(self, manager, storage: dict, now: float) -> bool:
+        if not self.compaction or not self.compaction_interval_days or not storage:
+            return False
+        last = manager.get_meta("last_compaction") or manager.get_meta("lifecycle_since") or now
+        if now - last >= self.compaction_interval_days * DAY_SECONDS:
+            return True
+        pages = storage["pages"] or 1
+        return (
+            not storage["incremental_vacuum"]
+            and storage["free_bytes"] >= COMPACT_MIN_FREE_BYTES
+            and storage["free_pages"] / pages >= COMPACT_FREE_RATIO
+        )
+
+    def run(self, manager, on_evicted: Optional[Callable[[List[str]], None]] = None, now: Optional[float] = None) -> dict:
+        """對單一快取執行一輪維護；on_evicted 收到實際淘汰的單位 (例如同步清除資料夾狀態快取)。"""
+        now = time.time() if now is None else now
+        deadline = time.monotonic() + self.time_budget
+        stats = {'evicted_units': 0, 'evicted_rows': 0, 'reclaimed_pages': 0, 'compacted': 0}
+
+        storage = manager.storage_stats()
+        victims = self.plan_evictions(manager.lifecycle_units(), storage.get('used_bytes', 0), now)
+        if victims:
+            stats['evicted_rows'], evicted = manager.evict_units(victims, deadline)
+            stats['evicted_units'] = len(evicted)
+            if on_evicted and evicted:
+                on_evicted(evicted)
+            log_info(f"[快取維護] {manager.db_path}: 淘汰 {len(evicted)}/{len(victims)} 個單位, {stats['evicted_rows']} 筆")
+            storage = manager.storage_stats()
+
+        if self.compaction_due(manager, storage, now):
+            started = time.perf_counter()
+            if manager.compact():
+                stats['compacted'] = 1
+                log_info(f"[快取維護] 已依路徑順序重寫 {manager.db_path} ({time.perf_counter() - started:.1f}s)")
+        else:
+            stats['reclaimed_pages'] = manager.reclaim_free_pages(deadline)
+        manager.checkpoint()
+        return stats
+
+
+def merge_lifecycle_stats(total: dict, stats: dict) -> dict:
+    for name, value in stats.items():
+        total[name] = total.get(name, 0) + value
+    return total
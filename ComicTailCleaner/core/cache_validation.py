@@ -0,0 +1,176 @@
+# ======================================================================
+# 檔案名稱：core/cache_validation.py
+# 模組目的：快取命中驗證策略 (分級驗證 + 依資料夾信任分數調整 qd64 抽驗)
+# ======================================================================
+
+import os
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+
+from utils import _calculate_quick_digest, _is_virtual_path, _norm_key, _parse_virtual_path
+
+VALIDATION_TIERS = ("stat", "stat_inode", "sampled", "full")
+DEFAULT_TRUST = 0.5
+# 每次執行結束時的信任分數調整：有不一致即大幅扣分，整輪抽驗全數通過才緩慢加分
+TRUST_PENALTY_FACTOR = 0.25
+TRUST_REWARD_RATE = 0.2
+# POSIX 的 os.scandir 由目錄項目直接帶出 inode；Windows 的 DirEntry.inode() 需對每個檔案另做一次 stat
+INODE_FROM_SCANDIR = os.name != "nt"
+
+
+def trust_key(path: str) -> str:
+    """信任分數的單位：一般圖片為所在資料夾，壓縮檔內圖片為壓縮檔本身。"""
+    if _is_virtual_path(path):
+        archive_path, _ = _parse_virtual_path(path)
+        return _norm_key(archive_path or path)
+    return _norm_key(os.path.dirname(path))
+
+
+class CacheValidationPolicy:
+    """
+    mtime 相符的快取項目再依分級驗證，取代「每筆命中都重讀 64KB 算 qd64」：
+      stat       : 另比對檔案大小
+      stat_inode : 另比對 inode (整個檔案被替換時會改變)
+      sampled    : stat_inode + 每次執行抽驗部分檔案的 qd64，抽驗對象每輪不同
+      full       : 每筆命中都重算 qd64 (舊行為)
+
+    每個資料夾 (壓縮檔以檔案為單位) 保存信任分數：
+      - 本輪出現任何不一致 (大小 / inode / qd64) 的資料夾，剩餘檔案立即改用 full 驗證，結束時扣分；
+      - 分數低於 full_verify_below 的資料夾下一輪起仍用 full 驗證，直到抽驗重新通過；
+      - 分數高於 reduced_sampling_above 的資料夾抽驗率降為四分之一。
+    未啟用 quick digest 時不讀檔，最高只到 stat_inode。
+    Windows 上 inode 需逐檔額外 stat，只有明確選用 stat_inode 才收集；sampled / full 改由 qd64 抽驗把關。
+    """
+
+    def __init__(
+        self,
+        tier: str = "sampled",
+        sample_rate: float = 0.02,
+        trust_store: Optional[Dict[str, tuple]] = None,
+        use_quick_digest: bool = True,
+        full_verify_below: float = 0.25,
+        reduced_sampling_above: float = 0.9,
+        run_salt: Optional[str] = None,
+    ):
+        self.tier = tier if tier in VALIDATION_TIERS else "sampled"
+        if not use_quick_digest and self.tier in ("sampled", "full"):
+            self.tier = "stat_inode"
+        self.use_quick_digest = use_quick_digest
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.full_verify_below = float(full_verify_below)
+        self.reduced_sampling_above = float(reduced_sampling_above)
+        self.run_salt = run_salt if run_salt is not None else str(time.time_ns())
+        self.trust: Dict[str, tuple] = dict(trust_store or {})
+        self.stats = {name: 0 for name in VALIDATION_TIERS}
+        self.stats.update({"digest_reads": 0, "mismatches": 0})
+        # 本輪各信任單位的 [通過 qd64 驗證數, 不一致數]
+        self._run_outcomes: Dict[str, list] = {}
+
+    @classmethod
+    def from_config(cls, config: dict, trust_store: Optional[Dict[str, tuple]] = None) -> "CacheValidationPolicy":
+        return cls(
+            tier=config.get('cache_validation_tier', 'sampled'),
+            sample_rate=config.get('cache_validation_sample_rate', 0.02),
+            trust_store=trust_store,
+            use_quick_digest=config.get('enable_quick_digest', True),
+            full_verify_below=config.get('cache_trust_full_verify_below', 0.25),
+            reduced_sampling_above=config.get('cache_trust_reduced_sampling_above', 0.9),
+        )
+
+    @property
+    def needs_inode(self) -> bool:
+        if self.tier == "stat_inode":
+            return True
+        return self.tier != "stat" and INODE_FROM_SCANDIR
+
+    def score(self, key: str) -> float:
+        record = self.trust.get(key)
+        return float(record[0]) if record else DEFAULT_TRUST
+
+    def tier_for(self, key: str) -> str:
+        outcome = self._run_outcomes.get(key)
+        suspicious = (outcome and outcome[1]) or self.score(key) < self.full_verify_below
+        if suspicious:
+            return "full" if self.use_quick_digest else "stat_inode"
+        return self.tier
+
+    def _is_sampled(self, path: str, key: str) -> bool:
+        rate = self.sample_rate
+        if self.score(key) >= self.reduced_sampling_above:
+            rate /= 4.0
+        if rate <= 0:
+            return False
+        # 以路徑 + 本輪 salt 決定抽驗對象：結果可重現，且每輪抽到不同檔案
+        bucket = zlib.crc32(f"{self.run_salt}|{path}".encode("utf-8", errors="ignore")) % 10000
+        return bucket < rate * 10000
+
+    def _record(self, key: str, ok: bool) -> None:
+        outcome = self._run_outcomes.setdefault(key, [0, 0])
+        outcome[0 if ok else 1] += 1
+        if not ok:
+            self.stats["mismatches"] += 1
+
+    def validate(self, path: str, cached: dict, identity: Optional[tuple]) -> Tuple[bool, bool]:
+        """
+        cached 的 mtime 已由呼叫端比對相符。identity 為本輪盤點取得的 (size, inode)，可為 None。
+        回傳 (是否命中, 是否需補寫 qd64)。
+        """
+        key = trust_key(path)
+        tier = self.tier_for(key)
+        self.stats[tier] += 1
+
+        if identity:
+            size, inode = identity
+            cached_size = cached.get('size')
+            if size is not None and cached_size is not None and int(cached_size) != int(size):
+                self._record(key, False)
+                return False, False
+            cached_inode = cached.get('inode')
+            if tier != "stat" and inode and cached_inode and int(cached_inode) != int(inode):
+                self._record(key, False)
+                return False, False
+
+        if tier in ("stat", "stat_inode"):
+            return True, False
+        if tier == "sampled" and not self._is_sampled(path, key):
+            return True, False
+
+        cached_digest = cached.get('qd64')
+        if not cached_digest:
+            return True, True
+        self.stats["digest_reads"] += 1
+        digest_now = _calculate_quick_digest(path)
+        if not digest_now:
+            return False, False
+        ok = digest_now == cached_digest
+        self._record(key, ok)
+        return ok, False
+
+    def finish_run(self) -> Dict[str, tuple]:
+        """結算本輪信任分數，回傳有變動的 {key: (score, verified_runs, mismatches, updated_at)}。"""
+        now = time.time()
+        changed = {}
+        for key, (verified, mismatched) in self._run_outcomes.items():
+            score, runs, total_mismatches = self.trust.get(key, (DEFAULT_TRUST, 0, 0, 0.0))[:3]
+            if mismatched:
+                score *= TRUST_PENALTY_FACTOR
+                total_mismatches += mismatched
+            elif verified:
+                score += (1.0 - score) * TRUST_REWARD_RATE
+                runs += 1
+            else:
+                continue
+            changed[key] = self.trust[key] = (score, runs, total_mismatches, now)
+        self._run_outcomes = {}
+        return changed
+
+    def describe(self) -> str:
+        tiers = ", ".join(f"{name}={self.stats[name]}" for name in VALIDATION_TIERS if self.stats[name])
+        return f"{tiers or '無命中'}; qd64 讀取 {self.stats['digest_reads']} 次, 不一致 {self.stats['mismatches']} 筆"
+
+
+def merge_validation_stats(total: dict, stats: dict) -> dict:
+    for name, value in stats.items():
+        total[name] = total.get(name, 0) + value
+    return total
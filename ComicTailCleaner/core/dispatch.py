@@ -0,0 +1,143 @@
+# ======================================================================
+# 檔案名稱：core/dispatch.py
+# 模組目的：串流式工作派發 (分塊送出 + 完成即取回 + 依實測延遲自適應塊大小)
+# ======================================================================
+
+import math
+import queue
+import time
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from core.io_scheduler import merge_io_stats
+from utils import drain_io_stats, install_io_gates
+
+
+def _run_worker_chunk(worker_function: Callable, payloads: Sequence[tuple], io_gates=None) -> Tuple[List[tuple], float, dict]:
+    """
+    在子進程內依序執行一個分塊。單筆例外只記錄在該筆結果，不影響同塊其他圖片。
+    io_gates 為 core.io_scheduler 規劃的裝置閘門，安裝後本塊的讀檔依裝置限流。
+    回傳 ([(ok, value), ...], 純計算耗時秒數, 本塊的裝置 I/O 統計)。
+    """
+    install_io_gates(io_gates)
+    drain_io_stats()
+    outcomes = []
+    started = time.perf_counter()
+    for args in payloads:
+        try:
+            outcomes.append((True, worker_function(*args)))
+        except Exception as e:
+            outcomes.append((False, str(e)))
+    return outcomes, time.perf_counter() - started, drain_io_stats()
+
+
+class StreamingDispatcher:
+    """
+    取代「每張圖一次 apply_async + 50ms 輪詢全部結果」的派發器。
+
+    - 同時在途的分塊數受限 (每個 worker 預設 2 塊)，其餘工作留在主進程，不一次塞滿 IPC。
+    - 分塊完成時由 pool 的 callback 放進佇列，主進程阻塞等待，不再重複掃描未完成清單。
+    - 塊大小依實測的單張處理延遲調整，讓每塊約耗時 target_chunk_seconds；
+      剩餘工作不足時自動縮小，避免尾端只剩少數 worker 在跑。
+    - 暫停時停止送出新塊 (在途塊照常收回)；取消時立即停止產出，由呼叫端終結進程池。
+    - 各塊回報的裝置 I/O 統計累計於 io_stats，供呼叫端輸出各裝置吞吐量。
+    """
+
+    def __init__(
+        self,
+        pool,
+        worker_function: Callable,
+        jobs: Sequence[Tuple[Any, tuple]],
+        pool_size: int,
+        control: Optional[Callable[[], str]] = None,
+        target_chunk_seconds: float = 0.5,
+        max_chunk: int = 64,
+        window_per_worker: int = 2,
+        io_plan=None,
+    ):
+        self.pool = pool
+        self.worker_function = worker_function
+        self.jobs = list(jobs)
+        self.pool_size = max(1, int(pool_size))
+        self.control = control or (lambda: 'continue')
+        self.target_chunk_seconds = max(0.01, float(target_chunk_seconds))
+        self.max_chunk = max(1, int(max_chunk))
+        self.max_in_flight = self.pool_size * max(1, int(window_per_worker))
+        self.cancelled = False
+        self.item_latency: Optional[float] = None
+        self.chunks_done = 0
+        self.io_plan = io_plan
+        self.io_gates = io_plan.worker_gates if io_plan is not None else None
+        self.io_stats: dict = {}
+        self.started_at: Optional[float] = None
+        self._next_job = 0
+        self._in_flight = 0
+        self._done_queue: "queue.Queue" = queue.Queue()
+
+    def _chunk_size(self) -> int:
+        remaining = len(self.jobs) - self._next_job
+        # 首輪尚無延遲資料：先送單張探測，快速取得第一筆量測
+        if self.item_latency is None:
+            size = 1
+        else:
+            size = int(self.target_chunk_seconds / max(self.item_latency, 1e-6))
+        fair_share = math.ceil(remaining / self.max_in_flight) if remaining else 1
+        return max(1, min(size, self.max_chunk, fair_share))
+
+    def _submit_next_chunk(self) -> None:
+        size = self._chunk_size()
+        start = self._next_job
+        chunk = self.jobs[start:start + size]
+        self._next_job += len(chunk)
+        self._in_flight += 1
+        keys = [key for key, _ in chunk]
+
+        def _on_done(result, keys=keys):
+            self._done_queue.put((keys, result, None))
+
+        def _on_error(exc, keys=keys):
+            self._done_queue.put((keys, None, exc))
+
+        self.pool.apply_async(
+            _run_worker_chunk,
+            args=(self.worker_function, [args for _, args in chunk], self.io_gates),
+            callback=_on_done,
+            error_callback=_on_error,
+        )
+
+    def _record_latency(self, elapsed: float, count: int) -> None:
+        if count <= 0:
+            return
+        sample = elapsed / count
+        self.item_latency = sample if self.item_latency is None else 0.7 * self.item_latency + 0.3 * sample
+
+    def iter_batches(self, poll_interval: float = 0.2) -> Iterator[List[Tuple[Any, bool, Any]]]:
+        """
+        逐塊產出 [(key, ok, value), ...]；ok 為 False 時 value 為錯誤訊息。
+        取消時停止產出並設定 self.cancelled。
+        """
+        self.started_at = time.perf_counter()
+        while self._next_job < len(self.jobs) or self._in_flight:
+            state = self.control()
+            if state == 'cancel':
+                self.cancelled = True
+                return
+            if state != 'pause':
+                while self._next_job < len(self.jobs) and self._in_flight < self.max_in_flight:
+                    self._submit_next_chunk()
+            if not self._in_flight:
+                time.sleep(poll_interval)
+                continue
+
+            try:
+                keys, result, exc = self._done_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                continue
+            self._in_flight -= 1
+            self.chunks_done += 1
+            if exc is not None:
+                yield [(key, False, str(exc)) for key in keys]
+                continue
+            outcomes, elapsed, io_report = result
+            self._record_latency(elapsed, len(outcomes))
+            merge_io_stats(self.io_stats, io_report)
+            yield [(key, ok, value) for key, (ok, value) in zip(keys, outcomes)]
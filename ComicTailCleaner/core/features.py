@@ -0,0 +1,333 @@
+# ======================================================================
+# 檔案名稱：core/features.py
+# 模組目的：圖片特徵計算核心 (pHash 融合核心 + 向量化色彩特徵)
+# ======================================================================
+
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import scipy.fftpack as _fftpack
+except ImportError:
+    _fftpack = None
+
+try:
+    import cv2 as _cv2
+except ImportError:
+    _cv2 = None
+
+# imagehash.phash 的預設 highfreq_factor，縮圖邊長 = hash_size * 4
+PHASH_HIGHFREQ_FACTOR = 4
+PHASH_SIZES = (8, 16, 32)
+GRID_ROWS = 4
+GRID_COLS = 4
+GRID_HASH_SIZE = 8
+GRID_MIN_SIDE = 32
+
+
+# 所有 hash 中解析度需求最高者：pHash-512 需 128px 縮圖，4x4 Grid 每格需 32px
+HASH_REQUIRED_SIDE = max(max(PHASH_SIZES), GRID_HASH_SIZE * GRID_ROWS) * PHASH_HIGHFREQ_FACTOR
+
+# pHash 特徵版本 (隨結果寫入快取的 phash_version)；不同版本的雜湊定義不同，彼此不可比較，版本不符一律重算
+#   1：舊版 imagehash 路徑，每個尺寸與每個 Grid 格子各自由原圖縮圖 (未記錄版本的舊快取視為此版)
+#   2：融合核心，原圖只縮圖一次到 HASH_REQUIRED_SIDE，其餘尺寸與 Grid 格子皆由該縮圖取得；
+#      旋轉變體由 DCT 係數推導。與版本 1 相比 pHash-512 逐位元相同，
+#      pHash-64 / 256 與 Grid 會有數個位元的差異 (見 tests/test_phash_parity.py 的預算)
+LEGACY_PHASH_VERSION = 1
+FUSED_PHASH_VERSION = 2
+PHASH_VERSION_KEY = "phash_version"
+
+# worker 回傳的 draft 抽驗報告欄位；由主進程彙整後移除，不寫入快取
+DRAFT_REPORT_KEY = "_draft_check"
+
+
+def fused_kernel_available() -> bool:
+    return np is not None and Image is not None and _fftpack is not None
+
+
+def phash_feature_version() -> int:
+    """目前環境產出的 pHash 特徵版本：融合核心可用時為 FUSED_PHASH_VERSION，否則退回 imagehash 路徑。"""
+    return FUSED_PHASH_VERSION if fused_kernel_available() else LEGACY_PHASH_VERSION
+
+
+def cached_phash_version(entry: Optional[Dict[str, Any]]) -> int:
+    return int((entry or {}).get(PHASH_VERSION_KEY) or LEGACY_PHASH_VERSION)
+
+
+def _resample_filter():
+    # 與 imagehash.ANTIALIAS 相同 (LANCZOS)，確保位元級一致
+    return Image.Resampling.LANCZOS if hasattr(Image, "Resampling") else Image.LANCZOS
+
+
+def _dct2(pixels: "np.ndarray") -> "np.ndarray":
+    """對最後兩軸做 2D DCT-II；順序與 imagehash.phash 相同 (先列後行)。"""
+    return _fftpack.dct(_fftpack.dct(pixels, axis=-2), axis=-1)
+
+
+def _bits_from_dct(dct: "np.ndarray", hash_size: int) -> "np.ndarray":
+    low = dct[..., :hash_size, :hash_size]
+    med = np.median(low, axis=(-2, -1), keepdims=True)
+    return low > med
+
+
+def bits_to_hex(bits: "np.ndarray") -> str:
+    """布林位元矩陣 → 與 str(imagehash.ImageHash) 相同的十六進位字串。"""
+    return np.packbits(bits.reshape(-1)).tobytes().hex()
+
+
+def _phash_base(gray: "Image.Image", side: int = HASH_REQUIRED_SIDE) -> "Image.Image":
+    """整個核心唯一一次由原圖縮圖：side x side 的 LANCZOS 縮圖 (與 imagehash.phash(hash_size=side/4) 的輸入相同)。"""
+    return gray.resize((side, side), _resample_filter())
+
+
+def _base_plane(base: "Image.Image", side: int) -> "np.ndarray":
+    """由共用縮圖取得 side x side 的輸入；與縮圖同尺寸時直接使用，不再重新取樣。"""
+    if base.size != (side, side):
+        base = base.resize((side, side), _resample_filter())
+    return np.asarray(base, dtype=np.float64)
+
+
+def _grid_blocks(plane: "np.ndarray") -> "np.ndarray":
+    """把 (4*s, 4*s) 縮圖切成 4x4 格，回傳 (16, s, s) 的視圖順序陣列 (列優先)。"""
+    side = plane.shape[-1] // GRID_COLS
+    return plane.reshape(GRID_ROWS, side, GRID_COLS, side).transpose(0, 2, 1, 3).reshape(GRID_ROWS * GRID_COLS, side, side)
+
+
+def grid_dct_stack(gray: "Image.Image", base: Optional["Image.Image"] = None) -> Optional["np.ndarray"]:
+    """4x4 Grid 的 (16, 32, 32) DCT 係數：格子直接取自共用縮圖，一次呼叫完成批次 DCT；原圖小於 32px 時回傳 None。"""
+    if gray.width < GRID_MIN_SIDE or gray.height < GRID_MIN_SIDE:
+        return None
+    plane = _base_plane(base if base is not None else _phash_base(gray), GRID_HASH_SIZE * PHASH_HIGHFREQ_FACTOR * GRID_ROWS)
+    return _dct2(_grid_blocks(plane))
+
+
+def grid_phash_hex(gray: "Image.Image") -> List[str]:
+    dct_stack = grid_dct_stack(gray)
+    if dct_stack is None:
+        return []
+    return _grid_hex_from_dct(dct_stack)
+
+
+def _grid_hex_from_dct(dct_stack: "np.ndarray") -> List[str]:
+    bits = _bits_from_dct(dct_stack, GRID_HASH_SIZE)
+    return [bits_to_hex(block) for block in bits]
+
+
+# ----------------------------------------------------------------------
+# 旋轉變體：直接由 DCT 係數推導，不需重新旋轉、縮圖整張圖
+#   對 N×N 影像 X 的 DCT-II 係數 C[u, v]：
+#     轉置 X.T        → C[v, u]
+#     上下翻轉        → (-1)^u · C[u, v]
+#     左右翻轉        → (-1)^v · C[u, v]
+#   PIL rotate(角度) 為逆時針：90° = 轉置後上下翻轉、180° = 上下+左右翻轉、270° = 轉置後左右翻轉
+#   Grid 格子取自整張圖的共用縮圖，旋轉後的格子即為原格子依 np.rot90 重排，無餘數邊的問題
+#   推導結果並非與「旋轉後重新計算」逐位元相同：180 度完全一致；90/270 度時原圖縮圖的水平/垂直兩趟
+#   uint8 捨入順序對調，主 pHash 實測至多 8 bits、Grid 紋理格每格至多 6 bits (漸層格可達 22 bits)
+#   旋轉變體與主雜湊同屬 FUSED_PHASH_VERSION；舊版 (重新旋轉計算) 快取的版本不符，會整筆重算而不混用
+# ----------------------------------------------------------------------
+ROTATION_ANGLES = (90, 180, 270)
+
+
+def rotate_dct(coeffs: "np.ndarray", angle: int) -> "np.ndarray":
+    """回傳 img.rotate(angle) 後影像的 DCT 係數 (作用於最後兩軸，需為方陣)。"""
+    n = coeffs.shape[-1]
+    sign = np.where(np.arange(n) % 2 == 0, 1.0, -1.0)
+    if angle == 90:
+        return np.swapaxes(coeffs, -1, -2) * sign[:, None]
+    if angle == 180:
+        return coeffs * sign[:, None] * sign[None, :]
+    if angle == 270:
+        return np.swapaxes(coeffs, -1, -2) * sign[None, :]
+    raise ValueError(f"unsupported rotation angle: {angle}")
+
+
+def _grid_rotation_order(angle: int) -> "np.ndarray":
+    # 旋轉後第 i 格對應的原始格索引 (與像素同樣以 np.rot90 的逆時針規則排列)
+    return np.rot90(np.arange(GRID_ROWS * GRID_COLS).reshape(GRID_ROWS, GRID_COLS), k=angle // 90).reshape(-1)
+
+
+def compute_phash_features(
+    img: "Image.Image",
+    hash_sizes: Sequence[int] = PHASH_SIZES,
+    with_grid: bool = True,
+    with_rotations: bool = False,
+) -> Dict[str, Any]:
+    """
+    融合 pHash 核心：灰階轉換與原圖縮圖各只做一次 (HASH_REQUIRED_SIDE 邊長)，
+    各尺寸 pHash 由該縮圖再取樣、4x4 Grid 直接切自該縮圖 (特徵版本 FUSED_PHASH_VERSION)。
+    with_rotations 時另由 64-bit pHash 與 Grid 的 DCT 係數推導 90/180/270 度旋轉變體。
+    """
+    gray = img if img.mode == "L" else img.convert("L")
+    base = _phash_base(gray)
+    dct_by_size = {}
+    for hash_size in set(hash_sizes) | ({8} if with_rotations else set()):
+        dct_by_size[hash_size] = _dct2(_base_plane(base, hash_size * PHASH_HIGHFREQ_FACTOR))[:hash_size, :hash_size]
+    bits_by_size = {size: _bits_from_dct(dct_by_size[size], size) for size in hash_sizes}
+
+    features: Dict[str, Any] = {PHASH_VERSION_KEY: FUSED_PHASH_VERSION}
+    if 8 in bits_by_size:
+        h64 = bits_to_hex(bits_by_size[8])
+        features["phash"] = h64
+        features["phash_32"] = h64
+    if 16 in bits_by_size:
+        features["phash_128"] = bits_by_size[16].tobytes()
+    if 32 in bits_by_size:
+        features["phash_512"] = bits_by_size[32].tobytes()
+
+    grid_stack = grid_dct_stack(gray, base) if (with_grid or with_rotations) else None
+    if with_grid:
+        features["grid_phash"] = _grid_hex_from_dct(grid_stack) if grid_stack is not None else []
+
+    if with_rotations:
+        phash_rotations, grid_rotations = {}, {}
+        for angle in ROTATION_ANGLES:
+            phash_rotations[str(angle)] = bits_to_hex(_bits_from_dct(rotate_dct(dct_by_size[8], angle), 8))
+            if grid_stack is None:
+                grid_rotations[str(angle)] = []
+                continue
+            grid_low = grid_stack[..., :GRID_HASH_SIZE, :GRID_HASH_SIZE]
+            grid_rotations[str(angle)] = _grid_hex_from_dct(rotate_dct(grid_low[_grid_rotation_order(angle)], angle))
+        features["phash_rotations"] = phash_rotations
+        features["grid_rotations"] = grid_rotations
+    return features
+
+
+def hex_hamming(h1: Optional[str], h2: Optional[str]) -> Optional[int]:
+    if not h1 or not h2:
+        return None
+    try:
+        return bin(int(h1, 16) ^ int(h2, 16)).count("1")
+    except (TypeError, ValueError):
+        return None
+
+
+def phash_drift(reference: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, Any]:
+    """比較兩組 pHash 特徵的位元漂移：主 pHash 的 Hamming 距離與 Grid 各格的最大距離。"""
+    grid_ref = reference.get("grid_phash") or []
+    grid_cand = candidate.get("grid_phash") or []
+    grid_bits = [
+        d for d in (hex_hamming(a, b) for a, b in zip(grid_ref, grid_cand)) if d is not None
+    ]
+    return {
+        "phash_bits": hex_hamming(reference.get("phash"), candidate.get("phash")),
+        "grid_max_bits": max(grid_bits) if grid_bits else 0,
+        "grid_mean_bits": (sum(grid_bits) / len(grid_bits)) if grid_bits else 0.0,
+    }
+
+
+# ----------------------------------------------------------------------
+# 色彩特徵：向量化 RGB→HSV 平均值 + Lab 彩度判定，共用同一次 RGB 轉換
+# ----------------------------------------------------------------------
+HSV_THUMB_SIDE = 32
+COLOR_SAMPLE_MAX_SIDE = 400
+COLORFUL_THRESHOLD = 15.0
+
+
+def color_sample(rgb, max_side: int = COLOR_SAMPLE_MAX_SIDE) -> "np.ndarray":
+    """彩度判定用的 RGB 緩衝 (長邊不超過 max_side)；接受 RGB PIL 圖片或 (H, W, 3) 陣列。"""
+    arr = np.asarray(rgb)
+    scale = max_side / max(arr.shape[:2])
+    if scale >= 1.0:
+        return arr
+    if _cv2 is not None:
+        return _cv2.resize(arr, (0, 0), fx=scale, fy=scale, interpolation=_cv2.INTER_AREA)
+    size = (max(1, int(round(arr.shape[1] * scale))), max(1, int(round(arr.shape[0] * scale))))
+    return np.asarray(Image.fromarray(arr).resize(size, Image.Resampling.BOX))
+
+
+def hsv_thumbnail(rgb: "Image.Image", side: int = HSV_THUMB_SIDE) -> "np.ndarray":
+    """平均 HSV 用的 32x32 縮圖；必須由原圖直接縮放，才能與既有快取值一致。"""
+    return np.asarray(rgb.resize((side, side), Image.Resampling.BILINEAR))
+
+
+def rgb_to_hsv_array(rgb: "np.ndarray") -> "np.ndarray":
+    """
+    與 colorsys.rgb_to_hsv 逐像素語意相同的向量化版本，最後一軸為 (r, g, b)，數值範圍 [0, 1]。
+    輸出 h 亦為 [0, 1)，灰階像素 (max == min) 的 h、s 為 0。
+    """
+    rgb = np.asarray(rgb)
+    if not np.issubdtype(rgb.dtype, np.floating):
+        rgb = rgb.astype(np.float32) / np.float32(255.0)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    rangec = maxc - minc
+    chroma = rangec > 0
+    safe_range = np.where(chroma, rangec, 1)
+    rc = (maxc - r) / safe_range
+    gc = (maxc - g) / safe_range
+    bc = (maxc - b) / safe_range
+    # 分支優先序與 colorsys 相同：r 為最大值優先，其次 g，最後 b
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(chroma, (h / 6.0) % 1.0, 0)
+    s = np.where(chroma, rangec / np.where(maxc > 0, maxc, 1), 0)
+    return np.stack([h, s, maxc], axis=-1).astype(rgb.dtype, copy=False)
+
+
+def mean_hsv_batch(thumbs: "np.ndarray") -> "np.ndarray":
+    """
+    批次計算平均 HSV：輸入 (N, H, W, 3) 的預縮圖 (uint8 或 [0, 1] 浮點)，
+    輸出 (N, 3)，每列為 (色相角度 0~360, 飽和度, 明度)，與 utils._avg_hsv 單張結果相同。
+    """
+    hsv = rgb_to_hsv_array(thumbs)
+    flat = np.moveaxis(hsv, -1, 1).reshape(hsv.shape[0], 3, -1)
+    means = np.ascontiguousarray(flat).mean(axis=-1).astype(np.float64)
+    means[:, 0] *= 360.0
+    return means
+
+
+def _rgb_to_lab_u8(sample: "np.ndarray") -> "np.ndarray":
+    """OpenCV COLOR_RGB2LAB (8-bit) 的 NumPy 版本，僅在未安裝 cv2 時使用。"""
+    rgb = sample.astype(np.float32) / np.float32(255.0)
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array(
+        [[0.412453, 0.212671, 0.019334],
+         [0.357580, 0.715160, 0.119193],
+         [0.180423, 0.072169, 0.950227]],
+        dtype=np.float32,
+    )
+    xyz /= np.array([0.950456, 1.0, 1.088754], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    lab = np.empty_like(xyz)
+    lab[..., 0] = (116.0 * f[..., 1] - 16.0) * 255.0 / 100.0
+    lab[..., 1] = 500.0 * (f[..., 0] - f[..., 1]) + 128.0
+    lab[..., 2] = 200.0 * (f[..., 1] - f[..., 2]) + 128.0
+    return np.clip(np.rint(lab), 0, 255).astype(np.uint8)
+
+
+def colorfulness(sample: "np.ndarray") -> float:
+    """Lab 色度分佈的彩度分數 (a/b 通道標準差 + 偏離中性灰程度)。"""
+    if _cv2 is not None:
+        lab = _cv2.cvtColor(np.ascontiguousarray(sample), _cv2.COLOR_RGB2LAB)
+    else:
+        lab = _rgb_to_lab_u8(sample)
+    a, b = lab[..., 1], lab[..., 2]
+    std_a, std_b = np.std(a), np.std(b)
+    mean_a, mean_b = np.mean(a), np.mean(b)
+    return float(np.sqrt(std_a ** 2 + std_b ** 2) + 0.3 * np.sqrt((mean_a - 128) ** 2 + (mean_b - 128) ** 2))
+
+
+def compute_color_features(
+    img: "Image.Image",
+    with_hsv: bool = True,
+    with_colorful: bool = True,
+    color_threshold: float = COLORFUL_THRESHOLD,
+) -> Dict[str, Any]:
+    """單次 RGB 轉換，同時產出 avg_hsv 與 is_colorful。"""
+    rgb = img if img.mode == "RGB" else img.convert("RGB")
+    features: Dict[str, Any] = {}
+    if with_hsv:
+        h, s, v = mean_hsv_batch(hsv_thumbnail(rgb)[np.newaxis])[0]
+        features["avg_hsv"] = (float(h), float(s), float(v))
+    if with_colorful:
+        features["is_colorful"] = bool(colorfulness(color_sample(rgb)) > color_threshold)
+    return features
@@ -0,0 +1,234 @@
+# ======================================================================
+# 檔案名稱：core/hamming_pairs.py
+# 模組目的：分塊 (tile) 全配對 XOR + popcount 核心，只輸出距離 ≤ 半徑的配對，供互比模式 Phase A 使用
+# ======================================================================
+
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from core import popcount as popcount_backend
+from core.hamming_index import GRID_BLOCK_RADIUS, GRID_MIN_BLOCKS, grid_block_matches, radius_for_similarity
+from core.popcount import popcount, scratch_for, xor_popcount
+
+# 每個 tile 為 tile_size x tile_size；每個執行緒的暫存約 13 * tile_size² 位元組 (1024 → 約 13 MB)
+# 256 ~ 1024 時暫存區大致留在快取內，更大的 tile 反而變慢 (見本模組的 benchmark)
+DEFAULT_TILE_SIZE = 1024
+
+
+def resolve_workers(workers: int) -> int:
+    """0 (或負值) 表示依 CPU 核心數自動決定。"""
+    return int(workers) if workers and workers > 0 else max(1, os.cpu_count() or 1)
+
+
+class _Scratch(threading.local):
+    """每個執行緒各自的 tile 暫存區，整個配對過程重複使用，不隨 tile 重新配置。"""
+
+    def buffers(self, tile_size: int):
+        if getattr(self, "size", None) != tile_size:
+            self.size = tile_size
+            self.xor = np.empty((tile_size, tile_size), dtype=np.uint64)
+            self.count = np.empty((tile_size, tile_size), dtype=np.uint8)
+            self.best = np.empty((tile_size, tile_size), dtype=np.uint8)
+            self.hit = np.empty((tile_size, tile_size), dtype=bool)
+            self.band = np.empty((tile_size, tile_size), dtype=bool)
+            self.grid = np.empty((tile_size, tile_size), dtype=np.uint8)
+            self.popcount = scratch_for((tile_size, tile_size))
+        return self.xor, self.count, self.best, self.hit, self.band, self.grid, self.popcount
+
+
+def pairs_within(
+    rows: "np.ndarray",
+    cols: "np.ndarray",
+    radius: int,
+    *,
+    rescue_radius: Optional[int] = None,
+    row_grids: Optional["np.ndarray"] = None,
+    col_grids: Optional["np.ndarray"] = None,
+    upper: bool = False,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    workers: int = 0,
+    should_stop: Optional[Callable[[], bool]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    回傳距離 ≤ radius 的所有 (列序號, 欄序號, 距離, 是否由 Grid 補救)，依 tile 順序排列。
+    rows 為 (n,) 或 (n, k) uint64；k 個變體 (例如旋轉角度) 取最小距離。cols 為 (m,) uint64。
+    提供 rescue_radius 與 row_grids (n, g, 16) / col_grids (m, 16) 時，距離在 (radius, rescue_radius] 的配對
+    若通過 grid_block_matches (g 個 Grid 變體任一吻合) 也會輸出，補救旗標為 True。
+    Grid 先在整個 tile 上只比前幾個區塊 (見 grid_block_matches)，其餘區塊只對少數通過的配對計算。
+    upper=True 時 rows 與 cols 須等長，只輸出欄序號 > 列序號的配對 (只計算上三角的 tile)。
+    rows 第一欄或 cols 為 0 的項目視為無效雜湊，不輸出。
+    各 tile 以執行緒平行計算 (NumPy 運算期間釋放 GIL)；should_stop 回傳 True 時不再處理剩餘 tile。
+    """
+    rows = np.asarray(rows, dtype=np.uint64)
+    if rows.ndim == 1:
+        rows = rows[:, np.newaxis]
+    cols = np.asarray(cols, dtype=np.uint64)
+    n, m = len(rows), len(cols)
+    empty = np.zeros(0, dtype=np.int64)
+    nothing = (empty, empty, empty.astype(np.uint8), empty.astype(bool))
+    if not n or not m or radius < 0:
+        return nothing
+    if upper and n != m:
+        raise ValueError("upper=True 需要 rows 與 cols 等長")
+    tile_size = max(1, int(tile_size))
+    radius = min(int(radius), 64)
+    rescue = rescue_radius is not None and int(rescue_radius) > radius and row_grids is not None and col_grids is not None
+    if rescue:
+        rescue_radius = min(int(rescue_radius), 64)
+        row_grids = np.asarray(row_grids, dtype=np.uint64)
+        col_grids = np.asarray(col_grids, dtype=np.uint64)
+        head = max(1, col_grids.shape[1] - GRID_MIN_BLOCKS + 1)
+        # tile 預篩只比前 head 個區塊，且不逐一檢查 0 (無效) 區塊：列的 0 改為全 1、欄維持 0，
+        # 兩者互比距離為 64，與一般雜湊也幾乎不會 ≤ GRID_BLOCK_RADIUS；少數誤判由 grid_block_matches 完整比對排除
+        head_rows = row_grids[:, :, :head]
+        head_rows = np.where(head_rows != 0, head_rows, ~np.uint64(0))
+        head_cols = np.ascontiguousarray(col_grids[:, :head].T)
+        head_variants = (row_grids[:, :, :head] != 0).any(axis=2)
+    row_valid = rows[:, 0] != 0
+    col_valid = cols != 0
+    # 與基準雜湊相同的變體不必重算；只有含不同變體的 tile 才會多算一輪
+    variant_differs = rows[:, 1:] != rows[:, :1]
+    tiles = [
+        (r0, c0)
+        for r0 in range(0, n, tile_size)
+        for c0 in range(r0 if upper else 0, m, tile_size)
+        if row_valid[r0:r0 + tile_size].any() and col_valid[c0:c0 + tile_size].any()
+    ]
+    scratch = _Scratch()
+
+    def run_tile(tile: Tuple[int, int]):
+        if should_stop is not None and should_stop():
+            return None
+        r0, c0 = tile
+        r1, c1 = min(r0 + tile_size, n), min(c0 + tile_size, m)
+        xor_buf, count_buf, best_buf, hit_buf, band_buf, grid_buf, pc_buf = scratch.buffers(tile_size)
+        xor, count, best, hit, band, grid = (
+            buf[: r1 - r0, : c1 - c0] for buf in (xor_buf, count_buf, best_buf, hit_buf, band_buf, grid_buf)
+        )
+        # 查表 / SWAR 後端的暫存只在完整 tile 時可直接重用；邊緣 tile 由後端自行配置
+        pc_scratch = pc_buf if (r1 - r0, c1 - c0) == (tile_size, tile_size) else None
+        col_block = cols[c0:c1][np.newaxis, :]
+        np.bitwise_xor(rows[r0:r1, 0, np.newaxis], col_block, out=xor)
+        popcount(xor, out=best, scratch=pc_scratch)
+        for v in range(1, rows.shape[1]):
+            if not variant_differs[r0:r1, v - 1].any():
+                continue
+            np.bitwise_xor(rows[r0:r1, v, np.newaxis], col_block, out=xor)
+            popcount(xor, out=count, scratch=pc_scratch)
+            np.minimum(best, count, out=best)
+        np.less_equal(best, radius, out=hit)
+        ii, jj = extract(hit, r0, c0, c1)
+        rescued = np.zeros(len(ii), dtype=bool)
+        if rescue:
+            # band：距離在 (radius, rescue_radius] 的配對 (hit 為其子集，XOR 即相減)
+            np.less_equal(best, rescue_radius, out=band)
+            np.logical_xor(band, hit, out=band)
+            variants = np.flatnonzero(head_variants[r0:r1].any(axis=0))
+            if band.any() and len(variants):
+                # grid 累積前幾個區塊的最小距離
+                grid.fill(255)
+                for v in variants:
+                    for b in range(head):
+                        np.bitwise_xor(head_rows[r0:r1, v, b, np.newaxis], head_cols[np.newaxis, b, c0:c1], out=xor)
+                        popcount(xor, out=count, scratch=pc_scratch)
+                        np.minimum(grid, count, out=grid)
+                np.less_equal(grid, GRID_BLOCK_RADIUS, out=hit)  # hit 已取出，改存預篩結果
+                np.logical_and(band, hit, out=band)
+                bi, bj = extract(band, r0, c0, c1)
+                if len(bi):
+                    ok = grid_block_matches(row_grids[r0 + bi], col_grids[c0 + bj])
+                    bi, bj = bi[ok], bj[ok]
+                    ii, jj = np.concatenate((ii, bi)), np.concatenate((jj, bj))
+                    rescued = np.concatenate((rescued, np.ones(len(bi), dtype=bool)))
+        return ii + r0, jj + c0, best[ii, jj], rescued
+
+    def extract(mask: "np.ndarray", r0: int, c0: int, c1: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """tile 內為 True 的 (列, 欄) 相對位置，排除無效雜湊與上三角以外的配對。"""
+        if not mask.any():
+            return empty, empty
+        # 二維 nonzero 比一維 flatnonzero 慢約 10 倍，改以攤平後的位置還原列 / 欄
+        ii, jj = np.divmod(np.flatnonzero(mask), c1 - c0)
+        keep = row_valid[r0 + ii] & col_valid[c0 + jj]
+        if upper and r0 == c0:
+            keep &= jj > ii
+        return ii[keep], jj[keep]
+
+    parts: List[tuple] = []
+    max_workers = min(resolve_workers(workers), max(1, len(tiles)))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run_tile, tile) for tile in tiles]
+        for done, future in enumerate(futures, 1):
+            result = future.result()
+            if result is None:
+                for pending in futures[done:]:
+                    pending.cancel()
+                break
+            parts.append(result)
+            if progress is not None:
+                progress(done, len(tiles))
+    if not parts:
+        return nothing
+    return (
+        np.concatenate([p[0] for p in parts]).astype(np.int64),
+        np.concatenate([p[1] for p in parts]).astype(np.int64),
+        np.concatenate([p[2] for p in parts]),
+        np.concatenate([p[3] for p in parts]),
+    )
+
+
+def benchmark(n: int = 200000, sim: float = 0.70, tile_size: int = DEFAULT_TILE_SIZE, workers: int = 0, clusters: int = 5000, seed: int = 0) -> dict:
+    """互比 (上三角) 全配對的耗時與輸出量；另以小樣本對照逐列暴力比對確認結果一致。"""
+    if np is None:
+        raise RuntimeError("benchmark 需要 numpy")
+    rng = np.random.default_rng(seed)
+    radius = radius_for_similarity(sim)
+    centers = rng.integers(1, 2**63, size=clusters, dtype=np.uint64)
+    flips = np.zeros(n, dtype=np.uint64)
+    for _ in range(radius):
+        hit = rng.random(n) < 0.5
+        flips[hit] ^= np.uint64(1) << rng.integers(0, 64, size=int(hit.sum()), dtype=np.uint64)
+    values = centers[rng.integers(0, clusters, size=n)] ^ flips
+    values[values == 0] = 1
+
+    t0 = time.perf_counter()
+    ii, jj, _, _ = pairs_within(values, values, radius, upper=True, tile_size=tile_size, workers=workers)
+    elapsed = time.perf_counter() - t0
+
+    order = np.argsort(ii, kind="stable")
+    ii, jj = ii[order], jj[order]
+    exact = True
+    for i in random.Random(seed).sample(range(n), min(n, 200)):
+        expected = np.flatnonzero(xor_popcount(values, values[i]) <= radius)
+        lo, hi = np.searchsorted(ii, [i, i + 1])
+        exact &= np.array_equal(np.sort(jj[lo:hi]), expected[expected > i])
+    return {
+        "n": n, "radius": radius, "tile_size": tile_size, "workers": resolve_workers(workers), "popcount": popcount_backend.BACKEND,
+        "seconds": elapsed, "pairs": len(ii), "pair_checks_per_s": n * (n - 1) / 2 / max(elapsed, 1e-9),
+        "sample_exact": exact,
+    }
+
+
+if __name__ == "__main__":
+    # python -m core.hamming_pairs [n] [tile_size] [workers] [similarity]
+    args = sys.argv[1:]
+    n = int(args[0]) if len(args) > 0 else 200000
+    tiles = [int(args[1])] if len(args) > 1 else [512, 1024, 2048, 4096]
+    workers = int(args[2]) if len(args) > 2 else 0
+    sim = float(args[3]) if len(args) > 3 else 0.70
+    for tile in tiles:
+        r = benchmark(n, sim, tile, workers)
+        print(
+            f"n={r['n']} r={r['radius']} tile={r['tile_size']} workers={r['workers']} popcount={r['popcount']} | "
+            f"{r['seconds']:.2f}s, {r['pair_checks_per_s'] / 1e9:.2f} G pairs/s | pairs {r['pairs']} | sample exact {r['sample_exact']}"
+        )
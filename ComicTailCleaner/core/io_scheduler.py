@@ -0,0 +1,213 @@
+# ======================================================================
+# 檔案名稱：core/io_scheduler.py
+# 模組目的：依實體裝置 (st_dev) 分組的 I/O 排程 (機械硬碟限流、SSD 不限流、吞吐量報告)
+# ======================================================================
+
+import os
+import subprocess
+import sys
+import uuid
+from typing import Dict, Iterable, Optional
+
+from utils import _is_virtual_path, _parse_virtual_path, log_info, log_warning
+
+
+def _real_path(path: str) -> str:
+    if _is_virtual_path(path):
+        archive_path, _ = _parse_virtual_path(path)
+        return archive_path or path
+    return path
+
+
+def _mount_point(path: str) -> str:
+    path = os.path.abspath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def _linux_is_rotational(dev: int) -> Optional[bool]:
+    # 分割區的 sysfs 節點沒有 queue/，需往上找所屬磁碟
+    node = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    for candidate in (node, os.path.dirname(node)):
+        flag_path = os.path.join(candidate, "queue", "rotational")
+        try:
+            with open(flag_path) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def _windows_is_rotational(mount: str) -> Optional[bool]:
+    drive = os.path.splitdrive(mount)[0].rstrip(":")
+    if len(drive) != 1:
+        return None  # UNC 網路路徑等無法查詢
+    command = (
+        f"(Get-Partition -DriveLetter {drive} | Get-Disk | Get-PhysicalDisk).MediaType"
+    )
+    try:
+        result = subprocess.run(
+            ["powershell", "-NoProfile", "-Command", command],
+            capture_output=True, text=True, timeout=5,
+            creationflags=subprocess.CREATE_NO_WINDOW,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    media = result.stdout.strip().upper()
+    if "HDD" in media:
+        return True
+    if "SSD" in media or "SCM" in media:
+        return False
+    return None
+
+
+def detect_rotational(dev: int, mount: str) -> Optional[bool]:
+    """回傳 True=機械硬碟、False=固態、None=無法判斷。"""
+    try:
+        if sys.platform.startswith("linux"):
+            return _linux_is_rotational(dev)
+        if os.name == "nt":
+            return _windows_is_rotational(mount)
+    except Exception:
+        pass
+    return None
+
+
+class IoDevice:
+    def __init__(self, dev: int, mount: str, rotational: Optional[bool], limit: int):
+        self.dev = dev
+        self.mount = mount
+        self.rotational = rotational
+        self.limit = limit
+        self.files = 0
+
+    @property
+    def kind(self) -> str:
+        return {True: "HDD", False: "SSD", None: "未知"}[self.rotational]
+
+
+class IoPlan:
+    """單次派發的裝置規劃；gates 只包含需要限流的裝置 {st_dev: 跨進程 Semaphore}。"""
+
+    def __init__(self, plan_id: str, devices: Dict[int, IoDevice], gates: Dict[int, object]):
+        self.plan_id = plan_id
+        self.devices = devices
+        self.gates = gates
+
+    @property
+    def worker_gates(self):
+        return (self.plan_id, self.gates) if self.gates else None
+
+    def label(self, dev) -> str:
+        device = self.devices.get(dev)
+        return f"{device.mount} [{device.kind}]" if device else f"dev {dev}"
+
+    def describe(self) -> str:
+        parts = []
+        for device in self.devices.values():
+            limit = f"並行 {device.limit}" if device.limit > 0 else "不限流"
+            parts.append(f"{device.mount} [{device.kind}, {limit}, {device.files} 檔]")
+        return "; ".join(parts)
+
+
+class IoScheduler:
+    """
+    取代舊的全域 SHARED_IO_LOCK：依工作檔案所在裝置分組，
+    機械硬碟 (或使用者指定的裝置) 以跨進程 Semaphore 限制同時讀檔的 worker 數，避免磁頭來回尋軌；
+    SSD / NVMe 預設不限流，worker 直接以檔案把手串流解碼。
+    裝置類型偵測結果以 st_dev 快取，整個程式生命週期只查一次。
+    """
+
+    _rotational_cache: Dict[int, Optional[bool]] = {}
+
+    def __init__(self, config: dict, manager_factory):
+        self.config = config
+        self._manager_factory = manager_factory
+        self.rotational_limit = max(0, int(config.get('io_rotational_concurrency', 1)))
+        self.solid_state_limit = max(0, int(config.get('io_solid_state_concurrency', 0)))
+        self.unknown_as_rotational = bool(config.get('io_unknown_as_rotational', False))
+        self.overrides = self._resolve_overrides(config.get('io_device_concurrency') or {})
+
+    @staticmethod
+    def _resolve_overrides(raw: dict) -> Dict[int, int]:
+        resolved = {}
+        for path, limit in raw.items():
+            try:
+                resolved[os.stat(path).st_dev] = max(0, int(limit))
+            except (OSError, TypeError, ValueError):
+                log_warning(f"[I/O 排程] 忽略無效的裝置設定: {path!r} -> {limit!r}")
+        return resolved
+
+    def _limit_for(self, dev: int, rotational: Optional[bool]) -> int:
+        if dev in self.overrides:
+            return self.overrides[dev]
+        if rotational is None:
+            rotational = self.unknown_as_rotational
+        return self.rotational_limit if rotational else self.solid_state_limit
+
+    def plan(self, paths: Iterable[str]) -> IoPlan:
+        devices: Dict[int, IoDevice] = {}
+        dev_by_dir: Dict[str, Optional[int]] = {}
+        for path in paths:
+            # 以所在資料夾的 st_dev 代表檔案，stat 次數與資料夾數而非檔案數成正比
+            folder = os.path.dirname(_real_path(path))
+            if folder not in dev_by_dir:
+                try:
+                    dev_by_dir[folder] = os.stat(folder).st_dev
+                except OSError:
+                    dev_by_dir[folder] = None
+            dev = dev_by_dir[folder]
+            if dev is None:
+                continue
+            device = devices.get(dev)
+            if device is None:
+                if dev not in self._rotational_cache:
+                    self._rotational_cache[dev] = detect_rotational(dev, _mount_point(folder))
+                rotational = self._rotational_cache[dev]
+                device = devices[dev] = IoDevice(dev, _mount_point(folder), rotational, self._limit_for(dev, rotational))
+            device.files += 1
+
+        gates = {}
+        limited = [d for d in devices.values() if d.limit > 0]
+        if limited:
+            manager = self._manager_factory()
+            for device in limited:
+                gates[device.dev] = manager.Semaphore(device.limit)
+        return IoPlan(uuid.uuid4().hex, devices, gates)
+
+
+def merge_io_stats(total: dict, report: Optional[dict]) -> dict:
+    """report 格式：{st_dev: [files, bytes, busy_seconds, wait_seconds]}。"""
+    if not report:
+        return total
+    for dev, values in report.items():
+        entry = total.setdefault(dev, [0, 0, 0.0, 0.0])
+        for i, value in enumerate(values):
+            entry[i] += value
+    return total
+
+
+def format_io_report(stats: dict, wall_seconds: float) -> str:
+    """
+    吞吐量以派發的牆鐘時間計算；平均佔用為每檔在裝置名額內的時間
+    (限流裝置只含整檔讀入，未限流裝置為串流讀取 + 解碼)。
+    """
+    parts = []
+    wall_seconds = max(wall_seconds, 1e-6)
+    for label, (files, nbytes, busy, wait) in sorted(stats.items(), key=lambda item: -item[1][1]):
+        files_div = max(files, 1)
+        parts.append(
+            f"{label}: {files} 檔, {nbytes / 2**20:.1f} MB, "
+            f"{nbytes / 2**20 / wall_seconds:.1f} MB/s, {files / wall_seconds:.1f} 檔/s, "
+            f"平均佔用 {busy / files_div * 1000:.1f} ms, 平均等待 {wait / files_div * 1000:.1f} ms"
+        )
+    return "; ".join(parts)
+
+
+def log_io_plan(plan: IoPlan) -> None:
+    if plan.devices:
+        log_info(f"[I/O 排程] {plan.describe()}")
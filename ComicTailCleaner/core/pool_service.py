@@ -0,0 +1,115 @@
+# ======================================================================
+# 檔案名稱：core/pool_service.py
+# 模組目的：應用程式層級的常駐工作進程池 (跨掃描 / QR / 外掛共用，預載重型模組)
+# ======================================================================
+
+import sys
+import threading
+from multiprocessing import Pool, set_start_method
+from typing import Optional
+
+from utils import log_info, log_warning
+
+# 子進程啟動時預先匯入的模組；spawn 模式下可省去每次任務首次匯入的延遲
+_WARM_MODULES = (
+    "numpy",
+    "PIL.Image",
+    "scipy.fftpack",
+    "imagehash",
+    "cv2",
+    "core.features",
+    "processors.qr_engine",
+)
+
+
+def _warm_worker_initializer() -> None:
+    import importlib
+    for name in _WARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+
+class WorkerPoolService:
+    """
+    常駐進程池：第一次取用時建立，之後各 ImageComparisonEngine / Processor / 外掛共用同一組暖機 worker。
+
+    - 進程數或 maxtasksperchild 變更時才重建。
+    - maxtasksperchild 讓 worker 處理固定數量任務 (分塊) 後自動汰換，限制長時間執行的記憶體成長。
+    - 取消掃描需要中斷執行中的任務，因此以 terminate() 丟棄整個池，下次取用時重新建立。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._signature = None
+
+    def acquire(self, processes: int, max_tasks_per_child: Optional[int] = None):
+        processes = max(1, int(processes))
+        max_tasks_per_child = int(max_tasks_per_child) if max_tasks_per_child and max_tasks_per_child > 0 else None
+        signature = (processes, max_tasks_per_child)
+        with self._lock:
+            if self._pool is not None and self._signature == signature:
+                return self._pool
+            if self._pool is not None:
+                log_info(f"[進程池] 設定變更 {self._signature} -> {signature}，重建常駐進程池。")
+                self._close_locked(wait=True)
+            if sys.platform.startswith('win'):
+                try:
+                    set_start_method('spawn', force=True)
+                except RuntimeError:
+                    pass
+            self._pool = Pool(
+                processes=processes,
+                initializer=_warm_worker_initializer,
+                maxtasksperchild=max_tasks_per_child,
+            )
+            self._signature = signature
+            log_info(f"[進程池] 已建立常駐進程池: {processes} 個 worker, maxtasksperchild={max_tasks_per_child}")
+            return self._pool
+
+    def terminate(self) -> None:
+        """立即終止所有 worker (用於取消)。"""
+        with self._lock:
+            if self._pool is None:
+                return
+            try:
+                self._pool.terminate()
+                self._pool.join()
+            except Exception as e:
+                log_warning(f"[進程池] 終止時發生錯誤: {e}")
+            finally:
+                self._pool = None
+                self._signature = None
+
+    def shutdown(self, wait: bool = True) -> None:
+        """程式結束時呼叫；wait=False 時直接終止，不等待在途任務。"""
+        with self._lock:
+            self._close_locked(wait=wait)
+
+    def _close_locked(self, wait: bool) -> None:
+        if self._pool is None:
+            return
+        try:
+            if wait:
+                self._pool.close()
+            else:
+                self._pool.terminate()
+            self._pool.join()
+        except Exception as e:
+            log_warning(f"[進程池] 關閉時發生錯誤: {e}")
+        finally:
+            self._pool = None
+            self._signature = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._pool is not None
+
+
+worker_pool_service = WorkerPoolService()
+
+
+def shutdown_worker_pool(wait: bool = True) -> None:
+    worker_pool_service.shutdown(wait=wait)
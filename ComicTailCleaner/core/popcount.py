@@ -0,0 +1,192 @@
+# ======================================================================
+# 檔案名稱：core/popcount.py
+# 模組目的：uint64 陣列位元計數 (popcount) 後端層；執行期依 NumPy 版本選擇最快的實作
+# ======================================================================
+
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_M1, _M2, _M4, _H01 = 0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101
+# 16 位元查表 (64 KB，可留在 L2)：每個 uint64 只需 4 次查表；8 位元表要 8 次，且索引展開成 intp 的成本翻倍
+_LUT16 = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8) if np is not None else None
+
+
+def _check_out(arr: "np.ndarray", out: Optional["np.ndarray"]) -> "np.ndarray":
+    if out is None:
+        return np.empty(arr.shape, dtype=np.uint8)
+    if out.shape != arr.shape:
+        raise ValueError(f"out 形狀 {out.shape} 與輸入 {arr.shape} 不符")
+    return out
+
+
+def _popcount_native(arr: "np.ndarray", out: Optional["np.ndarray"] = None, scratch: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """NumPy ≥ 2.0 的 np.bitwise_count (編譯後使用 CPU 的 popcnt 指令)，不需要暫存。"""
+    return np.bitwise_count(arr, out=_check_out(arr, out))
+
+
+def _popcount_lut(arr: "np.ndarray", out: Optional["np.ndarray"] = None, scratch: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """
+    查表：把 uint64 視為 4 個 uint16 各查一次表，得到的 4 個位元組再以一次乘法橫向相加
+    ((c * 0x01010101) >> 24，每格 ≤ 16 不會進位溢出)。
+    scratch 為 arr.shape + (4,) 的 uint8 暫存 (可重複使用)；不提供時配置一次。
+    """
+    out = _check_out(arr, out)
+    arr = np.ascontiguousarray(arr, dtype=np.uint64)
+    if scratch is None or scratch.shape != arr.shape + (4,) or scratch.dtype != np.uint8:
+        scratch = np.empty(arr.shape + (4,), dtype=np.uint8)
+    np.take(_LUT16, arr.view(np.uint16).reshape(arr.shape + (4,)), out=scratch)
+    packed = scratch.view(np.uint32)
+    np.multiply(packed, np.uint32(0x01010101), out=packed)
+    np.right_shift(packed, np.uint32(24), out=packed)
+    np.copyto(out, packed.reshape(arr.shape), casting="unsafe")
+    return out
+
+
+def _popcount_swar(arr: "np.ndarray", out: Optional["np.ndarray"] = None, scratch: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """
+    SWAR (mask-shift-add) 加一次乘法，舊版 bit_count_np 的作法；全部以 out 參數在 uint64 暫存中原地運算。
+    scratch 為 (2,) + arr.shape 的 uint64 暫存，會被覆寫。
+    """
+    out = _check_out(arr, out)
+    if scratch is None or scratch.shape != (2,) + arr.shape or scratch.dtype != np.uint64:
+        scratch = np.empty((2,) + arr.shape, dtype=np.uint64)
+    c, tmp = scratch[0], scratch[1]
+    np.right_shift(arr, np.uint64(1), out=tmp)
+    np.bitwise_and(tmp, np.uint64(_M1), out=tmp)
+    np.subtract(arr, tmp, out=c)
+    np.right_shift(c, np.uint64(2), out=tmp)
+    np.bitwise_and(tmp, np.uint64(_M2), out=tmp)
+    np.bitwise_and(c, np.uint64(_M2), out=c)
+    np.add(c, tmp, out=c)
+    np.right_shift(c, np.uint64(4), out=tmp)
+    np.add(c, tmp, out=c)
+    np.bitwise_and(c, np.uint64(_M4), out=c)
+    np.multiply(c, np.uint64(_H01), out=c)
+    np.right_shift(c, np.uint64(56), out=c)
+    out[...] = c
+    return out
+
+
+_BACKENDS: Dict[str, Callable] = {"native": _popcount_native, "lut": _popcount_lut, "swar": _popcount_swar}
+
+
+def available_backends() -> List[str]:
+    if np is None:
+        return []
+    return [name for name in _BACKENDS if name != "native" or hasattr(np, "bitwise_count")]
+
+
+def _time_backend(name: str, values: "np.ndarray", repeats: int = 3) -> float:
+    out, scratch = np.empty(len(values), dtype=np.uint8), scratch_for((len(values),), name)
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        _BACKENDS[name](values, out, scratch)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _select_backend() -> Optional[str]:
+    """
+    NumPy ≥ 2.0 一律用 native；較舊的 NumPy 在查表與 SWAR 間以一小段實測 (約 1 ms) 挑較快者，
+    兩者的相對速度取決於 CPU 快取與 NumPy 的索引實作，無法事先判斷。
+    """
+    names = available_backends()
+    if not names or names[0] == "native":
+        return names[0] if names else None
+    sample = np.random.default_rng(0).integers(0, 2**63, size=1 << 14, dtype=np.uint64)
+    return min(names, key=lambda name: _time_backend(name, sample))
+
+
+def set_backend(name: str = "auto") -> str:
+    """切換後端 (主要供基準測試與比對使用)；'auto' 還原為執行期自動選擇的結果。"""
+    global BACKEND
+    if name == "auto":
+        BACKEND = _select_backend()
+    elif name in available_backends():
+        BACKEND = name
+    else:
+        raise ValueError(f"無法使用的 popcount 後端: {name} (可用: {available_backends()})")
+    return BACKEND
+
+
+def scratch_for(shape: tuple, backend: Optional[str] = None) -> Optional["np.ndarray"]:
+    """配置 shape 大小輸入所需的 popcount 暫存 (依目前或指定的後端)；native 回傳 None。"""
+    backend = backend or BACKEND
+    if backend == "lut":
+        return np.empty(tuple(shape) + (4,), dtype=np.uint8)
+    if backend == "swar":
+        return np.empty((2,) + tuple(shape), dtype=np.uint64)
+    return None
+
+
+BACKEND = _select_backend()
+
+
+def popcount(arr: "np.ndarray", out: Optional["np.ndarray"] = None, scratch: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """
+    uint64 陣列逐元素位元數，回傳 uint8 陣列。out / scratch 可傳入重複使用的緩衝區以避免每次配置：
+    out 為同形狀 uint8；scratch 依後端而定 (見 scratch_for)，native 不需要。
+    """
+    arr = np.asarray(arr)
+    if arr.dtype != np.uint64:
+        arr = arr.astype(np.uint64)
+    return _BACKENDS[BACKEND](arr, out, scratch)
+
+
+def xor_popcount(
+    a: "np.ndarray",
+    b: "np.ndarray",
+    out: Optional["np.ndarray"] = None,
+    xor_out: Optional["np.ndarray"] = None,
+    scratch: Optional["np.ndarray"] = None,
+) -> "np.ndarray":
+    """popcount(a ^ b) (支援廣播)；xor_out 為 XOR 結果的 uint64 暫存，提供時原地寫入。"""
+    a = np.asarray(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+    xor = np.bitwise_xor(a, b, out=xor_out) if xor_out is not None else np.bitwise_xor(a, b)
+    return popcount(xor, out=out, scratch=scratch)
+
+
+def benchmark_backends(n: int = 1 << 22, repeats: int = 5, seed: int = 0) -> List[Dict[str, object]]:
+    """
+    各後端對 n 個隨機 uint64 的吞吐量 (百萬個 / 秒，取最佳一次)，並以第一個後端的結果核對一致性。
+    每個後端都以預先配置的 out / scratch 呼叫，量測的是穩定狀態下的內層迴圈成本。
+    """
+    if np is None:
+        raise RuntimeError("benchmark 需要 numpy")
+    values = np.random.default_rng(seed).integers(0, 2**64, size=n, dtype=np.uint64, endpoint=False)
+    reference = None
+    reports = []
+    selected = BACKEND
+    for name in available_backends():
+        out = np.empty(n, dtype=np.uint8)
+        scratch = scratch_for((n,), name)
+        best = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            _BACKENDS[name](values, out, scratch)
+            best = min(best, time.perf_counter() - t0)
+        if reference is None:
+            reference = out.copy()
+        reports.append({
+            "backend": name,
+            "selected": name == selected,
+            "mvals_per_s": n / best / 1e6,
+            "matches": bool(np.array_equal(out, reference)),
+        })
+    return reports
+
+
+if __name__ == "__main__":
+    # python -m core.popcount [n]
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1 << 22
+    print(f"numpy {np.__version__ if np is not None else '-'} | 自動選擇: {BACKEND}")
+    for r in benchmark_backends(size):
+        print(f"{'*' if r['selected'] else ' '} {r['backend']:<7} {r['mvals_per_s']:9.1f} M/s  一致: {r['matches']}")
@@ -25,6 +25,9 @@ from utils import (
     _color_gate,
 )
 from processors.scanner import _iter_scandir_recursively
+from core.hamming_index import HammingIndex, grid_block_matches, radius_for_similarity
+from core.hamming_pairs import DEFAULT_TILE_SIZE, pairs_within
+from core.popcount import popcount, xor_popcount
 
 try:
     import imagehash
@@ -34,26 +37,19 @@ except ImportError:
 # 為了在 Mixin 中正確使用常量，這裡重新宣告或引用
 HASH_BITS = 64
 PHASH_FAST_THRESH = 0.70
+# pHash 未達 PHASH_FAST_THRESH、但不低於此值的配對仍可由 Grid 區塊吻合補救
+GRID_RESCUE_FLOOR = 0.40
 PHASH_STRICT_SKIP = 0.93
 AD_GROUPING_THRESHOLD = 0.95
-LSH_BANDS = 8
 
 FEATURE_PHASH = 1 << 0
 FEATURE_WHASH = 1 << 1
 FEATURE_COLOR = 1 << 2
 
 
-def bit_count_np(arr):
-    """高效的 NumPy 陣列位元計數 (Popcount) 實作。"""
-    import numpy as np
-    c = arr.astype(np.uint64)
-    c = (c & 0x5555555555555555) + ((c >> 1) & 0x5555555555555555)
-    c = (c & 0x3333333333333333) + ((c >> 2) & 0x3333333333333333)
-    c = (c & 0x0F0F0F0F0F0F0F0F) + ((c >> 4) & 0x0F0F0F0F0F0F0F0F)
-    c = (c & 0x00FF00FF00FF00FF) + ((c >> 8) & 0x00FF00FF00FF00FF)
-    c = (c & 0x0000FFFF0000FFFF) + ((c >> 16) & 0x0000FFFF0000FFFF)
-    c = (c & 0x00000000FFFFFFFF) + ((c >> 32) & 0x00000000FFFFFFFF)
-    return c.astype(np.int8)
+def bit_count_np(arr, out=None):
+    """NumPy 陣列位元計數 (Popcount)，回傳 uint8；後端由 core.popcount 依執行環境選擇 (np.bitwise_count / 查表 / SWAR)。"""
+    return popcount(arr, out=out)
 
 
 class SimilarityFlowMixin:
@@ -112,29 +108,31 @@ class SimilarityFlowMixin:
         scan_cache_manager: Any,
     ) -> tuple[list, list, dict]:
         color_gate_params = self._build_color_gate_params(context['user_thresh_percent'])
-        phash_index = self._build_phash_band_index(context['gallery_data'])
         user_thresh = context['user_thresh_percent'] / 100.0
         inter_folder_only = self.config.get('enable_inter_folder_only', False) and context['is_mutual_mode']
         stats = {'comparisons': 0, 'passed_phash': 0, 'passed_color': 0, 'entered_whash': 0, 'filtered_inter': 0}
         use_color_filter = self.config.get('enable_color_filter', True)
         use_whash = self.config.get('enable_whash', True)
+        phash_radius = self._phash_search_radius()
 
         candidates_phash, phase_a_start = self._collect_phash_candidates(
             context['ad_data_representatives'],
             context['gallery_data'],
             context['ad_data'],
             context['leader_to_ad_group'],
-            phash_index,
+            phash_radius,
             context['is_mutual_mode'],
             context['is_ad_mode'],
             inter_folder_only,
             stats,
             ad_cache_manager=context['ad_cache_manager'],
             ad_member_to_leader=context.get('ad_member_to_leader'),
+            gallery_snapshot=context.get('gallery_snapshot'),
         )
         if self._check_control() != 'continue':
             return [], [], stats
 
+        gallery_snapshot = context.get('gallery_snapshot')
         phase_b_start = time.time()
         if use_color_filter:
             self._ensure_candidate_hsv(
@@ -142,10 +140,14 @@ class SimilarityFlowMixin:
                 context['is_mutual_mode'],
                 context['ad_cache_manager'],
                 scan_cache_manager,
+                gallery_snapshot=gallery_snapshot,
             )
         log_info(f"[Phase B 完成] HSV 特徵準備耗時: {time.time() - phase_b_start:.2f}s")
         phase_c_start = time.time()
-        candidates_hsv = self._filter_candidates_by_color(candidates_phash, color_gate_params, use_color_filter, stats)
+        candidates_hsv = self._filter_candidates_by_color(
+            candidates_phash, color_gate_params, use_color_filter, stats,
+            gallery_snapshot=gallery_snapshot, left_in_gallery=context['is_mutual_mode'],
+        )
         log_info(f"[Phase C 完成] 顏色向量化過濾耗時: {time.time() - phase_c_start:.2f}s")
 
         phase_d_start = time.time()
@@ -155,10 +157,14 @@ class SimilarityFlowMixin:
                 context['is_mutual_mode'],
                 context['ad_cache_manager'],
                 scan_cache_manager,
+                gallery_snapshot=gallery_snapshot,
             )
         log_info(f"[Phase D 完成] wHash 特徵準備耗時: {time.time() - phase_d_start:.2f}s")
         phase_e_start = time.time()
-        temp_found_pairs = self._select_final_matches(candidates_hsv, user_thresh, use_whash, stats, phase_a_start)
+        temp_found_pairs = self._select_final_matches(
+            candidates_hsv, user_thresh, use_whash, stats, phase_a_start,
+            gallery_snapshot=gallery_snapshot, left_in_gallery=context['is_mutual_mode'],
+        )
         log_info(f"[Phase E 耗時] wHash 向量化複核耗時: {time.time() - phase_e_start:.2f}s")
 
         build_items_start = time.time()
@@ -193,6 +199,7 @@ class SimilarityFlowMixin:
             'is_ad_mode': is_ad_mode,
             'current_digest': current_digest,
             'gallery_data': gallery_data,
+            'gallery_snapshot': self._open_gallery_snapshot(scan_cache_manager),
             'user_thresh_percent': user_thresh_percent,
             **mode_state,
         }
@@ -252,6 +259,85 @@ class SimilarityFlowMixin:
             return None
         return {k: v for k, v in self.file_data.items() if k in tasks_to_process}
 
+    def _open_gallery_snapshot(self, scan_cache_manager: Any):
+        """同步並開啟圖片快取的欄式雜湊快照 (唯讀 memmap)；停用或不支援時回傳 None。"""
+        if not self.config.get('enable_hash_snapshot', True):
+            return None
+        refresh = getattr(scan_cache_manager, 'refresh_hash_snapshot', None)
+        if refresh is None:
+            return None
+        start = time.time()
+        snapshot = refresh()
+        if snapshot is not None:
+            log_info(f"[快照] 雜湊快照就緒: {len(snapshot)} 列, 耗時 {time.time() - start:.2f}s")
+        return snapshot
+
+    def _gallery_hash_vector(self, gallery_items: list, gallery_ids, gallery_snapshot):
+        """圖庫 pHash 向量：有快照時直接由 memmap 取值，快照缺漏的項目才回頭讀 dict。"""
+        import numpy as np
+        if gallery_ids is None:
+            return np.array([self._h2i(it[1].get('phash')) for it in gallery_items], dtype=np.uint64)
+        hashes = gallery_snapshot.take('phash', gallery_ids)
+        for idx in np.flatnonzero(gallery_ids < 0):
+            hashes[idx] = self._h2i(gallery_items[idx][1].get('phash'))
+        return hashes
+
+    def _gallery_grid_matrix(self, gallery_items: list, gallery_ids, gallery_snapshot):
+        """圖庫 Grid 矩陣 (N, 16)，與 _gallery_hash_vector 同序；缺 Grid (或不是 16 塊) 的列為全 0，不會通過 Grid 補救。"""
+        import numpy as np
+
+        def parse(ent: dict) -> list:
+            grid = [self._h2i(x) for x in ent.get('grid_phash', [])]
+            return grid if len(grid) == 16 else [0] * 16
+
+        if gallery_ids is None:
+            return np.array([parse(it[1]) for it in gallery_items], dtype=np.uint64).reshape(len(gallery_items), 16)
+        grids = gallery_snapshot.take('grid', gallery_ids)
+        for idx in np.flatnonzero(gallery_ids < 0):
+            grids[idx] = parse(gallery_items[idx][1])
+        return grids
+
+    def _snapshot_feature_column(self, gallery_snapshot: Any, paths: list, name: str):
+        """
+        路徑在快照中的 HSV (name='hsv', float32[N, 3]) 或 wHash (name='whash', uint64[N]) 與缺值遮罩；
+        不在快照中、該欄為缺值 (HSV 為 NaN、wHash 為 0) 或沒有快照時視為缺值。
+        """
+        import numpy as np
+        if name == 'hsv':
+            if gallery_snapshot is None:
+                return np.full((len(paths), 3), np.nan, dtype=np.float32), np.ones(len(paths), dtype=bool)
+            values = gallery_snapshot.take('hsv', gallery_snapshot.ids_for(_norm_key(p) for p in paths), fill=np.nan)
+            return values, np.isnan(values).any(axis=1)
+        if gallery_snapshot is None:
+            return np.zeros(len(paths), dtype=np.uint64), np.ones(len(paths), dtype=bool)
+        values = gallery_snapshot.take('whash', gallery_snapshot.ids_for(_norm_key(p) for p in paths))
+        return values, values == 0
+
+    def _candidate_feature_pairs(self, candidates: list, name: str, gallery_snapshot: Any, left_in_gallery: bool) -> tuple:
+        """
+        Phase C / E 的候選兩側特徵：圖庫側由快照 memmap 批次取值，快照缺值的列才讀 file_data 的單檔 dict。
+        左側 (member) 只有互比模式來自圖庫；廣告模式的左側一律讀 dict。回傳 (左側陣列, 右側陣列)。
+        """
+        import numpy as np
+        sides = []
+        for pos, from_gallery in ((1, left_in_gallery), (2, True)):
+            paths = [c[pos] for c in candidates]
+            values, missing = self._snapshot_feature_column(gallery_snapshot if from_gallery else None, paths, name)
+            for idx in np.flatnonzero(missing):
+                ent = self.file_data.get(_norm_key(paths[idx]), {})
+                values[idx] = (ent.get('avg_hsv') or (0, 0, 0)) if name == 'hsv' else self._h2i(ent.get('whash'))
+            sides.append(values)
+        return sides[0], sides[1]
+
+    def _drop_snapshot_covered(self, paths: list, cache_mgr_map: dict, scan_cache_manager: Any, gallery_snapshot: Any, name: str) -> list:
+        """Phase B / D：快照已有該特徵的圖庫路徑不必讀單檔 dict 或補算，只留下其餘路徑。"""
+        if gallery_snapshot is None:
+            return paths
+        gallery_paths = [p for p in dict.fromkeys(paths) if cache_mgr_map.get(_norm_key(p)) is scan_cache_manager]
+        _, missing = self._snapshot_feature_column(gallery_snapshot, gallery_paths, name)
+        covered = {p for p, absent in zip(gallery_paths, missing.tolist()) if not absent}
+        return [p for p in paths if p not in covered]
+
     def _get_phash_worker(self):
         from processors.qr_engine import _pool_worker_process_image_phash_only
         return _pool_worker_process_image_phash_only
@@ -443,7 +529,15 @@ class SimilarityFlowMixin:
                     return True
         return False
 
-    def _filter_candidates_by_color(self, candidates_phash: list, color_gate_params: dict, use_color_filter: bool, stats: dict) -> list:
+    def _filter_candidates_by_color(
+        self,
+        candidates_phash: list,
+        color_gate_params: dict,
+        use_color_filter: bool,
+        stats: dict,
+        gallery_snapshot: Any = None,
+        left_in_gallery: bool = False,
+    ) -> list:
         log_info(f"[Phase C] 顏色過濾 {len(candidates_phash)} 個 pHash 候選...")
         if not candidates_phash: return []
         if not use_color_filter:
@@ -452,20 +546,9 @@ class SimilarityFlowMixin:
 
         import numpy as np
         
-        hsv_pairs = []
-        skip_mask = []
-        rescue_mask = []
-        
-        for (_, m_path, p2_path, sim_p, grid_rescue) in candidates_phash:
-            hsv1 = self.file_data.get(_norm_key(m_path), {}).get('avg_hsv') or (0, 0, 0)
-            hsv2 = self.file_data.get(_norm_key(p2_path), {}).get('avg_hsv') or (0, 0, 0)
-            hsv_pairs.append([hsv1, hsv2])
-            skip_mask.append(sim_p >= PHASH_STRICT_SKIP)
-            rescue_mask.append(grid_rescue)
-
-        HSV = np.array(hsv_pairs, dtype=np.float32)
-        SK = np.array(skip_mask, dtype=bool)
-        GR = np.array(rescue_mask, dtype=bool)
+        HSV1, HSV2 = self._candidate_feature_pairs(candidates_phash, 'hsv', gallery_snapshot, left_in_gallery)
+        SK = np.array([c[3] >= PHASH_STRICT_SKIP for c in candidates_phash], dtype=bool)
+        GR = np.array([c[4] for c in candidates_phash], dtype=bool)
         
         h_tol = color_gate_params['hue_deg_tol']
         s_tol = color_gate_params['sat_tol']
@@ -473,8 +556,8 @@ class SimilarityFlowMixin:
         ls_v_tol = color_gate_params['low_sat_value_tol']
         ls_a_tol = color_gate_params['low_sat_achroma_tol']
 
-        H1, S1, V1 = HSV[:, 0, 0], HSV[:, 0, 1], HSV[:, 0, 2]
-        H2, S2, V2 = HSV[:, 1, 0], HSV[:, 1, 1], HSV[:, 1, 2]
+        H1, S1, V1 = HSV1[:, 0], HSV1[:, 1], HSV1[:, 2]
+        H2, S2, V2 = HSV2[:, 0], HSV2[:, 1], HSV2[:, 2]
 
         is_low_sat = np.maximum(S1, S2) < ls_thresh
         ls_ok = (np.abs(V1 - V2) <= ls_v_tol) & \
@@ -501,6 +584,7 @@ class SimilarityFlowMixin:
         is_mutual_mode: bool,
         ad_cache_manager: Any,
         scan_cache_manager: Any,
+        gallery_snapshot: Any = None,
     ) -> None:
         if not candidates_hsv:
             return
@@ -514,6 +598,7 @@ class SimilarityFlowMixin:
             primary_cache,
             scan_cache_manager,
         )
+        all_paths_d = self._drop_snapshot_covered(all_paths_d, cache_mgr_map_d, scan_cache_manager, gallery_snapshot, 'whash')
         self._batch_ensure_features(all_paths_d, cache_mgr_map_d, need_whash=True, phase_name="wHash")
 
     def _ensure_candidate_hsv(
@@ -522,6 +607,7 @@ class SimilarityFlowMixin:
         is_mutual_mode: bool,
         ad_cache_manager: Any,
         scan_cache_manager: Any,
+        gallery_snapshot: Any = None,
     ) -> None:
         if not candidates:
             return
@@ -532,6 +618,7 @@ class SimilarityFlowMixin:
             primary_cache,
             scan_cache_manager,
         )
+        all_paths_b = self._drop_snapshot_covered(all_paths_b, cache_mgr_map, scan_cache_manager, gallery_snapshot, 'hsv')
         self._batch_ensure_features(all_paths_b, cache_mgr_map, need_hsv=True, phase_name="HSV")
 
     def _collect_phash_candidates(
@@ -540,13 +627,14 @@ class SimilarityFlowMixin:
         gallery_data: dict,
         ad_data: dict,
         leader_to_ad_group: dict,
-        phash_index: list,
+        phash_radius: int,
         is_mutual_mode: bool,
         is_ad_mode: bool,
         inter_folder_only: bool,
         stats: dict,
         ad_cache_manager: Any = None,
         ad_member_to_leader: Optional[dict] = None,
+        gallery_snapshot: Any = None,
     ) -> tuple[list, float]:
         log_info("[Phase A] 開始純記憶體 pHash 篩選 (向量化優化版)...")
         self._update_progress(text="🔍 [Phase A] pHash 快篩中 (向量化加速)...")
@@ -557,7 +645,8 @@ class SimilarityFlowMixin:
         
         gallery_items = list(gallery_data.items())
         gallery_paths = [it[0] for it in gallery_items]
-        gallery_hashes = np.array([self._h2i(it[1].get('phash')) for it in gallery_items], dtype=np.uint64)
+        gallery_ids = gallery_snapshot.ids_for(_norm_key(p) for p in gallery_paths) if gallery_snapshot is not None else None
+        gallery_hashes = self._gallery_hash_vector(gallery_items, gallery_ids, gallery_snapshot)
         
         # 廣告模式必須以「成員圖」做 pHash 候選，而不是只用代表圖。
         # 代表圖只負責最後分組顯示；實際進 Phase E 的 member_path 必須是命中的那張廣告圖。
@@ -593,6 +682,28 @@ class SimilarityFlowMixin:
 
         AD_H = np.array(ad_hashes_matrix, dtype=np.uint64)
         AD_G = np.array(ad_grid_matrix, dtype=np.uint64)
+        if is_mutual_mode:
+            gallery_grids = self._gallery_grid_matrix(gallery_items, gallery_ids, gallery_snapshot)
+            candidates_phash.extend(
+                self._mutual_phash_pairs(
+                    ad_paths, AD_H, AD_G, gallery_paths, gallery_hashes, gallery_grids, phash_radius, inter_folder_only, stats
+                )
+            )
+            return candidates_phash, phase_a_start
+
+        # 多索引雜湊：保證找出任一旋轉角度與圖庫 pHash 距離 ≤ phash_radius (Grid 補救下限) 的所有圖片 (id = gallery 位置)；
+        # 其中未達 PHASH_FAST_THRESH 者仍須通過下方的 Grid 補救
+        hamming_index = HammingIndex(gallery_hashes, phash_radius)
+        gallery_pos = {p: idx for idx, p in enumerate(gallery_paths)}
+        log_info(
+            f"[Phase A] Hamming 索引: {hamming_index.size} 張, 半徑 {phash_radius}, "
+            f"{'線性掃描' if hamming_index.width is None else f'{hamming_index.substrings} x {hamming_index.width} bits'}"
+        )
+        # 廣告模式下不與圖庫中的廣告圖本身比對
+        skip_mask = np.zeros(len(gallery_paths), dtype=bool)
+        if is_ad_mode:
+            skip_mask[[gallery_pos[p] for p in ad_data if p in gallery_pos]] = True
+        gallery_grids = None
         
         # [AD-LSH-02] 建立 Grid 倒排索引 (僅廣告比模式且非互比時啟用)
         grid_index = None
@@ -602,11 +713,13 @@ class SimilarityFlowMixin:
         for i, ad_path in enumerate(ad_paths):
             if self._check_control() != 'continue': break
             
-            ad_h_base = AD_H[i, 0]
-            lsh_candidates = self._lsh_candidates_for(ad_path, ad_h_base, phash_index)
+            candidate_ids = hamming_index.ids_array(AD_H[i])
+            self_pos = gallery_pos.get(_norm_key(ad_path), -1)
+            if self_pos >= 0:
+                candidate_ids = candidate_ids[candidate_ids != self_pos]
             
-            # [AD-LSH-02] Fallback 補救邏輯
-            if not lsh_candidates and grid_index is not None:
+            # [AD-LSH-02] Fallback 補救邏輯：pHash 半徑內完全沒有候選時，改以 Grid 區塊投票
+            if not len(candidate_ids) and grid_index is not None:
                 stats['fallback_trigger_count'] = stats.get('fallback_trigger_count', 0) + 1
                 ad_grid_blocks = AD_G[i, 0] # 使用 0 度旋轉作為投票基準
                 votes = defaultdict(int)
@@ -616,7 +729,7 @@ class SimilarityFlowMixin:
                         votes[path] += 1
                 
                 # 門檻：matched_blocks >= 12
-                fb_list = [p for p, v in votes.items() if v >= 12]
+                fb_list = [p for p, v in votes.items() if v >= 12 and p in gallery_pos and gallery_pos[p] != self_pos]
                 
                 # 分層 Cap
                 MAX_FB_PER_AD = 200
@@ -632,72 +745,38 @@ class SimilarityFlowMixin:
                     stats['fallback_cap_hit_total'] = stats.get('fallback_cap_hit_total', 0) + 1
                 
                 if fb_list:
-                    lsh_candidates = set(fb_list)
+                    candidate_ids = np.array(sorted(gallery_pos[p] for p in fb_list), dtype=np.int64)
                     stats['fallback_candidates_added'] = total_fb_so_far + len(fb_list)
                     # 記錄這些是由補救產生的，供後續統計最終通過數
                     if 'fallback_pairs' not in stats: stats['fallback_pairs'] = set()
                     leader_path = ad_member_to_leader.get(ad_path, ad_path) if ad_member_to_leader else ad_path
-                    for scan_item_path in lsh_candidates:
+                    for scan_item_path in fb_list:
                         stats['fallback_pairs'].add((leader_path, scan_item_path))
 
-            if not lsh_candidates: continue
-            
-            filtered_candidates = []
-            for p2_path in lsh_candidates:
-                if is_mutual_mode:
-                    if p2_path <= ad_path:
-                        continue
-                    if inter_folder_only:
-                        p1_parent_base = ad_path if not _is_virtual_path(ad_path) else _parse_virtual_path(ad_path)[0]
-                        p2_parent_base = p2_path if not _is_virtual_path(p2_path) else _parse_virtual_path(p2_path)[0]
-                        if os.path.dirname(p1_parent_base) == os.path.dirname(p2_parent_base):
-                            stats['filtered_inter'] += 1
-                            continue
-                if is_ad_mode and p2_path in ad_data:
-                    continue
-                filtered_candidates.append(p2_path)
-            if not filtered_candidates:
-                continue
-
-            lsh_set = set(filtered_candidates)
-            lsh_mask = np.array([p in lsh_set for p in gallery_paths], dtype=bool)
-            if not np.any(lsh_mask): continue
-            
-            target_hashes = gallery_hashes[lsh_mask]
-            target_paths = [gallery_paths[idx] for idx, val in enumerate(lsh_mask) if val]
-            valid_target_mask = target_hashes != 0
-            if not np.any(valid_target_mask):
-                continue
-            if not np.all(valid_target_mask):
-                target_hashes = target_hashes[valid_target_mask]
-                target_paths = [p for p, keep in zip(target_paths, valid_target_mask) if keep]
+            # 候選依 gallery 位置遞增，維持與圖庫相同的順序
+            sel = candidate_ids[~skip_mask[candidate_ids]]
+            sel = sel[gallery_hashes[sel] != 0]
+            if not len(sel): continue
             
-            xor_results = AD_H[i][:, np.newaxis] ^ target_hashes
-            hamming_dists = bit_count_np(xor_results)
+            hamming_dists = xor_popcount(AD_H[i][:, np.newaxis], gallery_hashes[sel])
             sims = 1.0 - (hamming_dists / 64.0)
             max_sims = np.max(sims, axis=0)
             
-            stats['comparisons'] += len(target_paths)
+            stats['comparisons'] += len(sel)
             
-            rescue_needed_mask = (max_sims < 0.70)
-            grid_rescue_final = np.zeros(len(target_paths), dtype=bool)
+            rescue_needed_mask = (max_sims < PHASH_FAST_THRESH)
+            grid_rescue_final = np.zeros(len(sel), dtype=bool)
             
-            rescue_candidates_mask = rescue_needed_mask & (max_sims >= 0.4)
+            rescue_candidates_mask = rescue_needed_mask & (max_sims >= GRID_RESCUE_FLOOR)
             if np.any(rescue_candidates_mask):
-                for idx in np.where(rescue_candidates_mask)[0]:
-                    g_path = target_paths[idx]
-                    grid2 = [self._h2i(x) for x in gallery_data.get(g_path, {}).get('grid_phash', [])]
-                    if len(grid2) != 16: continue
-                    G2 = np.array(grid2, dtype=np.uint64)
-                    g_xor = AD_G[i] ^ G2
-                    valid_blocks = (AD_G[i] != 0) & (G2 != 0)
-                    g_matches = np.sum(valid_blocks & (1.0 - (bit_count_np(g_xor) / 64.0) >= 0.95), axis=1)
-                    if np.any(g_matches >= 12):
-                        grid_rescue_final[idx] = True
-
-            passed_mask = (max_sims >= 0.70) | grid_rescue_final
-            for idx in np.where(passed_mask)[0]:
-                scan_item_path = target_paths[idx]
+                if gallery_grids is None:
+                    gallery_grids = self._gallery_grid_matrix(gallery_items, gallery_ids, gallery_snapshot)
+                rescue_idx = np.flatnonzero(rescue_candidates_mask)
+                grid_rescue_final[rescue_idx] = grid_block_matches(AD_G[i], gallery_grids[sel[rescue_idx]])
+
+            passed_mask = (max_sims >= PHASH_FAST_THRESH) | grid_rescue_final
+            for idx in np.flatnonzero(passed_mask):
+                scan_item_path = gallery_paths[sel[idx]]
                 sim_p = float(max_sims[idx])
                 is_gr = bool(grid_rescue_final[idx])
                 
@@ -718,7 +797,90 @@ class SimilarityFlowMixin:
 
         return candidates_phash, phase_a_start
 
-    def _select_final_matches(self, candidates_hsv: list, user_thresh: float, use_whash: bool, stats: dict, phase_a_start: float) -> list:
+    def _mutual_phash_pairs(
+        self,
+        ad_paths: list,
+        ad_hashes: Any,
+        ad_grids: Any,
+        gallery_paths: list,
+        gallery_hashes: Any,
+        gallery_grids: Any,
+        phash_radius: int,
+        inter_folder_only: bool,
+        stats: dict,
+    ) -> list:
+        """
+        互比模式 Phase A：以分塊 XOR + popcount 核心一次算出所有配對，取代逐張圖片在 Python 中對整個圖庫建遮罩的 O(N²) 迴圈。
+        pHash 達 PHASH_FAST_THRESH 的配對直接通過；距離不超過 phash_radius (Grid 補救下限) 的其餘配對
+        須在核心內通過 Grid 區塊比對，並標記為 Grid 補救。
+        圖庫依路徑排序後只算上三角，即原本 p2 > p1 的條件；輸出順序同樣依 p1、p2 在圖庫中的位置。
+        """
+        import numpy as np
+        gallery_pos = {p: idx for idx, p in enumerate(gallery_paths)}
+        ad_pos = np.array([gallery_pos.get(p, -1) for p in ad_paths], dtype=np.int64)
+        in_gallery = ad_pos >= 0
+        rows = np.zeros((len(gallery_paths), ad_hashes.shape[1]), dtype=np.uint64)
+        rows[ad_pos[in_gallery]] = ad_hashes[in_gallery]
+        # 只保留至少一張圖有值的 Grid 變體 (通常只有 0 度)，核心不必為全 0 的旋轉多算
+        grid_variants = np.flatnonzero(ad_grids.any(axis=(0, 2))) if len(ad_grids) else np.zeros(0, dtype=np.int64)
+        row_grids = np.zeros((len(gallery_paths), len(grid_variants), ad_grids.shape[-1]), dtype=np.uint64)
+        row_grids[ad_pos[in_gallery]] = ad_grids[in_gallery][:, grid_variants]
+        order = np.array(sorted(range(len(gallery_paths)), key=gallery_paths.__getitem__), dtype=np.int64)
+
+        tile_size = int(self.config.get('mutual_pair_tile_size', DEFAULT_TILE_SIZE) or DEFAULT_TILE_SIZE)
+        workers = int(self.config.get('mutual_pair_workers', 0) or 0)
+        last_report = [0.0]
+
+        def report(done: int, total: int) -> None:
+            now = time.time()
+            if now - last_report[0] >= 0.5 or done == total:
+                last_report[0] = now
+                self._update_progress(text=f"🔍 [Phase A] 互比全配對 {done}/{total} 區塊...")
+
+        t0 = time.time()
+        fast_radius = radius_for_similarity(PHASH_FAST_THRESH, HASH_BITS)
+        row_idx, col_idx, dists, rescued = pairs_within(
+            rows[order], gallery_hashes[order], fast_radius,
+            rescue_radius=phash_radius, row_grids=row_grids[order], col_grids=gallery_grids[order],
+            upper=True, tile_size=tile_size, workers=workers,
+            should_stop=lambda: self._check_control() != 'continue', progress=report,
+        )
+        p1_pos, p2_pos = order[row_idx], order[col_idx]
+        log_info(
+            f"[Phase A] 互比全配對: {len(gallery_paths)} 張, tile {tile_size}, {len(row_idx)} 對 "
+            f"(≤ {fast_radius} bits 或 ≤ {phash_radius} bits 且 Grid 補救 {int(rescued.sum())} 對), 耗時 {time.time() - t0:.2f}s"
+        )
+
+        if inter_folder_only and len(p1_pos):
+            folder_ids = {}
+            parent_of = np.array([
+                folder_ids.setdefault(os.path.dirname(p if not _is_virtual_path(p) else _parse_virtual_path(p)[0]), len(folder_ids))
+                for p in gallery_paths
+            ], dtype=np.int64)
+            same_folder = parent_of[p1_pos] == parent_of[p2_pos]
+            stats['filtered_inter'] += int(same_folder.sum())
+            keep = ~same_folder
+            p1_pos, p2_pos, dists, rescued = p1_pos[keep], p2_pos[keep], dists[keep], rescued[keep]
+
+        ordered = np.lexsort((p2_pos, p1_pos))
+        sims = 1.0 - (dists[ordered].astype(np.float64) / 64.0)
+        stats['comparisons'] += len(ordered)
+        stats['passed_phash'] += len(ordered)
+        return [
+            (gallery_paths[a], gallery_paths[a], gallery_paths[b], sim, is_gr)
+            for a, b, sim, is_gr in zip(p1_pos[ordered].tolist(), p2_pos[ordered].tolist(), sims.tolist(), rescued[ordered].tolist())
+        ]
+
+    def _select_final_matches(
+        self,
+        candidates_hsv: list,
+        user_thresh: float,
+        use_whash: bool,
+        stats: dict,
+        phase_a_start: float,
+        gallery_snapshot: Any = None,
+        left_in_gallery: bool = False,
+    ) -> list:
         log_info(f"[Phase E] wHash 最終過濾 {len(candidates_hsv)} 個候選...")
         if not candidates_hsv: return []
         
@@ -728,18 +890,12 @@ class SimilarityFlowMixin:
         sim_p_arr = np.array([c[3] for c in candidates_hsv], dtype=np.float32)
         gr_arr = np.array([c[4] for c in candidates_hsv], dtype=bool)
         
-        w1_list, w2_list = [], []
-        for (_, m_path, p2_path, _, _) in candidates_hsv:
-            w1_list.append(self._h2i(self.file_data.get(_norm_key(m_path), {}).get('whash')))
-            w2_list.append(self._h2i(self.file_data.get(_norm_key(p2_path), {}).get('whash')))
-        
-        W1 = np.array(w1_list, dtype=np.uint64)
-        W2 = np.array(w2_list, dtype=np.uint64)
+        W1, W2 = self._candidate_feature_pairs(candidates_hsv, 'whash', gallery_snapshot, left_in_gallery)
         
         if use_whash:
             # 增加安全檢查：如果雜湊值為 0，通常代表讀圖失敗或純色，不應視為有效匹配
             valid_w = (W1 != 0) & (W2 != 0)
-            diffs = bit_count_np(W1 ^ W2)
+            diffs = xor_popcount(W1, W2)
             sim_w = 1.0 - (diffs / HASH_BITS)
             wh_adaptive = 0.90 - np.maximum(0.0, np.minimum(1.0, (sim_p_arr - 0.70) / 0.23)) * 0.20
             
@@ -815,16 +971,16 @@ class SimilarityFlowMixin:
         targeted_floor_sim = 0.40
         ad_member_to_leader = ad_member_to_leader or {}
 
-        if ad_cache_manager and hasattr(ad_cache_manager, "query_hash_index"):
+        if ad_cache_manager and hasattr(ad_cache_manager, "query_hash_index_many"):
             best_matches = {
                 leader: {'path': None, 'sim': targeted_floor_sim}
                 for leader in ad_data_representatives.keys()
             }
-            for scan_path, scan_ent in gallery_list:
-                h2 = self._coerce_hash_obj(scan_ent.get('phash'))
-                if not self._valid_hash_obj(h2): continue
-                candidate_paths = ad_cache_manager.query_hash_index(h2)
-                if not candidate_paths: continue
+            gallery_hashes = [self._coerce_hash_obj(scan_ent.get('phash')) for _, scan_ent in gallery_list]
+            gallery_hashes = [h2 if self._valid_hash_obj(h2) else None for h2 in gallery_hashes]
+            candidate_sets = ad_cache_manager.query_hash_index_many(gallery_hashes)
+            for (scan_path, _), h2, candidate_paths in zip(gallery_list, gallery_hashes, candidate_sets):
+                if h2 is None or not candidate_paths: continue
                 for ad_path in candidate_paths:
                     ad_ent = ad_data.get(ad_path, {})
                     h1 = self._coerce_hash_obj(ad_ent.get('phash'))
@@ -990,24 +1146,9 @@ class SimilarityFlowMixin:
         if sim_w >= whash_adaptive or sim_p >= PHASH_STRICT_SKIP: return True, max(sim_p, sim_w)
         return False, sim_p
 
-    def _build_phash_band_index(self, gallery_file_data: dict, bands=LSH_BANDS):
-        seg_bits = HASH_BITS // bands; mask = (1 << seg_bits) - 1
-        index = [defaultdict(list) for _ in range(bands)]
-        for path, ent in gallery_file_data.items():
-            phash_obj = self._coerce_hash_obj(ent.get('phash'))
-            if not self._valid_hash_obj(phash_obj): continue
-            v = self._h2i(phash_obj)
-            for b in range(bands):
-                key = (v >> (b * seg_bits)) & mask
-                index[b][key].append(_norm_key(path))
-        return index
-
-    def _lsh_candidates_for(self, ad_path: str, ad_hash_obj: Any, index: list, bands=LSH_BANDS):
-        seg_bits = HASH_BITS // bands; mask = (1 << seg_bits) - 1
-        v = self._h2i(ad_hash_obj)
-        cand = set()
-        for b in range(bands):
-            key = (v >> (b * seg_bits)) & mask
-            cand.update(index[b].get(key, []))
-        if _norm_key(ad_path) in cand: cand.remove(_norm_key(ad_path))
-        return cand
+    def _phash_search_radius(self) -> int:
+        """
+        Phase A 的 pHash 搜尋半徑 (Hamming 距離)：取 Grid 補救下限 GRID_RESCUE_FLOOR，
+        介於下限與 PHASH_FAST_THRESH 之間的配對須再經 Grid 區塊比對才會通過。
+        """
+        return radius_for_similarity(GRID_RESCUE_FLOOR, HASH_BITS)
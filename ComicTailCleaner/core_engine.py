@@ -11,6 +11,7 @@ import time
 import datetime
 import sys
 import hashlib
+import heapq
 from collections import deque, defaultdict
 import threading
 from multiprocessing import Pool, set_start_method
@@ -37,7 +38,7 @@ import utils
 from utils import (log_info, log_error, log_performance, _is_virtual_path,
                    _parse_virtual_path, _open_image_from_any_path,
                    _get_file_stat, sim_from_hamming, hamming_from_sim,
-                   _avg_hsv, _color_gate, _norm_key, _calculate_quick_digest)
+                   _avg_hsv, _color_gate, _norm_key, _calculate_quick_digest, _image_quick_digest)
 
 try:
     from utils import log_warning
@@ -53,11 +54,16 @@ from processors.scanner import (
     _natural_sort_key
 )
 from core.cache_flow import CacheFlowMixin
+from core.cache_validation import CacheValidationPolicy
+from core.features import cached_phash_version, phash_feature_version
+from core.hamming_index import HammingIndex
+from core.pool_service import worker_pool_service
 from core.similarity_flow import SimilarityFlowMixin
 
 try:
     from processors.qr_engine import (_pool_worker_detect_qr_code,
                                      _pool_worker_detect_qr_colorful_only,
+                                     _pool_worker_detect_qr_fused,
                                      _pool_worker_process_image_full,
                                      _pool_worker_process_image_phash_only,
                                      _pool_worker_ensure_image_features)
@@ -66,6 +72,7 @@ except ImportError:
     utils.log_warning("[警告] 無法從 processors.qr_engine 導入 QR worker，QR 相關功能將不可用。")
     def _pool_worker_detect_qr_code(*args, **kwargs): return (args[0] if args else '', {'error': 'QR Engine not loaded'})
     def _pool_worker_detect_qr_colorful_only(*args, **kwargs): return (args[0] if args else '', {'error': 'QR Engine not loaded'})
+    def _pool_worker_detect_qr_fused(*args, **kwargs): return (args[0] if args else '', {'error': 'QR Engine not loaded'})
     def _pool_worker_process_image_full(*args, **kwargs): return (args[0] if args else '', {'error': 'QR Engine not loaded'})
     def _pool_worker_process_image_phash_only(*args, **kwargs): return (args[0] if args else '', {'error': 'QR Engine not loaded'})
     def _pool_worker_ensure_image_features(*args, **kwargs): return (args[0] if args else '', {'error': 'QR Engine not loaded'})
@@ -86,7 +93,6 @@ WHASH_RELAXED_THRESH = 0.70  # pHash 及格時 wHash 門檻
 WHASH_STRICT_THRESH  = 0.85  # wHash 單獨救援門檻 (需同時滿足 WHASH_MIN_PHASH)
 WHASH_MIN_PHASH      = 0.80  # wHash 單獨救援時 pHash 最低下限 (防止無關圖片亂入)
 AD_GROUPING_THRESHOLD = 0.95
-LSH_BANDS = 8
 
 # --- 快取特徵位元遮罩 ---
 FEATURE_PHASH = 1 << 0
@@ -98,10 +104,6 @@ FEATURE_QR    = 1 << 3
 # Section: 核心比對引擎
 # ======================================================================
 
-def _pool_initializer(lock):
-    import utils
-    utils.SHARED_IO_LOCK = lock
-
 class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
     def __init__(self, config_dict: dict, progress_queue=None, control_events: Optional[Dict] = None):
         self.config = config_dict; self.progress_queue = progress_queue; self.control_events = control_events
@@ -109,6 +111,7 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         self.pool = None; self.file_data = {}; self.tasks_to_process = []
         self.total_task_count = 0; self.completed_task_count = 0; self.failed_tasks = []
         self.vpath_size_map = {}
+        self.file_identity_map = {}
         self.quarantine_list = set()
         self.cache_stats = {'hit': 0, 'recalc': 0, 'purge': 0, 'rescan_folders': 0}
         
@@ -150,11 +153,19 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         if self.pool:
             log_info("正在終結現有進程池...");
             if self.progress_queue: self.progress_queue.put({'type': 'status_update', 'text': "正在終止背景任務..."})
-            self.pool.terminate(); self.pool.join()
+            worker_pool_service.terminate()
             log_info("進程池已成功終結。"); self.pool = None
-            if hasattr(self, 'manager') and self.manager:
-                try: self.manager.shutdown(); self.manager = None
-                except Exception: pass
+        self._release_manager()
+
+    def _release_pool(self):
+        # 正常結束只歸還常駐進程池，worker 保持暖機供下一次掃描 / 外掛使用
+        self.pool = None
+        self._release_manager()
+
+    def _release_manager(self):
+        if hasattr(self, 'manager') and self.manager:
+            try: self.manager.shutdown(); self.manager = None
+            except Exception: pass
 
     def _normalize_cached_hashes(self, cached_data: Optional[dict]) -> Optional[dict]:
         if not cached_data:
@@ -168,11 +179,16 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
                     cached_data[hash_key] = None
         return cached_data
 
-    def _build_worker_payload(self, worker_function: callable, path: str):
-        worker_name = worker_function.__name__
+    def _hash_options(self) -> tuple[bool, bool, int]:
+        """決定 pHash 特徵值的選項：(旋轉雜湊, 影像前處理, 雜湊解析度)。"""
         is_targeted = self.config.get('enable_targeted_search', False)
         use_rotation = is_targeted or bool(self.config.get('enable_rotation_matching', False))
         use_preprocess = is_targeted or bool(self.config.get('enable_image_preprocess', False))
+        return use_rotation, use_preprocess, int(self.config.get('hash_resolution', 128))
+
+    def _build_worker_payload(self, worker_function: callable, path: str):
+        worker_name = worker_function.__name__
+        use_rotation, use_preprocess, hash_resolution = self._hash_options()
         use_qr_filter = bool(self.config.get('enable_qr_color_filter', False))
 
         if 'full' in worker_name:
@@ -182,21 +198,49 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
                 use_qr_filter,
                 use_rotation,
                 use_preprocess,
+                hash_resolution,
+                self._build_qr_options(),
+            )
+        if 'qr_fused' in worker_name:
+            return (
+                path,
+                int(self.config.get('qr_resize_size', 800)),
+                self._build_qr_options(),
             )
         if 'qr_code' in worker_name:
             return (
                 path,
                 int(self.config.get('qr_resize_size', 800)),
                 use_qr_filter,
+                self._build_qr_options(),
             )
         if 'phash_only' in worker_name:
             return (
                 path,
                 use_rotation,
                 use_preprocess,
+                hash_resolution,
+                self._build_decode_options(),
             )
         return path
 
+    def _build_qr_options(self) -> dict:
+        return {
+            'stage_order': list(self.config.get('qr_stage_order') or []),
+            'finder_min_candidates': int(self.config.get('qr_finder_min_candidates', 1)),
+        }
+
+    def _build_decode_options(self) -> dict:
+        if not self.config.get('enable_draft_decode', True):
+            return {}
+        from core.features import HASH_REQUIRED_SIDE
+        oversample = max(1, int(self.config.get('draft_decode_oversample', 4)))
+        return {
+            'draft_side': HASH_REQUIRED_SIDE * oversample,
+            'verify_rate': float(self.config.get('draft_verify_rate', 0.02)),
+            'bit_budget': int(self.config.get('draft_bit_budget', 2)),
+        }
+
     @staticmethod
     def _feature_bits_from_result(data: dict) -> int:
         feature_bit = 0
@@ -227,14 +271,26 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
             feature_bit |= FEATURE_QR
         return feature_bit
 
-    def _collect_file_mtimes(self, current_task_list: list[str], description: str) -> dict[str, Optional[float]]:
+    def _collect_file_mtimes(self, current_task_list: list[str], description: str, with_inode: bool = True) -> dict[str, Optional[float]]:
+        """盤點 mtime；同時把 (size, inode) 記入 self.file_identity_map 供快取驗證策略使用。"""
         file_mtimes = {}
+        identities = self.file_identity_map
         target_dirs = defaultdict(list)
+        archive_stats = {}
 
         for path in current_task_list:
             if _is_virtual_path(path):
-                _, _, mt = _get_file_stat(path)
-                file_mtimes[path] = mt
+                # 同一壓縮檔內的圖片共用一次 stat
+                archive_path, _ = _parse_virtual_path(path)
+                if archive_path not in archive_stats:
+                    try:
+                        archive_stats[archive_path] = os.stat(archive_path)
+                    except (OSError, TypeError, ValueError):
+                        archive_stats[archive_path] = None
+                st = archive_stats[archive_path]
+                file_mtimes[path] = st.st_mtime if st else None
+                if st:
+                    identities[path] = (st.st_size, st.st_ino or None)
             else:
                 target_dirs[os.path.dirname(path)].append(path)
 
@@ -255,7 +311,11 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
                     bname = os.path.basename(path).lower()
                     if bname in entries:
                         try:
-                            file_mtimes[path] = entries[bname].stat(follow_symlinks=False).st_mtime
+                            entry = entries[bname]
+                            st = entry.stat(follow_symlinks=False)
+                            file_mtimes[path] = st.st_mtime
+                            # Windows 的 scandir stat 不含 inode，entry.inode() 需額外查詢，僅在驗證策略需要時取得
+                            identities[path] = (st.st_size, (entry.inode() or None) if with_inode else None)
                         except OSError:
                             file_mtimes[path] = None
                     else:
@@ -272,42 +332,37 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         mt: Optional[float],
         path: str,
         data_key: str,
-        use_quick_digest: bool,
+        policy: CacheValidationPolicy,
     ) -> tuple[bool, bool]:
         if mt is None or not cached_data:
             return False, False
         if abs(mt - float(cached_data.get('mtime', 0))) >= 1e-6:
             return False, False
-
-        needs_qd64_upgrade = False
-        is_hit = False
-
-        if use_quick_digest:
-            if 'qd64' not in cached_data or not cached_data.get('qd64'):
-                is_hit = True
-                needs_qd64_upgrade = True
-            else:
-                qd64_now = _calculate_quick_digest(path)
-                if qd64_now and cached_data.get('qd64') == qd64_now:
-                    is_hit = True
-        else:
-            is_hit = True
-
-        if not is_hit:
+        if not self._has_required_features(cached_data, data_key):
             return False, False
+        # 特徵不足的項目反正要重算，驗證 (可能讀檔) 放在最後
+        return policy.validate(path, cached_data, self.file_identity_map.get(path))
 
+    def _has_required_features(self, cached_data: dict, data_key: str) -> bool:
         features = cached_data.get('features_at', 0) | self._feature_bits_from_entry(cached_data)
         if data_key == 'phash' and not (features & FEATURE_PHASH):
-            return False, False
+            return False
+        # 不同特徵版本的 pHash 定義不同、不可互相比較；舊版 (含未記錄版本) 的雜湊視為未命中並重算
+        if data_key in ('phash', 'qr_points', 'qr_fused') and cached_data.get('phash') \
+                and cached_phash_version(cached_data) != phash_feature_version():
+            return False
         if data_key == 'whash' and not (features & FEATURE_WHASH):
-            return False, False
+            return False
         if data_key == 'avg_hsv' and not (features & FEATURE_COLOR):
-            return False, False
+            return False
         if data_key == 'is_colorful' and 'is_colorful' not in cached_data:
-            return False, False
+            return False
         if data_key == 'qr_points' and not (features & FEATURE_QR):
-            return False, False
-        return True, needs_qd64_upgrade
+            return False
+        # 融合模式：已知非彩圖者不需再偵測 QR，同樣視為命中
+        if data_key == 'qr_fused' and not (features & FEATURE_QR) and cached_data.get('is_colorful') is not False:
+            return False
+        return True
 
     def _purge_stale_cache_entries(self, paths_to_purge: set[str], cache_manager: ScannedImageCacheManager) -> None:
         if not paths_to_purge:
@@ -422,20 +477,12 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         manifest_items.sort()
         manifest_digest = hashlib.sha256(json.dumps(manifest_items).encode()).hexdigest()
 
-        needs_rebuild = False
         if manifest_digest != current_state.get('manifest_digest'):
             log_info("[Digest] 檢測到廣告庫內容變更，將重新計算內容摘要。")
-            needs_rebuild = True
-            current_state['manifest_digest'] = manifest_digest
-        
-        if needs_rebuild:
-            ad_cache = ScannedImageCacheManager(ad_folder_path)
-            ad_paths = [os.path.join(ad_folder_path, item[0].replace('/', os.sep)) for item in manifest_items]
-            _, ad_local_data = self._process_images_with_cache(ad_paths, ad_cache, "更新廣告庫哈希", _pool_worker_process_image_phash_only, 'phash', progress_scope='local')
-            ad_cache.save_cache()
-            ad_hashes = sorted([str(data['phash']) for data in ad_local_data.values() if data and data.get('phash')])
-            content_digest = hashlib.sha256(json.dumps(ad_hashes).encode()).hexdigest()
-            current_state['content_digest'] = content_digest
+            content_digest = self._update_ad_manifest(ad_folder_path, manifest_items)
+            if content_digest is not None:
+                current_state['manifest_digest'] = manifest_digest
+                current_state['content_digest'] = content_digest
         
         final_digest = hashlib.sha256((current_state.get('content_digest', '') + params_digest).encode()).hexdigest()
         
@@ -452,6 +499,40 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         log_info(f"[Digest] 當前 Catalog Digest: {current_state.get('catalog_digest', '')[:8]}...")
         return current_state
 
+    def _update_ad_manifest(self, ad_folder_path: str, manifest_items: list) -> Optional[str]:
+        """
+        與資料庫中的上次清單比對 (rel_path, size, mtime)，只對新增或變更的檔案計算雜湊，
+        再由完整清單的 pHash 算出內容摘要 (定義與整份重算相同)。中途取消時回傳 None。
+        """
+        from processors.scanner import MasterAdCacheManager
+        ad_cache = MasterAdCacheManager(ad_folder_path)
+        previous = ad_cache.load_manifest()
+        current_rels = {item[0] for item in manifest_items}
+        # 上次雜湊失敗 (phash 為空) 的檔案也重算
+        changed_items = [
+            item for item in manifest_items
+            if item[0] not in previous or tuple(previous[item[0]][:2]) != tuple(item[1:]) or not previous[item[0]][2]
+        ]
+        removed = [rel for rel in previous if rel not in current_rels]
+        log_info(f"[Digest] 廣告庫差異：新增/變更 {len(changed_items)}，移除 {len(removed)}，未變 {len(manifest_items) - len(changed_items)}")
+
+        ad_paths = [os.path.join(ad_folder_path, item[0].replace('/', os.sep)) for item in changed_items]
+        continue_processing, ad_local_data = self._process_images_with_cache(ad_paths, ad_cache, "更新廣告庫哈希", _pool_worker_process_image_phash_only, 'phash', progress_scope='local')
+        if not continue_processing:
+            ad_cache.close()
+            return None
+        updates = []
+        for (rel_path, size, mtime), path in zip(changed_items, ad_paths):
+            data = ad_local_data.get(path) or ad_local_data.get(_norm_key(path)) or {}
+            phash = str(data['phash']) if data.get('phash') else None
+            updates.append((rel_path, size, mtime, phash))
+        ok = ad_cache.update_manifest(updates, removed)
+        ad_hashes = sorted(phash for _, _, _, phash in ad_cache.load_manifest().values() if phash) if ok else None
+        ad_cache.close()
+        if ad_hashes is None:
+            return None
+        return hashlib.sha256(json.dumps(ad_hashes).encode()).hexdigest()
+
     def _load_quarantine_list(self) -> None:
         self.quarantine_list = set()
         if not self.config.get('enable_quarantine', True):
@@ -565,6 +646,8 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
             return None
 
         result = self._dispatch_comparison_mode(mode, scan_cache_manager, ad_catalog_state)
+        if self._check_control() != 'cancel':
+            self._run_cache_maintenance()
         return self._normalize_mode_result(result)
 
     def find_duplicates(self) -> Union[tuple[list, dict, list], None]:
@@ -572,7 +655,7 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
             return self._run_scan_orchestration()
         finally:
             self._persist_quarantine_failures()
-            self._cleanup_pool()
+            self._release_pool()
 
     def _ensure_features(self, path: str, cache_mgr: ScannedImageCacheManager, need_hsv: bool = False, need_whash: bool = False) -> bool:
         norm_path = _norm_key(path)
@@ -593,6 +676,7 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
             from PIL import Image, ImageOps
             img = _open_image_from_any_path(path)
             if not img: raise IOError("無法開啟圖片")
+            quick_digest = _image_quick_digest(img)
             
             img = ImageOps.exif_transpose(img)
             from utils import _auto_crop_white_borders
@@ -612,7 +696,7 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
             if 'whash' in ent and ent['whash'] is not None: update_payload['whash'] = str(ent['whash'])
             
             if self.config.get('enable_quick_digest', True):
-                update_payload['qd64'] = _calculate_quick_digest(path)
+                update_payload['qd64'] = quick_digest or _calculate_quick_digest(path)
             
             cache_mgr.update_data(norm_path, update_payload)
             return True
@@ -702,15 +786,8 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         log_info(f"[lazy feature] parallel {phase_name}: {len(to_load)} images, workers={pool_size}")
         self._update_progress(text=f"平行補算 {phase_name} ({len(to_load)} 張, {pool_size} workers)...")
 
-        async_results = []
-        path_map = {}
-        for p in to_load:
-            res = self.pool.apply_async(
-                _pool_worker_ensure_image_features,
-                args=(p, need_hsv, need_whash, use_preprocess, enable_qd, hash_resolution),
-            )
-            async_results.append(res)
-            path_map[res] = p
+        jobs = [(p, (p, need_hsv, need_whash, use_preprocess, enable_qd, hash_resolution)) for p in to_load]
+        dispatcher = self._build_dispatcher(_pool_worker_ensure_image_features, jobs, pool_size)
 
         calculated = 0
         completed = 0
@@ -718,24 +795,13 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         last_hb = time.time()
         touched_cache_managers = set()
 
-        while async_results:
-            if self._check_control() == 'cancel':
-                self._cleanup_pool()
-                return calculated
-
-            remaining = []
-            for res in async_results:
-                if not res.ready():
-                    remaining.append(res)
-                    continue
-
+        for batch in dispatcher.iter_batches():
+            for path_hint, ok, value in batch:
                 completed += 1
-                path_hint = path_map.get(res, "")
-                try:
-                    path_done, data = res.get()
-                except Exception as e:
-                    log_error(f"[lazy feature] worker failed for {path_hint}: {e}", include_traceback=True)
+                if not ok:
+                    log_error(f"[lazy feature] worker failed for {path_hint}: {value}")
                     continue
+                path_done, data = value
 
                 norm_path = _norm_key(path_done)
                 cache_mgr = cache_mgr_map.get(norm_path)
@@ -764,13 +830,15 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
                 touched_cache_managers.add(cache_mgr)
                 calculated += 1
 
-            async_results = remaining
             now = time.time()
             if now - last_hb >= hb_interval:
                 pct = int(completed / len(to_load) * 100)
                 log_info(f"[lazy feature] {phase_name}: {completed}/{len(to_load)} ({pct}%) | calculated={calculated}")
                 last_hb = now
-            time.sleep(0.05)
+
+        if dispatcher.cancelled:
+            self._cleanup_pool()
+            return calculated
 
         for cache_mgr in touched_cache_managers:
             try:
@@ -778,6 +846,7 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
             except Exception as e:
                 log_error(f"[lazy feature] {phase_name} cache save failed: {e}")
 
+        self._log_io_throughput(dispatcher, phase_name)
         log_info(f"[lazy feature] parallel {phase_name} complete: requested={len(to_load)}, calculated={calculated}, failed={len(to_load) - calculated}")
         return calculated
 
@@ -807,8 +876,8 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         continue_processing, ad_data = self._process_images_with_cache(ad_paths, ad_cache_manager, description, worker_function, data_key, progress_scope='local')
         if continue_processing and ad_data and current_digest:
             if not ad_cache_manager.index_is_current(current_digest):
-                log_info(f"[AdIndex] rebuilding because digest changed: {current_digest[:8]}...")
-                ad_cache_manager.rebuild_hash_index(ad_data, digest=current_digest)
+                log_info(f"[AdIndex] syncing because digest changed: {current_digest[:8]}...")
+                ad_cache_manager.sync_hash_index(ad_data, digest=current_digest)
             else:
                 log_info(f"[AdIndex] index current: {current_digest[:8]}...")
         return continue_processing, ad_paths, ad_cache_manager, ad_data
@@ -826,23 +895,78 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         if not continue_processing: return None
         self.file_data.update(ad_data)
         self._update_progress(text="🔍 正在使用 LSH 高效預處理廣告庫...")
-        ad_lsh_index = self._build_phash_band_index(ad_data)
-        ad_path_to_leader = {p: p for p in ad_data}
-        grouping_dist = hamming_from_sim(AD_GROUPING_THRESHOLD, HASH_BITS)
-        for p1 in sorted(ad_data.keys()):
-            if ad_path_to_leader[p1] != p1: continue
-            h1 = self._coerce_hash_obj(ad_data.get(p1, {}).get('phash'))
-            if not h1: continue
-            for p2 in self._lsh_candidates_for(p1, h1, ad_lsh_index):
-                if p2 <= p1 or ad_path_to_leader[p2] != p2: continue
-                h2 = self._coerce_hash_obj(ad_data.get(p2, {}).get('phash'))
-                if h2 and (h1 - h2) <= grouping_dist: ad_path_to_leader[p2] = ad_path_to_leader[p1]
+        ad_path_to_leader = self._group_ad_leaders(ad_data, ad_cache_manager)
         leader_to_ad_group = {}
-        for path, leader in ad_path_to_leader.items(): leader_to_ad_group.setdefault(leader, []).append(path)
+        for path in ad_data: leader_to_ad_group.setdefault(ad_path_to_leader[path], []).append(path)
         ad_data_representatives = {p: d for p, d in ad_data.items() if p in leader_to_ad_group}
         self._update_progress(text=f"🔍 廣告庫預處理完成，找到 {len(ad_data_representatives)} 個獨立廣告組。")
         return {'ad_data': ad_data, 'ad_cache_manager': ad_cache_manager, 'leader_to_ad_group': leader_to_ad_group, 'ad_member_to_leader': ad_path_to_leader, 'ad_data_representatives': ad_data_representatives}
 
+    def _group_ad_leaders(self, ad_data: dict, ad_cache_manager) -> dict:
+        """
+        廣告貪婪分組：依路徑排序，距離 ≤ grouping_dist 內有較前面的 leader 者歸入其中最前面的一個，否則自成 leader。
+        上次結果存於廣告快取，只重算新增 / 變更的廣告、被移除或變更之 leader 的鄰居，
+        以及 leader 身分有變動者後方的鄰居 (依路徑順序推進，結果與整份重算相同)。
+        """
+        grouping_dist = hamming_from_sim(AD_GROUPING_THRESHOLD, HASH_BITS)
+        # 候選改由精確半徑的 Hamming 索引產生 (舊版 8-band LSH 的分組結果不沿用)
+        group_params = f"{AD_GROUPING_THRESHOLD}:{HASH_BITS}:mih"
+        values = {}
+        for path, ent in ad_data.items():
+            h = self._coerce_hash_obj((ent or {}).get('phash'))
+            values[path] = self._h2i(h) if h else 0
+        signatures = {path: f"{v:016x}" if v else None for path, v in values.items()}
+        stored = ad_cache_manager.load_ad_groups(group_params) if ad_cache_manager else {}
+        leader = {p: stored[p][1] for p in values if p in stored and stored[p][0] == signatures[p] and stored[p][1] in values}
+        dirty = [p for p in values if p not in leader]
+        # 不再存在 (或雜湊已變) 的舊 leader：其舊雜湊附近的後方廣告需要重新歸屬
+        former_leaders = [(p, int(ph, 16)) for p, (ph, ld) in stored.items() if ld == p and ph and signatures.get(p) != ph]
+        removed = [p for p in stored if p not in values]
+        if not dirty and not former_leaders:
+            if removed and ad_cache_manager:
+                ad_cache_manager.save_ad_groups(group_params, {}, removed)
+            return leader
+
+        paths = list(values)
+        hamming_index = HammingIndex([values[p] for p in paths], grouping_dist, keys=paths)
+
+        def neighbours(path, v):
+            return hamming_index.query_keys(v, exclude=path)
+
+        if not stored:
+            # 首次建立 (或參數變更)：與原本相同的順向貪婪分組
+            leader = {p: p for p in values}
+            for p1 in sorted(values):
+                if leader[p1] != p1 or not values[p1]: continue
+                for p2 in neighbours(p1, values[p1]):
+                    if p2 > p1 and leader[p2] == p2: leader[p2] = p1
+            recomputed = len(values)
+        else:
+            for p, v in former_leaders:
+                dirty.extend(q for q in neighbours(p, v) if q > p)
+            heap = list(set(dirty))
+            heapq.heapify(heap)
+            last, recomputed = None, 0
+            while heap:
+                p = heapq.heappop(heap)
+                if p == last: continue
+                last = p
+                recomputed += 1
+                near = neighbours(p, values[p]) if values[p] else []
+                earlier_leaders = [q for q in near if q < p and leader.get(q) == q]
+                new_leader = min(earlier_leaders) if earlier_leaders else p
+                was_leader = leader.get(p) == p
+                leader[p] = new_leader
+                # 只有 leader 身分變動會影響後方廣告的歸屬
+                if (new_leader == p) != was_leader:
+                    for q in near:
+                        if q > p: heapq.heappush(heap, q)
+        log_info(f"[AdGroup] 重新歸屬 {recomputed}/{len(values)} 張廣告")
+        if ad_cache_manager:
+            changed = {p: (signatures[p], leader[p]) for p in values if stored.get(p) != (signatures[p], leader[p])}
+            ad_cache_manager.save_ad_groups(group_params, changed, removed, replace=not stored)
+        return leader
+
     def _detect_qr_codes(self, scan_cache_manager: ScannedImageCacheManager) -> Union[tuple[list, dict], None]:
         if self.config.get('enable_qr_hybrid_mode'): return self._detect_qr_codes_hybrid(self.tasks_to_process, scan_cache_manager)
         else: return self._detect_qr_codes_pure(self.tasks_to_process, scan_cache_manager)
@@ -854,14 +978,28 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         log_info(f"[QR 分組] 使用相似度門檻 {user_pct:.0f}%（與其他比對模式共用）")
         return _qr_group(flat_qr_list, file_data, sim_threshold=qr_thresh)
 
+    def _run_qr_detection_pass(self, files: list[str], scan_cache_manager: ScannedImageCacheManager, progress_scope: str = 'global') -> tuple[bool, dict]:
+        """
+        QR 偵測主流程。啟用彩圖前篩時預設走融合模式：一次解碼同時完成前篩與偵測，結果一次寫入快取；
+        關閉 enable_qr_fused_color_filter 則維持舊的兩段式 (先彩圖前篩、再對彩圖偵測)。
+        """
+        if self.config.get('enable_qr_color_filter', False) and files:
+            if self.config.get('enable_qr_fused_color_filter', True):
+                self._update_progress(text=f"🎨 對 {len(files)} 個檔案進行 QR 彩圖前篩 + 偵測（單次解碼）")
+                continue_proc, qr_data = self._process_images_with_cache(files, scan_cache_manager, "QR 彩圖前篩+偵測", _pool_worker_detect_qr_fused, 'qr_fused', progress_scope=progress_scope)
+                if continue_proc: self.file_data.update(qr_data)
+                return continue_proc, qr_data
+            self._update_progress(text=f"🎨 對剩餘 {len(files)} 個檔案進行 QR 彩圖前篩（局部進度）")
+            continue_proc_color, color_data = self._process_images_with_cache(files, scan_cache_manager, "QR 彩圖前篩", _pool_worker_detect_qr_colorful_only, 'is_colorful', progress_scope='local')
+            if not continue_proc_color: return False, {}
+            self.file_data.update(color_data); files = [p for p in files if color_data.get(p, {}).get('is_colorful')]
+        continue_proc, qr_data = self._process_images_with_cache(files, scan_cache_manager, "QR Code 檢測", _pool_worker_detect_qr_code, 'qr_points', progress_scope=progress_scope)
+        if continue_proc: self.file_data.update(qr_data)
+        return continue_proc, qr_data
+
     def _detect_qr_codes_pure(self, files_to_process: list[str], scan_cache_manager: ScannedImageCacheManager) -> Union[tuple[list, dict], None]:
-        log_info("[QR] 正在執行純粹掃描模式..."); remaining_files_for_qr = list(files_to_process)
-        if self.config.get('enable_qr_color_filter', False) and remaining_files_for_qr:
-            self._update_progress(text=f"🎨 對剩餘 {len(remaining_files_for_qr)} 個檔案進行 QR 彩圖前篩（局部進度）")
-            continue_proc_color, color_data = self._process_images_with_cache(remaining_files_for_qr, scan_cache_manager, "QR 彩圖前篩", _pool_worker_detect_qr_colorful_only, 'is_colorful', progress_scope='local')
-            if not continue_proc_color: return None
-            self.file_data.update(color_data); remaining_files_for_qr = [p for p in remaining_files_for_qr if color_data.get(p, {}).get('is_colorful')]
-        continue_processing, file_data = self._process_images_with_cache(remaining_files_for_qr, scan_cache_manager, "QR Code 檢測", _pool_worker_detect_qr_code, 'qr_points'); self.file_data.update(file_data)
+        log_info("[QR] 正在執行純粹掃描模式...")
+        continue_processing, file_data = self._run_qr_detection_pass(list(files_to_process), scan_cache_manager, progress_scope='global')
         if not continue_processing: return None
         flat_qr = [(path, path, "🆕 新掃描 QR", "qr_item") for path, data in file_data.items() if data and data.get('qr_points')]
         return self._group_qr_results_by_phash(flat_qr, file_data), self.file_data
@@ -873,20 +1011,18 @@ class ImageComparisonEngine(CacheFlowMixin, SimilarityFlowMixin):
         if not continue_proc_ad: return None
         self.file_data.update(ad_data); ad_with_phash = {p: d for p, d in ad_data.items() if d and d.get('phash')}
         if not ad_with_phash: return self._detect_qr_codes_pure(files_to_process, scan_cache_manager)
-        if ad_cache_manager and hasattr(ad_cache_manager, "rebuild_hash_index"): ad_cache_manager.rebuild_hash_index(ad_with_phash, digest=f"qr_hybrid:{len(ad_with_phash)}")
+        if ad_cache_manager and hasattr(ad_cache_manager, "sync_hash_index"): ad_cache_manager.sync_hash_index(ad_with_phash, digest=f"qr_hybrid:{len(ad_with_phash)}")
         found_ad_matches = []; remaining_files_for_qr = list(files_to_process)
-        if self.config.get('enable_qr_color_filter', False) and remaining_files_for_qr:
-            continue_proc_color, color_data = self._process_images_with_cache(remaining_files_for_qr, scan_cache_manager, "QR 彩圖前篩", _pool_worker_detect_qr_colorful_only, 'is_colorful', progress_scope='local')
-            if not continue_proc_color: return None
-            self.file_data.update(color_data); remaining_files_for_qr = [p for p in remaining_files_for_qr if color_data.get(p, {}).get('is_colorful')]
         if remaining_files_for_qr:
-            continue_proc_qr, qr_data = self._process_images_with_cache(remaining_files_for_qr, scan_cache_manager, "QR Code 檢測", _pool_worker_detect_qr_code, 'qr_points', progress_scope='local')
+            continue_proc_qr, qr_data = self._run_qr_detection_pass(remaining_files_for_qr, scan_cache_manager, progress_scope='local')
             if not continue_proc_qr: return None
-            self.file_data.update(qr_data); qr_positive_paths = [p for p, d in qr_data.items() if d and d.get('qr_points')]
+            qr_positive_paths = [p for p, d in qr_data.items() if d and d.get('qr_points')]
             user_thresh = self.config.get('similarity_threshold', 95.0) / 100.0; unmatched_qr_paths = []
-            for g_path in qr_positive_paths:
-                g_ent = self.file_data.get(_norm_key(g_path), {}); g_p_hash = self._coerce_hash_obj(g_ent.get('phash')); matched = False
-                candidate_paths = ad_cache_manager.query_hash_index(g_p_hash) if ad_cache_manager and hasattr(ad_cache_manager, "query_hash_index") else set(ad_with_phash.keys())
+            qr_hashes = [self._coerce_hash_obj(self.file_data.get(_norm_key(p), {}).get('phash')) for p in qr_positive_paths]
+            # 所有 QR 陽性圖片的 LSH 候選一次批次查出，不再每張圖下 8 次 SQL
+            candidate_sets = ad_cache_manager.query_hash_index_many(qr_hashes) if ad_cache_manager and hasattr(ad_cache_manager, "query_hash_index_many") else [set(ad_with_phash.keys())] * len(qr_positive_paths)
+            for g_path, g_p_hash, candidate_paths in zip(qr_positive_paths, qr_hashes, candidate_sets):
+                matched = False
                 for ad_path in candidate_paths:
                     ad_ent = ad_with_phash.get(ad_path)
                     if not ad_ent or not ad_ent.get('qr_points'): continue
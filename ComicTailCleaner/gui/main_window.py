@@ -51,6 +51,7 @@ from processors.scanner import ScannedImageCacheManager, FolderStateCacheManager
 # 如果沒有該檔案，請暫時註解掉這行以及 _select_suggested_smart 中的相關邏輯
 # import core.selection_strategies as selection_strategies (已改為延遲載入)
 from core.undo_manager import UndoManager
+from core.pool_service import shutdown_worker_pool
 
 try:
     from multiprocessing import cpu_count
@@ -817,6 +818,13 @@ class MainWindow(tk.Tk):
                     
                     if getattr(self, 'scan_start_time', None):
                         log_info(f"任務總結: {msg.get('text', '任務完成')}{qr_summary}{eh_summary}{cache_summary}{total_dur}")
+                        self._append_runtime_recap(self._build_structured_recap(
+                            self.config.get('comparison_mode'),
+                            msg.get('text', '任務完成'),
+                            time.perf_counter() - self.scan_start_time,
+                            cache_stats=cache_stats,
+                            error_count=msg.get('error_count'),
+                        ))
                     
                     self.final_status_text = f"{msg.get('text', '任務完成')}{qr_summary}{eh_summary}{cache_summary}{total_dur}"
                     self._reset_control_buttons(self.final_status_text)
@@ -851,6 +859,19 @@ class MainWindow(tk.Tk):
         if cache_stats:
             cs = cache_stats
             lines.append(f"cache: hit={cs.get('hit', 0)}, recalc={cs.get('recalc', 0)}, purge={cs.get('purge', 0)}, rescan_folders={cs.get('rescan_folders', 0)}")
+            if cs.get('qr_stages'):
+                from processors.qr_cascade import format_stage_stats
+                lines.append(f"qr_stages: {format_stage_stats(cs['qr_stages'])}")
+            if cs.get('validation'):
+                v = cs['validation']
+                tiers = ", ".join(f"{k}={v[k]}" for k in ('stat', 'stat_inode', 'sampled', 'full') if v.get(k))
+                lines.append(f"validation: {tiers or 'none'}, digest_reads={v.get('digest_reads', 0)}, mismatches={v.get('mismatches', 0)}")
+            if cs.get('io_devices'):
+                from core.io_scheduler import format_io_report
+                lines.append(f"io_devices: {format_io_report(cs['io_devices'], cs.get('io_wall_seconds', 0.0))}")
+            if cs.get('lifecycle'):
+                lc = cs['lifecycle']
+                lines.append(f"lifecycle: evicted_units={lc.get('evicted_units', 0)}, evicted_rows={lc.get('evicted_rows', 0)}, reclaimed_pages={lc.get('reclaimed_pages', 0)}, compacted={lc.get('compacted', 0)}")
         lines.append("warnings: unknown")
         if error_count is not None:
             lines.append(f"errors: {error_count}")
@@ -1678,11 +1699,13 @@ class MainWindow(tk.Tk):
             if messagebox.askokcancel("關閉程式", "掃描仍在進行中，確定要強制關閉程式嗎？"):
                 self.cancel_event.set()
                 self.executor.shutdown(wait=False, cancel_futures=True)
+                shutdown_worker_pool(wait=False)
                 if hasattr(self, 'undo_manager'):
                     self._commit_deletions_impl(silent=True)
                 self.destroy()
         else:
             self.executor.shutdown(wait=False, cancel_futures=True)
+            shutdown_worker_pool(wait=True)
             if hasattr(self, 'undo_manager'):
                 self._commit_deletions_impl(silent=True)
             self.destroy()
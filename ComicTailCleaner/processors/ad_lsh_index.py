@@ -0,0 +1,222 @@
+# ======================================================================
+# 檔案名稱：processors/ad_lsh_index.py
+# 模組目的：廣告 LSH 索引的記憶體版本 (band → bucket → 廣告編號，CSR 陣列)，以 pickle 存於資料庫旁
+# ======================================================================
+
+import os
+import pickle
+from typing import Iterable, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import log_info, log_warning
+
+AD_LSH_SUFFIX = ".adlsh.pkl"
+AD_LSH_FORMAT = 1
+_MASK64 = (1 << 64) - 1
+
+
+def ad_lsh_path_for(db_path: str) -> str:
+    return db_path + AD_LSH_SUFFIX
+
+
+def _csr_tables(band_arr: "np.ndarray", bucket_arr: "np.ndarray", id_arr: "np.ndarray", bands: int) -> list:
+    """(band, bucket, 廣告編號) 三個等長陣列 → 每個 band 一組 (keys, starts, ids)；重複的 (bucket, 編號) 只記一次。"""
+    tables = []
+    for band in range(bands):
+        selected = band_arr == band
+        pairs = np.unique(np.stack([bucket_arr[selected], id_arr[selected].astype(np.uint64)], axis=1), axis=0)
+        if len(pairs):
+            keys, starts = np.unique(pairs[:, 0], return_index=True)
+        else:
+            keys, starts = np.zeros(0, np.uint64), np.zeros(0, np.int64)
+        starts = np.append(starts, len(pairs)).astype(np.int64)
+        tables.append((keys.astype(np.uint64), starts, pairs[:, 1].astype(np.int32)))
+    return tables
+
+
+def hash_values(hash_objs: Iterable) -> Tuple["np.ndarray", "np.ndarray"]:
+    """雜湊物件 / 十六進位字串 → (低 64 位元 uint64 陣列, 有效遮罩)；與 _compute_lsh_buckets_from_hash_obj 取相同位元。"""
+    values, valid = [], []
+    for obj in hash_objs:
+        try:
+            values.append(int(str(obj), 16) & _MASK64 if obj else 0)
+            valid.append(bool(obj))
+        except (TypeError, ValueError):
+            values.append(0)
+            valid.append(False)
+    return np.array(values, dtype=np.uint64), np.array(valid, dtype=bool)
+
+
+class AdLshIndex:
+    """
+    ad_hash_index 表的唯讀記憶體副本。每個 band 一組 CSR：
+      keys   : 排序後的 bucket 值 (uint64)
+      starts : keys[i] 的廣告編號位於 ids[starts[i]:starts[i + 1]]
+      ids    : 廣告編號 (paths 的索引)
+    目錄內容固定時 (catalog_digest 不變) 直接由 pickle 載入，查詢不必再下 SQL。
+    """
+
+    def __init__(self, digest: str, index_version: str, hash_kind: str, bands: int, bits: int, paths: List[str], tables: list):
+        self.digest = digest
+        self.index_version = index_version
+        self.hash_kind = hash_kind
+        self.bands = bands
+        self.bits = bits
+        self.paths = paths
+        self.tables = tables
+        self.seg_bits = bits // bands
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple], *, digest: str, index_version: str, hash_kind: str, bands: int, bits: int) -> "AdLshIndex":
+        """rows 為 (band, bucket, path)；同一廣告的多個旋轉變體落在同一 bucket 時只記一次。"""
+        path_ids, paths = {}, []
+        band_col, bucket_col, id_col = [], [], []
+        for band, bucket, path in rows:
+            pid = path_ids.get(path)
+            if pid is None:
+                pid = path_ids[path] = len(paths)
+                paths.append(path)
+            band_col.append(band)
+            bucket_col.append(bucket)
+            id_col.append(pid)
+        tables = _csr_tables(
+            np.array(band_col, dtype=np.int64), np.array(bucket_col, dtype=np.uint64), np.array(id_col, dtype=np.int64), bands
+        )
+        return cls(digest, index_version, hash_kind, bands, bits, paths, tables)
+
+    def with_changes(self, removed: Set[str], rows: Iterable[tuple], digest: str) -> "AdLshIndex":
+        """
+        增量版本：移除 removed 中的廣告、加入 rows (band, bucket, path) 後回傳新索引，不需重讀整張 ad_hash_index。
+        內容變更的廣告應同時出現在 removed 與 rows。
+        """
+        keep = np.array([path not in removed for path in self.paths], dtype=bool)
+        remap = np.full(len(self.paths) + 1, -1, dtype=np.int64)
+        remap[:-1][keep] = np.arange(int(keep.sum()))
+        paths = [path for path, kept in zip(self.paths, keep) if kept]
+        path_ids = {path: i for i, path in enumerate(paths)}
+        band_parts, bucket_parts, id_parts = [], [], []
+        for band, (keys, starts, ids) in enumerate(self.tables):
+            new_ids = remap[ids] if len(ids) else np.zeros(0, np.int64)
+            alive = new_ids >= 0
+            bucket_parts.append(np.repeat(keys, np.diff(starts))[alive])
+            id_parts.append(new_ids[alive])
+            band_parts.append(np.full(int(alive.sum()), band, dtype=np.int64))
+        added_band, added_bucket, added_id = [], [], []
+        for band, bucket, path in rows:
+            pid = path_ids.get(path)
+            if pid is None:
+                pid = path_ids[path] = len(paths)
+                paths.append(path)
+            added_band.append(band)
+            added_bucket.append(bucket)
+            added_id.append(pid)
+        band_parts.append(np.array(added_band, dtype=np.int64))
+        bucket_parts.append(np.array(added_bucket, dtype=np.uint64))
+        id_parts.append(np.array(added_id, dtype=np.int64))
+        tables = _csr_tables(np.concatenate(band_parts), np.concatenate(bucket_parts), np.concatenate(id_parts), self.bands)
+        return AdLshIndex(digest, self.index_version, self.hash_kind, self.bands, self.bits, paths, tables)
+
+    def save(self, file_path: str) -> None:
+        payload = {
+            "format": AD_LSH_FORMAT,
+            "digest": self.digest,
+            "index_version": self.index_version,
+            "hash_kind": self.hash_kind,
+            "bands": self.bands,
+            "bits": self.bits,
+            "paths": self.paths,
+            "tables": self.tables,
+        }
+        tmp_path = file_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, file_path)
+        except OSError as e:
+            log_warning(f"[AdIndex] 無法寫入記憶體索引檔: {e}")
+
+    @classmethod
+    def load(cls, file_path: str, digest: str, index_version: str, hash_kind: str) -> Optional["AdLshIndex"]:
+        """檔案不存在、格式不符或 digest / 版本 / hash_kind 與資料庫 meta 不同時回傳 None。"""
+        if np is None or not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, "rb") as f:
+                payload = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+            log_warning(f"[AdIndex] 記憶體索引檔損毀，將重建: {e}")
+            return None
+        if (
+            not isinstance(payload, dict)
+            or payload.get("format") != AD_LSH_FORMAT
+            or payload.get("digest") != digest
+            or payload.get("index_version") != index_version
+            or payload.get("hash_kind") != hash_kind
+        ):
+            return None
+        return cls(digest, index_version, hash_kind, payload["bands"], payload["bits"], payload["paths"], payload["tables"])
+
+    def query_ids(self, values: "np.ndarray", valid: Optional["np.ndarray"] = None) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        批次查詢：回傳去重後的 (查詢序號, 廣告編號) 兩個等長陣列，依查詢序號排序。
+        每個 band 以 searchsorted 一次處理全部查詢，再以 repeat + cumsum 展開 CSR 區段。
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        mask = np.uint64((1 << self.seg_bits) - 1)
+        query_parts, id_parts = [], []
+        for band, (keys, starts, ids) in enumerate(self.tables):
+            if not len(keys):
+                continue
+            buckets = (values >> np.uint64(band * self.seg_bits)) & mask
+            pos = np.searchsorted(keys, buckets)
+            pos_clipped = np.minimum(pos, len(keys) - 1)
+            hit = (pos < len(keys)) & (keys[pos_clipped] == buckets)
+            if valid is not None:
+                hit &= valid
+            hit_queries = np.nonzero(hit)[0]
+            if not len(hit_queries):
+                continue
+            begin = starts[pos_clipped[hit_queries]]
+            counts = starts[pos_clipped[hit_queries] + 1] - begin
+            total = int(counts.sum())
+            # 每個命中查詢展開成 ids[begin:begin + count]
+            run_offsets = np.repeat(begin - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+            query_parts.append(np.repeat(hit_queries, counts))
+            id_parts.append(ids[run_offsets + np.arange(total)])
+        if not query_parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        pairs = np.unique(
+            np.concatenate(query_parts).astype(np.int64) * len(self.paths) + np.concatenate(id_parts).astype(np.int64)
+        )
+        return pairs // len(self.paths), pairs % len(self.paths)
+
+    def query_many(self, hash_objs: Iterable) -> List[Set[str]]:
+        """每個雜湊的候選廣告路徑集合 (與逐筆 query 結果相同)；無效雜湊得到空集合。"""
+        values, valid = hash_values(hash_objs)
+        result = [set() for _ in range(len(values))]
+        if not len(values) or not self.paths:
+            return result
+        query_idx, ad_ids = self.query_ids(values, valid)
+        if len(query_idx):
+            bounds = np.flatnonzero(np.diff(query_idx)) + 1
+            paths = self.paths
+            for group_q, group_ids in zip(np.split(query_idx, bounds), np.split(ad_ids, bounds)):
+                result[int(group_q[0])] = {paths[i] for i in group_ids.tolist()}
+        return result
+
+    def query(self, hash_obj) -> Set[str]:
+        return self.query_many([hash_obj])[0]
+
+
+def build_and_save(file_path: str, rows: Iterable[tuple], **meta) -> Optional[AdLshIndex]:
+    if np is None:
+        return None
+    index = AdLshIndex.from_rows(rows, **meta)
+    index.save(file_path)
+    log_info(f"[AdIndex] 記憶體索引已建立: {len(index.paths)} 張廣告, {index.bands} bands")
+    return index
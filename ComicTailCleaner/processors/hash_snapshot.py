@@ -0,0 +1,239 @@
+# ======================================================================
+# 檔案名稱：processors/hash_snapshot.py
+# 模組目的：圖片快取的欄式雜湊快照 (np.memmap 唯讀載入，依 dirty 鍵增量更新)
+# ======================================================================
+
+import json
+import os
+import shutil
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import log_info, log_warning
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".snapshot"
+MANIFEST_NAME = "manifest.json"
+PATHS_NAME = "paths.jsonl"
+# 欄位檔：(檔名, dtype, 每列形狀)；一律小端序原始位元組，列數記在 manifest
+SNAPSHOT_ARRAYS = {
+    "phash": ("phash.u64", "<u8", ()),
+    "whash": ("whash.u64", "<u8", ()),
+    "hsv": ("hsv.f32", "<f4", (3,)),
+    "grid": ("grid.u64", "<u8", (16,)),
+    "dims": ("dims.u32", "<u4", (2,)),
+    "live": ("live.u8", "u1", ()),
+}
+# 失效列超過此比例 (且至少 COMPACT_MIN_DEAD 列) 時改為整份重建
+COMPACT_DEAD_RATIO = 0.25
+COMPACT_MIN_DEAD = 1024
+
+
+def snapshot_dir_for(db_path: str) -> str:
+    return db_path + SNAPSHOT_SUFFIX
+
+
+def _read_manifest(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+def _write_manifest(directory: str, manifest: dict) -> None:
+    # manifest 最後才以 os.replace 原子替換；中途中斷時舊 manifest 仍描述一份一致的快照
+    tmp_path = os.path.join(directory, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+
+
+def _row_bytes(dtype: str, shape: tuple) -> int:
+    return np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+
+
+def _column(arrays: dict, name: str, count: int):
+    """load_feature_arrays 的輸出 → 快照欄位 dtype。"""
+    _, dtype, shape = SNAPSHOT_ARRAYS[name]
+    if name == "live":
+        return np.ones(count, dtype=dtype)
+    return np.ascontiguousarray(arrays[name], dtype=dtype).reshape((count,) + shape)
+
+
+class HashSnapshot:
+    """
+    唯讀快照：paths 為列號 → 路徑，各欄位為 np.memmap (mode='r')。
+    頁面由作業系統共享與換出，不需把整個圖庫轉成 Python 物件；已刪除的列以 live=0 標記。
+    """
+
+    def __init__(self, directory: str, manifest: dict, paths: List[str], arrays: Dict[str, "np.ndarray"]):
+        self.directory = directory
+        self.manifest = manifest
+        self.paths = paths
+        self.arrays = arrays
+        self._index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def open(cls, directory: str) -> Optional["HashSnapshot"]:
+        if np is None:
+            return None
+        manifest = _read_manifest(directory)
+        if manifest is None:
+            return None
+        count = int(manifest.get("count", 0))
+        try:
+            with open(os.path.join(directory, PATHS_NAME), "rb") as f:
+                raw = f.read(int(manifest.get("paths_bytes", 0)))
+            paths = [json.loads(line) for line in raw.decode("utf-8").splitlines()]
+            if len(paths) != count:
+                return None
+            arrays = {}
+            for name, (filename, dtype, shape) in SNAPSHOT_ARRAYS.items():
+                if count == 0:
+                    arrays[name] = np.zeros((0,) + shape, dtype=dtype)
+                    continue
+                arrays[name] = np.memmap(os.path.join(directory, filename), dtype=dtype, mode="r", shape=(count,) + shape)
+        except (OSError, ValueError):
+            return None
+        return cls(directory, manifest, paths, arrays)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @property
+    def index(self) -> Dict[str, int]:
+        if self._index is None:
+            live = self.arrays["live"]
+            self._index = {path: i for i, path in enumerate(self.paths) if live[i]}
+        return self._index
+
+    def ids_for(self, paths: Iterable[str]) -> "np.ndarray":
+        """路徑 → 列號；不在快照中 (或已刪除) 的路徑為 -1。路徑須已 _norm_key。"""
+        index = self.index
+        return np.fromiter((index.get(p, -1) for p in paths), dtype=np.int64)
+
+    def take(self, name: str, ids: "np.ndarray", fill=0) -> "np.ndarray":
+        """依列號取出欄位值；列號 -1 的位置填入 fill。"""
+        column = self.arrays[name]
+        found = ids >= 0
+        result = np.full((len(ids),) + column.shape[1:], fill, dtype=column.dtype)
+        if np.any(found):
+            result[found] = column[ids[found]]
+        return result
+
+    def close(self) -> None:
+        # 只釋放參照；仍被切片引用的映射會在最後一個參照消失時自動解除
+        self.arrays = {}
+        self._index = None
+
+
+def build_snapshot(directory: str, arrays: dict) -> int:
+    """以 load_feature_arrays 的完整輸出重建快照，回傳列數。"""
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    paths = arrays["paths"]
+    count = len(paths)
+    for name, (filename, _, _) in SNAPSHOT_ARRAYS.items():
+        _column(arrays, name, count).tofile(os.path.join(tmp_dir, filename))
+    encoded = "".join(json.dumps(p) + "\n" for p in paths).encode("utf-8")
+    with open(os.path.join(tmp_dir, PATHS_NAME), "wb") as f:
+        f.write(encoded)
+    _write_manifest(tmp_dir, {"version": SNAPSHOT_VERSION, "count": count, "live": count, "paths_bytes": len(encoded)})
+    # 舊快照可能仍被映射 (Windows 上無法刪除)，先改名再清除
+    if os.path.isdir(directory):
+        stale_dir = directory + ".old"
+        shutil.rmtree(stale_dir, ignore_errors=True)
+        os.replace(directory, stale_dir)
+        shutil.rmtree(stale_dir, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return count
+
+
+def update_snapshot(directory: str, arrays: dict, removed: Iterable[str]) -> Optional[int]:
+    """
+    增量更新：arrays 為 dirty 鍵重新讀出的資料列，removed 為已不在資料庫中的鍵。
+    既有列原地覆寫、新列附加在檔尾、刪除的列標 live=0，最後才改寫 manifest。
+    回傳更新後的存活列數；快照不存在、損毀或失效列過多時回傳 None，由呼叫端整份重建。
+    """
+    manifest = _read_manifest(directory)
+    if manifest is None:
+        return None
+    snapshot = HashSnapshot.open(directory)
+    if snapshot is None:
+        return None
+    index = dict(snapshot.index)
+    count = len(snapshot)
+    live_count = int(manifest.get("live", count))
+    snapshot.close()
+
+    paths = arrays["paths"]
+    existing_ids, existing_rows, new_rows = [], [], []
+    for row, path in enumerate(paths):
+        row_id = index.get(path)
+        if row_id is None:
+            new_rows.append(row)
+        else:
+            existing_ids.append(row_id)
+            existing_rows.append(row)
+    dead_ids = [index[path] for path in removed if path in index]
+
+    dead_total = count - live_count + len(dead_ids)
+    if dead_total >= max(COMPACT_MIN_DEAD, (count + len(new_rows)) * COMPACT_DEAD_RATIO):
+        return None
+
+    n_rows = len(paths)
+    try:
+        for name, (filename, dtype, shape) in SNAPSHOT_ARRAYS.items():
+            file_path = os.path.join(directory, filename)
+            values = _column(arrays, name, n_rows)
+            # 上次中斷時可能殘留超出 manifest 列數的尾端，先截斷
+            expected_size = count * _row_bytes(dtype, shape)
+            if os.path.getsize(file_path) != expected_size:
+                with open(file_path, "r+b") as f:
+                    f.truncate(expected_size)
+            if count and (existing_ids or (name == "live" and dead_ids)):
+                column = np.memmap(file_path, dtype=dtype, mode="r+", shape=(count,) + shape)
+                if existing_ids:
+                    column[np.asarray(existing_ids, dtype=np.int64)] = values[existing_rows]
+                if name == "live" and dead_ids:
+                    column[np.asarray(dead_ids, dtype=np.int64)] = 0
+                column.flush()
+                del column
+            if new_rows:
+                with open(file_path, "ab") as f:
+                    f.write(np.ascontiguousarray(values[new_rows]).tobytes())
+
+        paths_bytes = int(manifest["paths_bytes"])
+        if new_rows:
+            encoded = "".join(json.dumps(paths[row]) + "\n" for row in new_rows).encode("utf-8")
+            with open(os.path.join(directory, PATHS_NAME), "r+b") as f:
+                if os.fstat(f.fileno()).st_size != paths_bytes:
+                    f.truncate(paths_bytes)
+                f.seek(paths_bytes)
+                f.write(encoded)
+            paths_bytes += len(encoded)
+    except (OSError, ValueError) as e:
+        log_warning(f"[快照] 增量更新失敗，改為整份重建: {e}")
+        return None
+
+    live_count = live_count - len(dead_ids) + len(new_rows)
+    _write_manifest(directory, {
+        "version": SNAPSHOT_VERSION,
+        "count": count + len(new_rows),
+        "live": live_count,
+        "paths_bytes": paths_bytes,
+    })
+    if new_rows or existing_ids or dead_ids:
+        log_info(f"[快照] 增量更新: 覆寫 {len(existing_ids)} 列, 新增 {len(new_rows)} 列, 刪除 {len(dead_ids)} 列")
+    return live_count
@@ -0,0 +1,351 @@
+# ======================================================================
+# 檔案名稱：processors/qr_cascade.py
+# 模組目的：分段式 QR 偵測串聯 (定位圖案快篩 → 依成本排序的解碼階段 → ROI 局部重試)
+# ======================================================================
+
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    from pyzbar.pyzbar import decode as pyzbar_decode
+    from pyzbar.pyzbar import ZBarSymbol
+except ImportError:
+    pyzbar_decode = None
+    ZBarSymbol = None
+
+# 預設階段順序 (由便宜到昂貴)；finder 為快篩閘門，roi 會在原圖的可疑區塊上重跑解碼階段
+QR_STAGE_ORDER = ("finder", "pyzbar", "opencv", "clahe", "adaptive", "roi")
+QR_DECODE_STAGES = ("pyzbar", "opencv", "clahe", "adaptive")
+
+# 閘門類階段的命中數代表「排除頁數」；colorful 為 worker 端的彩圖前篩，不屬於 QrCascade 本身
+GATE_STAGES = ("colorful", "finder")
+STATS_DISPLAY_ORDER = ("colorful",) + QR_STAGE_ORDER
+
+# worker 回傳的各階段統計欄位；由主進程彙整至 cache_stats['qr_stages'] 後移除，不寫入快取
+QR_STAGE_STATS_KEY = "_qr_stage_stats"
+
+FINDER_MAX_SIDE = 800
+ROI_PADDING = 60
+
+
+class _QrFrame:
+    """單張圖的共用緩衝：RGB / 灰階 / CLAHE 只在第一個需要的階段計算一次。"""
+
+    def __init__(self, img: "Image.Image"):
+        self.img = img
+        self._rgb = None
+        self._gray = None
+        self._clahe = None
+
+    @property
+    def rgb(self) -> "np.ndarray":
+        if self._rgb is None:
+            self._rgb = np.array(self.img.convert("RGB"))
+        return self._rgb
+
+    @property
+    def gray(self) -> "np.ndarray":
+        if self._gray is None:
+            self._gray = np.array(self.img.convert("L"))
+        return self._gray
+
+    @property
+    def clahe(self) -> "np.ndarray":
+        if self._clahe is None:
+            self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(self.gray)
+        return self._clahe
+
+
+def _pyzbar_points(gray: "np.ndarray") -> Optional[List]:
+    decoded = pyzbar_decode(gray, symbols=[ZBarSymbol.QRCODE])
+    if decoded:
+        poly = decoded[0].polygon
+        if poly and len(poly) == 4:
+            return [[[p.x, p.y] for p in poly]]
+    return None
+
+
+def _stage_pyzbar(frame: _QrFrame) -> Optional[List]:
+    if not pyzbar_decode:
+        return None
+    return _pyzbar_points(frame.gray)
+
+
+def _stage_opencv(frame: _QrFrame) -> Optional[List]:
+    retval, _, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(frame.rgb)
+    if retval and points is not None and len(points) > 0:
+        return points.tolist()
+    return None
+
+
+def _stage_clahe(frame: _QrFrame) -> Optional[List]:
+    if not pyzbar_decode:
+        return None
+    return _pyzbar_points(frame.clahe)
+
+
+def _stage_adaptive(frame: _QrFrame) -> Optional[List]:
+    if not pyzbar_decode:
+        return None
+    blurred = cv2.GaussianBlur(frame.clahe, (5, 5), 0)
+    thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+    return _pyzbar_points(thresh)
+
+
+_DECODERS: Dict[str, Callable[[_QrFrame], Optional[List]]] = {
+    "pyzbar": _stage_pyzbar,
+    "opencv": _stage_opencv,
+    "clahe": _stage_clahe,
+    "adaptive": _stage_adaptive,
+}
+
+
+def count_finder_candidates(gray: "np.ndarray", max_side: Optional[int] = FINDER_MAX_SIDE) -> int:
+    """
+    QR 定位圖案 (7:5:3 的三層同心方框) 快篩：Otsu 二值化後找「方框內有洞、洞內有實心方塊」的輪廓，
+    並要求外框近似正方形、內外面積比接近 49:9 且中心重合。成本遠低於解碼階段，多數漫畫頁在此即被排除。
+    max_side 為 None 時不縮圖 (以原解析度檢查小型 QR)。
+    """
+    scale = max_side / max(gray.shape[:2]) if max_side else 1.0
+    small = cv2.resize(gray, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    candidates = 0
+    for flags in (cv2.THRESH_BINARY_INV, cv2.THRESH_BINARY):
+        # 同時檢查深色與淺色模組 (反白 QR)
+        _, binary = cv2.threshold(small, 0, 255, flags | cv2.THRESH_OTSU)
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        if hierarchy is None:
+            continue
+        tree = hierarchy[0]
+        for idx, contour in enumerate(contours):
+            hole = tree[idx][2]
+            if hole < 0:
+                continue
+            core = tree[hole][2]
+            if core < 0:
+                continue
+            # 以最小外接旋轉矩形判斷，傾斜的 QR 也能通過
+            (ox, oy), (w, h), _ = cv2.minAreaRect(contour)
+            if w < 5 or h < 5 or not (0.6 <= w / h <= 1.66):
+                continue
+            outer_area = cv2.contourArea(contour)
+            core_area = cv2.contourArea(contours[core])
+            if core_area <= 0 or outer_area < 0.6 * w * h:
+                continue
+            if not (2.0 <= outer_area / core_area <= 14.0):
+                continue
+            (cx, cy), _, _ = cv2.minAreaRect(contours[core])
+            if abs(cx - ox) > w * 0.2 or abs(cy - oy) > h * 0.2:
+                continue
+            candidates += 1
+    return candidates
+
+
+def _fast_get_qr_regions(
+    img_cv: "np.ndarray",
+    min_area: int = 400,
+    max_area_ratio: float = 0.5,
+) -> List[Tuple[int, int, int, int]]:
+    if cv2 is None or np is None:
+        return []
+
+    gray = cv2.cvtColor(img_cv, cv2.COLOR_RGB2GRAY) if img_cv.ndim == 3 else img_cv
+    scale = 800 / max(gray.shape)
+    if scale < 1.0:
+        small = cv2.resize(gray, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        small = gray
+        scale = 1.0
+
+    grad_x = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
+    grad = cv2.magnitude(grad_x, grad_y)
+    grad = cv2.convertScaleAbs(grad)
+    _, thresh = cv2.threshold(grad, 50, 255, cv2.THRESH_BINARY)
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (11, 11))
+    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    rois = []
+    total_area = small.shape[0] * small.shape[1]
+    max_area = total_area * max_area_ratio
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        area = w * h
+        if area < min_area or area > max_area:
+            continue
+        aspect_ratio = w / float(h)
+        if 0.3 <= aspect_ratio <= 3.5:
+            rois.append((int(x / scale), int(y / scale), int(w / scale), int(h / scale)))
+    return rois
+
+
+def normalize_stage_order(order: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    """過濾未知階段與重複項；空設定時回到預設順序。"""
+    if not order:
+        return QR_STAGE_ORDER
+    known = set(QR_STAGE_ORDER)
+    seen, result = set(), []
+    for name in order:
+        name = str(name).strip().lower()
+        if name in known and name not in seen:
+            seen.add(name)
+            result.append(name)
+    return tuple(result) or QR_STAGE_ORDER
+
+
+class QrCascade:
+    """
+    依設定順序執行的 QR 偵測串聯，並累計各階段的呼叫數、命中數與耗時。
+
+    - finder：定位圖案快篩。候選數不足 finder_min_candidates 即判定無 QR 並結束 (命中數 = 拒絕頁數)。
+      縮圖解析不出小型 QR 的定位圖案；啟用 roi 且有原圖時，縮圖上被拒絕的頁面會再以原圖原解析度檢查一次，
+      兩者皆不足才拒絕，避免閘門擋掉 roi 本來要找的小型 QR。
+    - pyzbar / opencv / clahe / adaptive：解碼階段，第一個成功者即回傳。
+    - roi：在原尺寸圖片的 Sobel 可疑區塊上，依同樣順序重跑解碼階段。
+    """
+
+    def __init__(
+        self,
+        order: Optional[Sequence[str]] = None,
+        finder_min_candidates: int = 1,
+        stats: Optional[Dict[str, Dict[str, float]]] = None,
+    ):
+        self.order = normalize_stage_order(order)
+        self.decode_order = tuple(name for name in self.order if name in QR_DECODE_STAGES)
+        self.finder_min_candidates = max(1, int(finder_min_candidates))
+        self.stats = stats if stats is not None else {}
+
+    def _record(self, stage: str, hit: bool, elapsed: float) -> None:
+        entry = self.stats.setdefault(stage, {"calls": 0, "hits": 0, "seconds": 0.0})
+        entry["calls"] += 1
+        entry["hits"] += int(bool(hit))
+        entry["seconds"] += elapsed
+
+    def _run_decoders(self, frame: _QrFrame) -> Optional[List]:
+        for name in self.decode_order:
+            started = time.perf_counter()
+            try:
+                points = _DECODERS[name](frame)
+            except Exception:
+                points = None
+            self._record(name, bool(points), time.perf_counter() - started)
+            if points:
+                return points
+        return None
+
+    def _run_roi(self, full_img: "Image.Image") -> Optional[List]:
+        for x, y, w, h in _fast_get_qr_regions(np.array(full_img.convert("RGB"))):
+            crop_box = (
+                max(0, x - ROI_PADDING),
+                max(0, y - ROI_PADDING),
+                min(full_img.width, x + w + ROI_PADDING),
+                min(full_img.height, y + h + ROI_PADDING),
+            )
+            crop_points = self._run_decoders(_QrFrame(full_img.crop(crop_box)))
+            if crop_points:
+                return [[[p[0] + crop_box[0], p[1] + crop_box[1]] for p in crop_points[0]]]
+        return None
+
+    def _finder_rejects(self, frame: _QrFrame, full_img: Optional["Image.Image"]) -> bool:
+        if count_finder_candidates(frame.gray) >= self.finder_min_candidates:
+            return False
+        if full_img is None or "roi" not in self.order or max(full_img.size) <= max(frame.img.size):
+            return True
+        full_gray = np.array(full_img.convert("L"))
+        return count_finder_candidates(full_gray, max_side=None) < self.finder_min_candidates
+
+    def detect(self, img: "Image.Image", full_img: Optional["Image.Image"] = None) -> Optional[List]:
+        """
+        img 為縮圖後的偵測用圖片；full_img 為原尺寸圖片 (供 roi 階段使用，省略時不做 ROI 重試)。
+        回傳的座標位於 img (頁面解碼) 或 full_img (ROI) 的座標系，與舊版 worker 相同。
+        """
+        if cv2 is None or np is None or Image is None:
+            return None
+        if img.width == 0 or img.height == 0:
+            raise ValueError("空圖片無法進行 QR 偵測")
+
+        frame = _QrFrame(img)
+        decoded_page = False
+        for stage in self.order:
+            started = time.perf_counter()
+            if stage == "finder":
+                rejected = self._finder_rejects(frame, full_img)
+                self._record(stage, rejected, time.perf_counter() - started)
+                if rejected:
+                    return None
+            elif stage == "roi":
+                if full_img is None:
+                    continue
+                points = self._run_roi(full_img)
+                self._record(stage, bool(points), time.perf_counter() - started)
+                if points:
+                    return points
+            elif not decoded_page:
+                # 解碼階段在頁面上依序執行一次 (順序由 self.decode_order 決定)
+                decoded_page = True
+                points = self._run_decoders(frame)
+                if points:
+                    return points
+        return None
+
+
+def merge_stage_stats(target: Dict[str, Dict[str, float]], source: Optional[Dict[str, Dict[str, float]]]) -> None:
+    for stage, entry in (source or {}).items():
+        agg = target.setdefault(stage, {"calls": 0, "hits": 0, "seconds": 0.0})
+        agg["calls"] += entry.get("calls", 0)
+        agg["hits"] += entry.get("hits", 0)
+        agg["seconds"] += entry.get("seconds", 0.0)
+
+
+def format_stage_stats(stats: Dict[str, Dict[str, float]], order: Sequence[str] = STATS_DISPLAY_ORDER) -> str:
+    names = [name for name in order if name in stats] + [name for name in stats if name not in order]
+    parts = []
+    for name in names:
+        entry = stats[name]
+        label = "rejects" if name in GATE_STAGES else "hits"
+        parts.append(f"{name}(calls={entry['calls']}, {label}={entry['hits']}, ms={entry['seconds'] * 1000:.0f})")
+    return ", ".join(parts)
+
+
+def benchmark_stage_orders(
+    images: Sequence["Image.Image"],
+    orders: Sequence[Sequence[str]],
+    resize_size: int = 1000,
+    finder_min_candidates: int = 1,
+) -> List[Dict[str, Any]]:
+    """
+    對同一批圖片比較不同階段順序：回傳每種順序的總耗時、偵測到 QR 的張數與各階段統計。
+    供調整 qr_stage_order 設定時離線比較使用。
+    """
+    reports = []
+    for order in orders:
+        cascade = QrCascade(order, finder_min_candidates=finder_min_candidates)
+        found = 0
+        started = time.perf_counter()
+        for img in images:
+            resized = img.copy()
+            resized.thumbnail((resize_size, resize_size), Image.Resampling.LANCZOS)
+            if cascade.detect(resized, full_img=img):
+                found += 1
+        reports.append({
+            "order": cascade.order,
+            "seconds": time.perf_counter() - started,
+            "found": found,
+            "stages": cascade.stats,
+        })
+    return reports
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import time
 from collections import defaultdict
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -22,132 +23,69 @@ try:
 except ImportError:
     imagehash = None
 
+from core.hamming_index import HammingIndex, radius_for_similarity
+
 try:
-    from pyzbar.pyzbar import decode as pyzbar_decode
-    from pyzbar.pyzbar import ZBarSymbol
+    from core.features import (
+        COLORFUL_THRESHOLD,
+        DRAFT_REPORT_KEY,
+        LEGACY_PHASH_VERSION,
+        PHASH_VERSION_KEY,
+        color_sample,
+        colorfulness,
+        compute_color_features,
+        compute_phash_features,
+        fused_kernel_available,
+        grid_phash_hex,
+        phash_drift,
+    )
 except ImportError:
-    pyzbar_decode = None
-    ZBarSymbol = None
+    COLORFUL_THRESHOLD = 15.0
+    DRAFT_REPORT_KEY = "_draft_check"
+    LEGACY_PHASH_VERSION = 1
+    PHASH_VERSION_KEY = "phash_version"
+    color_sample = None
+    colorfulness = None
+    compute_color_features = None
+    compute_phash_features = None
+    grid_phash_hex = None
+    phash_drift = None
+
+    def fused_kernel_available() -> bool:
+        return False
+
+from processors.qr_cascade import (
+    QR_DECODE_STAGES,
+    QR_STAGE_STATS_KEY,
+    QrCascade,
+    _fast_get_qr_regions,
+)
 
 
 def _detect_qr_on_image(img: "Image.Image") -> Optional[List]:
-    if cv2 is None or np is None or Image is None:
-        return None
-
-    img_cv = np.array(img.convert("RGB"))
-    if img_cv.shape[0] == 0 or img_cv.shape[1] == 0:
-        raise ValueError("空圖片無法進行 QR 偵測")
-
-    if pyzbar_decode:
-        try:
-            gray = cv2.cvtColor(img_cv, cv2.COLOR_RGB2GRAY)
-            decoded = pyzbar_decode(gray, symbols=[ZBarSymbol.QRCODE])
-            if decoded:
-                poly = decoded[0].polygon
-                if poly and len(poly) == 4:
-                    return [[[p.x, p.y] for p in poly]]
-        except Exception:
-            pass
-
-    qr_detector = cv2.QRCodeDetector()
-    retval, decoded_info, points, _ = qr_detector.detectAndDecodeMulti(img_cv)
-    if retval and points is not None and len(points) > 0:
-        return points.tolist()
-
-    if pyzbar_decode:
-        try:
-            gray = cv2.cvtColor(img_cv, cv2.COLOR_RGB2GRAY)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(gray)
-            decoded = pyzbar_decode(enhanced, symbols=[ZBarSymbol.QRCODE])
-            if decoded:
-                poly = decoded[0].polygon
-                if poly and len(poly) == 4:
-                    return [[[p.x, p.y] for p in poly]]
-
-            blurred = cv2.GaussianBlur(enhanced, (5, 5), 0)
-            thresh = cv2.adaptiveThreshold(
-                blurred,
-                255,
-                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY,
-                11,
-                2,
-            )
-            decoded = pyzbar_decode(thresh, symbols=[ZBarSymbol.QRCODE])
-            if decoded:
-                poly = decoded[0].polygon
-                if poly and len(poly) == 4:
-                    return [[[p.x, p.y] for p in poly]]
-        except Exception:
-            pass
+    """舊版單張解碼流程 (不含快篩與 ROI)，保留給直接呼叫者。"""
+    return QrCascade(QR_DECODE_STAGES).detect(img)
 
-    return None
 
+def _build_qr_cascade(qr_options: Optional[Dict[str, Any]]) -> QrCascade:
+    qr_options = qr_options or {}
+    return QrCascade(
+        qr_options.get("stage_order"),
+        finder_min_candidates=int(qr_options.get("finder_min_candidates", 1)),
+    )
 
-def _fast_get_qr_regions(
-    img_cv: np.ndarray,
-    min_area: int = 400,
-    max_area_ratio: float = 0.5,
-) -> List[Tuple[int, int, int, int]]:
-    if cv2 is None or np is None:
-        return []
-
-    gray = cv2.cvtColor(img_cv, cv2.COLOR_RGB2GRAY) if img_cv.ndim == 3 else img_cv
-    scale = 800 / max(gray.shape)
-    if scale < 1.0:
-        small = cv2.resize(gray, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-    else:
-        small = gray
-        scale = 1.0
-
-    grad_x = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
-    grad = cv2.magnitude(grad_x, grad_y)
-    grad = cv2.convertScaleAbs(grad)
-    _, thresh = cv2.threshold(grad, 50, 255, cv2.THRESH_BINARY)
-
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (11, 11))
-    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    rois = []
-    total_area = small.shape[0] * small.shape[1]
-    max_area = total_area * max_area_ratio
-    for cnt in contours:
-        x, y, w, h = cv2.boundingRect(cnt)
-        area = w * h
-        if area < min_area or area > max_area:
-            continue
-        aspect_ratio = w / float(h)
-        if 0.3 <= aspect_ratio <= 3.5:
-            rois.append((int(x / scale), int(y / scale), int(w / scale), int(h / scale)))
-    return rois
 
-
-def _fast_is_colorful(img_cv: np.ndarray, color_threshold: float = 15.0) -> bool:
-    if cv2 is None or np is None:
+def _fast_is_colorful(img_cv: np.ndarray, color_threshold: float = COLORFUL_THRESHOLD) -> bool:
+    if colorfulness is None or np is None:
         return True
-
-    scale = 400.0 / max(img_cv.shape[:2])
-    if scale < 1.0:
-        small = cv2.resize(img_cv, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-    else:
-        small = img_cv
-
-    lab = cv2.cvtColor(small, cv2.COLOR_RGB2LAB)
-    _, a, b = cv2.split(lab)
-    std_a = np.std(a)
-    std_b = np.std(b)
-    mean_a = np.mean(a)
-    mean_b = np.mean(b)
-    color_val = np.sqrt(std_a ** 2 + std_b ** 2) + 0.3 * np.sqrt((mean_a - 128) ** 2 + (mean_b - 128) ** 2)
-    return color_val > color_threshold
+    return colorfulness(color_sample(img_cv)) > color_threshold
 
 
 def _get_4x4_grid_hashes(image: "Image.Image") -> List[str]:
     if not image or not imagehash:
         return []
+    if fused_kernel_available():
+        return grid_phash_hex(image.convert("L"))
     tw, th = image.size
     if tw < 32 or th < 32:
         return []
@@ -160,6 +98,47 @@ def _get_4x4_grid_hashes(image: "Image.Image") -> List[str]:
     return hashes
 
 
+def _compute_phash_metadata(img: "Image.Image", use_rotation: bool = False) -> Dict[str, Any]:
+    if fused_kernel_available():
+        # 旋轉變體由同一組 DCT 係數推導，不再對整張圖 rotate 三次
+        metadata = compute_phash_features(img, with_rotations=use_rotation)
+        metadata.setdefault("phash_rotations", {})
+        metadata.setdefault("grid_rotations", {})
+        return metadata
+    h32 = imagehash.phash(img, hash_size=8)
+    h128 = imagehash.phash(img, hash_size=16)
+    h512 = imagehash.phash(img, hash_size=32)
+    return {
+        "phash": str(h32),
+        "phash_32": str(h32),
+        "phash_128": h128.hash.tobytes(),
+        "phash_512": h512.hash.tobytes(),
+        "grid_phash": _get_4x4_grid_hashes(img),
+        "phash_rotations": {},
+        "grid_rotations": {},
+        PHASH_VERSION_KEY: LEGACY_PHASH_VERSION,
+    }
+
+
+def _compute_main_phash(img: "Image.Image") -> Dict[str, Any]:
+    """只需主 pHash (QR 命中圖) 時使用；與 _compute_phash_metadata 同一版本定義，兩者的結果可互相比較。"""
+    if fused_kernel_available():
+        return compute_phash_features(img, hash_sizes=(8,), with_grid=False)
+    return {"phash": str(imagehash.phash(img, hash_size=8)), PHASH_VERSION_KEY: LEGACY_PHASH_VERSION}
+
+
+def _attach_quick_digest(metadata: Dict[str, Any], pil_img: "Image.Image") -> None:
+    """開圖時已順手算好 qd64 (與內容大小) 就隨結果回傳，主進程不必再讀一次檔頭。"""
+    from utils import _image_content_size, _image_quick_digest
+
+    qd64 = _image_quick_digest(pil_img)
+    if qd64:
+        metadata["qd64"] = qd64
+        content_size = _image_content_size(pil_img)
+        if content_size is not None:
+            metadata["content_size"] = content_size
+
+
 def _pool_worker_detect_qr_colorful_only(
     image_path: str,
     pil_img: "Image.Image" = None,
@@ -174,6 +153,7 @@ def _pool_worker_detect_qr_colorful_only(
     try:
         if pil_img is None:
             pil_img = _open_image_from_any_path(image_path)
+        _attach_quick_digest(metadata, pil_img)
         if pil_img is None or pil_img.width == 0 or pil_img.height == 0:
             metadata["is_colorful"] = False
             return (image_path, metadata)
@@ -184,8 +164,10 @@ def _pool_worker_detect_qr_colorful_only(
             except Exception:
                 pass
 
-        img_cv = np.array(pil_img.convert("RGB"))
-        metadata["is_colorful"] = bool(_fast_is_colorful(img_cv))
+        if compute_color_features is not None:
+            metadata.update(compute_color_features(pil_img, with_hsv=False))
+        else:
+            metadata["is_colorful"] = True
         return (image_path, metadata)
     except Exception as e:
         metadata["error"] = f"彩圖前篩失敗: {image_path}: {e}"
@@ -202,6 +184,7 @@ def _pool_worker_detect_qr_code(
     image_path: str,
     resize_size: int,
     enable_color_filter: bool = False,
+    qr_options: Optional[Dict[str, Any]] = None,
     pil_img: "Image.Image" = None,
 ) -> Tuple[str, Dict[str, Any]]:
     from utils import _get_file_stat, _open_image_from_any_path
@@ -216,6 +199,7 @@ def _pool_worker_detect_qr_code(
             pil_img = _open_image_from_any_path(image_path)
         if pil_img is None:
             raise UnidentifiedImageError("無法開啟圖片")
+        _attach_quick_digest(metadata, pil_img)
         if pil_img.width == 0 or pil_img.height == 0:
             metadata["error"] = f"空圖片無法進行 QR 偵測: {image_path}"
             return (image_path, metadata)
@@ -226,38 +210,28 @@ def _pool_worker_detect_qr_code(
             except Exception:
                 pass
 
-        img_cv = np.array(pil_img.convert("RGB"))
-        if enable_color_filter and not _fast_is_colorful(img_cv):
-            metadata["is_colorful"] = False
-            metadata["qr_points"] = None
-            return (image_path, metadata)
+        cascade = _build_qr_cascade(qr_options)
+        metadata[QR_STAGE_STATS_KEY] = cascade.stats
+        if enable_color_filter:
+            started = time.perf_counter()
+            is_colorful = _fast_is_colorful(np.array(pil_img.convert("RGB")))
+            cascade.stats["colorful"] = {"calls": 1, "hits": int(not is_colorful), "seconds": time.perf_counter() - started}
+            if not is_colorful:
+                metadata["is_colorful"] = False
+                metadata["qr_points"] = None
+                return (image_path, metadata)
         metadata["is_colorful"] = True
 
         resized_img = pil_img.copy()
         resized_img.thumbnail((resize_size, resize_size), Image.Resampling.LANCZOS)
-        points = _detect_qr_on_image(resized_img)
-
-        if not points:
-            rois = _fast_get_qr_regions(img_cv)
-            for x, y, w, h in rois:
-                pad = 60
-                crop_box = (
-                    max(0, x - pad),
-                    max(0, y - pad),
-                    min(pil_img.width, x + w + pad),
-                    min(pil_img.height, y + h + pad),
-                )
-                crop_img = pil_img.crop(crop_box)
-                crop_points = _detect_qr_on_image(crop_img)
-                if crop_points:
-                    points = [[[p[0] + crop_box[0], p[1] + crop_box[1]] for p in crop_points[0]]]
-                    break
+        points = cascade.detect(resized_img, full_img=pil_img)
 
         metadata["qr_points"] = points
         if points and imagehash:
             try:
-                ph = imagehash.phash(pil_img, hash_size=8)
-                metadata["phash"] = str(ph)
+                main = _compute_main_phash(pil_img)
+                metadata["phash"] = main["phash"]
+                metadata[PHASH_VERSION_KEY] = main[PHASH_VERSION_KEY]
                 from core_engine import FEATURE_PHASH, FEATURE_QR
                 metadata["features_at"] = metadata.get("features_at", 0) | FEATURE_PHASH | FEATURE_QR
             except Exception:
@@ -277,11 +251,103 @@ def _pool_worker_detect_qr_code(
                 pass
 
 
+def _pool_worker_detect_qr_fused(
+    image_path: str,
+    resize_size: int,
+    qr_options: Optional[Dict[str, Any]] = None,
+    pil_img: "Image.Image" = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    彩圖前篩與 QR 偵測共用同一次解碼：非彩圖直接結束，彩圖接著跑 QR 串聯。
+    非彩圖只回傳 is_colorful=False，不帶 qr_points，避免在快取中被誤標為「已做過 QR 偵測」。
+    """
+    image_path, metadata = _pool_worker_detect_qr_code(image_path, resize_size, True, qr_options, pil_img)
+    if metadata.get("is_colorful") is False:
+        metadata.pop("qr_points", None)
+    return (image_path, metadata)
+
+
+def _prepare_phash_image(pil_img: "Image.Image", use_preprocess: bool) -> "Image.Image":
+    img = ImageOps.exif_transpose(pil_img.convert("RGB"))
+    if use_preprocess:
+        from utils import _auto_crop_white_borders
+        img = _auto_crop_white_borders(img)
+        img = ImageOps.equalize(img.convert("L")).convert("RGB")
+    return img
+
+
+# EXIF Orientation 5~8 為轉置類 (含 90/270 度旋轉)，exif_transpose 後寬高互換
+_EXIF_ORIENTATION_TAG = 0x0112
+_AXIS_SWAPPING_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def _exif_swaps_axes(pil_img: "Image.Image") -> bool:
+    try:
+        return pil_img.getexif().get(_EXIF_ORIENTATION_TAG) in _AXIS_SWAPPING_ORIENTATIONS
+    except Exception:
+        return False
+
+
+def _source_dimensions(pil_img: "Image.Image", img: "Image.Image") -> Tuple[int, int]:
+    """
+    draft 解碼時依各軸縮放比例換算回原圖尺寸，確保快取中的 width/height 語意不變。
+    libjpeg 的 DCT 縮放對寬、高各自無條件進位 (ceil(W / k))，兩軸比例不一定相同，
+    因此以 EXIF 轉正前的實際解碼尺寸分別計算，轉正交換長寬時一併對調。
+    未裁切時 (含前處理轉為直向) 直接回傳原圖尺寸；裁切後則依長寬方向對應兩軸比例，並以原圖尺寸為上限。
+    """
+    source_size = pil_img.info.get("draft_source_size") if pil_img.info else None
+    if not source_size or not pil_img.width or not pil_img.height:
+        return img.width, img.height
+    source_w, source_h = source_size
+    decoded_w, decoded_h = pil_img.size
+    if _exif_swaps_axes(pil_img):
+        source_w, source_h, decoded_w, decoded_h = source_h, source_w, decoded_h, decoded_w
+    # _auto_crop_white_borders 會把橫向結果轉成直向，方向與解碼圖相反時兩軸比例對調
+    if (img.width > img.height) != (decoded_w > decoded_h) and img.width != img.height:
+        source_w, source_h, decoded_w, decoded_h = source_h, source_w, decoded_h, decoded_w
+    if img.size == (decoded_w, decoded_h):
+        return source_w, source_h
+    width = min(source_w, int(round(img.width * source_w / float(decoded_w))))
+    height = min(source_h, int(round(img.height * source_h / float(decoded_h))))
+    return width, height
+
+
+def _should_verify_draft(image_path: str, verify_rate: float) -> bool:
+    # 以路徑 CRC 決定抽驗對象：各 worker 無需共享狀態，且同一張圖每次結果一致
+    if verify_rate <= 0:
+        return False
+    if verify_rate >= 1:
+        return True
+    import zlib
+    return (zlib.crc32(image_path.encode("utf-8", errors="ignore")) % 10000) < verify_rate * 10000
+
+
+def _verify_draft_fidelity(
+    image_path: str,
+    use_preprocess: bool,
+    draft_features: Dict[str, Any],
+    bit_budget: int,
+) -> Tuple[Dict[str, Any], Optional["Image.Image"]]:
+    """以完整解碼重算 pHash 比對 draft 結果；漂移超出預算時回傳完整解碼的圖片供改用。"""
+    from utils import _open_image_from_any_path
+
+    full_img = _open_image_from_any_path(image_path)
+    if full_img is None:
+        return {"checked": False}, None
+    prepared = _prepare_phash_image(full_img, use_preprocess)
+    drift = phash_drift(_compute_phash_metadata(prepared), draft_features)
+    phash_bits = drift["phash_bits"] or 0
+    over_budget = phash_bits > bit_budget or drift["grid_mean_bits"] > bit_budget
+    report = {"checked": True, "over_budget": over_budget, **drift}
+    return report, (prepared if over_budget else None)
+
+
 def _pool_worker_process_image_phash_only(
     image_path: str,
     use_rotation: bool = False,
     use_preprocess: bool = False,
     hash_resolution: int = 128,
+    decode_options: Optional[Dict[str, Any]] = None,
     pil_img: "Image.Image" = None,
 ) -> Tuple[str, Dict[str, Any]]:
     from utils import _get_file_stat, _open_image_from_any_path
@@ -290,51 +356,36 @@ def _pool_worker_process_image_phash_only(
     if st_mtime is None:
         return (image_path, {"error": f"圖片檔案不存在: {image_path}"})
     metadata = {"size": st_size, "ctime": st_ctime, "mtime": st_mtime}
+    decode_options = decode_options or {}
+    draft_side = int(decode_options.get("draft_side", 0) or 0)
 
     try:
         if pil_img is None:
-            pil_img = _open_image_from_any_path(image_path)
+            pil_img = _open_image_from_any_path(image_path, draft_size=draft_side or None)
         if pil_img is None:
             raise UnidentifiedImageError("無法開啟圖片")
+        _attach_quick_digest(metadata, pil_img)
         if pil_img.width == 0 or pil_img.height == 0:
             metadata["error"] = f"空圖片無法計算 pHash: {image_path}"
             return (image_path, metadata)
 
-        img = ImageOps.exif_transpose(pil_img.convert("RGB"))
-        if use_preprocess:
-            from utils import _auto_crop_white_borders
-            img = _auto_crop_white_borders(img)
-            img = ImageOps.equalize(img.convert("L")).convert("RGB")
-
-        metadata["width"], metadata["height"] = img.width, img.height
-        h32 = imagehash.phash(img, hash_size=8)
-        h128 = imagehash.phash(img, hash_size=16)
-        h512 = imagehash.phash(img, hash_size=32)
-        metadata.update({
-            "phash": str(h32),
-            "phash_32": str(h32),
-            "phash_128": h128.hash.tobytes(),
-            "phash_512": h512.hash.tobytes(),
-            "grid_phash": _get_4x4_grid_hashes(img),
-        })
-
-        if use_rotation:
-            img_90 = img.rotate(90, expand=True)
-            img_180 = img.rotate(180, expand=True)
-            img_270 = img.rotate(270, expand=True)
-            metadata["phash_rotations"] = {
-                "90": str(imagehash.phash(img_90, hash_size=8)),
-                "180": str(imagehash.phash(img_180, hash_size=8)),
-                "270": str(imagehash.phash(img_270, hash_size=8)),
-            }
-            metadata["grid_rotations"] = {
-                "90": _get_4x4_grid_hashes(img_90),
-                "180": _get_4x4_grid_hashes(img_180),
-                "270": _get_4x4_grid_hashes(img_270),
-            }
-        else:
-            metadata["phash_rotations"] = {}
-            metadata["grid_rotations"] = {}
+        img = _prepare_phash_image(pil_img, use_preprocess)
+        metadata["width"], metadata["height"] = _source_dimensions(pil_img, img)
+        metadata.update(_compute_phash_metadata(img, use_rotation))
+
+        is_draft = bool(pil_img.info.get("draft_source_size"))
+        if is_draft and phash_drift and _should_verify_draft(image_path, float(decode_options.get("verify_rate", 0.0))):
+            report, full_img = _verify_draft_fidelity(
+                image_path,
+                use_preprocess,
+                metadata,
+                int(decode_options.get("bit_budget", 2)),
+            )
+            metadata[DRAFT_REPORT_KEY] = report
+            if full_img is not None:
+                img = full_img
+                metadata["width"], metadata["height"] = img.width, img.height
+                metadata.update(_compute_phash_metadata(img, use_rotation))
 
         return (image_path, metadata)
     except Exception as e:
@@ -356,7 +407,7 @@ def _pool_worker_ensure_image_features(
     enable_quick_digest: bool = True,
     hash_resolution: int = 128,
 ) -> Tuple[str, Dict[str, Any]]:
-    from utils import _avg_hsv, _auto_crop_white_borders, _calculate_quick_digest, _get_file_stat, _open_image_from_any_path
+    from utils import _avg_hsv, _auto_crop_white_borders, _calculate_quick_digest, _get_file_stat, _image_quick_digest, _open_image_from_any_path
 
     st_size, st_ctime, st_mtime = _get_file_stat(image_path)
     if st_mtime is None:
@@ -388,7 +439,7 @@ def _pool_worker_ensure_image_features(
                 return (image_path, metadata)
             metadata["whash"] = str(imagehash.whash(img, hash_size=8, mode="haar", remove_max_haar_ll=True))
         if enable_quick_digest:
-            qd64 = _calculate_quick_digest(image_path)
+            qd64 = _image_quick_digest(pil_img) or _calculate_quick_digest(image_path)
             if qd64:
                 metadata["qd64"] = qd64
         return (image_path, metadata)
@@ -410,6 +461,7 @@ def _pool_worker_process_image_full(
     use_rotation: bool = False,
     use_preprocess: bool = False,
     hash_resolution: int = 128,
+    qr_options: Optional[Dict[str, Any]] = None,
     pil_img: "Image.Image" = None,
 ) -> Tuple[str, Dict[str, Any]]:
     from utils import _get_file_stat, _open_image_from_any_path
@@ -424,6 +476,7 @@ def _pool_worker_process_image_full(
             pil_img = _open_image_from_any_path(image_path)
         if pil_img is None:
             raise UnidentifiedImageError("無法開啟圖片")
+        _attach_quick_digest(metadata, pil_img)
         if pil_img.width == 0 or pil_img.height == 0:
             metadata["error"] = f"空圖片無法計算雜湊: {image_path}"
             return (image_path, metadata)
@@ -437,61 +490,19 @@ def _pool_worker_process_image_full(
             img = ImageOps.equalize(img.convert("L")).convert("RGB")
 
         metadata["width"], metadata["height"] = img.width, img.height
-        img_cv = np.array(img.convert("RGB"))
-        if enable_color_filter and not _fast_is_colorful(img_cv):
+        if enable_color_filter and not _fast_is_colorful(np.array(img.convert("RGB"))):
             metadata["is_colorful"] = False
             metadata["qr_points"] = None
             return (image_path, metadata)
         metadata["is_colorful"] = True
 
-        h32 = imagehash.phash(img, hash_size=8)
-        h128 = imagehash.phash(img, hash_size=16)
-        h512 = imagehash.phash(img, hash_size=32)
-        metadata.update({
-            "phash": str(h32),
-            "phash_32": str(h32),
-            "phash_128": h128.hash.tobytes(),
-            "phash_512": h512.hash.tobytes(),
-            "grid_phash": _get_4x4_grid_hashes(img),
-        })
-
-        if use_rotation:
-            img_90 = img.rotate(90, expand=True)
-            img_180 = img.rotate(180, expand=True)
-            img_270 = img.rotate(270, expand=True)
-            metadata["phash_rotations"] = {
-                "90": str(imagehash.phash(img_90, hash_size=8)),
-                "180": str(imagehash.phash(img_180, hash_size=8)),
-                "270": str(imagehash.phash(img_270, hash_size=8)),
-            }
-            metadata["grid_rotations"] = {
-                "90": _get_4x4_grid_hashes(img_90),
-                "180": _get_4x4_grid_hashes(img_180),
-                "270": _get_4x4_grid_hashes(img_270),
-            }
-        else:
-            metadata["phash_rotations"] = {}
-            metadata["grid_rotations"] = {}
+        metadata.update(_compute_phash_metadata(img, use_rotation))
 
         resized_img = img.copy()
         resized_img.thumbnail((resize_size, resize_size), Image.Resampling.LANCZOS)
-        qr_points = _detect_qr_on_image(resized_img)
-        if not qr_points:
-            rois = _fast_get_qr_regions(img_cv)
-            for x, y, w, h in rois:
-                pad = 60
-                crop_box = (
-                    max(0, x - pad),
-                    max(0, y - pad),
-                    min(img.width, x + w + pad),
-                    min(img.height, y + h + pad),
-                )
-                crop_img = img.crop(crop_box)
-                crop_points = _detect_qr_on_image(crop_img)
-                if crop_points:
-                    qr_points = [[[p[0] + crop_box[0], p[1] + crop_box[1]] for p in crop_points[0]]]
-                    break
-        metadata["qr_points"] = qr_points
+        cascade = _build_qr_cascade(qr_options)
+        metadata["qr_points"] = cascade.detect(resized_img, full_img=img)
+        metadata[QR_STAGE_STATS_KEY] = cascade.stats
         return (image_path, metadata)
     except UnidentifiedImageError:
         metadata["error"] = f"無法開啟圖片: {image_path}"
@@ -556,10 +567,19 @@ def group_qr_results_by_phash(
         if pi != pj:
             parent[pi] = pj
 
-    for i in range(n):
-        for j in range(i + 1, n):
-            if _sim(items_with_hash[i][3], items_with_hash[j][3]) >= sim_threshold:
-                union(i, j)
+    if all(item[3].hash.size == hash_bits for item in items_with_hash):
+        # 64 位元雜湊：以 Hamming 索引只取半徑內的鄰居，結果與逐對比較相同
+        values = [int(str(item[3]), 16) for item in items_with_hash]
+        index = HammingIndex(values, radius_for_similarity(sim_threshold, hash_bits))
+        for i, value in enumerate(values):
+            for j in index.query_ids(value):
+                if j > i:
+                    union(i, j)
+    else:
+        for i in range(n):
+            for j in range(i + 1, n):
+                if _sim(items_with_hash[i][3], items_with_hash[j][3]) >= sim_threshold:
+                    union(i, j)
 
     groups: dict = defaultdict(list)
     for i, (path, val_str, tag, _) in enumerate(items_with_hash):
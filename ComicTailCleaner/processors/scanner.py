@@ -5,6 +5,7 @@
 # ======================================================================
 
 import os
+import atexit
 import datetime
 import json
 import time
@@ -12,8 +13,8 @@ import sqlite3
 import re
 import threading
 from collections import deque, defaultdict
-from queue import Queue
-from typing import Union, Tuple, Dict, List, Set, Optional, Generator, Any
+from queue import Empty, Queue
+from typing import Union, Tuple, Dict, List, Set, Optional, Generator, Any, Iterable
 
 # --- 第三方庫 ---
 try:
@@ -38,6 +39,8 @@ from utils import (log_info, log_error, _is_virtual_path, _parse_virtual_path,
                    CACHE_LOCK, _sanitize_path_for_filename, _open_image_from_any_path, 
                    _get_file_stat, _norm_key)
 from .everything_ipc import EverythingIPCManager
+from .hash_snapshot import HashSnapshot, build_snapshot, update_snapshot, snapshot_dir_for, _read_manifest
+from .ad_lsh_index import AdLshIndex, ad_lsh_path_for, build_and_save as build_ad_lsh_index
 
 try:
     from utils import log_warning
@@ -58,6 +61,48 @@ SCANNER_ENGINE_VERSION = "3.1.3"
 DEFAULT_IMG_FLUSH_THRESHOLD = 1000
 DEFAULT_FOLDER_FLUSH_THRESHOLD = 200
 RESTORE_FOLDER_BATCH_SIZE = 500
+# 低於舊版 SQLite 的 999 個參數上限
+GET_MANY_BATCH_SIZE = 900
+# data JSON 之外另有獨立欄位的鍵；patch 含這些鍵時同步更新欄位
+BLIND_MERGE_COLUMNS = ("phash_32", "phash_128", "phash_512", "mtime")
+# 圖片快取的型別化特徵欄位：常用特徵改存原生型別，不再放在 data JSON
+#   phash / whash 為 64 位元雜湊 (有號 INTEGER)、avg_hsv 拆成三個 REAL、4x4 Grid 為 16×8 位元組 BLOB
+#   row_format 2：初版型別化欄位；3：新增 width / height
+TYPED_FEATURE_COLUMNS = {
+    "phash": ("phash_64",),
+    "whash": ("whash_64",),
+    "avg_hsv": ("hsv_h", "hsv_s", "hsv_v"),
+    "grid_phash": ("grid_phash_blob",),
+    "features_at": ("features_at",),
+    "width": ("width",),
+    "height": ("height",),
+}
+TYPED_VALUE_COLUMNS = tuple(col for cols in TYPED_FEATURE_COLUMNS.values() for col in cols)
+TYPED_COLUMN_TYPES = {
+    "phash_64": "INTEGER", "whash_64": "INTEGER",
+    "hsv_h": "REAL", "hsv_s": "REAL", "hsv_v": "REAL",
+    "grid_phash_blob": "BLOB", "features_at": "INTEGER", "width": "INTEGER", "height": "INTEGER",
+    "row_format": "INTEGER",
+}
+TYPED_ROW_FORMAT = 3
+# 純量狀態欄位的 SQL 型別 → 讀取時的 Python 型別 (BOOLEAN 以 0/1 儲存)
+STATE_COLUMN_CONVERTERS = {"REAL": float, "INTEGER": int, "BOOLEAN": bool}
+GRID_HASH_CELLS = 16
+TYPED_MIGRATION_BATCH_SIZE = 2000
+# 開啟快取時線上遷移舊資料列的時間上限 (秒)；未完成的部分下次開啟再繼續
+TYPED_MIGRATION_TIME_BUDGET = 2.0
+CONTENT_STORE_DB_NAME = "content_features.db"
+# 與檔案位置 / 檔案系統相關的鍵，不進入以內容定址的全域特徵庫
+CONTENT_LOCAL_KEYS = frozenset(("mtime", "ctime", "size", "inode", "qd64", "content_size", "features_at"))
+# 新建的快取檔採 incremental auto_vacuum；WAL 於 checkpoint 後截斷到此上限
+WAL_SIZE_LIMIT_BYTES = 64 * 1024 * 1024
+LIFECYCLE_EVICT_BATCH_SIZE = 200
+# 背景寫入執行緒佇列最多容納的 patch 批次數；滿了 update_data 才會阻塞 (back-pressure)
+WRITER_QUEUE_BATCHES = 4
+WRITER_BUSY_TIMEOUT = 30.0
+# 同一批次連續提交失敗達此次數即隔離 (丟棄並記錄)，避免單一壞批次擋住之後所有寫入
+WRITER_MAX_ATTEMPTS = 3
+INCREMENTAL_VACUUM_STEP_PAGES = 4096
 AD_INDEX_HASH_KIND = "phash_64"
 AD_INDEX_VERSION = "ad_lsh_v1_bands8_bits64"
 AD_INDEX_BITS = 64
@@ -79,6 +124,103 @@ def _cache_folder_key(path: str) -> str:
     return _norm_key(os.path.dirname(path))
 
 
+_json_encode = json.JSONEncoder().encode
+_BLIND_MERGE_SUPPORT: Dict[str, bool] = {}
+
+
+def _supports_blind_merge(conn: sqlite3.Connection) -> bool:
+    """盲寫合併需要 UPSERT (SQLite 3.24+) 與 JSON1 的 json_set。"""
+    version = sqlite3.sqlite_version
+    if version not in _BLIND_MERGE_SUPPORT:
+        supported = sqlite3.sqlite_version_info >= (3, 24, 0)
+        if supported:
+            try:
+                conn.execute("SELECT json_set('{}', '$.a', json('1'))").fetchone()
+            except sqlite3.Error:
+                supported = False
+        _BLIND_MERGE_SUPPORT[version] = supported
+        if not supported:
+            log_warning(f"[快取] SQLite {version} 不支援 UPSERT/JSON1，寫入改用批次讀取合併。")
+    return _BLIND_MERGE_SUPPORT[version]
+
+
+def _hex_to_hash(hexstr: str):
+    """與 imagehash.hex_to_hash 結果相同，改以 bytes.fromhex + unpackbits 轉換，批次讀快取時快一個數量級。"""
+    bits = len(hexstr) * 4
+    side = int(bits ** 0.5)
+    if np is None or side * side != bits:
+        return imagehash.hex_to_hash(hexstr)
+    packed = np.frombuffer(bytes.fromhex(hexstr), dtype=np.uint8)
+    return imagehash.ImageHash(np.unpackbits(packed).astype(bool).reshape(side, side))
+
+
+def _hash_to_int64(value) -> Optional[int]:
+    """64 位元雜湊 (ImageHash 或 16 位 hex) → SQLite INTEGER 可存的有號整數；其他長度回傳 None。"""
+    if value is None:
+        return None
+    text = str(value)
+    if len(text) != 16:
+        return None
+    try:
+        unsigned = int(text, 16)
+    except ValueError:
+        return None
+    return unsigned - (1 << 64) if unsigned >= (1 << 63) else unsigned
+
+
+def _int64_to_hex(value: int) -> str:
+    return f"{int(value) & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+def _grid_to_blob(grid) -> Optional[bytes]:
+    if not isinstance(grid, (list, tuple)) or len(grid) != GRID_HASH_CELLS:
+        return None
+    cells = []
+    for cell in grid:
+        text = str(cell) if cell is not None else ""
+        if len(text) != 16:
+            return None
+        try:
+            cells.append(bytes.fromhex(text))
+        except ValueError:
+            return None
+    return b"".join(cells)
+
+
+def _typed_feature_values(data: dict) -> Tuple[dict, set]:
+    """
+    取出可改存型別化欄位的特徵，回傳 ({欄位: 值}, 已搬離 data JSON 的鍵)。
+    data 中出現的特徵鍵一律寫入對應欄位：無法型別化的值 (非 64 位元雜湊、非 16 格 Grid 等)
+    欄位寫 NULL 並保留在 JSON；值為 None 時欄位寫 NULL 且自 JSON 移除。
+    """
+    columns = {}
+    moved = set()
+    for key, cols in TYPED_FEATURE_COLUMNS.items():
+        if key not in data:
+            continue
+        value = data[key]
+        typed = None
+        if value is not None:
+            if key in ("phash", "whash"):
+                converted = _hash_to_int64(value)
+                typed = (converted,) if converted is not None else None
+            elif key == "avg_hsv":
+                try:
+                    if len(value) == 3:
+                        typed = tuple(float(x) for x in value)
+                except (TypeError, ValueError):
+                    typed = None
+            elif key == "grid_phash":
+                blob = _grid_to_blob(value)
+                typed = (blob,) if blob is not None else None
+            elif isinstance(value, int):
+                typed = (int(value),)
+        if typed is not None or value is None:
+            moved.add(key)
+        columns.update(zip(cols, typed or (None,) * len(cols)))
+    return columns, moved
+
+
 def _compute_lsh_buckets_from_hash_obj(phash_obj, bands: int = AD_INDEX_BANDS, bits: int = AD_INDEX_BITS) -> list[int]:
     if not phash_obj:
         return []
@@ -519,20 +661,108 @@ def _pool_worker_process_image_phash_only(payload: Union[str, tuple]) -> tuple[s
 
 
 # === SQLite 快取基類 ===
+class _FlushBarrier:
+    """排在寫入佇列中的屏障：之前送出的批次都已提交 (durable 時另把 WAL 同步到磁碟) 後才放行。"""
+
+    def __init__(self, durable: bool):
+        self.durable = durable
+        self.done = threading.Event()
+
+
+class _SQLiteWriter:
+    """
+    每個資料庫一條寫入執行緒，使用自己的連線：
+      - 佇列中已到達的批次合併成一個交易提交 (group commit)；
+      - 佇列有上限，寫入跟不上時 submit 阻塞 (back-pressure)；
+      - 提交失敗時改為逐批依序提交，找出失敗的批次；它與之後的批次保留下來，併入下一輪最前面重試，維持寫入順序；
+      - 同一批次失敗達 WRITER_MAX_ATTEMPTS 次即隔離：記錄後丟棄，之後的批次照常寫入。
+    讀取端仍用主連線；WAL 模式下讀取不會被寫入交易擋住。
+    """
+
+    def __init__(self, cache: "SQLiteCacheBase", max_batches: int = WRITER_QUEUE_BATCHES):
+        self.cache = cache
+        self.queue: Queue = Queue(maxsize=max(1, max_batches))
+        self._carry: List[dict] = []
+        # 保留中批次的失敗次數 {id(batch): 次數}；批次留在 _carry 期間 id 不會重複
+        self._attempts: Dict[int, int] = {}
+        self.thread = threading.Thread(
+            target=self._run, name=f"sqlite-writer:{os.path.basename(cache.db_path)}", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, item) -> None:
+        self.queue.put(item)
+
+    def _run(self) -> None:
+        conn = self.cache._open_write_conn()
+        try:
+            while True:
+                items = [self.queue.get()]
+                while True:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                batches = self._carry + [item for item in items if isinstance(item, dict)]
+                self._carry = []
+                if batches and not self.cache._commit_batches(conn, batches):
+                    self._carry = self._commit_one_by_one(conn, batches)
+                for item in items:
+                    if isinstance(item, _FlushBarrier):
+                        if item.durable and not self._carry:
+                            self.cache._sync_wal(conn)
+                        item.done.set()
+                if any(item is None for item in items):
+                    return
+        finally:
+            conn.close()
+
+    def _commit_one_by_one(self, conn: sqlite3.Connection, batches: List[dict]) -> List[dict]:
+        """合併提交失敗後逐批依序提交；回傳仍須保留重試的批次 (第一個未達隔離次數的失敗批次及其後)。"""
+        for index, batch in enumerate(batches):
+            if self.cache._commit_batches(conn, [batch]):
+                self._attempts.pop(id(batch), None)
+                continue
+            attempts = self._attempts.pop(id(batch), 0) + 1
+            if attempts >= WRITER_MAX_ATTEMPTS:
+                self.cache._quarantine_batch(batch, attempts)
+                continue
+            self._attempts[id(batch)] = attempts
+            return batches[index:]
+        return []
+
+
 class SQLiteCacheBase:
+    # 圖片快取將常用特徵存於型別化欄位；資料夾快取等其他表維持純 JSON
+    TYPED_COLUMNS = False
+    # 生命週期 (last_seen 戳記 / LRU 淘汰) 的單位欄位：folder_path 以資料夾為單位，path 以單筆為單位；None 不追蹤
+    LIFECYCLE_UNIT_COLUMN: Optional[str] = None
+    # 以原生欄位儲存、不放在 data JSON 的純量狀態鍵 ((鍵名即欄位名, SQL 型別), ...)；mtime 沿用既有欄位
+    STATE_COLUMNS: Tuple[Tuple[str, str], ...] = ()
+
     def __init__(self, db_path: str, table_name: str):
         self.db_path = db_path
         self.table_name = table_name
         self._pending_lock = threading.RLock()
         self._pending_updates = {}
+        # 已交給寫入執行緒、尚未提交的批次 (依送出順序)；讀取時疊加在資料庫內容之上
+        self._inflight_lock = threading.Lock()
+        self._inflight: List[dict] = []
+        self._writer: Optional[_SQLiteWriter] = None
         self._known_columns = set()
+        # 本次執行已戳記過的生命週期單位，避免每個階段重複寫入；寫入執行緒與主執行緒都會存取，須持有 _stamp_lock
+        self._stamp_lock = threading.Lock()
+        self._stamped_units = set()
         self.flush_threshold = 1000
         self.conn = self._init_db()
 
     def _init_db(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=WRITER_BUSY_TIMEOUT)
+        # 只對尚未建表的新檔生效；既有檔案於 compact() 重寫時轉換
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
         conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT_BYTES}")
         conn.execute(f"""
             CREATE TABLE IF NOT EXISTS {self.table_name} (
                 path TEXT PRIMARY KEY,
@@ -545,6 +775,8 @@ class SQLiteCacheBase:
             )
         """)
         self._ensure_columns(conn)
+        if self.LIFECYCLE_UNIT_COLUMN:
+            self._ensure_lifecycle_tables(conn)
         conn.commit()
         self._refresh_known_columns(conn)
         return conn
@@ -576,7 +808,11 @@ class SQLiteCacheBase:
             except sqlite3.Error as e:
                 log_error(f"SQLite phash_32 migration failed: {e}")
 
-        for col, ctype in (("folder_path", "TEXT"), ("phash_32", "TEXT"), ("phash_128", "BLOB"), ("phash_512", "BLOB"), ("mtime", "REAL")):
+        wanted = [("folder_path", "TEXT"), ("phash_32", "TEXT"), ("phash_128", "BLOB"), ("phash_512", "BLOB"), ("mtime", "REAL")]
+        if self.TYPED_COLUMNS:
+            wanted.extend(TYPED_COLUMN_TYPES.items())
+        wanted.extend(self.STATE_COLUMNS)
+        for col, ctype in wanted:
             if col not in columns:
                 try:
                     target_conn.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {col} {ctype}")
@@ -637,6 +873,9 @@ class SQLiteCacheBase:
             return 0
 
     def _serialize(self, data: dict) -> str:
+        return json.dumps(self._serializable(data))
+
+    def _serializable(self, data: dict) -> dict:
         serializable = data.copy()
         if imagehash:
             for key in ["phash", "whash"]:
@@ -647,7 +886,7 @@ class SQLiteCacheBase:
         for key, value in list(serializable.items()):
             if isinstance(value, bytes):
                 serializable[key] = f"__hex__{value.hex()}"
-        return json.dumps(serializable)
+        return serializable
 
     def _deserialize(self, json_str: str) -> dict:
         try:
@@ -659,7 +898,7 @@ class SQLiteCacheBase:
             for key in ["phash", "whash"]:
                 if key in data and data[key] and isinstance(data[key], str):
                     try:
-                        data[key] = imagehash.hex_to_hash(data[key])
+                        data[key] = _hex_to_hash(data[key])
                     except ValueError:
                         data[key] = None
         if 'avg_hsv' in data and isinstance(data['avg_hsv'], list):
@@ -708,12 +947,30 @@ class SQLiteCacheBase:
         except (TypeError, ValueError, OverflowError):
             return 0.0
 
-    def _select_row(self, key: str) -> Union[tuple, None]:
+    def _select_columns(self) -> list:
         columns = self._known_columns or self._refresh_known_columns()
         select_cols = ["data"]
         for col in ("phash_32", "phash_128", "phash_512", "mtime"):
             if col in columns:
                 select_cols.append(col)
+        if self.TYPED_COLUMNS:
+            select_cols.extend(col for col in TYPED_VALUE_COLUMNS if col in columns)
+        select_cols.extend(col for col in self._state_row_columns() if col in columns)
+        return select_cols
+
+    def _state_row_columns(self) -> tuple:
+        """STATE_COLUMNS 中需要額外欄位的部分 (mtime 已是基本欄位)。"""
+        return tuple(name for name, _ in self.STATE_COLUMNS if name != "mtime")
+
+    def _state_keys(self, data: dict) -> set:
+        return {name for name, _ in self.STATE_COLUMNS if name in data}
+
+    @staticmethod
+    def _row_map(select_cols: list, row: tuple) -> dict:
+        return dict(zip(select_cols, row))
+
+    def _select_row(self, key: str) -> Union[dict, None]:
+        select_cols = self._select_columns()
         try:
             cursor = self.conn.execute(f"SELECT {', '.join(select_cols)} FROM {self.table_name} WHERE path=?", (key,))
             row = cursor.fetchone()
@@ -722,85 +979,322 @@ class SQLiteCacheBase:
             return None
         if not row:
             return None
-        row_map = dict(zip(select_cols, row))
-        return (row_map.get("data"), row_map.get("phash_32"), row_map.get("phash_128"), row_map.get("phash_512"), row_map.get("mtime"))
+        return self._row_map(select_cols, row)
+
+    def _unflushed_batches(self) -> List[dict]:
+        """由舊到新：寫入執行緒尚未提交的批次 + 仍在記憶體累積的 patch。須持有 _pending_lock。"""
+        with self._inflight_lock:
+            batches = list(self._inflight)
+        batches.append(self._pending_updates)
+        return batches
 
     def get_data(self, path: str) -> Union[dict, None]:
         key = _norm_key(path)
         with self._pending_lock:
-            if key in self._pending_updates:
-                return self._pending_updates[key]
-            return self.get_data_inner(key)
+            # 先取未提交批次的快照再讀資料庫：期間若已提交，重複套用同一 patch 結果不變
+            batches = self._unflushed_batches()
+            data = self.get_data_inner(key)
+            for batch in batches:
+                patch = batch.get(key)
+                if patch is not None:
+                    data = data or {}
+                    data.update(patch)
+            return data
+
+    def get_many(self, paths, batch_size: int = GET_MANY_BATCH_SIZE) -> Dict[str, dict]:
+        """
+        批次讀取多筆快取，回傳 {_norm_key(path): data}；查無資料的路徑不會出現在結果中。
+        以 path IN (...) 分批查詢，取代逐筆 get_data 的 SELECT 往返；尚未落盤的更新優先。
+        """
+        keys = list(dict.fromkeys(_norm_key(p) for p in paths if p))
+        result = {}
+        select_cols = self._select_columns()
+        sql_head = f"SELECT path, {', '.join(select_cols)} FROM {self.table_name} WHERE path IN "
+        with self._pending_lock:
+            batches = self._unflushed_batches()
+            try:
+                for start in range(0, len(keys), batch_size):
+                    batch = keys[start:start + batch_size]
+                    cursor = self.conn.execute(sql_head + f"({','.join('?' * len(batch))})", batch)
+                    for row in cursor:
+                        result[row[0]] = self._data_from_row(self._row_map(select_cols, row[1:]))
+            except sqlite3.Error as e:
+                log_error(f"SQLite batch read failed: {e}")
+            for batch in batches:
+                for key in keys:
+                    patch = batch.get(key)
+                    if patch is not None:
+                        result.setdefault(key, {}).update(patch)
+        return result
 
     def get_data_inner(self, key: str) -> Union[dict, None]:
         row = self._select_row(key)
         if not row:
             return None
-        base_data = self._deserialize(row[0])
-        if row[1] is not None:
-            base_data["phash_32"] = str(row[1])
-        if row[2] is not None:
-            base_data["phash_128"] = self._coerce_blob(row[2], 32)
-        if row[3] is not None:
-            base_data["phash_512"] = self._coerce_blob(row[3], 128)
-        if row[4] is not None:
-            base_data["mtime"] = self._coerce_mtime(row[4])
+        return self._data_from_row(row)
+
+    def _data_from_row(self, row: dict) -> dict:
+        base_data = self._deserialize(row.get("data"))
+        if row.get("phash_32") is not None:
+            base_data["phash_32"] = str(row["phash_32"])
+        if row.get("phash_128") is not None:
+            base_data["phash_128"] = self._coerce_blob(row["phash_128"], 32)
+        if row.get("phash_512") is not None:
+            base_data["phash_512"] = self._coerce_blob(row["phash_512"], 128)
+        if row.get("mtime") is not None:
+            base_data["mtime"] = self._coerce_mtime(row["mtime"])
+        if self.TYPED_COLUMNS:
+            self._apply_typed_columns(base_data, row)
+        for name, ctype in self.STATE_COLUMNS:
+            if name != "mtime" and row.get(name) is not None:
+                base_data[name] = STATE_COLUMN_CONVERTERS[ctype](row[name])
         return base_data
 
+    @staticmethod
+    def _apply_typed_columns(base_data: dict, row: dict) -> None:
+        """型別化欄位優先；欄位為 NULL 時沿用 data JSON 的值 (尚未遷移的舊資料列)。"""
+        for key, col in (("phash", "phash_64"), ("whash", "whash_64")):
+            value = row.get(col)
+            if value is not None:
+                hexstr = _int64_to_hex(value)
+                base_data[key] = _hex_to_hash(hexstr) if imagehash else hexstr
+        if row.get("hsv_h") is not None:
+            base_data["avg_hsv"] = (float(row["hsv_h"]), float(row["hsv_s"] or 0.0), float(row["hsv_v"] or 0.0))
+        blob = row.get("grid_phash_blob")
+        if blob is not None and len(blob) == GRID_HASH_CELLS * 8:
+            base_data["grid_phash"] = [blob[i:i + 8].hex() for i in range(0, len(blob), 8)]
+        for key in ("features_at", "width", "height"):
+            if row.get(key) is not None:
+                base_data[key] = int(row[key])
+
     def update_data(self, path: str, data: dict):
+        """
+        盲寫合併：不先讀取既有資料列，只把欄位修補累積在記憶體 (_pending_updates 存放的是 patch 而非整列)，
+        落盤時才由 SQLite 端合併進既有的 data JSON。
+        """
         if not data or "error" in data:
             return
         key = _norm_key(path)
         with self._pending_lock:
-            current = self.get_data_inner(key) or {}
-            current.update(data)
-            self._pending_updates[key] = current
+            self._pending_updates.setdefault(key, {}).update(data)
             if len(self._pending_updates) >= self.flush_threshold:
-                self.save_cache_inner()
+                # 只把累積的 patch 交給寫入執行緒，不在呼叫端等待 SQLite 交易與 fsync
+                self._submit_pending()
 
-    def save_cache(self):
+    def save_cache(self, durable: bool = False):
+        """寫入屏障：回傳時先前的更新都已提交，主連線讀得到；durable=True 另把 WAL 同步到磁碟 (階段結束時使用)。"""
         with self._pending_lock:
-            self.save_cache_inner()
+            self._flush_writes(durable)
 
     def save_cache_inner(self):
         with self._pending_lock:
-            if not self._pending_updates:
-                return
-            pending_snapshot = self._pending_updates
+            self._flush_writes(False)
+
+    def _submit_pending(self) -> Optional[_SQLiteWriter]:
+        """須持有 _pending_lock。佇列已滿時在此阻塞；寫入執行緒不需要 _pending_lock，因此不會死結。"""
+        batch = self._pending_updates
+        if batch:
             self._pending_updates = {}
+            with self._inflight_lock:
+                self._inflight.append(batch)
+        if self._writer is None:
+            if not batch:
+                return None
+            self._writer = _SQLiteWriter(self)
+            atexit.register(self._stop_writer)
+        if batch:
+            self._writer.submit(batch)
+        return self._writer
+
+    def _flush_writes(self, durable: bool) -> None:
+        writer = self._submit_pending()
+        with self._inflight_lock:
+            idle = not self._inflight
+        if writer is None or (idle and not durable):
+            return
+        barrier = _FlushBarrier(durable)
+        writer.submit(barrier)
+        barrier.done.wait()
+
+    def _stop_writer(self) -> None:
+        with self._pending_lock:
+            writer = self._submit_pending()
+            if writer is None:
+                return
+            writer.submit(None)
+            writer.thread.join()
+            self._writer = None
+            try:
+                atexit.unregister(self._stop_writer)
+            except Exception:
+                pass
+            with self._inflight_lock:
+                lost = sum(len(batch) for batch in self._inflight)
+                self._inflight = []
+            if lost:
+                log_error(f"SQLite writer stopped with {lost} unwritten updates: {self.db_path}")
+
+    def _open_write_conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=WRITER_BUSY_TIMEOUT)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT_BYTES}")
+        return conn
 
+    def _commit_batches(self, conn: sqlite3.Connection, batches: List[dict]) -> bool:
+        """(寫入執行緒) 依序合併多個批次，以單一交易寫入；成功後才從未提交清單移除。"""
+        merged: Dict[str, dict] = {}
+        for batch in batches:
+            for key, patch in batch.items():
+                merged.setdefault(key, {}).update(patch)
+        stamped: Set[str] = set()
         try:
-            self._ensure_columns()
-            self._refresh_known_columns()
-            sql = f"INSERT OR REPLACE INTO {self.table_name} (path, folder_path, data, phash_32, phash_128, phash_512, mtime) VALUES (?, ?, ?, ?, ?, ?, ?)"
-            items = []
-            for key, value in pending_snapshot.items():
-                p32 = value.get("phash_32")
-                if p32 is not None and not isinstance(p32, str):
-                    p32 = str(p32)
-                items.append((
-                    key,
-                    _cache_folder_key(key),
-                    self._serialize(value),
-                    p32,
-                    self._coerce_blob(value.get("phash_128"), 32),
-                    self._coerce_blob(value.get("phash_512"), 128),
-                    self._coerce_mtime(value.get("mtime", 0)),
-                ))
-            self.conn.executemany(sql, items)
-            self.conn.commit()
-        except (sqlite3.Error, OverflowError) as e:
-            with self._pending_lock:
-                pending_snapshot.update(self._pending_updates)
-                self._pending_updates = pending_snapshot
+            if _supports_blind_merge(conn):
+                self._write_patches_upsert(merged, conn)
+            else:
+                self._write_patches_read_merge(merged, conn)
+            self._mark_dirty(merged.keys(), conn)
+            stamped = self._stamp_units(self._units_for_keys(merged.keys()), conn=conn)
+            conn.commit()
+        except (sqlite3.Error, OverflowError, TypeError, ValueError) as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            self._unstamp_units(stamped)
             log_error(f"SQLite write failed: {e}")
+            return False
+        with self._inflight_lock:
+            self._inflight = [batch for batch in self._inflight if not any(batch is done for done in batches)]
+        return True
+
+    def _quarantine_batch(self, batch: dict, attempts: int) -> None:
+        """(寫入執行緒) 丟棄一再提交失敗的批次：移出未提交清單 (讀取不再疊加、屏障不再等待) 並記錄受影響的鍵。"""
+        with self._inflight_lock:
+            self._inflight = [pending for pending in self._inflight if pending is not batch]
+        keys = list(batch)
+        sample = ", ".join(keys[:5]) + (" ..." if len(keys) > 5 else "")
+        log_error(f"SQLite writer dropped {len(keys)} updates after {attempts} failed attempts: {self.db_path} [{sample}]")
+
+    @staticmethod
+    def _sync_wal(conn: sqlite3.Connection) -> None:
+        # synchronous=NORMAL 的提交不做 fsync；PASSIVE checkpoint 會先同步 WAL，且不等待讀取端
+        try:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        except sqlite3.Error as e:
+            log_error(f"SQLite wal_checkpoint failed: {e}")
+
+    def _row_columns(self) -> tuple:
+        base = ("path", "folder_path", "data", "phash_32", "phash_128", "phash_512", "mtime")
+        if self.TYPED_COLUMNS:
+            base = base + TYPED_VALUE_COLUMNS + ("row_format",)
+        return base + self._state_row_columns()
+
+    def _row_values(self, key: str, value: dict, data_json: Optional[str] = None, typed: Optional[dict] = None) -> tuple:
+        """依 _row_columns() 的順序組出整列；型別化特徵與狀態欄位寫入欄位，不重複存於 data JSON。"""
+        moved = set()
+        if self.TYPED_COLUMNS and typed is None:
+            typed, moved = _typed_feature_values(value)
+        if data_json is None:
+            moved |= self._state_keys(value)
+            if moved:
+                data_json = self._serialize({k: v for k, v in value.items() if k not in moved})
+        p32 = value.get("phash_32")
+        if p32 is not None and not isinstance(p32, str):
+            p32 = str(p32)
+        row = (
+            key,
+            _cache_folder_key(key),
+            data_json if data_json is not None else self._serialize(value),
+            p32,
+            self._coerce_blob(value.get("phash_128"), 32),
+            self._coerce_blob(value.get("phash_512"), 128),
+            self._coerce_mtime(value.get("mtime", 0)),
+        )
+        if self.TYPED_COLUMNS:
+            row = row + tuple(typed.get(col) for col in TYPED_VALUE_COLUMNS) + (TYPED_ROW_FORMAT,)
+        return row + tuple(value.get(name) for name in self._state_row_columns())
+
+    def _write_patches_upsert(self, patches: Dict[str, dict], conn: Optional[sqlite3.Connection] = None) -> None:
+        """
+        依 patch 的形狀 (欄位數、是否含獨立欄位) 分組，每組一條 INSERT ... ON CONFLICT DO UPDATE 以 executemany 寫入。
+        data JSON 以 json_set 逐鍵覆寫 (與 dict.update 語意相同：None 保留為 null、巢狀 dict 整個取代)，
+        不使用 json_patch，因為它會刪除 null 欄位並遞迴合併巢狀物件。
+        改存型別化欄位的特徵以 json_remove 清掉舊資料列 JSON 中的同名鍵，避免欄位與 JSON 不一致。
+        """
+        conn = conn or self.conn
+        groups: Dict[tuple, list] = defaultdict(list)
+        unquotable = {}
+        for key, patch in patches.items():
+            if any('"' in field for field in patch):
+                # JSON path 的引號標籤無法表示含 " 的鍵，這類少見 patch 改走讀取合併
+                unquotable[key] = patch
+                continue
+            typed, moved = _typed_feature_values(patch) if self.TYPED_COLUMNS else ({}, set())
+            moved |= self._state_keys(patch)
+            json_part = {f: v for f, v in patch.items() if f not in moved} if moved else patch
+            # 每個欄位只編碼一次：同時用於 json_set 參數與新資料列的完整 data JSON
+            encoded = [(field, _json_encode(value)) for field, value in self._serializable(json_part).items()]
+            data_json = "{" + ", ".join(f"{_json_encode(field)}: {text}" for field, text in encoded) + "}"
+            columns = tuple(col for col in BLIND_MERGE_COLUMNS + self._state_row_columns() if col in patch)
+            typed_keys = tuple(k for k in TYPED_FEATURE_COLUMNS if k in patch) if self.TYPED_COLUMNS else ()
+            params = list(self._row_values(key, patch, data_json, typed))
+            for field, text in encoded:
+                params.append(f'$."{field}"')
+                params.append(text)
+            params.extend(f'$."{field}"' for field in sorted(moved))
+            groups[(len(encoded), columns, typed_keys, len(moved))].append(params)
+
+        table = self.table_name
+        row_columns = self._row_columns()
+        for (field_count, columns, typed_keys, removed_count), rows in groups.items():
+            assignments = ["folder_path = excluded.folder_path"]
+            assignments.extend(f"{col} = excluded.{col}" for col in columns)
+            assignments.extend(f"{col} = excluded.{col}" for key in typed_keys for col in TYPED_FEATURE_COLUMNS[key])
+            data_expr = f"CASE WHEN json_valid({table}.data) THEN {table}.data ELSE '{{}}' END"
+            if field_count:
+                data_expr = f"json_set({data_expr}, {', '.join(['?, json(?)'] * field_count)})"
+            if removed_count:
+                data_expr = f"json_remove({data_expr}, {', '.join('?' * removed_count)})"
+            assignments.append(f"data = {data_expr}")
+            sql = (
+                f"INSERT INTO {table} ({', '.join(row_columns)}) "
+                f"VALUES ({', '.join('?' * len(row_columns))}) ON CONFLICT(path) DO UPDATE SET {', '.join(assignments)}"
+            )
+            conn.executemany(sql, rows)
+        if unquotable:
+            self._write_patches_read_merge(unquotable, conn)
+
+    def _write_patches_read_merge(self, patches: Dict[str, dict], conn: Optional[sqlite3.Connection] = None) -> None:
+        """舊版 SQLite (無 UPSERT / JSON1) 的後備路徑：批次讀出既有資料列合併後整列覆寫。"""
+        conn = conn or self.conn
+        existing = {}
+        select_cols = self._select_columns()
+        sql_head = f"SELECT path, {', '.join(select_cols)} FROM {self.table_name} WHERE path IN "
+        keys = list(patches)
+        for start in range(0, len(keys), GET_MANY_BATCH_SIZE):
+            batch = keys[start:start + GET_MANY_BATCH_SIZE]
+            for row in conn.execute(sql_head + f"({','.join('?' * len(batch))})", batch):
+                existing[row[0]] = self._data_from_row(self._row_map(select_cols, row[1:]))
+        items = []
+        for key, patch in patches.items():
+            merged = existing.get(key) or {}
+            merged.update(patch)
+            items.append(self._row_values(key, merged))
+        row_columns = self._row_columns()
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {self.table_name} ({', '.join(row_columns)}) VALUES ({', '.join('?' * len(row_columns))})",
+            items,
+        )
 
     def remove_data(self, path: str) -> bool:
         key = _norm_key(path)
         with self._pending_lock:
             if key in self._pending_updates:
                 del self._pending_updates[key]
+            # 寫入執行緒手上的舊 patch 必須先落地，否則刪除後會被重新寫回
+            self._flush_writes(False)
             try:
+                self._mark_dirty((key,))
                 self.conn.execute(f"DELETE FROM {self.table_name} WHERE path=?", (key,))
                 self.conn.commit()
                 return True
@@ -813,14 +1307,498 @@ class SQLiteCacheBase:
             keys_to_del = [key for key in self._pending_updates if key.startswith(prefix_norm)]
             for key in keys_to_del:
                 del self._pending_updates[key]
+            self._flush_writes(False)
             try:
+                self._mark_dirty_prefix(prefix_norm)
                 self.conn.execute(f"DELETE FROM {self.table_name} WHERE path LIKE ?", (prefix_norm + "%",))
                 self.conn.commit()
             except sqlite3.Error as e:
                 log_error(f"SQLite remove_prefix failed: {e}")
 
-    def close(self):
+    def _mark_dirty(self, keys, conn: Optional[sqlite3.Connection] = None) -> None:
+        """寫入交易內的掛鉤：子類別可在同一交易 (conn，預設主連線) 中記錄被修改的鍵 (例如供快照增量更新)。"""
+
+    def _mark_dirty_prefix(self, prefix_norm: str) -> None:
+        """remove_prefix 刪除前的掛鉤，語意同 _mark_dirty。"""
+
+    def migrate_typed_columns(self, batch_size: int = TYPED_MIGRATION_BATCH_SIZE, time_budget: Optional[float] = None) -> Tuple[int, bool]:
+        """
+        線上遷移：把舊資料列 (row_format 為 NULL 或舊版) data JSON 內的特徵搬到型別化欄位，每批一個交易。
+        讀取路徑同時相容新舊格式，遷移可分多次進行；time_budget 用完即停。
+        回傳 (本次遷移筆數, 是否已全部完成)。
+        """
+        if not self.TYPED_COLUMNS or "row_format" not in (self._known_columns or self._refresh_known_columns()):
+            return 0, True
+        table = self.table_name
+        select_sql = (
+            f"SELECT rowid, data FROM {table} WHERE rowid > ? AND (row_format IS NULL OR row_format < ?) "
+            f"ORDER BY rowid LIMIT ?"
+        )
+        # 欄位已有值代表遷移前已被新格式寫入過，以欄位為準
+        typed_sets = ", ".join(f"{col} = COALESCE({col}, ?)" for col in TYPED_VALUE_COLUMNS)
+        update_sql = f"UPDATE {table} SET data = ?, {typed_sets}, row_format = ? WHERE rowid = ?"
+        deadline = time.perf_counter() + time_budget if time_budget else None
+        migrated, last_rowid = 0, 0
+        while True:
+            with self._pending_lock:
+                try:
+                    rows = self.conn.execute(select_sql, (last_rowid, TYPED_ROW_FORMAT, batch_size)).fetchall()
+                    updates = []
+                    for rowid, data_json in rows:
+                        try:
+                            data = json.loads(data_json) if data_json else {}
+                        except (json.JSONDecodeError, TypeError):
+                            data = None
+                        if not isinstance(data, dict):
+                            updates.append((data_json, *(None,) * len(TYPED_VALUE_COLUMNS), TYPED_ROW_FORMAT, rowid))
+                            continue
+                        typed, moved = _typed_feature_values(data)
+                        for key in moved:
+                            del data[key]
+                        updates.append((
+                            json.dumps(data) if moved else data_json,
+                            *(typed.get(col) for col in TYPED_VALUE_COLUMNS),
+                            TYPED_ROW_FORMAT,
+                            rowid,
+                        ))
+                    if updates:
+                        self.conn.executemany(update_sql, updates)
+                        self.conn.commit()
+                except sqlite3.Error as e:
+                    try:
+                        self.conn.rollback()
+                    except sqlite3.Error:
+                        pass
+                    log_error(f"SQLite typed column migration failed: {e}")
+                    return migrated, False
+            if len(rows) < batch_size:
+                return migrated + len(rows), True
+            migrated += len(rows)
+            last_rowid = rows[-1][0]
+            if deadline is not None and time.perf_counter() >= deadline:
+                return migrated, False
+
+    def _migrate_state_columns_on_open(self) -> None:
+        """把舊資料列 data JSON 內的狀態鍵搬到 STATE_COLUMNS 欄位 (單一 UPDATE；欄位已有值者以欄位為準)。"""
+        if not self.STATE_COLUMNS or not _supports_blind_merge(self.conn):
+            return
+        names = [name for name, _ in self.STATE_COLUMNS]
+        sets = ", ".join(f"{name} = COALESCE({name}, json_extract(data, '$.\"{name}\"'))" for name in names)
+        paths = ", ".join(f"'$.\"{name}\"'" for name in names)
+        pending = " OR ".join(f"json_type(data, '$.\"{name}\"') IS NOT NULL" for name in names)
+        try:
+            with self._pending_lock:
+                cursor = self.conn.execute(
+                    f"UPDATE {self.table_name} SET {sets}, data = json_remove(data, {paths}) WHERE json_valid(data) AND ({pending})"
+                )
+                self.conn.commit()
+            if cursor.rowcount > 0:
+                log_info(f"[Schema] {self.table_name}: 已將 {cursor.rowcount} 筆舊資料列的狀態遷移至欄位")
+        except sqlite3.Error as e:
+            log_error(f"SQLite state column migration failed: {e}")
+
+    def _migrate_typed_columns_on_open(self) -> None:
+        migrated, finished = self.migrate_typed_columns(time_budget=TYPED_MIGRATION_TIME_BUDGET)
+        if migrated:
+            suffix = "" if finished else "，其餘資料列將於下次開啟時繼續"
+            log_info(f"[Schema] {self.table_name}: 已將 {migrated} 筆舊資料列的特徵遷移至型別化欄位{suffix}")
+
+    def load_feature_arrays(self, paths=None) -> Optional[dict]:
+        """
+        以單一 SELECT 讀出型別化特徵並直接組成 NumPy 陣列，供相似度比對整批載入圖庫。
+        回傳 {'paths': [...], 'phash': uint64[N], 'whash': uint64[N], 'hsv': float64[N, 3],
+              'grid': uint64[N, 16], 'features_at': int64[N], 'dims': uint32[N, 2]}；
+        缺值的雜湊與尺寸為 0、HSV 為 NaN。
+        指定 paths 時改以 path IN (...) 分批查詢，回傳順序依資料庫而非 paths。
+        尚未遷移的舊資料列由 data JSON 補齊；呼叫前會先落盤待寫入的更新。
+        """
+        if np is None or not self.TYPED_COLUMNS:
+            return None
         self.save_cache()
+        self._ensure_columns()
+        self._refresh_known_columns()
+        table = self.table_name
+        sql_head = (
+            f"SELECT path, {', '.join(TYPED_VALUE_COLUMNS)}, "
+            f"CASE WHEN row_format IS NULL OR row_format < {TYPED_ROW_FORMAT} THEN data END FROM {table}"
+        )
+        rows = []
+        with self._pending_lock:
+            try:
+                if paths is None:
+                    rows = self.conn.execute(sql_head).fetchall()
+                else:
+                    keys = list(dict.fromkeys(_norm_key(p) for p in paths if p))
+                    for start in range(0, len(keys), GET_MANY_BATCH_SIZE):
+                        batch = keys[start:start + GET_MANY_BATCH_SIZE]
+                        rows.extend(self.conn.execute(sql_head + f" WHERE path IN ({','.join('?' * len(batch))})", batch))
+            except sqlite3.Error as e:
+                log_error(f"SQLite feature array read failed: {e}")
+                return None
+
+        n_typed = len(TYPED_VALUE_COLUMNS)
+        records = []
+        for row in rows:
+            values = list(row[1:1 + n_typed])
+            legacy_json = row[1 + n_typed]
+            if legacy_json:
+                try:
+                    legacy = json.loads(legacy_json)
+                except (json.JSONDecodeError, TypeError):
+                    legacy = None
+                if isinstance(legacy, dict):
+                    typed, _ = _typed_feature_values(legacy)
+                    values = [v if v is not None else typed.get(col) for v, col in zip(values, TYPED_VALUE_COLUMNS)]
+            records.append(values)
+
+        count = len(records)
+        columns = list(zip(*records)) if records else [()] * n_typed
+        col = dict(zip(TYPED_VALUE_COLUMNS, columns))
+        nan = float("nan")
+        empty_grid = bytes(GRID_HASH_CELLS * 8)
+        grid_bytes = b"".join(
+            blob if blob is not None and len(blob) == len(empty_grid) else empty_grid for blob in col["grid_phash_blob"]
+        )
+        return {
+            'paths': [row[0] for row in rows],
+            'phash': np.array([v or 0 for v in col["phash_64"]], dtype=np.int64).view(np.uint64),
+            'whash': np.array([v or 0 for v in col["whash_64"]], dtype=np.int64).view(np.uint64),
+            'hsv': np.array(
+                [[nan if v is None else v for v in hsv] for hsv in zip(col["hsv_h"], col["hsv_s"], col["hsv_v"])],
+                dtype=np.float64,
+            ).reshape(count, 3),
+            'grid': np.frombuffer(grid_bytes, dtype=">u8").astype(np.uint64).reshape(count, GRID_HASH_CELLS),
+            'features_at': np.array([v or 0 for v in col["features_at"]], dtype=np.int64),
+            'dims': np.array(
+                [(w or 0, h or 0) for w, h in zip(col["width"], col["height"])], dtype=np.uint32
+            ).reshape(count, 2),
+        }
+
+    def _ensure_trust_table(self) -> bool:
+        try:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS folder_trust (
+                    trust_key TEXT PRIMARY KEY,
+                    score REAL NOT NULL,
+                    verified_runs INTEGER NOT NULL DEFAULT 0,
+                    mismatches INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL
+                )
+            """)
+            return True
+        except sqlite3.Error as e:
+            log_error(f"SQLite folder_trust schema ensure failed: {e}")
+            return False
+
+    def load_folder_trust(self) -> Dict[str, tuple]:
+        """讀取快取驗證用的資料夾信任分數 {trust_key: (score, verified_runs, mismatches, updated_at)}。"""
+        if not self._ensure_trust_table():
+            return {}
+        try:
+            cursor = self.conn.execute("SELECT trust_key, score, verified_runs, mismatches, updated_at FROM folder_trust")
+            return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            log_error(f"SQLite folder_trust read failed: {e}")
+            return {}
+
+    def save_folder_trust(self, records: Dict[str, tuple]) -> None:
+        if not records or not self._ensure_trust_table():
+            return
+        try:
+            with CACHE_LOCK:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO folder_trust (trust_key, score, verified_runs, mismatches, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(key, *record) for key, record in records.items()],
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            log_error(f"SQLite folder_trust write failed: {e}")
+
+    # --- 生命週期：last_seen 戳記、LRU 淘汰、空間回收與依路徑順序重寫 ---
+
+    def _ensure_lifecycle_tables(self, conn: Optional[sqlite3.Connection] = None) -> bool:
+        target_conn = conn or self.conn
+        try:
+            target_conn.execute("CREATE TABLE IF NOT EXISTS lifecycle_seen (unit TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+            target_conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value REAL)")
+            # 啟用追蹤前就存在、之後從未被看見的單位，以此時間當作 last_seen
+            target_conn.execute("INSERT OR IGNORE INTO cache_meta (key, value) VALUES ('lifecycle_since', ?)", (time.time(),))
+            return True
+        except sqlite3.Error as e:
+            log_error(f"SQLite lifecycle schema ensure failed: {e}")
+            return False
+
+    def get_meta(self, key: str) -> Optional[float]:
+        try:
+            row = self.conn.execute("SELECT value FROM cache_meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: float) -> None:
+        try:
+            self.conn.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES (?, ?)", (key, value))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            log_error(f"SQLite cache_meta write failed: {e}")
+
+    def _units_for_keys(self, keys) -> Set[str]:
+        if not self.LIFECYCLE_UNIT_COLUMN:
+            return set()
+        if self.LIFECYCLE_UNIT_COLUMN != "folder_path":
+            return {_norm_key(key) for key in keys}
+        # 先取 dirname 去重再正規化，整批路徑只需對少數資料夾呼叫 _norm_key
+        folders = set()
+        for key in keys:
+            if _is_virtual_path(key):
+                archive_path, _ = _parse_virtual_path(key)
+                if archive_path:
+                    folders.add(os.path.dirname(archive_path))
+            else:
+                folders.add(os.path.dirname(key))
+        return {_norm_key(folder) for folder in folders}
+
+    def _stamp_units(self, units: Set[str], now: Optional[float] = None, conn: Optional[sqlite3.Connection] = None) -> Set[str]:
+        """
+        在目前交易內更新 last_seen (不 commit)；本次執行已戳記過的單位略過。回傳本次新戳記的單位，
+        呼叫端的交易失敗時須以 _unstamp_units 撤回，下次才會重新戳記。
+        """
+        with self._stamp_lock:
+            units = units - self._stamped_units
+            # 先登記再寫入：另一執行緒同時戳記同一單位時只會寫一次
+            self._stamped_units |= units
+        if not units:
+            return units
+        now = time.time() if now is None else now
+        try:
+            (conn or self.conn).executemany(
+                "INSERT OR REPLACE INTO lifecycle_seen (unit, last_seen) VALUES (?, ?)",
+                [(unit, now) for unit in units],
+            )
+        except sqlite3.Error:
+            self._unstamp_units(units)
+            raise
+        return units
+
+    def _unstamp_units(self, units) -> None:
+        with self._stamp_lock:
+            self._stamped_units.difference_update(units)
+
+    def touch(self, paths) -> int:
+        """將本次掃描看見的路徑所屬單位標記為最近使用；回傳新戳記的單位數。"""
+        units = self._units_for_keys(paths)
+        with self._pending_lock:
+            try:
+                units = self._stamp_units(units)
+                if not units:
+                    return 0
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self._unstamp_units(units)
+                log_error(f"SQLite lifecycle touch failed: {e}")
+                return 0
+        return len(units)
+
+    def lifecycle_units(self) -> List[tuple]:
+        """[(單位, last_seen, 資料列數)]，由最久未見到最近排序；從未戳記的單位以 lifecycle_since 計。"""
+        column = self.LIFECYCLE_UNIT_COLUMN
+        if not column:
+            return []
+        self.save_cache()
+        since = self.get_meta("lifecycle_since") or time.time()
+        try:
+            cursor = self.conn.execute(
+                f"SELECT t.{column}, COALESCE(s.last_seen, ?) AS seen, COUNT(*) FROM {self.table_name} t "
+                f"LEFT JOIN lifecycle_seen s ON s.unit = t.{column} WHERE t.{column} IS NOT NULL "
+                f"GROUP BY t.{column} ORDER BY seen, t.{column}",
+                (since,),
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            log_error(f"SQLite lifecycle scan failed: {e}")
+            return []
+
+    def evict_units(self, units: List[str], deadline: Optional[float] = None) -> Tuple[int, List[str]]:
+        """刪除指定單位的所有資料列 (分批提交，超過 deadline 即停)；回傳 (刪除列數, 實際淘汰的單位)。"""
+        column = self.LIFECYCLE_UNIT_COLUMN
+        if not column or not units:
+            return 0, []
+        deleted = 0
+        evicted = []
+        with self._pending_lock:
+            self.save_cache_inner()
+            for start in range(0, len(units), LIFECYCLE_EVICT_BATCH_SIZE):
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+                batch = list(units[start:start + LIFECYCLE_EVICT_BATCH_SIZE])
+                placeholders = ",".join("?" * len(batch))
+                try:
+                    keys = [row[0] for row in self.conn.execute(f"SELECT path FROM {self.table_name} WHERE {column} IN ({placeholders})", batch)]
+                    self._mark_dirty(keys)
+                    self.conn.execute(f"DELETE FROM {self.table_name} WHERE {column} IN ({placeholders})", batch)
+                    self.conn.execute(f"DELETE FROM lifecycle_seen WHERE unit IN ({placeholders})", batch)
+                    self.conn.commit()
+                    deleted += len(keys)
+                    evicted.extend(batch)
+                    self._unstamp_units(batch)
+                except sqlite3.Error as e:
+                    try:
+                        self.conn.rollback()
+                    except sqlite3.Error:
+                        pass
+                    log_error(f"SQLite lifecycle eviction failed: {e}")
+                    break
+        return deleted, evicted
+
+    def storage_stats(self) -> dict:
+        try:
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+            pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = self.conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        except sqlite3.Error:
+            return {}
+        try:
+            wal_bytes = os.path.getsize(self.db_path + "-wal")
+        except OSError:
+            wal_bytes = 0
+        return {
+            "page_size": page_size,
+            "pages": pages,
+            "free_pages": free_pages,
+            "used_bytes": (pages - free_pages) * page_size,
+            "free_bytes": free_pages * page_size,
+            "wal_bytes": wal_bytes,
+            "incremental_vacuum": auto_vacuum == 2,
+        }
+
+    def reclaim_free_pages(self, deadline: Optional[float] = None) -> int:
+        """incremental auto_vacuum 的檔案分段歸還空頁給檔案系統；回傳歸還頁數。"""
+        reclaimed = 0
+        with self._pending_lock:
+            try:
+                if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    return 0
+                while deadline is None or time.monotonic() < deadline:
+                    free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if not free_pages:
+                        break
+                    # execute() 只 step 一次 (每次僅歸還一頁)；executescript 會執行到完成
+                    self.conn.executescript(f"PRAGMA incremental_vacuum({min(free_pages, INCREMENTAL_VACUUM_STEP_PAGES)});")
+                    remaining = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if remaining >= free_pages:
+                        break
+                    reclaimed += free_pages - remaining
+            except sqlite3.Error as e:
+                log_error(f"SQLite incremental vacuum failed: {e}")
+        return reclaimed
+
+    def checkpoint(self) -> None:
+        """把 WAL 併回主檔並截斷 WAL 檔。"""
+        with self._pending_lock:
+            self.save_cache_inner()
+            try:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            except sqlite3.Error as e:
+                log_error(f"SQLite wal_checkpoint failed: {e}")
+
+    def _lock_sole_connection(self) -> bool:
+        """
+        確認主連線是此資料庫唯一開啟的連線，並獨佔鎖定到連線關閉為止。
+        離開 WAL 模式須沒有其他連線 (本程序的其他管理器、內容特徵庫、GUI 或其他程序) 開著此檔，否則 SQLite 回報 busy；
+        成功後以 EXCLUSIVE locking_mode 保持寫入鎖，之後新開的連線在重寫期間都無法讀寫。失敗時還原為 WAL。
+        """
+        try:
+            mode = self.conn.execute("PRAGMA journal_mode=DELETE").fetchone()[0]
+            if str(mode).lower() == "delete":
+                self.conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+                self.conn.execute("BEGIN EXCLUSIVE")
+                self.conn.commit()
+                return True
+        except sqlite3.Error:
+            pass
+        self._release_sole_connection()
+        return False
+
+    def _release_sole_connection(self) -> None:
+        try:
+            self.conn.rollback()
+            self.conn.execute("PRAGMA locking_mode=NORMAL")
+            self.conn.execute("PRAGMA journal_mode=WAL").fetchall()
+        except sqlite3.Error as e:
+            log_error(f"SQLite journal mode restore failed: {e}")
+
+    def compact(self) -> bool:
+        """
+        重寫整個資料庫檔：主表依 path 排序插入，使同資料夾的資料列在檔案中相鄰 (冷快取時循序讀取)，
+        同時清掉空頁並把舊檔轉為 incremental auto_vacuum。需要約一份資料庫大小的暫存空間。
+        VACUUM INTO 無法改變資料列順序，因此以 ATTACH 依序複製到暫存檔；只有能證明沒有其他連線時才替換原檔
+        (見 _lock_sole_connection)，否則略過，避免其他連線仍指向舊檔而遺失已提交的資料。
+        替換前已離開 WAL 模式並完成提交，不會留下需要刪除的 -wal / -shm。
+        """
+        import shutil
+
+        tmp_path = self.db_path + ".compact"
+        with self._pending_lock:
+            # 寫入執行緒的連線也指向舊檔，重寫前先停止 (之後有寫入時自動重建)
+            self._stop_writer()
+            try:
+                db_size = os.path.getsize(self.db_path)
+                if shutil.disk_usage(os.path.dirname(os.path.abspath(self.db_path))).free < db_size * 1.2:
+                    log_warning(f"[快取維護] 磁碟剩餘空間不足，略過重寫: {self.db_path}")
+                    return False
+            except OSError:
+                return False
+            if not self._lock_sole_connection():
+                log_info(f"[快取維護] 仍有其他連線開啟，略過重寫: {self.db_path}")
+                return False
+            for suffix in ("", "-journal"):
+                if os.path.exists(tmp_path + suffix):
+                    os.remove(tmp_path + suffix)
+            swapped = False
+            try:
+                new_conn = sqlite3.connect(tmp_path)
+                new_conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                new_conn.close()
+                schema = self.conn.execute(
+                    "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                    "ORDER BY type = 'index', rowid"
+                ).fetchall()
+                self.conn.execute("ATTACH DATABASE ? AS compact", (tmp_path,))
+                try:
+                    for kind, name, sql in schema:
+                        qualified = re.sub(r'^CREATE (TABLE|(?:UNIQUE )?INDEX)\s+', lambda m: m.group(0) + "compact.", sql, count=1)
+                        self.conn.execute(qualified)
+                        if kind == "table":
+                            order = "path" if name == self.table_name else "rowid"
+                            self.conn.execute(f'INSERT INTO compact."{name}" SELECT * FROM main."{name}" ORDER BY {order}')
+                    self.conn.commit()
+                finally:
+                    self.conn.execute("DETACH DATABASE compact")
+                # Windows 無法替換仍被開啟的檔案，因此先關閉；鎖定期間沒有其他連線能開始使用舊檔
+                self.conn.close()
+                os.replace(tmp_path, self.db_path)
+                swapped = True
+            except (sqlite3.Error, OSError) as e:
+                log_error(f"[快取維護] 重寫資料庫失敗: {e}")
+                if os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+            try:
+                self.conn.execute("SELECT 1")
+                self._release_sole_connection()
+            except sqlite3.ProgrammingError:
+                # 已關閉的主連線 (替換成功或失敗皆同) 重新開啟，_init_db 會恢復 WAL 模式
+                self.conn = self._init_db()
+        if swapped:
+            self.set_meta("last_compaction", time.time())
+        return swapped
+
+    def close(self):
+        self.save_cache(durable=True)
+        self._stop_writer()
         self.conn.close()
 
     def invalidate_cache(self) -> None:
@@ -838,6 +1816,8 @@ class SQLiteCacheBase:
 class MasterAdCacheManager(SQLiteCacheBase):
     """廣告庫快取。與圖片快取共用同一份 schema，並額外維護廣告 LSH 索引。"""
 
+    TYPED_COLUMNS = True
+
     def __init__(self, ad_folder_path: str):
         from config import DATA_DIR, CACHE_DIR
         import shutil
@@ -858,11 +1838,13 @@ class MasterAdCacheManager(SQLiteCacheBase):
                 db_path = old_db_path
 
         self._legacy_db_path = os.path.join(DATA_DIR, "ad_master_v17.db")
+        self._lsh_index: Optional[AdLshIndex] = None
         super().__init__(db_path, "images")
         self.flush_threshold = 100
         self._ensure_aux_tables()
         if (not os.path.exists(db_path) or self._is_db_empty()) and os.path.exists(self._legacy_db_path):
             self._migrate_from_legacy_ad_db()
+        self._migrate_typed_columns_on_open()
         log_info(f"[Hybrid Storage] Ad Master DB Ready: {db_path}")
 
     def _ensure_aux_tables(self):
@@ -887,6 +1869,12 @@ class MasterAdCacheManager(SQLiteCacheBase):
                     value TEXT
                 )
             """)
+            # 每張廣告目前在索引中的變體雜湊簽章；增量同步以此判斷哪些列需要重寫
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ad_index_entries (path TEXT PRIMARY KEY, signature TEXT NOT NULL)")
+            # 廣告庫檔案清單 (相對路徑, 大小, mtime) 與當時算出的 pHash，用於差異比對
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ad_manifest (rel_path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, phash TEXT)")
+            # 上次的廣告分組結果 (path → leader)；group_params 記錄於 ad_index_meta
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ad_groups (path TEXT PRIMARY KEY, phash TEXT, leader TEXT NOT NULL)")
             self.conn.commit()
         except sqlite3.Error as e:
             log_error(f"Ad index schema ensure failed: {e}")
@@ -942,14 +1930,135 @@ class MasterAdCacheManager(SQLiteCacheBase):
         finally:
             legacy_conn.close()
 
-    def index_is_current(self, digest: str, index_version: str = AD_INDEX_VERSION) -> bool:
-        if not digest:
-            return False
+    def _index_meta(self) -> dict:
         try:
-            rows = dict(self.conn.execute("SELECT key, value FROM ad_index_meta").fetchall())
-            return rows.get("catalog_digest") == digest and rows.get("index_version") == index_version
+            return dict(self.conn.execute("SELECT key, value FROM ad_index_meta").fetchall())
         except sqlite3.Error:
+            return {}
+
+    def _delete_in(self, sql_head: str, keys: list, *params) -> int:
+        """以 GET_MANY_BATCH_SIZE 分批執行 `sql_head IN (...)`，回傳刪除列數。"""
+        deleted = 0
+        for start in range(0, len(keys), GET_MANY_BATCH_SIZE):
+            batch = keys[start:start + GET_MANY_BATCH_SIZE]
+            cursor = self.conn.execute(f"{sql_head} IN ({','.join('?' * len(batch))})", (*params, *batch))
+            deleted += max(cursor.rowcount, 0)
+        return deleted
+
+    # --- 廣告庫檔案清單 ---
+
+    def load_manifest(self) -> Dict[str, tuple]:
+        """rel_path → (size, mtime, phash)。"""
+        try:
+            return {row[0]: tuple(row[1:]) for row in self.conn.execute("SELECT rel_path, size, mtime, phash FROM ad_manifest")}
+        except sqlite3.Error as e:
+            log_error(f"[AdIndex] manifest read failed: {e}")
+            return {}
+
+    def update_manifest(self, changed: Iterable[tuple], removed: Iterable[str]) -> bool:
+        """changed 為 (rel_path, size, mtime, phash)；removed 為已不存在的 rel_path。"""
+        try:
+            self._delete_in("DELETE FROM ad_manifest WHERE rel_path", list(removed))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ad_manifest (rel_path, size, mtime, phash) VALUES (?, ?, ?, ?)", list(changed)
+            )
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            log_error(f"[AdIndex] manifest update failed: {e}")
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
+            return False
+
+    # --- 廣告分組 ---
+
+    def load_ad_groups(self, group_params: str) -> Dict[str, tuple]:
+        """path → (phash, leader)；分組參數與上次不同時回傳空 dict (視同全部重分)。"""
+        if self._index_meta().get("group_params") != group_params:
+            return {}
+        try:
+            return {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT path, phash, leader FROM ad_groups")}
+        except sqlite3.Error as e:
+            log_error(f"[AdIndex] group read failed: {e}")
+            return {}
+
+    def save_ad_groups(self, group_params: str, changed: Dict[str, tuple], removed: Iterable[str], *, replace: bool = False) -> None:
+        """changed 為 path → (phash, leader)；replace=True 時先清空 (參數變更或首次建立)。"""
+        try:
+            if replace:
+                self.conn.execute("DELETE FROM ad_groups")
+            else:
+                self._delete_in("DELETE FROM ad_groups WHERE path", list(removed))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ad_groups (path, phash, leader) VALUES (?, ?, ?)",
+                [(path, phash, leader) for path, (phash, leader) in changed.items()],
+            )
+            self.conn.execute("INSERT OR REPLACE INTO ad_index_meta (key, value) VALUES ('group_params', ?)", (group_params,))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            log_error(f"[AdIndex] group save failed: {e}")
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
+
+    def index_is_current(self, digest: str, index_version: str = AD_INDEX_VERSION) -> bool:
+        if not digest:
             return False
+        rows = self._index_meta()
+        return rows.get("catalog_digest") == digest and rows.get("index_version") == index_version
+
+    def load_hash_index(self, hash_kind: str = AD_INDEX_HASH_KIND) -> Optional[AdLshIndex]:
+        """
+        取得記憶體版 LSH 索引：同一 catalog_digest 只從 SQL 讀一次，之後以資料庫旁的 pickle 載入。
+        尚未建立索引或缺少 numpy 時回傳 None (呼叫端改走 SQL 查詢)。
+        """
+        if np is None:
+            return None
+        meta = self._index_meta()
+        digest, index_version = meta.get("catalog_digest"), meta.get("index_version")
+        if not index_version:
+            return None
+        cached = self._lsh_index
+        if cached is not None and (cached.digest, cached.index_version, cached.hash_kind) == (digest, index_version, hash_kind):
+            return cached
+        index_path = ad_lsh_path_for(self.db_path)
+        index = AdLshIndex.load(index_path, digest, index_version, hash_kind)
+        if index is None:
+            try:
+                rows = self.conn.execute(
+                    "SELECT band, bucket, path FROM ad_hash_index WHERE hash_kind=?", (hash_kind,)
+                ).fetchall()
+            except sqlite3.Error as e:
+                log_error(f"[AdIndex] load failed: {e}")
+                return None
+            index = build_ad_lsh_index(
+                index_path, ((band, bucket, _norm_key(path)) for band, bucket, path in rows),
+                digest=digest, index_version=index_version, hash_kind=hash_kind, bands=AD_INDEX_BANDS, bits=AD_INDEX_BITS,
+            )
+        self._lsh_index = index
+        return index
+
+    @staticmethod
+    def _index_signature(data: dict) -> Tuple[str, list]:
+        """廣告的 (簽章, [(variant, phash_obj)])；簽章為各變體雜湊字串，任一變體改變即視為需要重寫。"""
+        variants = [("base", data.get("phash"))]
+        rotations = data.get("phash_rotations", {}) or {}
+        for rot_key in ("90", "180", "270"):
+            if rotations.get(rot_key):
+                variants.append((f"rot{rot_key}", rotations.get(rot_key)))
+        return "|".join(f"{variant}={phash_obj or ''}" for variant, phash_obj in variants), variants
+
+    @staticmethod
+    def _index_rows(path_key: str, variants: list, hash_kind: str, bands: int) -> list:
+        rows = []
+        for variant, phash_obj in variants:
+            buckets = _compute_lsh_buckets_from_hash_obj(phash_obj, bands=bands, bits=AD_INDEX_BITS)
+            for band, bucket in enumerate(buckets):
+                rows.append((hash_kind, band, bucket, path_key, variant))
+        return rows
 
     def rebuild_hash_index(
         self,
@@ -961,33 +2070,31 @@ class MasterAdCacheManager(SQLiteCacheBase):
         index_version: str = AD_INDEX_VERSION,
     ) -> None:
         self._ensure_aux_tables()
-        rows = []
+        rows, entries = [], []
         for path, data in ad_data.items():
             if not data:
                 continue
-            variants = [("base", data.get("phash"))]
-            rotations = data.get("phash_rotations", {}) or {}
-            for rot_key in ("90", "180", "270"):
-                if rotations.get(rot_key):
-                    variants.append((f"rot{rot_key}", rotations.get(rot_key)))
-            for variant, phash_obj in variants:
-                buckets = _compute_lsh_buckets_from_hash_obj(phash_obj, bands=bands, bits=AD_INDEX_BITS)
-                for band, bucket in enumerate(buckets):
-                    rows.append((hash_kind, band, bucket, _norm_key(path), variant))
+            signature, variants = self._index_signature(data)
+            rows.extend(self._index_rows(_norm_key(path), variants, hash_kind, bands))
+            entries.append((_norm_key(path), signature))
 
         try:
             self.conn.execute("DELETE FROM ad_hash_index")
-            self.conn.execute("DELETE FROM ad_index_meta")
+            self.conn.execute("DELETE FROM ad_index_entries")
+            self.conn.execute("DELETE FROM ad_index_meta WHERE key != 'group_params'")
             if rows:
                 self.conn.executemany(
                     "INSERT OR REPLACE INTO ad_hash_index (hash_kind, band, bucket, path, variant) VALUES (?, ?, ?, ?, ?)",
                     rows,
                 )
+            self.conn.executemany("INSERT OR REPLACE INTO ad_index_entries (path, signature) VALUES (?, ?)", entries)
             self.conn.executemany(
                 "INSERT OR REPLACE INTO ad_index_meta (key, value) VALUES (?, ?)",
                 [
                     ("catalog_digest", digest or ""),
                     ("index_version", index_version),
+                    ("hash_kind", hash_kind),
+                    ("bands", str(bands)),
                     ("row_count", str(len(rows))),
                 ],
             )
@@ -995,6 +2102,111 @@ class MasterAdCacheManager(SQLiteCacheBase):
             log_info(f"[AdIndex] rebuilt: {len(rows)} rows, version={index_version}")
         except sqlite3.Error as e:
             log_error(f"[AdIndex] rebuild failed: {e}")
+            return
+        self._lsh_index = None
+        if np is not None:
+            self._lsh_index = build_ad_lsh_index(
+                ad_lsh_path_for(self.db_path), ((band, bucket, path) for _, band, bucket, path, _ in rows),
+                digest=digest or "", index_version=index_version, hash_kind=hash_kind, bands=bands, bits=AD_INDEX_BITS,
+            )
+
+    def sync_hash_index(
+        self,
+        ad_data: dict,
+        *,
+        digest: str,
+        hash_kind: str = AD_INDEX_HASH_KIND,
+        bands: int = AD_INDEX_BANDS,
+        index_version: str = AD_INDEX_VERSION,
+    ) -> None:
+        """
+        增量維護 ad_hash_index：依 ad_index_entries 的簽章找出新增 / 變更 / 移除的廣告，只刪除並重寫這些廣告的列，
+        記憶體索引同步套用相同差異。索引版本、hash_kind 或 bands 不同 (或尚無簽章記錄) 時退回 rebuild_hash_index。
+        """
+        self._ensure_aux_tables()
+        meta = self._index_meta()
+        if (
+            meta.get("index_version") != index_version
+            or meta.get("hash_kind") != hash_kind
+            or meta.get("bands") != str(bands)
+        ):
+            self.rebuild_hash_index(ad_data, digest=digest, hash_kind=hash_kind, bands=bands, index_version=index_version)
+            return
+        try:
+            entries = dict(self.conn.execute("SELECT path, signature FROM ad_index_entries").fetchall())
+        except sqlite3.Error as e:
+            log_error(f"[AdIndex] entry read failed: {e}")
+            entries = {}
+        if not entries and meta.get("row_count") not in (None, "0"):
+            self.rebuild_hash_index(ad_data, digest=digest, hash_kind=hash_kind, bands=bands, index_version=index_version)
+            return
+
+        current = {}
+        for path, data in ad_data.items():
+            if data:
+                current[_norm_key(path)] = self._index_signature(data)
+        changed = [key for key, (signature, _) in current.items() if entries.get(key) != signature]
+        removed = [key for key in entries if key not in current]
+        if not changed and not removed:
+            if meta.get("catalog_digest") != (digest or ""):
+                self._set_index_digest(digest, hash_kind)
+            log_info(f"[AdIndex] index current: {(digest or '')[:8]}...")
+            return
+
+        # 先以舊 digest 取得記憶體索引，稍後直接套用差異
+        previous = self.load_hash_index(hash_kind) if np is not None else None
+        rows = []
+        for key in changed:
+            rows.extend(self._index_rows(key, current[key][1], hash_kind, bands))
+        stale = changed + removed
+        try:
+            deleted = self._delete_in("DELETE FROM ad_hash_index WHERE hash_kind=? AND path", stale, hash_kind)
+            self._delete_in("DELETE FROM ad_index_entries WHERE path", removed)
+            if rows:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO ad_hash_index (hash_kind, band, bucket, path, variant) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ad_index_entries (path, signature) VALUES (?, ?)",
+                [(key, current[key][0]) for key in changed],
+            )
+            try:
+                row_count = max(int(meta.get("row_count") or 0) - deleted + len(rows), 0)
+            except ValueError:
+                row_count = len(rows)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ad_index_meta (key, value) VALUES (?, ?)",
+                [("catalog_digest", digest or ""), ("row_count", str(row_count))],
+            )
+            self.conn.commit()
+            log_info(f"[AdIndex] synced: +{len(changed)} / -{len(removed)} ads, {deleted} rows removed, {len(rows)} rows written")
+        except sqlite3.Error as e:
+            log_error(f"[AdIndex] sync failed: {e}")
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
+            return
+        self._lsh_index = None
+        if previous is not None:
+            self._lsh_index = previous.with_changes(set(stale), ((band, bucket, path) for _, band, bucket, path, _ in rows), digest or "")
+            self._lsh_index.save(ad_lsh_path_for(self.db_path))
+
+    def _set_index_digest(self, digest: str, hash_kind: str) -> None:
+        """內容未變、只有 digest 改變 (例如比對參數變更)：改寫 meta 並沿用記憶體索引。"""
+        previous = self.load_hash_index(hash_kind) if np is not None else None
+        try:
+            self.conn.execute("INSERT OR REPLACE INTO ad_index_meta (key, value) VALUES ('catalog_digest', ?)", (digest or "",))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            log_error(f"[AdIndex] digest update failed: {e}")
+            return
+        self._lsh_index = None
+        if previous is not None:
+            previous.digest = digest or ""
+            previous.save(ad_lsh_path_for(self.db_path))
+            self._lsh_index = previous
 
     def query_hash_index(
         self,
@@ -1003,6 +2215,10 @@ class MasterAdCacheManager(SQLiteCacheBase):
         hash_kind: str = AD_INDEX_HASH_KIND,
         bands: int = AD_INDEX_BANDS,
     ) -> Set[str]:
+        if bands == AD_INDEX_BANDS:
+            index = self.load_hash_index(hash_kind)
+            if index is not None:
+                return index.query(phash_obj)
         buckets = _compute_lsh_buckets_from_hash_obj(phash_obj, bands=bands, bits=AD_INDEX_BITS)
         if not buckets:
             return set()
@@ -1018,16 +2234,32 @@ class MasterAdCacheManager(SQLiteCacheBase):
             log_error(f"[AdIndex] query failed: {e}")
         return paths
 
+    def query_hash_index_many(self, phash_objs, *, hash_kind: str = AD_INDEX_HASH_KIND) -> List[Set[str]]:
+        """批次版 query_hash_index：一次查詢數千個雜湊，回傳與輸入同序的候選路徑集合。"""
+        phash_objs = list(phash_objs)
+        index = self.load_hash_index(hash_kind)
+        if index is None:
+            return [self.query_hash_index(obj, hash_kind=hash_kind) if obj else set() for obj in phash_objs]
+        return index.query_many(phash_objs)
+
     def invalidate_cache(self) -> None:
         if send2trash is None:
             return
         log_info(f"[清理] 廣告快取資料庫已移至回收桶: {self.db_path}")
         super().invalidate_cache()
+        self._lsh_index = None
+        try:
+            os.remove(ad_lsh_path_for(self.db_path))
+        except OSError:
+            pass
         self._ensure_aux_tables()
 
 # === 具體快取管理類 (SQLite 版) ===
 
 class ScannedImageCacheManager(SQLiteCacheBase):
+    TYPED_COLUMNS = True
+    LIFECYCLE_UNIT_COLUMN = "folder_path"
+
     def __init__(self, root_scan_folder: str):
         sanitized_root = _sanitize_path_for_filename(root_scan_folder)
         base_name = f"scanned_hashes_cache_{sanitized_root}"
@@ -1059,9 +2291,79 @@ class ScannedImageCacheManager(SQLiteCacheBase):
                 )
                 if migrated:
                     log_info(f"[遷移][圖片快取] 成功遷移 {migrated} 筆資料。")
-        
+        self._migrate_typed_columns_on_open()
+        self._snapshot_dir = snapshot_dir_for(db_path)
+        # 快照存在時才記錄 dirty 鍵；否則下次使用時本來就會整份重建
+        self._snapshot_tracking = _read_manifest(self._snapshot_dir) is not None and self._ensure_snapshot_table()
+
         log_info(f"[快取] SQLite 圖片快取已就緒: '{self.cache_file_path}'")
 
+    def _ensure_snapshot_table(self) -> bool:
+        try:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS snapshot_dirty (path TEXT PRIMARY KEY)")
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            log_error(f"SQLite snapshot_dirty schema ensure failed: {e}")
+            return False
+
+    def _mark_dirty(self, keys, conn: Optional[sqlite3.Connection] = None) -> None:
+        if getattr(self, '_snapshot_tracking', False):
+            (conn or self.conn).executemany("INSERT OR IGNORE INTO snapshot_dirty (path) VALUES (?)", [(k,) for k in keys])
+
+    def _mark_dirty_prefix(self, prefix_norm: str) -> None:
+        if getattr(self, '_snapshot_tracking', False):
+            self.conn.execute(
+                "INSERT OR IGNORE INTO snapshot_dirty (path) SELECT path FROM images WHERE path LIKE ?",
+                (prefix_norm + "%",),
+            )
+
+    def refresh_hash_snapshot(self) -> Optional[HashSnapshot]:
+        """
+        將欄式雜湊快照與資料庫同步後以唯讀 memmap 開啟。
+        平時只重讀 snapshot_dirty 記錄的鍵 (與資料寫入同一交易記錄，中斷也不會遺漏)；
+        快照不存在、損毀、失效列過多或存活列數與資料庫不符時整份重建。
+        """
+        if np is None:
+            return None
+        directory = self._snapshot_dir
+        with self._pending_lock:
+            self.save_cache_inner()
+            try:
+                live = None
+                if self._snapshot_tracking:
+                    dirty = [row[0] for row in self.conn.execute("SELECT path FROM snapshot_dirty")]
+                    if dirty:
+                        arrays = self.load_feature_arrays(dirty)
+                        if arrays is not None:
+                            live = update_snapshot(directory, arrays, set(dirty) - set(arrays['paths']))
+                    else:
+                        manifest = _read_manifest(directory)
+                        live = manifest.get('live') if manifest else None
+                    if live is not None and live != self._row_count():
+                        log_warning("[快照] 快照列數與資料庫不符，整份重建。")
+                        live = None
+                if live is None:
+                    arrays = self.load_feature_arrays()
+                    if arrays is None:
+                        return None
+                    live = build_snapshot(directory, arrays)
+                    log_info(f"[快照] 已重建雜湊快照: {live} 列")
+                if self._ensure_snapshot_table():
+                    self.conn.execute("DELETE FROM snapshot_dirty")
+                    self.conn.commit()
+                    self._snapshot_tracking = True
+            except (sqlite3.Error, OSError) as e:
+                log_error(f"[快照] 更新雜湊快照失敗: {e}")
+                return None
+        return HashSnapshot.open(directory)
+
+    def invalidate_cache(self) -> None:
+        import shutil
+        super().invalidate_cache()
+        self._snapshot_tracking = False
+        shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+
     def count_missing_folder_paths(self) -> int:
         try:
             return self.conn.execute("SELECT COUNT(*) FROM images WHERE folder_path IS NULL OR folder_path = ''").fetchone()[0]
@@ -1175,7 +2477,158 @@ class ScannedImageCacheManager(SQLiteCacheBase):
 
         return restored_paths
 
+def content_key(content_size, qd64) -> Optional[str]:
+    """內容識別碼 "<位元組數>:<qd64>"；任一未知時回傳 None。"""
+    if content_size is None or not qd64:
+        return None
+    return f"{int(content_size)}:{qd64}"
+
+
+def file_ident(path: str, size, mtime, inode) -> Optional[str]:
+    """
+    檔案身分 "<size>:<mtime>:<inode>"，壓縮檔內圖片另附成員路徑 (size / mtime / inode 為壓縮檔本身)。
+    路徑對照表以此確認檔案自記錄後未變更；mtime 未知時回傳 None。
+    """
+    if mtime is None:
+        return None
+    ident = f"{'' if size is None else int(size)}:{float(mtime)!r}:{inode or ''}"
+    if _is_virtual_path(path):
+        _, inner_path = _parse_virtual_path(path)
+        ident += f"{VPATH_SEPARATOR}{inner_path}"
+    return ident
+
+
+class ContentFeatureStore(SQLiteCacheBase):
+    """
+    以內容定址的全域特徵庫 (所有掃描根目錄共用一份)，鍵為 "<content_key>|<選項簽章>"：
+    同一內容在不同前處理 / 雜湊解析度 / 旋轉設定下算出的特徵分開存放，不會互相取用。
+    只保存由圖片內容決定的特徵；路徑、mtime 等仍由各根目錄的圖片快取記錄。
+    另以 content_paths 表記錄「路徑 → content_key」與當時的檔案身分，查詢時不必讀取圖片：
+      - 路徑相同且身分未變 (其他根目錄掃過同一檔案、快取重建) 直接命中；
+      - 有 inode 時身分相同即視為同一檔案，資料夾改名或同一磁碟內搬移也能命中。
+    """
+
+    TYPED_COLUMNS = True
+    LIFECYCLE_UNIT_COLUMN = "path"
+    KEY_SEPARATOR = "|"
+
+    def __init__(self, db_path: Optional[str] = None):
+        if db_path is None:
+            from config import CACHE_DIR
+            db_path = os.path.join(CACHE_DIR, CONTENT_STORE_DB_NAME)
+        super().__init__(db_path, "content")
+        self.flush_threshold = DEFAULT_IMG_FLUSH_THRESHOLD
+        # 待寫入的路徑對照 {path: (ident, content_key)}；與特徵一同於 save_cache 落盤
+        self._pending_paths: Dict[str, tuple] = {}
+        self._ensure_path_table()
+        self._migrate_typed_columns_on_open()
+
+    def _ensure_path_table(self) -> None:
+        try:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS content_paths (path TEXT PRIMARY KEY, ident TEXT, content_key TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_content_paths_ident ON content_paths(ident)")
+            self.conn.commit()
+        except sqlite3.Error as e:
+            log_error(f"SQLite content_paths schema ensure failed: {e}")
+
+    @classmethod
+    def store_key(cls, cid: str, signature: str) -> str:
+        return f"{cid}{cls.KEY_SEPARATOR}{signature}"
+
+    def publish(self, content_size, qd64, data: dict, signature: str, path: Optional[str] = None, ident: Optional[str] = None) -> None:
+        cid = content_key(content_size, qd64)
+        if cid is None:
+            return
+        features = {k: v for k, v in data.items() if k not in CONTENT_LOCAL_KEYS}
+        if features:
+            self.update_data(self.store_key(cid, signature), features)
+        if path and ident:
+            self.record_path(path, ident, cid)
+
+    def record_path(self, path: str, ident: str, cid: str) -> None:
+        with self._pending_lock:
+            self._pending_paths[_norm_key(path)] = (ident, cid)
+
+    def lookup_content_keys(self, idents: Dict[str, str], movable: Set[str] = frozenset()) -> Dict[str, str]:
+        """
+        {路徑: 檔案身分} → {路徑: content_key}，完全不讀取圖片。
+        先以路徑查詢且記錄的身分須相同；其餘屬於 movable (身分含 inode) 的路徑再以身分查詢。
+        """
+        keys = {_norm_key(path): path for path, ident in idents.items() if ident}
+        found = {}
+        with self._pending_lock:
+            pending = dict(self._pending_paths)
+            try:
+                key_list = list(keys)
+                for start in range(0, len(key_list), GET_MANY_BATCH_SIZE):
+                    batch = key_list[start:start + GET_MANY_BATCH_SIZE]
+                    for key, ident, cid in self.conn.execute(
+                        f"SELECT path, ident, content_key FROM content_paths WHERE path IN ({','.join('?' * len(batch))})", batch
+                    ):
+                        if ident == idents[keys[key]]:
+                            found[keys[key]] = cid
+                by_ident = {}
+                for key, path in keys.items():
+                    if path in found:
+                        continue
+                    ident, cid = pending.get(key, (None, None))
+                    if ident == idents[path]:
+                        found[path] = cid
+                    elif path in movable:
+                        by_ident.setdefault(idents[path], []).append(path)
+                if by_ident:
+                    pending_by_ident = {ident: cid for ident, cid in pending.values()}
+                    ident_list = list(by_ident)
+                    for start in range(0, len(ident_list), GET_MANY_BATCH_SIZE):
+                        batch = ident_list[start:start + GET_MANY_BATCH_SIZE]
+                        for ident, cid in self.conn.execute(
+                            f"SELECT ident, content_key FROM content_paths WHERE ident IN ({','.join('?' * len(batch))})", batch
+                        ):
+                            pending_by_ident.setdefault(ident, cid)
+                    for ident, paths in by_ident.items():
+                        if ident in pending_by_ident:
+                            for path in paths:
+                                found[path] = pending_by_ident[ident]
+            except sqlite3.Error as e:
+                log_error(f"SQLite content path lookup failed: {e}")
+        return found
+
+    def save_cache(self, durable: bool = False):
+        with self._pending_lock:
+            super().save_cache(durable)
+            rows, self._pending_paths = self._pending_paths, {}
+            if not rows:
+                return
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO content_paths (path, ident, content_key) VALUES (?, ?, ?)",
+                    [(path, ident, cid) for path, (ident, cid) in rows.items()],
+                )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                log_error(f"SQLite content path write failed: {e}")
+
+    def evict_units(self, units: List[str], deadline: Optional[float] = None) -> Tuple[int, List[str]]:
+        deleted, evicted = super().evict_units(units, deadline)
+        if evicted:
+            # 對照到的內容已沒有任何選項簽章的特徵時，對照列一併刪除
+            sep = self.KEY_SEPARATOR
+            upper = chr(ord(sep) + 1)
+            try:
+                with self._pending_lock:
+                    self.conn.execute(
+                        f"DELETE FROM content_paths WHERE NOT EXISTS (SELECT 1 FROM {self.table_name} "
+                        f"WHERE path >= content_key || '{sep}' AND path < content_key || '{upper}')"
+                    )
+                    self.conn.commit()
+            except sqlite3.Error as e:
+                log_error(f"SQLite content path cleanup failed: {e}")
+        return deleted, evicted
+
+
 class FolderStateCacheManager(SQLiteCacheBase):
+    STATE_COLUMNS = (("mtime", "REAL"), ("ctime", "REAL"), ("scanned_count", "INTEGER"), ("is_empty", "BOOLEAN"))
+
     def __init__(self, root_scan_folder: str):
         sanitized_root = _sanitize_path_for_filename(root_scan_folder)
         base_name = f"folder_state_cache_{sanitized_root}"
@@ -1206,6 +2659,7 @@ class FolderStateCacheManager(SQLiteCacheBase):
                 )
                 if migrated:
                     log_info(f"[遷移][資料夾快取] 成功遷移 {migrated} 筆資料。")
+        self._migrate_state_columns_on_open()
 
         log_info(f"[快取] SQLite 資料夾快取已就緒: '{self.cache_file_path}'")
 
@@ -1225,6 +2679,7 @@ class FolderStateCacheManager(SQLiteCacheBase):
             for k in keys_to_del:
                  if k in self._pending_updates:
                      del self._pending_updates[k]
+            self._flush_writes(False)
         if not keys_to_del: return
         try:
             with CACHE_LOCK:
@@ -1234,12 +2689,36 @@ class FolderStateCacheManager(SQLiteCacheBase):
         except sqlite3.Error as e:
             log_error(f"SQLite 批量移除資料夾失敗: {e}")
             
+    def load_states(self) -> Dict[str, dict]:
+        """
+        一次讀出所有資料夾狀態 {path: {'mtime', 'ctime', 'scanned_count', 'is_empty', ...}}，
+        供掃描列舉的變更判斷、幽靈資料夾與新資料夾判斷共用，取代逐資料夾的 get_folder_state。
+        只讀狀態欄位；ctime 欄為 NULL 的資料列 (尚未遷移或無 JSON1 的舊 SQLite) 才解析 data JSON。
+        """
+        self.save_cache()
+        names = [name for name, _ in self.STATE_COLUMNS]
+        states = {}
+        try:
+            cursor = self.conn.execute(
+                f"SELECT path, {', '.join(names)}, CASE WHEN ctime IS NULL THEN data END FROM {self.table_name}"
+            )
+            for path, *values, data_json in cursor:
+                state = self._deserialize(data_json) if data_json is not None else {}
+                for (name, ctype), value in zip(self.STATE_COLUMNS, values):
+                    if value is not None:
+                        state[name] = STATE_COLUMN_CONVERTERS[ctype](value)
+                states[path] = state
+        except sqlite3.Error as e:
+            log_error(f"SQLite 資料夾狀態批次讀取失敗: {e}")
+        return states
+
     @property
     def cache(self) -> dict:
         self.save_cache()
+        select_cols = self._select_columns()
         try:
-            cursor = self.conn.execute("SELECT path, data FROM folders")
-            return {row[0]: self._deserialize(row[1]) for row in cursor.fetchall()}
+            cursor = self.conn.execute(f"SELECT path, {', '.join(select_cols)} FROM {self.table_name}")
+            return {row[0]: self._data_from_row(self._row_map(select_cols, row[1:])) for row in cursor.fetchall()}
         except sqlite3.Error:
             return {}
 
@@ -1247,7 +2726,7 @@ class FolderStateCacheManager(SQLiteCacheBase):
 # Section: 高效檔案列舉 (修正版：智慧根目錄保護 + 剪枝優化 + 完整清理)
 # ======================================================================
 
-def _unified_scan_traversal(root_folder: str, excluded_paths: set, excluded_names: set, time_filter: dict, folder_cache: 'FolderStateCacheManager', progress_queue: Optional[Queue], control_events: Optional[dict], use_pruning: bool, time_mode: str, required_count: int, use_everything: bool = False, everything_exts: list = None) -> Tuple[Dict[str, Any], Set[str], Set[str], Optional[Dict[str, List[str]]]]:
+def _unified_scan_traversal(root_folder: str, excluded_paths: set, excluded_names: set, time_filter: dict, folder_cache: 'FolderStateCacheManager', progress_queue: Optional[Queue], control_events: Optional[dict], use_pruning: bool, time_mode: str, required_count: int, use_everything: bool = False, everything_exts: list = None, folder_states: Optional[Dict[str, dict]] = None) -> Tuple[Dict[str, Any], Set[str], Set[str], Optional[Dict[str, List[str]]]]:
     
     def _scan_newest_first_recursive(path: str, stats: Dict[str, int], is_root: bool = False) -> Generator[Tuple[str, float, float], None, None]:
         if control_events and control_events.get('cancel') and control_events['cancel'].is_set(): return
@@ -1379,16 +2858,18 @@ def _unified_scan_traversal(root_folder: str, excluded_paths: set, excluded_name
                 except OSError: pass
 
     live_folders, changed_or_new_folders = {}, set()
-    cached_states = folder_cache.cache.copy()
+    if folder_states is None:
+        folder_states = folder_cache.load_states()
+    unseen_folders = set(folder_states)
 
     for path_data in target_folders_iter:
         path_str, mtime, ctime = path_data
         norm_path = _norm_key(path_str)
-        cached_states.pop(norm_path, None)
+        unseen_folders.discard(norm_path)
         try:
             live_folders[norm_path] = {'mtime': mtime, 'ctime': ctime}
             
-            cached_entry = folder_cache.get_folder_state(norm_path)
+            cached_entry = folder_states.get(norm_path)
             
             is_changed = False
             if not cached_entry:
@@ -1409,7 +2890,7 @@ def _unified_scan_traversal(root_folder: str, excluded_paths: set, excluded_name
                 
         except OSError: continue
             
-    ghost_folders = set(cached_states.keys())
+    ghost_folders = unseen_folders
     
     scan_duration = time.perf_counter() - scan_start_time
     log_info(f"掃描判斷完成 (耗時 {scan_duration:.2f} 秒)。即時: {len(live_folders)}, 變更(含增量): {len(changed_or_new_folders)}, 幽靈: {len(ghost_folders)}")
@@ -1434,16 +2915,19 @@ def get_files_to_process(config_dict: Dict,
     required_count = scan_context['required_count']
     first_scan_extract = scan_context['first_scan_extract']
     excluded_paths, excluded_names = _resolve_excluded_folder_rules(config_dict)
+    # 變更判斷與新資料夾判斷共用同一份批次讀取的狀態
+    folder_states = folder_cache.load_states()
     
     live_folders, folders_to_scan_content, ghost_folders, everything_files_by_dir = _unified_scan_traversal(
         root_folder, excluded_paths, excluded_names, time_filter, folder_cache, 
         progress_queue, control_events, runtime_options['use_pruning'], runtime_options['time_mode'], 
         required_count,
         use_everything=runtime_options['use_everything_setting'],
-        everything_exts=list(image_exts) + list(supported_archive_exts)
+        everything_exts=list(image_exts) + list(supported_archive_exts),
+        folder_states=folder_states,
     )
 
-    new_folders = {f for f in live_folders if folder_cache.get_folder_state(f) is None}
+    new_folders = {f for f in live_folders if f not in folder_states}
     _expand_new_folders_into_scan_set(new_folders, folders_to_scan_content, time_filter, runtime_options['time_mode'])
 
     _apply_root_folder_protection(root_folder, folders_to_scan_content, image_exts)
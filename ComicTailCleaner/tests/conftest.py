@@ -0,0 +1,23 @@
+# ======================================================================
+# 檔案名稱：tests/conftest.py
+# 模組目的：測試共用設定 (匯入路徑) 與共用的合成圖片 fixture
+# ======================================================================
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL.Image")
+
+from synthetic import IMAGE_SIZES, noise_image, page_image  # noqa: E402
+
+
+@pytest.fixture(params=[(kind, size, seed) for kind in ("noise", "page") for size in IMAGE_SIZES for seed in (0, 1)],
+                ids=lambda p: f"{p[0]}-{p[1][0]}x{p[1][1]}-{p[2]}")
+def sample_image(request):
+    kind, size, seed = request.param
+    return (noise_image if kind == "noise" else page_image)(size, seed)
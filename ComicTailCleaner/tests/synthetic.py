@@ -0,0 +1,43 @@
+# ======================================================================
+# 檔案名稱：tests/synthetic.py
+# 模組目的：合成測試圖片產生器 (固定亂數種子，結果可重現)
+# ======================================================================
+
+import numpy as np
+from PIL import Image
+
+# 含無法被 4 整除的邊長 (Grid 餘數) 與小於 Grid 下限 (32px) 的尺寸
+IMAGE_SIZES = ((64, 64), (97, 131), (300, 200), (33, 47), (20, 28), (517, 733))
+
+
+def noise_image(size, seed: int, mode: str = "RGB") -> "Image.Image":
+    """逐像素隨機雜訊 (高頻紋理)。"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    arr = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    return Image.fromarray(arr, "RGB").convert(mode)
+
+
+def page_image(size, seed: int, mode: str = "RGB") -> "Image.Image":
+    """漸層底色加隨機色塊 (接近漫畫頁面的低頻內容)。"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = np.stack([xx * 255 // max(width - 1, 1), yy * 255 // max(height - 1, 1), (xx + yy) % 256], axis=-1)
+    arr = base.astype(np.uint8)
+    for _ in range(8):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x1, y1 = int(rng.integers(x0, width + 1)), int(rng.integers(y0, height + 1))
+        arr[y0:y1, x0:x1] = rng.integers(0, 256, size=3, dtype=np.uint8)
+    return Image.fromarray(arr, "RGB").convert(mode)
+
+
+
+def low_saturation_image(size, seed: int, mode: str = "RGB") -> "Image.Image":
+    """隨機灰階加上每通道 -3~3 的抖動 (近灰階、色相不穩定的低飽和內容)。"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    gray = rng.integers(0, 256, size=(height, width, 1), dtype=np.int16)
+    jitter = rng.integers(-3, 4, size=(height, width, 3), dtype=np.int16)
+    arr = np.clip(gray + jitter, 0, 255).astype(np.uint8)
+    return Image.fromarray(arr, "RGB").convert(mode)
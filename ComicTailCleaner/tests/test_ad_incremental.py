@@ -0,0 +1,122 @@
+# ======================================================================
+# 檔案名稱：tests/test_ad_incremental.py
+# 模組目的：廣告庫增量維護 (leader 分組、ad_hash_index 與記憶體索引) 與整份重建的結果相同
+# ======================================================================
+
+import os
+import random
+
+import pytest
+
+imagehash = pytest.importorskip("imagehash")
+scanner = pytest.importorskip("processors.scanner")
+core_engine = pytest.importorskip("core_engine")
+import config
+
+
+@pytest.fixture
+def ad_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path / "caches"))
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path / "data"))
+    os.makedirs(config.CACHE_DIR)
+    os.makedirs(config.DATA_DIR)
+    return tmp_path
+
+
+def hex_hash(value):
+    return imagehash.hex_to_hash(f"{value:016x}")
+
+
+class Catalog:
+    """群集內距離多落在分組半徑 (3) 附近的廣告庫，可隨機新增 / 移除 / 變更。"""
+
+    def __init__(self, seed, count=400):
+        self.rng = random.Random(seed)
+        self.centers = [self.rng.getrandbits(64) for _ in range(25)]
+        self.next_id = 0
+        self.data = {}
+        for _ in range(count):
+            self.add()
+
+    def _hash(self):
+        value = self.rng.choice(self.centers)
+        for b in self.rng.sample(range(64), self.rng.randint(0, 4)):
+            value ^= 1 << b
+        return value
+
+    def _entry(self):
+        if self.rng.random() < 0.02:
+            return {"phash": None}
+        entry = {"phash": hex_hash(self._hash())}
+        if self.rng.random() < 0.25:
+            entry["phash_rotations"] = {rot: hex_hash(self._hash()) for rot in ("90", "180", "270")}
+        return entry
+
+    def add(self):
+        # 路徑號碼隨機，使新增的廣告可能排在既有 leader 之前
+        path = f"/ads/{self.rng.getrandbits(24):08d}-{self.next_id}.png"
+        self.next_id += 1
+        self.data[path] = self._entry()
+
+    def mutate(self, steps):
+        for _ in range(steps):
+            roll = self.rng.random()
+            if roll < 0.35:
+                self.add()
+            elif roll < 0.7 and self.data:
+                del self.data[self.rng.choice(sorted(self.data))]
+            elif self.data:
+                self.data[self.rng.choice(sorted(self.data))] = self._entry()
+
+
+def bare_engine():
+    return object.__new__(core_engine.ImageComparisonEngine)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_incremental_grouping_matches_full_pass(ad_root, seed):
+    catalog = Catalog(seed)
+    cache = scanner.MasterAdCacheManager(str(ad_root / "ads"))
+    engine = bare_engine()
+    assert engine._group_ad_leaders(dict(catalog.data), cache) == engine._group_ad_leaders(dict(catalog.data), None)
+    for steps in (1, 1, 5, 30, 0, 120):
+        catalog.mutate(steps)
+        incremental = engine._group_ad_leaders(dict(catalog.data), cache)
+        full = bare_engine()._group_ad_leaders(dict(catalog.data), None)
+        assert incremental == full
+        # 儲存的分組與本輪結果一致，下一輪以此為基準
+        stored = cache.load_ad_groups(f"{core_engine.AD_GROUPING_THRESHOLD}:{core_engine.HASH_BITS}:mih")
+        assert {path: leader for path, (_, leader) in stored.items()} == full
+    cache.close()
+
+
+def index_state(cache):
+    rows = sorted(cache.conn.execute("SELECT hash_kind, band, bucket, path, variant FROM ad_hash_index").fetchall())
+    entries = sorted(cache.conn.execute("SELECT path, signature FROM ad_index_entries").fetchall())
+    meta = dict(cache.conn.execute("SELECT key, value FROM ad_index_meta WHERE key != 'group_params'").fetchall())
+    return rows, entries, meta
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_index_sync_matches_rebuild(ad_root, seed):
+    catalog = Catalog(seed, count=200)
+    synced = scanner.MasterAdCacheManager(str(ad_root / "synced"))
+    synced.sync_hash_index(dict(catalog.data), digest="d0")
+    rng = random.Random(seed)
+    for round_no, steps in enumerate((1, 10, 0, 60), start=1):
+        catalog.mutate(steps)
+        digest = f"d{round_no}"
+        synced.sync_hash_index(dict(catalog.data), digest=digest)
+        rebuilt = scanner.MasterAdCacheManager(str(ad_root / f"rebuilt{round_no}"))
+        rebuilt.rebuild_hash_index(dict(catalog.data), digest=digest)
+
+        assert index_state(synced) == index_state(rebuilt)
+        queries = [hex_hash(rng.getrandbits(64)) for _ in range(20)]
+        queries += [entry["phash"] for entry in catalog.data.values() if entry["phash"]][:100]
+        assert synced.query_hash_index_many(queries) == rebuilt.query_hash_index_many(queries)
+        # 套用差異後的記憶體索引與從 SQL 重新載入的結果相同
+        synced._lsh_index = None
+        os.remove(scanner.ad_lsh_path_for(synced.db_path))
+        assert synced.query_hash_index_many(queries) == rebuilt.query_hash_index_many(queries)
+        rebuilt.close()
+    synced.close()
@@ -0,0 +1,104 @@
+# ======================================================================
+# 檔案名稱：tests/test_ad_index.py
+# 模組目的：記憶體版廣告 LSH 索引 (單筆 / 批次) 與原本逐 band SQL 查詢的結果相同
+# ======================================================================
+
+import os
+import random
+
+import pytest
+
+imagehash = pytest.importorskip("imagehash")
+scanner = pytest.importorskip("processors.scanner")
+import config
+from processors.ad_lsh_index import ad_lsh_path_for
+
+
+@pytest.fixture
+def ad_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path / "caches"))
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path / "data"))
+    os.makedirs(config.CACHE_DIR)
+    os.makedirs(config.DATA_DIR)
+    return str(tmp_path / "ads")
+
+
+def hex_hash(value):
+    return imagehash.hex_to_hash(f"{value:016x}")
+
+
+def flip(value, rng, bits):
+    for b in rng.sample(range(64), bits):
+        value ^= 1 << b
+    return value
+
+
+def ad_catalog(count=300, seed=0):
+    """數個群集的廣告；部分帶旋轉變體，部分雜湊無效。"""
+    rng = random.Random(seed)
+    centers = [rng.getrandbits(64) for _ in range(20)]
+    catalog = {}
+    for i in range(count):
+        path = f"/ads/{i:04d}.png"
+        if i % 53 == 0:
+            catalog[path] = {"phash": None}
+            continue
+        entry = {"phash": hex_hash(flip(rng.choice(centers), rng, rng.randint(0, 12)))}
+        if i % 4 == 0:
+            entry["phash_rotations"] = {rot: hex_hash(rng.getrandbits(64)) for rot in ("90", "180", "270")}
+        catalog[path] = entry
+    return catalog, centers
+
+
+def query_hashes(centers, seed=1, count=200):
+    rng = random.Random(seed)
+    hashes = [hex_hash(flip(rng.choice(centers), rng, rng.randint(0, 20))) for _ in range(count)]
+    return hashes + [hex_hash(rng.getrandbits(64)) for _ in range(20)] + [None, "not-a-hash"]
+
+
+def sql_query(cache, phash_obj):
+    """原本的逐 band SQL 查詢 (不經記憶體索引)。"""
+    original = cache.load_hash_index
+    cache.load_hash_index = lambda *args, **kwargs: None
+    try:
+        return cache.query_hash_index(phash_obj)
+    finally:
+        cache.load_hash_index = original
+
+
+def test_in_memory_queries_match_sql(ad_root):
+    catalog, centers = ad_catalog()
+    cache = scanner.MasterAdCacheManager(ad_root)
+    cache.rebuild_hash_index(catalog, digest="d1")
+    queries = query_hashes(centers)
+
+    expected = [sql_query(cache, q) if q else set() for q in queries]
+    assert any(expected)
+    assert [cache.query_hash_index(q) if q else set() for q in queries] == expected
+    assert cache.query_hash_index_many(queries) == expected
+    cache.close()
+
+
+def test_pickled_index_is_reused_and_rebuilt_when_stale(ad_root):
+    catalog, centers = ad_catalog(seed=2)
+    cache = scanner.MasterAdCacheManager(ad_root)
+    cache.rebuild_hash_index(catalog, digest="d1")
+    queries = query_hashes(centers, seed=3)
+    expected = cache.query_hash_index_many(queries)
+    index_path = ad_lsh_path_for(cache.db_path)
+    assert os.path.exists(index_path)
+    cache.close()
+
+    reopened = scanner.MasterAdCacheManager(ad_root)
+    assert reopened.query_hash_index_many(queries) == expected
+    # 索引檔遺失或 digest 與 meta 不符時由 ad_hash_index 重建，結果不變
+    os.remove(index_path)
+    reopened._lsh_index = None
+    assert reopened.query_hash_index_many(queries) == expected
+    assert os.path.exists(index_path)
+    reopened.conn.execute("UPDATE ad_index_meta SET value = 'd2' WHERE key = 'catalog_digest'")
+    reopened.conn.commit()
+    index = reopened.load_hash_index()
+    assert index.digest == "d2"
+    assert reopened.query_hash_index_many(queries) == expected
+    reopened.close()
@@ -0,0 +1,118 @@
+# ======================================================================
+# 檔案名稱：tests/test_cache_blind_merge.py
+# 模組目的：盲寫合併 (UPSERT + json_set / json_remove) 與讀取合併後備路徑結果一致
+# ======================================================================
+
+import json
+import random
+
+import pytest
+
+scanner = pytest.importorskip("processors.scanner")
+
+PATHS = [f"/lib/vol{i % 3}/{i:03d}.jpg" for i in range(24)]
+
+
+class PlainTable(scanner.SQLiteCacheBase):
+    pass
+
+
+class ImageTable(scanner.SQLiteCacheBase):
+    TYPED_COLUMNS = True
+
+
+def random_patch(rng):
+    """涵蓋型別化欄位、獨立欄位、null、巢狀 dict、bytes 與含引號鍵的 patch。"""
+    choices = {
+        "phash": lambda: f"{rng.getrandbits(64):016x}",
+        "whash": lambda: rng.choice([None, f"{rng.getrandbits(64):016x}", "abc"]),
+        "avg_hsv": lambda: rng.choice([None, (rng.random() * 360, rng.random(), rng.random())]),
+        "grid_phash": lambda: rng.choice([None, [f"{rng.getrandbits(64):016x}" for _ in range(16)], ["short"]]),
+        "features_at": lambda: rng.randrange(1, 10),
+        "width": lambda: rng.randrange(1, 4000),
+        "height": lambda: rng.randrange(1, 4000),
+        "mtime": lambda: rng.random() * 1e9,
+        "phash_32": lambda: f"{rng.getrandbits(32):08x}",
+        "phash_512": lambda: bytes(rng.getrandbits(8) for _ in range(128)),
+        "qd64": lambda: rng.getrandbits(63),
+        "qr_points": lambda: rng.choice([None, [[1, 2], [3, 4]]]),
+        "meta": lambda: rng.choice([{"a": 1}, {"b": {"c": [1, 2]}}, {}]),
+        "label": lambda: rng.choice(["x", "雙語", ""]),
+        'odd"key': lambda: rng.randrange(100),
+    }
+    fields = rng.sample(sorted(choices), rng.randrange(1, 6))
+    return {field: choices[field]() for field in fields}
+
+
+def replay(cache, seed, steps=600):
+    rng = random.Random(seed)
+    cache.flush_threshold = 7
+    for _ in range(steps):
+        roll = rng.random()
+        path = rng.choice(PATHS)
+        if roll < 0.08:
+            cache.remove_data(path)
+        elif roll < 0.12:
+            cache.save_cache()
+        else:
+            cache.update_data(path, random_patch(rng))
+    cache.save_cache(durable=True)
+
+
+def snapshot(cache):
+    """
+    讀取結果與資料表內容；data JSON 以解析後的 dict 比較 (兩條路徑的鍵順序不同)。
+    有獨立欄位的鍵 (mtime 等) 讀取時以欄位為準：讀取合併會把欄位預設值帶回 JSON，因此只比較欄位本身。
+    """
+    read = cache.get_many(PATHS)
+    columns = [row[1] for row in cache.conn.execute(f"PRAGMA table_info({cache.table_name})")]
+    rows = {}
+    for row in cache.conn.execute(f"SELECT * FROM {cache.table_name}"):
+        record = dict(zip(columns, row))
+        data = json.loads(record["data"])
+        record["data"] = {k: v for k, v in data.items() if k not in scanner.BLIND_MERGE_COLUMNS}
+        rows[record.pop("path")] = record
+    return read, rows
+
+
+def run_both(cls, tmp_path, monkeypatch, seed):
+    blind = cls(str(tmp_path / "blind.db"), "images")
+    if not scanner._supports_blind_merge(blind.conn):
+        blind.close()
+        pytest.skip("SQLite 不支援 UPSERT/JSON1")
+    replay(blind, seed)
+    expected = snapshot(blind)
+    blind.close()
+
+    monkeypatch.setattr(scanner, "_supports_blind_merge", lambda conn: False)
+    fallback = cls(str(tmp_path / "fallback.db"), "images")
+    replay(fallback, seed)
+    actual = snapshot(fallback)
+    fallback.close()
+    return expected, actual
+
+
+@pytest.mark.parametrize("cls", [PlainTable, ImageTable], ids=["json", "typed"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_blind_merge_matches_read_merge(cls, seed, tmp_path, monkeypatch):
+    (blind_read, blind_rows), (merge_read, merge_rows) = run_both(cls, tmp_path, monkeypatch, seed)
+    assert blind_read == merge_read
+    assert blind_rows == merge_rows
+
+
+def test_update_keeps_dict_update_semantics(tmp_path):
+    cache = ImageTable(str(tmp_path / "semantics.db"), "images")
+    path = PATHS[0]
+    cache.update_data(path, {"qr_points": [[1, 2]], "meta": {"a": 1, "b": 2}, "phash": "00000000000000ff"})
+    cache.save_cache()
+    cache.update_data(path, {"qr_points": None, "meta": {"c": 3}})
+    cache.update_data(path, {"label": "x"})
+    # 未落盤的兩次 patch 疊加在已提交資料列之上
+    assert cache.get_data(path)["label"] == "x"
+    cache.save_cache()
+    data = cache.get_data(path)
+    cache.close()
+    assert "qr_points" in data and data["qr_points"] is None
+    assert data["meta"] == {"c": 3}
+    assert str(data["phash"]) == "00000000000000ff"
+    assert data["label"] == "x"
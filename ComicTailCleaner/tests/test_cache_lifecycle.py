@@ -0,0 +1,144 @@
+# ======================================================================
+# 檔案名稱：tests/test_cache_lifecycle.py
+# 模組目的：快取生命週期的淘汰規劃 (年齡 / 容量 / 筆數預算、低水位、保護期) 與 SQLite 淘汰 / 獨佔鎖定
+# ======================================================================
+
+import sqlite3
+import time
+
+import pytest
+
+from core.cache_lifecycle import DAY_SECONDS, LOW_WATERMARK, CacheLifecyclePolicy
+
+scanner = pytest.importorskip("processors.scanner")
+
+NOW = 1_000_000_000.0
+HOUR = 3600.0
+
+
+def units(*ages_and_rows):
+    """(距今秒數, 列數) → lifecycle_units() 格式，由舊到新。"""
+    return [(f"/lib/u{i}", NOW - age, rows) for i, (age, rows) in enumerate(ages_and_rows)]
+
+
+def test_defaults_never_evict():
+    policy = CacheLifecyclePolicy.from_config({})
+    assert policy.max_age_days == 0
+    old = units((1000 * DAY_SECONDS, 10), (500 * DAY_SECONDS, 10))
+    assert policy.plan_evictions(old, used_bytes=10 ** 9, now=NOW) == []
+
+
+def test_age_budget_evicts_only_expired_units():
+    policy = CacheLifecyclePolicy(max_age_days=30)
+    planned = units((90 * DAY_SECONDS, 5), (31 * DAY_SECONDS, 5), (29 * DAY_SECONDS, 5), (HOUR, 5))
+    assert policy.plan_evictions(planned, used_bytes=0, now=NOW) == ["/lib/u0", "/lib/u1"]
+
+
+def test_entry_budget_evicts_oldest_down_to_low_watermark():
+    policy = CacheLifecyclePolicy(max_entries=100, protect_hours=0)
+    planned = units(*[((20 - i) * DAY_SECONDS, 10) for i in range(15)])
+    victims = policy.plan_evictions(planned, used_bytes=0, now=NOW)
+    remaining = 150 - 10 * len(victims)
+    assert remaining <= 100 * LOW_WATERMARK
+    # 只淘汰到水位為止，且由最舊的開始
+    assert remaining + 10 > 100 * LOW_WATERMARK
+    assert victims == [unit for unit, _, _ in planned[:len(victims)]]
+
+
+def test_within_budget_evicts_nothing():
+    policy = CacheLifecyclePolicy(max_entries=100, max_size_mb=1)
+    planned = units(*[(DAY_SECONDS * 10, 10)] * 10)
+    assert policy.plan_evictions(planned, used_bytes=1024 * 1024, now=NOW) == []
+
+
+def test_size_budget_uses_average_row_size():
+    policy = CacheLifecyclePolicy(max_size_mb=1, protect_hours=0)
+    mb = 1024 * 1024
+    planned = units((3 * DAY_SECONDS, 50), (2 * DAY_SECONDS, 30), (DAY_SECONDS, 20))
+    # 100 列共 2 MB：降到 0.9 MB 以下需淘汰前兩個單位 (剩 20 列 = 0.4 MB)
+    assert policy.plan_evictions(planned, used_bytes=2 * mb, now=NOW) == ["/lib/u0", "/lib/u1"]
+
+
+def test_protect_window_is_never_evicted():
+    policy = CacheLifecyclePolicy(max_entries=10, max_age_days=0.5, protect_hours=24)
+    planned = units((3 * DAY_SECONDS, 10), (23 * HOUR, 10), (0, 10))
+    # 仍超出筆數預算且已逾年齡預算，但 24 小時內見過的單位 (含本輪) 保留
+    assert policy.plan_evictions(planned, used_bytes=0, now=NOW) == ["/lib/u0"]
+
+
+class FolderTable(scanner.SQLiteCacheBase):
+    LIFECYCLE_UNIT_COLUMN = "folder_path"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = FolderTable(str(tmp_path / "lifecycle.db"), "images")
+    for folder in ("a", "b", "c"):
+        for i in range(3):
+            cache.update_data(f"/lib/{folder}/{i}.jpg", {"phash": f"{i:016x}"})
+    cache.save_cache()
+    yield cache
+    cache.close()
+
+
+def folder(name):
+    return scanner._norm_key(f"/lib/{name}")
+
+
+def test_evict_units_deletes_rows_and_last_seen(cache):
+    cache.touch(["/lib/a/0.jpg", "/lib/b/0.jpg"])
+    deleted, evicted = cache.evict_units([folder("a")])
+    assert (deleted, evicted) == (3, [folder("a")])
+    assert cache.get_data("/lib/a/0.jpg") is None
+    assert cache.get_data("/lib/b/0.jpg") is not None
+    seen = {unit for unit, _, _ in cache.lifecycle_units()}
+    assert seen == {folder("b"), folder("c")}
+    assert cache.conn.execute("SELECT COUNT(*) FROM lifecycle_seen WHERE unit = ?", (folder("a"),)).fetchone()[0] == 0
+    # 淘汰後同一執行中再看見，須重新戳記
+    cache.update_data("/lib/a/0.jpg", {"phash": "00"})
+    assert cache.touch(["/lib/a/0.jpg"]) == 1
+
+
+def test_evict_units_stops_at_deadline(cache):
+    assert cache.evict_units([folder("a"), folder("b")], deadline=time.monotonic() - 1) == (0, [])
+    assert cache.get_data("/lib/a/0.jpg") is not None
+
+
+def test_lifecycle_run_orders_by_last_seen(cache):
+    cache.touch(["/lib/c/0.jpg"])
+    ordered = [unit for unit, _, _ in cache.lifecycle_units()]
+    assert ordered[-1] == folder("c")
+    stats = CacheLifecyclePolicy(max_entries=6, protect_hours=0).run(cache, now=time.time() + DAY_SECONDS)
+    assert stats["evicted_units"] == 2
+    assert {unit for unit, _, _ in cache.lifecycle_units()} == {folder("c")}
+
+
+def test_lock_sole_connection_refuses_while_another_connection_is_open(cache):
+    other = sqlite3.connect(cache.db_path, timeout=0)
+    other.execute("SELECT COUNT(*) FROM images").fetchall()
+    assert not cache._lock_sole_connection()
+    # 失敗後還原為 WAL，其他連線照常讀寫
+    assert cache.conn.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+    assert other.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 9
+    assert not cache.compact()
+    other.close()
+
+
+def test_lock_sole_connection_blocks_new_connections_until_released(cache):
+    cache._stop_writer()
+    assert cache._lock_sole_connection()
+    late = sqlite3.connect(cache.db_path, timeout=0)
+    with pytest.raises(sqlite3.OperationalError):
+        late.execute("SELECT COUNT(*) FROM images").fetchall()
+    cache._release_sole_connection()
+    assert cache.conn.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+    assert late.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 9
+    late.close()
+
+
+def test_compact_keeps_rows_when_sole_connection(cache):
+    before = cache.get_many([f"/lib/{f}/{i}.jpg" for f in "abc" for i in range(3)])
+    assert cache.compact()
+    after = cache.get_many([f"/lib/{f}/{i}.jpg" for f in "abc" for i in range(3)])
+    assert before == after
+    assert cache.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
@@ -0,0 +1,151 @@
+# ======================================================================
+# 檔案名稱：tests/test_cache_validation.py
+# 模組目的：快取驗證分級與信任分數結算
+# ======================================================================
+
+import os
+
+import pytest
+
+from core import cache_validation
+from core.cache_validation import (
+    DEFAULT_TRUST,
+    TRUST_PENALTY_FACTOR,
+    TRUST_REWARD_RATE,
+    CacheValidationPolicy,
+    trust_key,
+)
+
+FOLDER = os.path.join("lib", "series")
+PATH = os.path.join(FOLDER, "001.jpg")
+
+
+@pytest.fixture
+def digests(monkeypatch):
+    """以字典取代實際讀檔；未列出的路徑視為讀取失敗。"""
+    table = {}
+    calls = []
+
+    def fake_digest(path):
+        calls.append(path)
+        return table.get(path)
+
+    monkeypatch.setattr(cache_validation, "_calculate_quick_digest", fake_digest)
+    return table, calls
+
+
+def policy(tier="sampled", sample_rate=1.0, **kwargs):
+    return CacheValidationPolicy(tier=tier, sample_rate=sample_rate, run_salt="fixed", **kwargs)
+
+
+def test_size_mismatch_is_a_miss_on_every_tier(digests):
+    for tier in ("stat", "stat_inode", "sampled", "full"):
+        p = policy(tier)
+        assert p.validate(PATH, {"size": 100, "qd64": 1}, (101, None)) == (False, False)
+        assert p.stats["mismatches"] == 1
+    assert digests[1] == []
+
+
+def test_inode_mismatch_ignored_only_on_stat_tier(digests):
+    cached = {"size": 100, "inode": 7}
+    assert policy("stat").validate(PATH, cached, (100, 8)) == (True, False)
+    assert policy("stat_inode").validate(PATH, cached, (100, 8)) == (False, False)
+    # 盤點未取得 inode (例如 Windows) 時不以 inode 判定
+    assert policy("stat_inode").validate(PATH, cached, (100, None)) == (True, False)
+
+
+def test_digest_tiers_read_and_compare(digests):
+    table, calls = digests
+    table[PATH] = 42
+    assert policy("full").validate(PATH, {"qd64": 42}, None) == (True, False)
+    assert policy("full").validate(PATH, {"qd64": 41}, None) == (False, False)
+    assert policy("sampled", sample_rate=0.0).validate(PATH, {"qd64": 41}, None) == (True, False)
+    assert calls == [PATH, PATH]
+
+
+def test_missing_cached_digest_requests_upgrade(digests):
+    assert policy("full").validate(PATH, {}, None) == (True, True)
+    assert digests[1] == []
+
+
+def test_unreadable_file_is_a_miss_without_penalty(digests):
+    p = policy("full")
+    assert p.validate(PATH, {"qd64": 42}, None) == (False, False)
+    assert p.finish_run() == {}
+
+
+def test_mismatch_escalates_folder_to_full_within_run(digests):
+    table, calls = digests
+    other = os.path.join(FOLDER, "002.jpg")
+    table[PATH] = 1
+    table[other] = 2
+    p = policy("sampled", sample_rate=0.0)
+    # 抽驗率 0 時不讀檔；同資料夾出現尺寸不一致後改為 full
+    assert p.validate(other, {"qd64": 2}, None) == (True, False)
+    assert calls == []
+    p.validate(PATH, {"size": 1}, (2, None))
+    assert p.tier_for(trust_key(other)) == "full"
+    assert p.validate(other, {"qd64": 2}, None) == (True, False)
+    assert calls == [other]
+
+
+def test_finish_run_penalises_mismatch(digests):
+    table, _ = digests
+    table[PATH] = 1
+    p = policy("full", trust_store={FOLDER: (0.8, 5, 0, 0.0)})
+    p.validate(PATH, {"qd64": 2}, None)
+    changed = p.finish_run()
+    score, runs, mismatches, _ = changed[FOLDER]
+    assert score == pytest.approx(0.8 * TRUST_PENALTY_FACTOR)
+    assert (runs, mismatches) == (5, 1)
+    assert p.trust[FOLDER] == changed[FOLDER]
+
+
+def test_finish_run_rewards_clean_verification(digests):
+    table, _ = digests
+    table[PATH] = 1
+    p = policy("full")
+    p.validate(PATH, {"qd64": 1}, None)
+    score, runs, mismatches, _ = p.finish_run()[FOLDER]
+    assert score == pytest.approx(DEFAULT_TRUST + (1 - DEFAULT_TRUST) * TRUST_REWARD_RATE)
+    assert (runs, mismatches) == (1, 0)
+    # 結算後清空本輪紀錄，重複結算不再變動
+    assert p.finish_run() == {}
+
+
+def test_unverified_folders_keep_their_score(digests):
+    p = policy("stat", trust_store={FOLDER: (0.7, 3, 1, 0.0)})
+    p.validate(PATH, {}, (1, None))
+    assert p.finish_run() == {}
+    assert p.trust[FOLDER] == (0.7, 3, 1, 0.0)
+
+
+def test_low_trust_uses_full_and_high_trust_reduces_sampling():
+    low = policy("sampled", trust_store={FOLDER: (0.1, 0, 3, 0.0)})
+    assert low.tier_for(FOLDER) == "full"
+    no_digest = policy("sampled", use_quick_digest=False, trust_store={FOLDER: (0.1, 0, 3, 0.0)})
+    assert no_digest.tier_for(FOLDER) == "stat_inode"
+
+    paths = [os.path.join(FOLDER, f"{i:04d}.jpg") for i in range(4000)]
+    normal = policy("sampled", sample_rate=0.2)
+    trusted = policy("sampled", sample_rate=0.2, trust_store={FOLDER: (0.95, 10, 0, 0.0)})
+    normal_hits = sum(normal._is_sampled(p, FOLDER) for p in paths)
+    trusted_hits = sum(trusted._is_sampled(p, FOLDER) for p in paths)
+    assert normal_hits == pytest.approx(800, rel=0.15)
+    assert trusted_hits == pytest.approx(200, rel=0.3)
+
+
+def test_virtual_paths_share_the_archive_trust_key():
+    archive = os.path.join(FOLDER, "vol1.zip")
+    assert trust_key(f"zip://{archive}!a/001.jpg") == trust_key(f"zip://{archive}!b/002.jpg")
+
+
+def test_needs_inode_skips_extra_stat_on_windows(monkeypatch):
+    monkeypatch.setattr(cache_validation, "INODE_FROM_SCANDIR", False)
+    assert not policy("stat").needs_inode
+    assert not policy("sampled").needs_inode
+    assert not policy("full").needs_inode
+    assert policy("stat_inode").needs_inode
+    monkeypatch.setattr(cache_validation, "INODE_FROM_SCANDIR", True)
+    assert policy("sampled").needs_inode
+    assert not policy("stat").needs_inode
@@ -0,0 +1,68 @@
+# ======================================================================
+# 檔案名稱：tests/test_color_parity.py
+# 模組目的：向量化平均 HSV 與舊版 colorsys 逐像素實作 (utils._avg_hsv) 的數值一致性
+# ======================================================================
+
+import colorsys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+features = pytest.importorskip("core.features")
+
+import utils
+from synthetic import IMAGE_SIZES, low_saturation_image
+
+# float32 向量化與 colorsys (float64) 的累積誤差實測約 2e-5 度 / 1e-7，留十倍以上餘裕
+HUE_TOL_DEG = 5e-4
+SV_TOL = 1e-5
+
+
+def colorsys_avg_hsv(img):
+    """舊版 utils._avg_hsv：32x32 縮圖後逐像素呼叫 colorsys.rgb_to_hsv 再取平均。"""
+    small = img.convert("RGB").resize((32, 32), Image.Resampling.BILINEAR)
+    arr = np.asarray(small, dtype=np.float32) / 255.0
+    hsv = np.apply_along_axis(lambda p: colorsys.rgb_to_hsv(p[0], p[1], p[2]), 2, arr)
+    return float(np.mean(hsv[..., 0]) * 360.0), float(np.mean(hsv[..., 1])), float(np.mean(hsv[..., 2]))
+
+
+def assert_hsv_close(actual, expected):
+    assert actual is not None
+    assert actual[0] == pytest.approx(expected[0], abs=HUE_TOL_DEG)
+    assert actual[1] == pytest.approx(expected[1], abs=SV_TOL)
+    assert actual[2] == pytest.approx(expected[2], abs=SV_TOL)
+
+
+def test_avg_hsv_matches_colorsys(sample_image):
+    expected = colorsys_avg_hsv(sample_image)
+    assert_hsv_close(features.compute_color_features(sample_image, with_colorful=False)["avg_hsv"], expected)
+    assert_hsv_close(utils._avg_hsv(sample_image), expected)
+
+
+@pytest.mark.parametrize("size", IMAGE_SIZES, ids=lambda s: f"{s[0]}x{s[1]}")
+@pytest.mark.parametrize("seed", range(3))
+def test_avg_hsv_matches_colorsys_low_saturation(size, seed):
+    img = low_saturation_image(size, seed)
+    assert_hsv_close(utils._avg_hsv(img), colorsys_avg_hsv(img))
+
+
+@pytest.mark.parametrize("mode", ["L", "RGBA", "P", "CMYK"])
+def test_avg_hsv_matches_colorsys_other_modes(mode):
+    img = low_saturation_image((97, 131), 0, mode=mode)
+    assert_hsv_close(utils._avg_hsv(img), colorsys_avg_hsv(img))
+
+
+def test_gray_image_has_zero_hue_and_saturation():
+    img = Image.new("RGB", (40, 40), (128, 128, 128))
+    h, s, v = utils._avg_hsv(img)
+    assert (h, s) == (0.0, 0.0)
+    assert v == pytest.approx(128 / 255, abs=SV_TOL)
+
+
+def test_batch_mean_matches_single_image():
+    images = [low_saturation_image(size, 0) for size in IMAGE_SIZES]
+    thumbs = np.stack([features.hsv_thumbnail(img) for img in images])
+    batch = features.mean_hsv_batch(thumbs)
+    for row, img in zip(batch, images):
+        assert tuple(row) == pytest.approx(utils._avg_hsv(img), abs=1e-9)
@@ -0,0 +1,160 @@
+# ======================================================================
+# 檔案名稱：tests/test_content_store.py
+# 模組目的：全域內容特徵庫依選項簽章分開存放，並以路徑對照表跨根目錄重用而不讀取圖片
+# ======================================================================
+
+import os
+
+import pytest
+
+pytest.importorskip("imagehash")
+scanner = pytest.importorskip("processors.scanner")
+core_engine = pytest.importorskip("core_engine")
+from core import cache_flow
+from core.features import PHASH_VERSION_KEY, phash_feature_version
+
+PHASH = "00ff00ff00ff00ff"
+FEATURES = {"phash": PHASH, PHASH_VERSION_KEY: phash_feature_version(), "width": 800, "height": 1200}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = scanner.ContentFeatureStore(str(tmp_path / "content.db"))
+    yield store
+    store.close()
+
+
+def ident(path, size=1000, mtime=5.0, inode=None):
+    return scanner.file_ident(path, size, mtime, inode)
+
+
+def test_same_path_with_unchanged_ident_hits_after_flush(store):
+    path = "/lib/a/001.jpg"
+    store.publish(1000, "77", FEATURES, "sig", path=path, ident=ident(path))
+    # 尚未落盤時由待寫入對照命中
+    assert store.lookup_content_keys({path: ident(path)}) == {path: "1000:77"}
+    store.save_cache()
+    assert store.lookup_content_keys({path: ident(path)}) == {path: "1000:77"}
+    # 檔案變更 (mtime 不同) 即未命中
+    assert store.lookup_content_keys({path: ident(path, mtime=6.0)}) == {}
+
+
+def test_renamed_file_hits_by_inode_only_when_movable(store):
+    old, new = "/lib/a/001.jpg", "/lib/b/renamed.jpg"
+    store.publish(1000, "77", FEATURES, "sig", path=old, ident=ident(old, inode=42))
+    store.save_cache()
+    moved = {new: ident(new, inode=42)}
+    assert store.lookup_content_keys(moved, movable={new}) == {new: "1000:77"}
+    assert store.lookup_content_keys(moved) == {}
+    assert store.lookup_content_keys({new: ident(new, inode=43)}, movable={new}) == {}
+
+
+def test_virtual_ident_includes_member_path():
+    archive = "/lib/vol1.zip"
+    a = scanner.file_ident(f"zip://{archive}!p/001.jpg", 10, 1.0, 3)
+    b = scanner.file_ident(f"zip://{archive}!p/002.jpg", 10, 1.0, 3)
+    assert a != b
+    assert scanner.file_ident("/lib/a.jpg", 10, None, 3) is None
+
+
+def test_option_signatures_are_kept_apart(store):
+    store.publish(1000, "77", dict(FEATURES, phash="1111111111111111"), "v1-p0-r128-o0")
+    store.publish(1000, "77", dict(FEATURES, phash="2222222222222222"), "v1-p1-r128-o0")
+    store.save_cache()
+    plain = store.get_data(store.store_key("1000:77", "v1-p0-r128-o0"))
+    preprocessed = store.get_data(store.store_key("1000:77", "v1-p1-r128-o0"))
+    assert str(plain["phash"]) == "1111111111111111"
+    assert str(preprocessed["phash"]) == "2222222222222222"
+    assert store.get_data(store.store_key("1000:77", "v1-p0-r256-o0")) is None
+
+
+def test_evicting_last_signature_drops_path_rows(store):
+    path = "/lib/a/001.jpg"
+    store.publish(1000, "77", FEATURES, "s1", path=path, ident=ident(path))
+    store.publish(1000, "77", FEATURES, "s2")
+    store.save_cache()
+    store.evict_units([store.store_key("1000:77", "s1")])
+    assert store.lookup_content_keys({path: ident(path)}) == {path: "1000:77"}
+    store.evict_units([store.store_key("1000:77", "s2")])
+    assert store.lookup_content_keys({path: ident(path)}) == {}
+
+
+class RecordingCache:
+    def __init__(self):
+        self.updates = {}
+
+    def update_data(self, path, data):
+        self.updates.setdefault(path, {}).update(data)
+
+
+def engine_with(store, paths, inode=None, **config):
+    engine = object.__new__(core_engine.ImageComparisonEngine)
+    engine.config = {"enable_content_feature_store": True, **config}
+    engine.content_store = store
+    engine.completed_task_count = 0
+    engine.file_identity_map = {path: (os.path.getsize(path), inode) for path in paths}
+    return engine
+
+
+@pytest.fixture
+def no_main_thread_digest(monkeypatch):
+    def forbidden(path):
+        raise AssertionError(f"重用查詢不應讀取檔案: {path}")
+    monkeypatch.setattr(cache_flow, "_calculate_quick_digest", forbidden)
+
+
+def scan_root(engine, paths):
+    mtimes = {path: os.stat(path).st_mtime for path in paths}
+    cache, local = RecordingCache(), {}
+    remaining, _, reused = engine._reuse_content_features(list(paths), cache, local, "phash", "global", 0, mtimes)
+    return remaining, reused, cache
+
+
+def publish_from(engine, path):
+    data = dict(FEATURES, mtime=os.stat(path).st_mtime, size=os.path.getsize(path), qd64="77")
+    engine._publish_content_features(path, data, None)
+
+
+def test_engine_reuses_features_across_roots_without_reading(tmp_path, store, no_main_thread_digest):
+    image = tmp_path / "001.jpg"
+    image.write_bytes(b"x" * 64)
+    path = str(image)
+    first = engine_with(store, [path])
+    publish_from(first, path)
+    store.save_cache()
+
+    # 另一個根目錄 (另一個引擎、另一份圖片快取) 掃到同一檔案
+    second = engine_with(store, [path])
+    remaining, reused, cache = scan_root(second, [path])
+    assert (remaining, reused) == ([], 1)
+    assert str(cache.updates[path]["phash"]) == PHASH
+    assert cache.updates[path]["qd64"] == "77"
+
+
+def test_engine_keeps_option_variants_apart(tmp_path, store, no_main_thread_digest):
+    image = tmp_path / "001.jpg"
+    image.write_bytes(b"x" * 64)
+    path = str(image)
+    publish_from(engine_with(store, [path], enable_image_preprocess=True), path)
+    store.save_cache()
+
+    for config in ({}, {"hash_resolution": 256}, {"enable_rotation_matching": True}):
+        remaining, reused, _ = scan_root(engine_with(store, [path], **config), [path])
+        assert (remaining, reused) == ([path], 0), config
+    remaining, reused, _ = scan_root(engine_with(store, [path], enable_image_preprocess=True), [path])
+    assert (remaining, reused) == ([], 1)
+
+
+def test_engine_reuses_moved_file_by_inode(tmp_path, store, no_main_thread_digest):
+    old = tmp_path / "a" / "001.jpg"
+    old.parent.mkdir()
+    old.write_bytes(b"x" * 64)
+    inode = os.stat(old).st_ino
+    publish_from(engine_with(store, [str(old)], inode=inode), str(old))
+    store.save_cache()
+
+    new = tmp_path / "b" / "renamed.jpg"
+    new.parent.mkdir()
+    os.replace(old, new)
+    assert scan_root(engine_with(store, [str(new)]), [str(new)])[:2] == ([str(new)], 0)
+    assert scan_root(engine_with(store, [str(new)], inode=inode), [str(new)])[:2] == ([], 1)
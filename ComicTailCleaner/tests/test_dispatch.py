@@ -0,0 +1,133 @@
+# ======================================================================
+# 檔案名稱：tests/test_dispatch.py
+# 模組目的：串流派發器的塊大小自適應、暫停與取消
+# ======================================================================
+
+import pytest
+
+from core import dispatch
+from core.dispatch import StreamingDispatcher
+
+
+def square(x):
+    if x < 0:
+        raise ValueError(f"negative: {x}")
+    return x * x
+
+
+class InlinePool:
+    """同步執行分塊的假進程池；以固定的單張延遲回報耗時，使塊大小的調整可預期。"""
+
+    def __init__(self, item_latency=0.01, fail_chunks=()):
+        self.item_latency = item_latency
+        self.fail_chunks = set(fail_chunks)
+        self.chunk_sizes = []
+
+    def apply_async(self, fn, args, callback, error_callback):
+        worker_function, payloads, io_gates = args
+        self.chunk_sizes.append(len(payloads))
+        if len(self.chunk_sizes) - 1 in self.fail_chunks:
+            error_callback(RuntimeError("worker died"))
+            return
+        outcomes, _, io_report = fn(worker_function, payloads, io_gates)
+        callback((outcomes, self.item_latency * len(payloads), io_report))
+
+
+def jobs(count):
+    return [(f"k{i}", (i,)) for i in range(count)]
+
+
+def run(dispatcher):
+    return [item for batch in dispatcher.iter_batches(poll_interval=0.001) for item in batch]
+
+
+def test_every_job_is_returned_once_with_per_item_errors():
+    work = jobs(50) + [("bad", (-1,))]
+    results = run(StreamingDispatcher(InlinePool(), square, work, pool_size=2))
+    assert sorted(key for key, _, _ in results) == sorted(key for key, _ in work)
+    by_key = {key: (ok, value) for key, ok, value in results}
+    assert by_key["k7"] == (True, 49)
+    assert by_key["bad"][0] is False and "negative" in by_key["bad"][1]
+
+
+def test_pool_error_fails_only_that_chunk():
+    pool = InlinePool(fail_chunks={0})
+    results = run(StreamingDispatcher(pool, square, jobs(20), pool_size=2))
+    failed = [key for key, ok, _ in results if not ok]
+    assert failed == ["k0"]
+    assert len(results) == 20
+
+
+def test_chunk_size_adapts_to_measured_latency():
+    # 先送單張探測；單張 10ms、目標 0.5s 時塊大小收斂到 50 (上限 64)
+    pool = InlinePool(item_latency=0.01)
+    dispatcher = StreamingDispatcher(pool, square, jobs(2000), pool_size=2, target_chunk_seconds=0.5)
+    run(dispatcher)
+    assert pool.chunk_sizes[0] == 1
+    assert max(pool.chunk_sizes) == 50
+    assert dispatcher.item_latency == pytest.approx(0.01)
+
+    # 慢圖 (每張 1s) 維持單張一塊
+    slow = InlinePool(item_latency=1.0)
+    run(StreamingDispatcher(slow, square, jobs(30), pool_size=2, target_chunk_seconds=0.5))
+    assert set(slow.chunk_sizes) == {1}
+
+    # 快圖受 max_chunk 限制
+    fast = InlinePool(item_latency=1e-5)
+    run(StreamingDispatcher(fast, square, jobs(2000), pool_size=2, max_chunk=64))
+    assert max(fast.chunk_sizes) == 64
+
+
+def test_tail_chunks_shrink_to_fair_share():
+    pool = InlinePool(item_latency=0.001)
+    dispatcher = StreamingDispatcher(pool, square, jobs(300), pool_size=4, target_chunk_seconds=0.5, max_chunk=64)
+    run(dispatcher)
+    # 剩餘工作不足以填滿所有在途名額時，塊大小不超過平均分攤量
+    remaining = 300
+    for size in pool.chunk_sizes:
+        assert size <= max(1, -(-remaining // dispatcher.max_in_flight))
+        remaining -= size
+    assert remaining == 0
+
+
+def test_pause_stops_new_chunks_but_collects_in_flight():
+    pool = InlinePool()
+    states = iter(["continue"] + ["pause"] * 10)
+    submitted_while_paused = []
+
+    def control():
+        state = next(states, "continue")
+        if state == "pause":
+            submitted_while_paused.append(len(pool.chunk_sizes))
+        return state
+
+    dispatcher = StreamingDispatcher(pool, square, jobs(100), pool_size=2, control=control)
+    results = run(dispatcher)
+    first_window = dispatcher.max_in_flight
+    # 暫停期間只收回已在途的塊，送出數維持在第一輪的窗口
+    assert set(submitted_while_paused) == {first_window}
+    assert len(results) == 100
+    assert not dispatcher.cancelled
+
+
+def test_cancel_stops_iteration():
+    pool = InlinePool()
+    calls = []
+
+    def control():
+        calls.append(1)
+        return "cancel" if len(calls) > 2 else "continue"
+
+    dispatcher = StreamingDispatcher(pool, square, jobs(500), pool_size=2, control=control)
+    results = run(dispatcher)
+    assert dispatcher.cancelled
+    assert len(results) < 500
+    assert sum(pool.chunk_sizes) < 500
+
+
+def test_run_worker_chunk_reports_outcomes_in_order(monkeypatch):
+    monkeypatch.setattr(dispatch, "install_io_gates", lambda gates: None)
+    outcomes, elapsed, _ = dispatch._run_worker_chunk(square, [(2,), (-1,), (3,)])
+    assert [ok for ok, _ in outcomes] == [True, False, True]
+    assert [value for ok, value in outcomes if ok] == [4, 9]
+    assert elapsed >= 0
@@ -0,0 +1,57 @@
+# ======================================================================
+# 檔案名稱：tests/test_draft_dimensions.py
+# 模組目的：JPEG draft 縮放解碼後換算回的 width/height 必須與完整解碼 (含 EXIF 轉正與白邊裁切) 一致
+# ======================================================================
+
+import pytest
+from PIL import Image
+
+from processors import qr_engine
+from synthetic import noise_image
+from utils import _open_image_from_any_path
+
+DRAFT_SIDE = 64
+# 寬高除以 DCT 縮放倍數後的進位量不同 (例如 1001x603 在 1/8 時為 126x76)，單一比例會把其中一軸算錯
+ODD_SIZES = ((1001, 603), (603, 1001), (999, 999), (517, 733), (1024, 768))
+
+
+def write_jpeg(path, image, orientation=None):
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[qr_engine._EXIF_ORIENTATION_TAG] = orientation
+    image.save(path, "JPEG", quality=90, exif=exif.tobytes())
+    return str(path)
+
+
+def measured_dimensions(path, use_preprocess):
+    draft = _open_image_from_any_path(path, draft_size=DRAFT_SIDE)
+    assert draft.info.get("draft_source_size")
+    draft_dims = qr_engine._source_dimensions(draft, qr_engine._prepare_phash_image(draft, use_preprocess))
+    full = qr_engine._prepare_phash_image(_open_image_from_any_path(path), use_preprocess)
+    return draft_dims, full.size
+
+
+@pytest.mark.parametrize("use_preprocess", [False, True], ids=["plain", "preprocess"])
+@pytest.mark.parametrize("orientation", [None, 3, 6, 8])
+@pytest.mark.parametrize("size", ODD_SIZES, ids=lambda s: f"{s[0]}x{s[1]}")
+def test_draft_dimensions_match_full_decode(tmp_path, size, orientation, use_preprocess):
+    # 無白邊的雜訊圖不會被裁切，前處理只可能轉為直向；換算結果必須與完整解碼完全相同
+    path = write_jpeg(tmp_path / "page.jpg", noise_image(size, 0), orientation)
+    draft_dims, full_dims = measured_dimensions(path, use_preprocess)
+    assert draft_dims == full_dims
+
+
+@pytest.mark.parametrize("orientation", [None, 6])
+def test_draft_dimensions_after_white_border_crop(tmp_path, orientation):
+    # 白邊裁切在 draft 圖上只能對齊到縮放倍數的格線，換算結果允許一個縮放倍數 (8px) 的誤差
+    canvas = Image.new("RGB", (1001, 603), (255, 255, 255))
+    canvas.paste(noise_image((801, 403), 0), (100, 100))
+    path = write_jpeg(tmp_path / "bordered.jpg", canvas, orientation)
+    draft_dims, full_dims = measured_dimensions(path, use_preprocess=True)
+    assert abs(draft_dims[0] - full_dims[0]) <= 8
+    assert abs(draft_dims[1] - full_dims[1]) <= 8
+
+
+def test_non_draft_image_keeps_own_size():
+    img = noise_image((97, 131), 0)
+    assert qr_engine._source_dimensions(img, img) == (97, 131)
@@ -0,0 +1,79 @@
+# ======================================================================
+# 檔案名稱：tests/test_hamming_index.py
+# 模組目的：多索引雜湊與線性掃描在實際使用的半徑 (3 / 19 / 38) 下與暴力比對結果完全相同
+# ======================================================================
+
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from core import hamming_index
+from core.hamming_index import HammingIndex, radius_for_similarity
+
+# 0.95 (廣告分群 / Grid 區塊)、0.70 (預設相似度)、0.40 (Grid 補救的 pHash 下限)
+RADII = (3, 19, 38)
+WIDTHS = (None, 4, 8, 16)
+
+
+def clustered(count, radius, seed):
+    """中心加上 0..2r 個翻轉位元，使半徑邊界兩側都有足夠的鄰居；另混入無效的 0。"""
+    rng = random.Random(seed)
+    centers = [rng.getrandbits(64) for _ in range(max(1, count // 20))]
+    values = []
+    for i in range(count):
+        v = rng.choice(centers)
+        for b in rng.sample(range(64), rng.randint(0, min(64, 2 * radius))):
+            v ^= 1 << b
+        values.append(0 if i % 97 == 0 else v)
+    queries = [values[i] for i in rng.sample(range(count), 20)] + [rng.getrandbits(64) for _ in range(5)]
+    return values, [q for q in queries if q]
+
+
+def brute(values, q, radius):
+    return [i for i, v in enumerate(values) if v and bin(v ^ q).count("1") <= radius]
+
+
+@pytest.mark.parametrize("radius", RADII)
+@pytest.mark.parametrize("width", WIDTHS + ("auto",))
+def test_numpy_index_matches_brute_force(radius, width):
+    if width == 16 and radius == 38:
+        width = 8  # 16 位元子字串在 r = 38 時每表約 5 萬個探測桶，仍精確但過慢
+    values, queries = clustered(3000, radius, seed=radius)
+    index = HammingIndex(values, radius, width=width)
+    for q in queries:
+        assert index.query_ids(q) == brute(values, q, radius)
+    # 較小的查詢半徑與多雜湊聯集 (旋轉變體)
+    small = max(0, radius // 2)
+    assert index.query_ids(queries[0], radius=small) == brute(values, queries[0], small)
+    union = sorted(set(brute(values, queries[0], radius)) | set(brute(values, queries[1], radius)))
+    assert index.query_ids(queries[:2]) == union
+
+
+@pytest.mark.parametrize("radius", RADII)
+@pytest.mark.parametrize("width", (None, 4, 8))
+def test_pure_python_index_matches_brute_force(radius, width, monkeypatch):
+    monkeypatch.setattr(hamming_index, "np", None)
+    values, queries = clustered(800, radius, seed=radius + 1)
+    index = HammingIndex(values, radius, width=width)
+    for q in queries:
+        assert index.query_ids(q) == brute(values, q, radius)
+
+
+def test_uint64_array_input_and_keys():
+    values, queries = clustered(500, 19, seed=7)
+    keys = [f"/lib/{i:04d}.jpg" for i in range(len(values))]
+    index = HammingIndex(np.array(values, dtype=np.uint64), 19, keys=keys)
+    q = queries[0]
+    expected = {keys[i] for i in brute(values, q, 19)}
+    assert index.query_keys(q) == expected
+    assert index.query_keys(q, exclude=keys[values.index(q)]) == expected - {keys[values.index(q)]}
+    assert len(index) == sum(1 for v in values if v)
+
+
+def test_auto_width_falls_back_to_linear_scan_for_wide_radii():
+    # 70% / 40% 門檻的半徑下多索引沒有優勢，自動選擇線性掃描 (同樣精確)
+    for radius in (19, 38):
+        assert hamming_index.choose_width(100000, radius) is None
+    assert radius_for_similarity(0.70) == 19
+    assert radius_for_similarity(0.95) == 3
@@ -0,0 +1,128 @@
+# ======================================================================
+# 檔案名稱：tests/test_hamming_pairs.py
+# 模組目的：分塊全配對核心 (含旋轉變體與 Grid 補救) 與逐對暴力比對結果相同，且不受 tile / 執行緒數 / popcount 後端影響
+# ======================================================================
+
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from core import popcount as popcount_mod
+from core.hamming_index import GRID_BLOCK_RADIUS, GRID_MIN_BLOCKS
+from core.hamming_pairs import pairs_within
+
+RADIUS, RESCUE_RADIUS = 19, 38
+
+
+def dist(a, b):
+    return bin(int(a) ^ int(b)).count("1")
+
+
+def clustered(n, seed, spread):
+    rng = random.Random(seed)
+    centers = [rng.getrandbits(64) for _ in range(max(1, n // 10))]
+    values = []
+    for i in range(n):
+        v = rng.choice(centers)
+        for b in rng.sample(range(64), rng.randint(0, spread)):
+            v ^= 1 << b
+        values.append(0 if i % 29 == 0 else v or 1)
+    return np.array(values, dtype=np.uint64)
+
+
+def grids_for(n, seed):
+    """同群集的 Grid 區塊相近；部分區塊為 0 (無效)。"""
+    rng = random.Random(seed)
+    centers = [[rng.getrandbits(64) for _ in range(16)] for _ in range(max(1, n // 8))]
+    grids = []
+    for i in range(n):
+        base = rng.choice(centers)
+        cells = []
+        for b, cell in enumerate(base):
+            for bit in rng.sample(range(64), rng.randint(0, 4)):
+                cell ^= 1 << bit
+            cells.append(0 if (i + b) % 11 == 0 else cell)
+        grids.append(cells)
+    return np.array(grids, dtype=np.uint64)
+
+
+def grid_match(row_variants, col):
+    for row in row_variants:
+        blocks = sum(1 for a, b in zip(row, col) if a and b and dist(a, b) <= GRID_BLOCK_RADIUS)
+        if blocks >= GRID_MIN_BLOCKS:
+            return True
+    return False
+
+
+def brute(rows, cols, upper, row_grids=None, col_grids=None):
+    """{(i, j): (距離, 是否補救)}；rows 為 (n, k)，取各變體最小距離。"""
+    expected = {}
+    for i, variants in enumerate(rows.tolist()):
+        if not variants[0]:
+            continue
+        for j, c in enumerate(cols.tolist()):
+            if not c or (upper and j <= i):
+                continue
+            d = min(dist(v, c) for v in variants)
+            if d <= RADIUS:
+                expected[(i, j)] = (d, False)
+            elif row_grids is not None and d <= RESCUE_RADIUS and grid_match(row_grids[i].tolist(), col_grids[j].tolist()):
+                expected[(i, j)] = (d, True)
+    return expected
+
+
+def as_dict(result):
+    ii, jj, dd, rescued = result
+    assert len(set(zip(ii.tolist(), jj.tolist()))) == len(ii), "配對重複輸出"
+    return {(i, j): (d, r) for i, j, d, r in zip(ii.tolist(), jj.tolist(), dd.tolist(), rescued.tolist())}
+
+
+@pytest.fixture(params=popcount_mod.available_backends())
+def backend(request, monkeypatch):
+    monkeypatch.setattr(popcount_mod, "BACKEND", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("tile_size,workers", [(7, 1), (32, 3), (1024, 2)])
+def test_upper_triangle_matches_brute_force(backend, tile_size, workers):
+    values = clustered(150, seed=0, spread=24)
+    expected = brute(values[:, np.newaxis], values, upper=True)
+    assert len(expected) > 50
+    assert as_dict(pairs_within(values, values, RADIUS, upper=True, tile_size=tile_size, workers=workers)) == expected
+
+
+@pytest.mark.parametrize("tile_size", [5, 64])
+def test_rotation_variants_take_minimum_distance(backend, tile_size):
+    rng = np.random.default_rng(1)
+    cols = clustered(90, seed=1, spread=24)
+    base = clustered(70, seed=2, spread=24)
+    # 其他變體取自欄的雜湊加上雜訊，部分與基準相同 (略過重算的路徑)
+    variants = cols[rng.integers(0, len(cols), size=(70, 3))] ^ (np.uint64(1) << rng.integers(0, 64, size=(70, 3)).astype(np.uint64))
+    variants[::4] = base[::4, np.newaxis]
+    rows = np.concatenate([base[:, np.newaxis], variants], axis=1)
+    expected = brute(rows, cols, upper=False)
+    assert as_dict(pairs_within(rows, cols, RADIUS, tile_size=tile_size, workers=2)) == expected
+
+
+@pytest.mark.parametrize("tile_size", [6, 128])
+def test_grid_rescue_matches_brute_force(backend, tile_size):
+    n = 110
+    values = clustered(n, seed=3, spread=40)
+    grids = grids_for(n, seed=4)
+    row_grids = grids[:, np.newaxis, :]
+    expected = brute(values[:, np.newaxis], values, upper=True, row_grids=row_grids, col_grids=grids)
+    assert any(rescued for _, rescued in expected.values())
+    result = pairs_within(
+        values, values, RADIUS, rescue_radius=RESCUE_RADIUS, row_grids=row_grids, col_grids=grids,
+        upper=True, tile_size=tile_size, workers=2,
+    )
+    assert as_dict(result) == expected
+
+
+def test_should_stop_skips_remaining_tiles():
+    values = clustered(200, seed=5, spread=10)
+    ii, _, _, _ = pairs_within(values, values, RADIUS, upper=True, tile_size=16, workers=1, should_stop=lambda: True)
+    assert len(ii) == 0
+    with pytest.raises(ValueError):
+        pairs_within(values, values[:10], RADIUS, upper=True)
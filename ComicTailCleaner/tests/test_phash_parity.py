@@ -0,0 +1,112 @@
+# ======================================================================
+# 檔案名稱：tests/test_phash_parity.py
+# 模組目的：融合 pHash 核心 (單次縮圖) 與 imagehash.phash 的逐位元一致性，以及相對舊版逐次縮圖定義的位元差預算
+# ======================================================================
+
+import numpy as np
+import pytest
+
+imagehash = pytest.importorskip("imagehash")
+features = pytest.importorskip("core.features")
+if not features.fused_kernel_available():
+    pytest.skip("融合核心需要 numpy / Pillow / scipy", allow_module_level=True)
+
+from PIL import Image
+
+from processors import qr_engine
+from synthetic import IMAGE_SIZES, noise_image, page_image
+
+# 舊版 (特徵版本 1) 每個尺寸都由原圖直接縮圖；版本 2 由 128px 共用縮圖再取樣，頁面類圖片實測 64-bit ≤ 2、256-bit ≤ 4 位元
+LEGACY_PHASH64_BUDGET = 4
+LEGACY_PHASH256_BUDGET = 8
+
+
+def imagehash_grid(image):
+    """舊版 _get_4x4_grid_hashes (特徵版本 1)：原圖切 4x4 格後各自呼叫 imagehash.phash。"""
+    width, height = image.size
+    if width < 32 or height < 32:
+        return []
+    bw, bh = width // 4, height // 4
+    return [
+        str(imagehash.phash(image.crop((col * bw, row * bh, (col + 1) * bw, (row + 1) * bh)), hash_size=8))
+        for row in range(4)
+        for col in range(4)
+    ]
+
+
+def shared_base(image):
+    return image.convert("L").resize((features.HASH_REQUIRED_SIDE,) * 2, Image.Resampling.LANCZOS)
+
+
+def reference_features(image):
+    """版本 2 的定義：imagehash.phash 作用在 128px 共用縮圖上，Grid 為該縮圖的 32px 格子 (同尺寸時 imagehash 不再取樣)。"""
+    base = shared_base(image)
+    grid = []
+    if min(image.size) >= features.GRID_MIN_SIDE:
+        grid = [str(imagehash.phash(base.crop((col * 32, row * 32, (col + 1) * 32, (row + 1) * 32)), hash_size=8))
+                for row in range(4) for col in range(4)]
+    return {
+        "phash": str(imagehash.phash(base, hash_size=8)),
+        "phash_128": imagehash.phash(base, hash_size=16).hash.tobytes(),
+        "phash_512": imagehash.phash(base, hash_size=32).hash.tobytes(),
+        "grid_phash": grid,
+    }
+
+
+def test_fused_phash_matches_imagehash_on_shared_base(sample_image):
+    fused = features.compute_phash_features(sample_image)
+    expected = reference_features(sample_image)
+    assert fused["phash"] == fused["phash_32"] == expected["phash"]
+    assert fused["phash_128"] == expected["phash_128"]
+    assert fused["phash_512"] == expected["phash_512"]
+    assert fused["grid_phash"] == expected["grid_phash"]
+    assert fused[features.PHASH_VERSION_KEY] == features.FUSED_PHASH_VERSION
+
+
+def test_phash_512_matches_direct_imagehash(sample_image):
+    # 共用縮圖就是 imagehash.phash(hash_size=32) 的輸入，最大尺寸與舊版逐位元相同
+    fused = features.compute_phash_features(sample_image, hash_sizes=(32,), with_grid=False)
+    assert fused["phash_512"] == imagehash.phash(sample_image, hash_size=32).hash.tobytes()
+
+
+def test_phash_metadata_matches_fused_kernel(sample_image):
+    metadata = qr_engine._compute_phash_metadata(sample_image)
+    fused = features.compute_phash_features(sample_image)
+    for key in ("phash", "phash_128", "phash_512", "grid_phash", features.PHASH_VERSION_KEY):
+        assert metadata[key] == fused[key]
+
+
+@pytest.mark.parametrize("size", IMAGE_SIZES, ids=lambda s: f"{s[0]}x{s[1]}")
+def test_drift_from_legacy_definition_within_budget(size):
+    for seed in range(3):
+        image = page_image(size, seed)
+        fused = features.compute_phash_features(image, hash_sizes=(8, 16), with_grid=False)
+        legacy64 = str(imagehash.phash(image, hash_size=8))
+        legacy256 = imagehash.phash(image, hash_size=16).hash
+        assert features.hex_hamming(fused["phash"], legacy64) <= LEGACY_PHASH64_BUDGET
+        drift256 = int(np.count_nonzero(np.frombuffer(fused["phash_128"], dtype=bool) != legacy256.reshape(-1)))
+        assert drift256 <= LEGACY_PHASH256_BUDGET
+
+
+@pytest.mark.parametrize("mode", ["L", "RGBA", "P", "CMYK"])
+def test_fused_phash_matches_reference_for_other_modes(mode):
+    for image in (noise_image((97, 131), 3, mode), page_image((300, 200), 4, mode)):
+        fused = features.compute_phash_features(image, hash_sizes=(8, 16, 32))
+        expected = reference_features(image)
+        for key in ("phash", "phash_128", "phash_512", "grid_phash"):
+            assert fused[key] == expected[key]
+
+
+def test_main_phash_matches_full_metadata():
+    # QR 命中圖只算主 pHash，必須與完整特徵同版本、同值
+    image = page_image((517, 733), 0)
+    main = qr_engine._compute_main_phash(image)
+    full = qr_engine._compute_phash_metadata(image)
+    assert main["phash"] == full["phash"]
+    assert main[features.PHASH_VERSION_KEY] == full[features.PHASH_VERSION_KEY]
+
+
+def test_cached_phash_version_defaults_to_legacy():
+    assert features.cached_phash_version({"phash": "00"}) == features.LEGACY_PHASH_VERSION
+    assert features.cached_phash_version({features.PHASH_VERSION_KEY: 2}) == 2
+    assert features.phash_feature_version() == features.FUSED_PHASH_VERSION
@@ -0,0 +1,51 @@
+# ======================================================================
+# 檔案名稱：tests/test_phash_version.py
+# 模組目的：快取中不同 pHash 特徵版本 (含舊版重新旋轉計算的旋轉變體) 不得被視為命中而混用
+# ======================================================================
+
+import pytest
+
+pytest.importorskip("imagehash")
+features = pytest.importorskip("core.features")
+core_engine = pytest.importorskip("core_engine")
+
+FULL = core_engine.FEATURE_PHASH | core_engine.FEATURE_QR
+
+
+def has_required(entry, data_key):
+    engine = object.__new__(core_engine.ImageComparisonEngine)
+    return engine._has_required_features(entry, data_key)
+
+
+def entry(version=None, **extra):
+    data = {"phash": "8f00ff00ff00ff00", "features_at": FULL, "qr_points": None, **extra}
+    if version is not None:
+        data[features.PHASH_VERSION_KEY] = version
+    return data
+
+
+@pytest.mark.parametrize("data_key", ["phash", "qr_points", "qr_fused"])
+def test_current_version_is_a_hit(data_key):
+    assert has_required(entry(features.phash_feature_version()), data_key)
+
+
+@pytest.mark.parametrize("data_key", ["phash", "qr_points", "qr_fused"])
+def test_legacy_or_unversioned_phash_is_a_miss(data_key):
+    if features.phash_feature_version() == features.LEGACY_PHASH_VERSION:
+        pytest.skip("融合核心不可用時舊版即為目前版本")
+    rotations = {"phash_rotations": {"90": "00" * 8}, "grid_rotations": {}}
+    assert not has_required(entry(None, **rotations), data_key)
+    assert not has_required(entry(features.LEGACY_PHASH_VERSION), data_key)
+
+
+def test_entry_without_phash_is_unaffected_by_version():
+    # 非彩圖的 QR 快取沒有 pHash，版本不影響命中
+    assert has_required({"features_at": core_engine.FEATURE_QR, "qr_points": None, "is_colorful": False}, "qr_fused")
+
+
+def test_worker_results_carry_current_version():
+    from PIL import Image
+    from processors import qr_engine
+
+    image = Image.new("RGB", (64, 64), (30, 60, 90))
+    assert qr_engine._compute_phash_metadata(image, use_rotation=True)[features.PHASH_VERSION_KEY] == features.phash_feature_version()
@@ -0,0 +1,74 @@
+# ======================================================================
+# 檔案名稱：tests/test_popcount.py
+# 模組目的：各 popcount 後端與逐元素 bin().count("1") 結果相同 (含 out / scratch 重用與非連續輸入)
+# ======================================================================
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from core import popcount as popcount_mod
+
+BACKENDS = popcount_mod.available_backends()
+EDGE_VALUES = [0, 1, 2**63, 2**64 - 1, 0x5555555555555555, 0xAAAAAAAAAAAAAAAA, 0x0F0F0F0F0F0F0F0F, 0x8000000000000001]
+
+
+def reference(values):
+    return np.vectorize(lambda v: bin(int(v)).count("1"), otypes=[np.uint8])(values)
+
+
+def sample(shape, seed=0):
+    values = np.random.default_rng(seed).integers(0, 2**64, size=shape, dtype=np.uint64, endpoint=False)
+    flat = values.reshape(-1)
+    flat[: len(EDGE_VALUES)] = np.array(EDGE_VALUES, dtype=np.uint64)[: flat.size]
+    return values
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(popcount_mod, "BACKEND", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("shape", [(1,), (9,), (1000,), (33, 17), (4, 5, 6)])
+def test_backend_matches_reference(backend, shape):
+    values = sample(shape)
+    assert np.array_equal(popcount_mod.popcount(values), reference(values))
+
+
+def test_buffers_are_reused(backend):
+    values = sample((64, 64), seed=1)
+    out = np.empty(values.shape, dtype=np.uint8)
+    scratch = popcount_mod.scratch_for(values.shape)
+    for seed in (1, 2):
+        values = sample((64, 64), seed=seed)
+        result = popcount_mod.popcount(values, out=out, scratch=scratch)
+        assert result is out
+        assert np.array_equal(out, reference(values))
+
+
+def test_non_contiguous_and_signed_input(backend):
+    values = sample((40, 30), seed=3)
+    assert np.array_equal(popcount_mod.popcount(values.T), reference(values.T))
+    assert np.array_equal(popcount_mod.popcount(values[::3, 1::2]), reference(values[::3, 1::2]))
+    signed = np.array([-1, 0, 5, -(2**63)], dtype=np.int64)
+    assert popcount_mod.popcount(signed).tolist() == [64, 0, 2, 1]
+
+
+def test_xor_popcount_broadcasts(backend):
+    rows = sample((12, 1), seed=4)
+    cols = sample((1, 20), seed=5)
+    expected = reference(np.bitwise_xor(rows, cols))
+    assert np.array_equal(popcount_mod.xor_popcount(rows, cols), expected)
+    xor_out = np.empty((12, 20), dtype=np.uint64)
+    assert np.array_equal(popcount_mod.xor_popcount(rows, cols, xor_out=xor_out), expected)
+
+
+def test_out_shape_mismatch_and_unknown_backend():
+    with pytest.raises(ValueError):
+        popcount_mod.popcount(sample((8,)), out=np.empty(7, dtype=np.uint8))
+    with pytest.raises(ValueError):
+        popcount_mod.set_backend("no-such-backend")
+
+
+def test_backends_agree_in_benchmark():
+    assert all(report["matches"] for report in popcount_mod.benchmark_backends(n=4096, repeats=1))
@@ -0,0 +1,102 @@
+# ======================================================================
+# 檔案名稱：tests/test_qr_cascade.py
+# 模組目的：QR 偵測串聯的召回率 (大頁面上的小型 QR 不可被定位圖案閘門擋掉) 與各階段統計
+# ======================================================================
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+if not hasattr(cv2, "QRCodeEncoder"):
+    pytest.skip("需要 cv2.QRCodeEncoder 產生測試用 QR", allow_module_level=True)
+
+from PIL import Image
+
+from config import default_config
+from processors import qr_cascade
+from processors.qr_cascade import QR_STAGE_ORDER, QrCascade, format_stage_stats, merge_stage_stats
+
+RESIZE_SIZE = 1000
+
+
+def page_with_qr(size=(2400, 3400), qr_px=None, seed=0):
+    """漸層底色加隨機色塊的頁面；qr_px 指定時在右下角貼一個該邊長的 QR (含白邊)。"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    arr = np.stack([xx * 255 // width, yy * 255 // height, ((xx + yy) // 7) % 256], axis=-1).astype(np.uint8)
+    for _ in range(30):
+        x0, y0 = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 200))
+        arr[y0:y0 + int(rng.integers(20, 200)), x0:x0 + int(rng.integers(20, 200))] = rng.integers(0, 256, size=3)
+    if qr_px:
+        code = cv2.QRCodeEncoder.create().encode("https://example.com/ad/12345")
+        code = cv2.resize(code, (qr_px, qr_px), interpolation=cv2.INTER_NEAREST)
+        code = cv2.copyMakeBorder(code, 8, 8, 8, 8, cv2.BORDER_CONSTANT, value=255)
+        side = code.shape[0]
+        arr[height - side - 40:height - 40, width - side - 40:width - 40] = code[..., None]
+    return Image.fromarray(arr, "RGB")
+
+
+def detect(cascade, page):
+    thumb = page.copy()
+    thumb.thumbnail((RESIZE_SIZE, RESIZE_SIZE), Image.Resampling.LANCZOS)
+    return cascade.detect(thumb, full_img=page)
+
+
+def test_default_config_order_is_the_cascade_default():
+    assert tuple(default_config["qr_stage_order"]) == QR_STAGE_ORDER
+    assert QR_STAGE_ORDER[0] == "finder" and "roi" in QR_STAGE_ORDER
+
+
+@pytest.mark.parametrize("qr_px", [60, 90])
+def test_small_qr_on_large_page_found_with_default_order(qr_px):
+    page = page_with_qr(qr_px=qr_px)
+    thumb = page.copy()
+    thumb.thumbnail((RESIZE_SIZE, RESIZE_SIZE), Image.Resampling.LANCZOS)
+    # 前提：縮圖上解析不出定位圖案，只有原解析度才看得到
+    assert qr_cascade.count_finder_candidates(np.array(thumb.convert("L"))) == 0
+    cascade = QrCascade(default_config["qr_stage_order"])
+    points = cascade.detect(thumb, full_img=page)
+    assert points
+    assert cascade.stats["finder"] == pytest.approx({"calls": 1, "hits": 0, "seconds": cascade.stats["finder"]["seconds"]})
+    assert cascade.stats["roi"]["hits"] == 1
+    # ROI 座標位於原圖座標系，應落在右下角的 QR 上
+    xs = [p[0] for p in points[0]]
+    assert min(xs) > page.width - qr_px - 100
+
+
+def test_finder_rejects_on_thumbnail_without_roi():
+    # 不含 roi 的順序維持原本行為：縮圖看不到定位圖案即拒絕
+    cascade = QrCascade(["finder", "opencv"])
+    assert detect(cascade, page_with_qr(qr_px=60)) is None
+    assert cascade.stats["finder"]["hits"] == 1
+    assert "opencv" not in cascade.stats
+
+
+def test_stage_counters_for_rejected_and_found_pages():
+    cascade = QrCascade(["finder", "opencv", "roi"])
+    pages = [page_with_qr(seed=1), page_with_qr(seed=2), page_with_qr(qr_px=600, seed=3)]
+    results = [detect(cascade, page) for page in pages]
+    assert [bool(r) for r in results] == [False, False, True]
+    stats = cascade.stats
+    # finder 的 hits 為拒絕頁數；大型 QR 在縮圖上即被頁面解碼命中，不會進入 roi
+    assert stats["finder"]["calls"] == 3 and stats["finder"]["hits"] == 2
+    assert stats["opencv"]["calls"] == 1 and stats["opencv"]["hits"] == 1
+    assert "roi" not in stats
+
+
+def test_stage_counters_when_page_decode_misses():
+    cascade = QrCascade(["opencv", "roi"])
+    assert detect(cascade, page_with_qr(qr_px=60)) is not None
+    stats = cascade.stats
+    assert stats["roi"] == pytest.approx({"calls": 1, "hits": 1, "seconds": stats["roi"]["seconds"]})
+    # 頁面解碼一次 (未命中) + 每個 ROI 區塊各一次，最後一次命中
+    assert stats["opencv"]["calls"] >= 2 and stats["opencv"]["hits"] == 1
+
+
+def test_merge_and_format_stage_stats():
+    total = {}
+    merge_stage_stats(total, {"finder": {"calls": 2, "hits": 1, "seconds": 0.5}})
+    merge_stage_stats(total, {"finder": {"calls": 1, "hits": 1, "seconds": 0.25}, "opencv": {"calls": 1, "hits": 0, "seconds": 0.1}})
+    assert total["finder"] == {"calls": 3, "hits": 2, "seconds": 0.75}
+    assert format_stage_stats(total) == "finder(calls=3, rejects=2, ms=750), opencv(calls=1, hits=0, ms=100)"
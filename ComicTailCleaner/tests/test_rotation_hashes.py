@@ -0,0 +1,66 @@
+# ======================================================================
+# 檔案名稱：tests/test_rotation_hashes.py
+# 模組目的：由 DCT 係數推導的旋轉 pHash / Grid 與直接對旋轉圖計算結果 (同一特徵版本) 的位元差預算
+# ======================================================================
+
+import numpy as np
+import pytest
+
+features = pytest.importorskip("core.features")
+if not features.fused_kernel_available():
+    pytest.skip("融合核心需要 numpy / Pillow / scipy", allow_module_level=True)
+
+from synthetic import IMAGE_SIZES, low_saturation_image, noise_image, page_image
+
+# 位元差預算 (64-bit 雜湊)。180 度只是係數變號，必須逐位元一致；
+# 90/270 度的差異來自縮圖時水平/垂直兩趟的 uint8 捨入順序對調，實測主 pHash ≤ 8、紋理圖 Grid 單格 ≤ 6 / 平均 ≤ 1.5
+MAIN_BUDGET = 10
+TEXTURE_GRID_BLOCK_BUDGET = 8
+TEXTURE_GRID_MEAN_BUDGET = 2.0
+# 純線性漸層格的 AC 係數幾乎全部相等，中位數門檻附近的位元會被捨入誤差翻轉 (實測單格最多 22、平均 ≤ 5)，只檢查平均
+PAGE_GRID_MEAN_BUDGET = 8.0
+
+
+def rotation_distances(image, angle):
+    fused = features.compute_phash_features(image, with_rotations=True)
+    rotated = features.compute_phash_features(image.rotate(angle, expand=True))
+    main = features.hex_hamming(fused["phash_rotations"][str(angle)], rotated["phash"])
+    expected_grid = rotated["grid_phash"]
+    actual_grid = fused["grid_rotations"][str(angle)]
+    assert len(actual_grid) == len(expected_grid)
+    grid = [features.hex_hamming(a, b) for a, b in zip(actual_grid, expected_grid)]
+    return main, grid
+
+
+def test_rotation_180_is_exact(sample_image):
+    main, grid = rotation_distances(sample_image, 180)
+    assert main == 0
+    assert not any(grid)
+
+
+@pytest.mark.parametrize("angle", [90, 270])
+@pytest.mark.parametrize("size", IMAGE_SIZES, ids=lambda s: f"{s[0]}x{s[1]}")
+@pytest.mark.parametrize("generator", [noise_image, low_saturation_image], ids=["noise", "low_saturation"])
+def test_quarter_rotation_within_budget_textured(generator, size, angle):
+    for seed in range(3):
+        main, grid = rotation_distances(generator(size, seed), angle)
+        assert main <= MAIN_BUDGET
+        if grid:
+            assert max(grid) <= TEXTURE_GRID_BLOCK_BUDGET
+            assert np.mean(grid) <= TEXTURE_GRID_MEAN_BUDGET
+
+
+@pytest.mark.parametrize("angle", [90, 270])
+@pytest.mark.parametrize("size", IMAGE_SIZES, ids=lambda s: f"{s[0]}x{s[1]}")
+def test_quarter_rotation_within_budget_page(size, angle):
+    for seed in range(3):
+        main, grid = rotation_distances(page_image(size, seed), angle)
+        assert main <= MAIN_BUDGET
+        if grid:
+            assert np.mean(grid) <= PAGE_GRID_MEAN_BUDGET
+
+
+def test_rotation_keys_and_small_image_grid():
+    fused = features.compute_phash_features(noise_image((20, 28), 0), with_rotations=True)
+    assert sorted(fused["phash_rotations"]) == ["180", "270", "90"]
+    assert all(fused["grid_rotations"][str(angle)] == [] for angle in features.ROTATION_ANGLES)
@@ -0,0 +1,106 @@
+# ======================================================================
+# 檔案名稱：tests/test_snapshot_funnel.py
+# 模組目的：Phase B-E 由雜湊快照取 HSV / wHash 時，結果與逐筆讀 file_data 相同
+# ======================================================================
+
+import random
+
+import numpy as np
+import pytest
+
+similarity_flow = pytest.importorskip("core.similarity_flow")
+from processors.hash_snapshot import HashSnapshot, build_snapshot
+
+
+class Flow(similarity_flow.SimilarityFlowMixin):
+    def __init__(self, file_data):
+        self.config = {}
+        self.file_data = file_data
+
+
+def gallery(count=60, seed=0):
+    rng = random.Random(seed)
+    base_hsv = (rng.random() * 360, rng.random(), rng.random())
+    data = {}
+    for i in range(count):
+        # 一半與基準色相近，使顏色閘兩種結果都會出現
+        if i % 2:
+            hsv = (base_hsv[0] + rng.uniform(-10, 10), base_hsv[1], base_hsv[2] + rng.uniform(-0.05, 0.05))
+        else:
+            hsv = (rng.random() * 360, rng.random(), rng.random())
+        data[f"/lib/vol{i % 3}/{i:03d}.jpg"] = {
+            'avg_hsv': tuple(float(np.float32(x)) for x in hsv),
+            'whash': f"{rng.getrandbits(64):016x}" if i % 7 else f"{0xFFFF << (i % 48):016x}",
+        }
+    return data
+
+
+def snapshot_of(tmp_path, data, drop_hsv=(), drop_whash=(), absent=()):
+    """建立快照；drop_* 的列寫入缺值 (模擬快照之後才由 Phase B / D 補算)，absent 的路徑不放入快照。"""
+    paths = [p for p in data if p not in absent]
+    hsv = np.array([data[p]['avg_hsv'] if p not in drop_hsv else (np.nan,) * 3 for p in paths], dtype=np.float64)
+    whash = np.array([int(data[p]['whash'], 16) if p not in drop_whash else 0 for p in paths], dtype=np.uint64)
+    arrays = {
+        'paths': paths,
+        'phash': np.zeros(len(paths), dtype=np.uint64),
+        'whash': whash,
+        'hsv': hsv.reshape(len(paths), 3),
+        'grid': np.zeros((len(paths), 16), dtype=np.uint64),
+        'dims': np.zeros((len(paths), 2), dtype=np.uint32),
+    }
+    directory = str(tmp_path / "gallery.snapshot")
+    build_snapshot(directory, arrays)
+    return HashSnapshot.open(directory)
+
+
+def candidates_for(paths, seed=0):
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(200):
+        a, b = rng.sample(paths, 2)
+        pairs.append((a, a, b, rng.uniform(0.55, 0.99), rng.random() < 0.1))
+    return pairs
+
+
+GATE = Flow({})._build_color_gate_params(90.0)
+
+
+@pytest.mark.parametrize("left_in_gallery", [True, False])
+def test_snapshot_reads_match_dict_reads(tmp_path, left_in_gallery):
+    data = gallery()
+    paths = list(data)
+    snapshot = snapshot_of(tmp_path, data, drop_hsv=paths[::5], drop_whash=paths[::6], absent=paths[::11])
+    candidates = candidates_for(paths)
+
+    with_dicts = Flow(data)
+    with_snapshot = Flow(data)
+    stats_a, stats_b = {'passed_color': 0, 'entered_whash': 0}, {'passed_color': 0, 'entered_whash': 0}
+    color_a = with_dicts._filter_candidates_by_color(candidates, GATE, True, stats_a)
+    color_b = with_snapshot._filter_candidates_by_color(
+        candidates, GATE, True, stats_b, gallery_snapshot=snapshot, left_in_gallery=left_in_gallery
+    )
+    assert color_a == color_b
+    assert 0 < len(color_a) < len(candidates)
+
+    final_a = with_dicts._select_final_matches(color_a, 0.8, True, stats_a, 0.0)
+    final_b = with_snapshot._select_final_matches(
+        color_b, 0.8, True, stats_b, 0.0, gallery_snapshot=snapshot, left_in_gallery=left_in_gallery
+    )
+    assert final_a == final_b
+    assert stats_a == stats_b
+    snapshot.close()
+
+
+def test_snapshot_covered_paths_skip_feature_loading(tmp_path):
+    data = gallery(count=12)
+    paths = list(data)
+    snapshot = snapshot_of(tmp_path, data, drop_hsv=[paths[0]], drop_whash=[paths[1]], absent=[paths[2]])
+    gallery_cache, ad_cache = object(), object()
+    cache_map = {p: gallery_cache for p in paths}
+    cache_map[paths[3]] = ad_cache
+    flow = Flow(data)
+
+    assert flow._drop_snapshot_covered(paths, cache_map, gallery_cache, snapshot, 'hsv') == [paths[0], paths[2], paths[3]]
+    assert flow._drop_snapshot_covered(paths, cache_map, gallery_cache, snapshot, 'whash') == [paths[1], paths[2], paths[3]]
+    assert flow._drop_snapshot_covered(paths, cache_map, gallery_cache, None, 'hsv') == paths
+    snapshot.close()
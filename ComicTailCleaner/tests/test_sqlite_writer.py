@@ -0,0 +1,88 @@
+# ======================================================================
+# 檔案名稱：tests/test_sqlite_writer.py
+# 模組目的：背景寫入執行緒在單一批次一再提交失敗時隔離該批次，之後的寫入照常進行
+# ======================================================================
+
+import sqlite3
+
+import pytest
+
+scanner = pytest.importorskip("processors.scanner")
+
+
+class PoisonTable(scanner.SQLiteCacheBase):
+    """含 "poison" 鍵的交易一律失敗，模擬無法寫入的資料列。"""
+
+    def _write_patches_upsert(self, merged, conn):
+        if any("poison" in key for key in merged):
+            raise sqlite3.IntegrityError("poisoned row")
+        return super()._write_patches_upsert(merged, conn)
+
+    def _write_patches_read_merge(self, merged, conn):
+        if any("poison" in key for key in merged):
+            raise sqlite3.IntegrityError("poisoned row")
+        return super()._write_patches_read_merge(merged, conn)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = PoisonTable(str(tmp_path / "writer.db"), "images")
+    yield cache
+    cache.close()
+
+
+def committed(cache, path):
+    key = scanner._norm_key(path)
+    return cache.conn.execute(f"SELECT 1 FROM {cache.table_name} WHERE path = ?", (key,)).fetchone() is not None
+
+
+def submit(cache, updates):
+    with cache._pending_lock:
+        for path, data in updates.items():
+            cache.update_data(path, data)
+        cache._submit_pending()
+
+
+def test_poison_batch_is_quarantined_after_max_attempts(cache, monkeypatch):
+    errors = []
+    monkeypatch.setattr(scanner, "log_error", lambda message, *args: errors.append(message))
+    submit(cache, {"/lib/a/before.jpg": {"width": 1}})
+    submit(cache, {"/lib/a/poison.jpg": {"width": 2}})
+    submit(cache, {"/lib/a/after.jpg": {"width": 3}})
+    cache.save_cache()
+
+    # 壞批次之前的批次已提交；之後的批次排在它後面等待，讀取仍看得到
+    assert committed(cache, "/lib/a/before.jpg")
+    assert not committed(cache, "/lib/a/after.jpg")
+    assert cache.get_data("/lib/a/after.jpg")["width"] == 3
+
+    for _ in range(scanner.WRITER_MAX_ATTEMPTS - 1):
+        cache.save_cache()
+    # 隔離後屏障不再等待、後續批次已寫入，壞批次不再疊加於讀取
+    assert committed(cache, "/lib/a/after.jpg")
+    assert cache.get_data("/lib/a/poison.jpg") is None
+    assert cache._inflight == []
+    assert any("dropped 1 updates" in message and "poison" in message for message in errors)
+
+    cache.update_data("/lib/a/later.jpg", {"width": 4})
+    cache.save_cache()
+    assert committed(cache, "/lib/a/later.jpg")
+
+
+def test_transient_failure_is_retried_in_order(cache, monkeypatch):
+    failures = iter([True, True])
+    original = cache._commit_batches
+
+    def flaky(conn, batches):
+        if next(failures, False):
+            return False
+        return original(conn, batches)
+
+    monkeypatch.setattr(cache, "_commit_batches", flaky)
+    submit(cache, {"/lib/a/001.jpg": {"width": 1}})
+    submit(cache, {"/lib/a/001.jpg": {"width": 2}})
+    cache.save_cache()
+    cache.save_cache()
+    assert committed(cache, "/lib/a/001.jpg")
+    assert cache.get_data("/lib/a/001.jpg")["width"] == 2
+    assert cache._inflight == []
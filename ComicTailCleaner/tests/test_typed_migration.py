@@ -0,0 +1,131 @@
+# ======================================================================
+# 檔案名稱：tests/test_typed_migration.py
+# 模組目的：型別化欄位線上遷移可重複執行、可中斷續跑，且不改變讀取結果
+# ======================================================================
+
+import json
+import random
+import sqlite3
+
+import pytest
+
+scanner = pytest.importorskip("processors.scanner")
+
+
+class ImageTable(scanner.SQLiteCacheBase):
+    TYPED_COLUMNS = True
+
+
+def legacy_rows(count=40, seed=0):
+    """舊版 schema 的資料列：特徵全在 data JSON，另含損毀 JSON 與無法型別化的值。"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        data = {
+            "phash": f"{rng.getrandbits(64):016x}",
+            "whash": rng.choice([f"{rng.getrandbits(64):016x}", None, "not-a-hash"]),
+            "avg_hsv": [rng.random() * 360, rng.random(), rng.random()],
+            "grid_phash": rng.choice([[f"{rng.getrandbits(64):016x}" for _ in range(16)], ["short"]]),
+            "features_at": rng.randrange(1, 4),
+            "width": rng.randrange(100, 3000),
+            "height": rng.randrange(100, 3000),
+            "qd64": rng.getrandbits(60),
+            "qr_points": None,
+        }
+        rows.append((f"/lib/vol{i % 4}/{i:03d}.jpg", f"/lib/vol{i % 4}", json.dumps(data), None, None, None, float(i)))
+    rows.append(("/lib/broken.jpg", "/lib", "{not json", None, None, None, 1.0))
+    return rows
+
+
+def make_legacy_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE images (path TEXT PRIMARY KEY, folder_path TEXT, data TEXT, "
+        "phash_32 TEXT, phash_128 BLOB, phash_512 BLOB, mtime REAL)"
+    )
+    conn.executemany("INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def table_state(cache):
+    columns = [row[1] for row in cache.conn.execute("PRAGMA table_info(images)")]
+    return {row[0]: row for row in cache.conn.execute(f"SELECT {', '.join(columns)} FROM images")}
+
+
+def reads(cache, rows):
+    """讀取結果；值為 None 的特徵遷移後改為欄位 NULL、不再出現在 dict 中，對 .get() 而言相同，比較時略過。"""
+    return {
+        key: {k: str(v) for k, v in data.items() if v is not None}
+        for key, data in cache.get_many([r[0] for r in rows]).items()
+    }
+
+
+def test_migration_is_idempotent(tmp_path):
+    rows = legacy_rows()
+    db = str(tmp_path / "legacy.db")
+    make_legacy_db(db, rows)
+    cache = ImageTable(db, "images")
+    before = reads(cache, rows)
+
+    migrated, finished = cache.migrate_typed_columns()
+    assert (migrated, finished) == (len(rows), True)
+    state = table_state(cache)
+    assert reads(cache, rows) == before
+    assert {row[-1] for row in cache.conn.execute("SELECT row_format FROM images")} == {scanner.TYPED_ROW_FORMAT}
+
+    # 再跑一次不會選到任何資料列，也不改動內容
+    assert cache.migrate_typed_columns() == (0, True)
+    assert table_state(cache) == state
+    cache.close()
+
+    # 重新開啟 (加欄位、再次遷移) 同樣不變
+    reopened = ImageTable(db, "images")
+    assert reopened.migrate_typed_columns() == (0, True)
+    assert table_state(reopened) == state
+    assert reads(reopened, rows) == before
+    reopened.close()
+
+
+def test_interrupted_migration_resumes_to_the_same_result(tmp_path):
+    rows = legacy_rows(seed=1)
+    one_shot_db, resumed_db = str(tmp_path / "one.db"), str(tmp_path / "resumed.db")
+    make_legacy_db(one_shot_db, rows)
+    make_legacy_db(resumed_db, rows)
+
+    one_shot = ImageTable(one_shot_db, "images")
+    one_shot.migrate_typed_columns()
+    expected = table_state(one_shot)
+    one_shot.close()
+
+    resumed = ImageTable(resumed_db, "images")
+    before = reads(resumed, rows)
+    passes = 0
+    while True:
+        passes += 1
+        # 每次開啟只給極短的時間預算：處理一批就停下
+        migrated, finished = resumed.migrate_typed_columns(batch_size=5, time_budget=1e-9)
+        if finished:
+            break
+        assert migrated == 5
+        # 未遷移與已遷移的資料列混在一起時讀取結果不變
+        assert reads(resumed, rows) == before
+    assert passes > 1
+    assert table_state(resumed) == expected
+    resumed.close()
+
+
+def test_typed_column_written_before_migration_wins(tmp_path):
+    rows = legacy_rows(count=3, seed=2)
+    db = str(tmp_path / "mixed.db")
+    make_legacy_db(db, rows)
+    cache = ImageTable(db, "images")
+    path = rows[0][0]
+    # 遷移前已由新格式寫入 phash 欄位 (row_format 仍為 NULL)
+    cache.conn.execute("UPDATE images SET phash_64 = ? WHERE path = ?", (scanner._hash_to_int64("00000000000000ff"), path))
+    cache.conn.commit()
+    cache.migrate_typed_columns()
+    assert str(cache.get_data(path)["phash"]) == "00000000000000ff"
+    assert cache.migrate_typed_columns() == (0, True)
+    assert str(cache.get_data(path)["phash"]) == "00000000000000ff"
+    cache.close()
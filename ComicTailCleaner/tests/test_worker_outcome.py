@@ -0,0 +1,66 @@
+# ======================================================================
+# 檔案名稱：tests/test_worker_outcome.py
+# 模組目的：主進程處理 worker 結果時不得重讀檔案補算 qd64
+# ======================================================================
+
+import pytest
+
+pytest.importorskip("imagehash")
+core_engine = pytest.importorskip("core_engine")
+from core import cache_flow
+
+
+class RecordingCache:
+    def __init__(self):
+        self.updates = {}
+
+    def update_data(self, path, data):
+        self.updates.setdefault(path, {}).update(data)
+
+    def remove_data(self, path):
+        self.updates.pop(path, None)
+
+
+def bare_engine(**config):
+    engine = object.__new__(core_engine.ImageComparisonEngine)
+    engine.config = {"enable_content_feature_store": False, **config}
+    engine.failed_tasks = []
+    engine.cache_stats = {}
+    engine.file_identity_map = {}
+    engine.completed_task_count = 0
+    return engine
+
+
+@pytest.fixture
+def no_main_thread_digest(monkeypatch):
+    def forbidden(path):
+        raise AssertionError(f"主進程不應重讀檔案計算 qd64: {path}")
+    monkeypatch.setattr(cache_flow, "_calculate_quick_digest", forbidden)
+
+
+def handle(engine, cache, path, data):
+    local = {}
+    engine._handle_worker_outcome(path, True, (path, data), cache, local, {}, "global", 0)
+    return local
+
+
+@pytest.mark.parametrize("path", ["C:/comics/a/001.jpg", "zip://C:/comics/b.zip!inner/001.jpg"])
+def test_missing_worker_digest_is_left_empty(no_main_thread_digest, path):
+    engine, cache = bare_engine(), RecordingCache()
+    local = handle(engine, cache, path, {"phash": "00ff00ff00ff00ff", "mtime": 1.0, "size": 10})
+    assert "qd64" not in cache.updates[path]
+    assert "qd64" not in local[path]
+    assert not engine.failed_tasks
+
+
+def test_worker_digest_is_stored(no_main_thread_digest):
+    engine, cache = bare_engine(), RecordingCache()
+    handle(engine, cache, "C:/comics/a/001.jpg", {"phash": "00", "qd64": "abcd", "content_size": 10})
+    assert cache.updates["C:/comics/a/001.jpg"]["qd64"] == "abcd"
+    assert "content_size" not in cache.updates["C:/comics/a/001.jpg"]
+
+
+def test_worker_digest_dropped_when_quick_digest_disabled(no_main_thread_digest):
+    engine, cache = bare_engine(enable_quick_digest=False), RecordingCache()
+    handle(engine, cache, "C:/comics/a/001.jpg", {"phash": "00", "qd64": "abcd"})
+    assert "qd64" not in cache.updates["C:/comics/a/001.jpg"]
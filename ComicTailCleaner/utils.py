@@ -10,10 +10,11 @@ import datetime
 import traceback
 import json
 import io
-import colorsys
 import subprocess
 import threading
+import time
 import re
+from contextlib import contextmanager
 from typing import Union, Optional, Tuple
 from config import INFO_LOG_FILE, ERROR_LOG_FILE, DATA_DIR, LOG_DIR
 
@@ -113,21 +114,39 @@ def _auto_crop_white_borders(img: "Image.Image", tolerance: int = 240) -> "Image
     return img
 
 # --- 【v1.2.0 新增】 ---
+QUICK_DIGEST_BYTES = 65536
+# worker 開圖時順手算好的 qd64 存放於 img.info 的這個鍵，免去主進程再讀一次檔
+QUICK_DIGEST_INFO_KEY = "quick_digest"
+# 圖片內容本身的位元組數 (壓縮檔內圖片為成員大小而非壓縮檔大小)，與 qd64 組成內容定址鍵
+CONTENT_SIZE_INFO_KEY = "content_size"
+
+
+def _quick_digest_from_bytes(data) -> Optional[str]:
+    if not xxhash or data is None:
+        return None
+    return xxhash.xxh64(memoryview(data)[:QUICK_DIGEST_BYTES]).hexdigest()
+
+
+def _image_quick_digest(img) -> Optional[str]:
+    """取出 _open_image_from_any_path 開圖時一併計算的 qd64；外部傳入的圖片沒有則回傳 None。"""
+    info = getattr(img, "info", None)
+    return info.get(QUICK_DIGEST_INFO_KEY) if info else None
+
+
+def _image_content_size(img) -> Optional[int]:
+    info = getattr(img, "info", None)
+    return info.get(CONTENT_SIZE_INFO_KEY) if info else None
+
+
 def _calculate_quick_digest(path: str) -> Optional[str]:
     """Hash only the first 64KB to avoid loading the whole file into memory."""
     if not xxhash:
         return None
     try:
-        hasher = xxhash.xxh64()
         if _is_virtual_path(path):
-            data = _open_image_from_any_path(path, read_bytes=True)
-            if data is None:
-                return None
-            hasher.update(data[:65536])
-        else:
-            with open(path, 'rb') as f:
-                hasher.update(f.read(65536))
-        return hasher.hexdigest()
+            return _quick_digest_from_bytes(_open_image_from_any_path(path, read_bytes=True))
+        with open(path, 'rb') as f:
+            return _quick_digest_from_bytes(f.read(QUICK_DIGEST_BYTES))
     except Exception:
         return None
 # --- 輔助功能 ---
@@ -416,37 +435,161 @@ def _sanitize_path_for_filename(path: str) -> str:
     sanitized = re.sub(r'[\\/*?:"<>|]', '_', basename)
     return sanitized
 
-def _open_image_from_any_path(path: str, read_bytes: bool = False) -> Optional[Union[Image.Image, bytes]]:
-    if Image is None:
+# === 依裝置限流的讀檔閘門 (由 core.io_scheduler 規劃，於 worker 內安裝) ===
+_IO_GATES_ID = None
+_IO_GATES = {}
+_IO_STATS = {}
+
+
+def install_io_gates(gates) -> None:
+    """gates 為 (plan_id, {st_dev: Semaphore}) 或 None；同一規劃重複安裝時沿用既有連線。"""
+    global _IO_GATES_ID, _IO_GATES
+    plan_id, mapping = gates if gates else (None, {})
+    if plan_id == _IO_GATES_ID:
+        return
+    _IO_GATES_ID, _IO_GATES = plan_id, dict(mapping)
+
+
+def drain_io_stats() -> dict:
+    """取出並清空本進程累計的 {st_dev: [files, bytes, busy_seconds, wait_seconds]}。"""
+    global _IO_STATS
+    stats, _IO_STATS = _IO_STATS, {}
+    return stats
+
+
+def _io_device(path: str) -> Optional[int]:
+    real_path = _parse_virtual_path(path)[0] if _is_virtual_path(path) else path
+    try:
+        return os.stat(real_path).st_dev
+    except (OSError, TypeError, ValueError):
         return None
 
-    def _read_data():
+
+@contextmanager
+def _io_slot(dev: int):
+    """在所屬裝置的閘門內讀檔 (未限流的裝置直接放行)，並記錄等待 / 佔用時間與位元組數。"""
+    gate = _IO_GATES.get(dev)
+    waited = 0.0
+    if gate is not None:
+        t0 = time.perf_counter()
+        try:
+            gate.acquire()
+        except Exception:
+            # 閘門所屬的 Manager 已關閉 (例如上一輪掃描遺留)：放棄限流，照常讀檔
+            install_io_gates(None)
+            gate = None
+        waited = time.perf_counter() - t0
+    slot = {'bytes': 0}
+    started = time.perf_counter()
+    try:
+        yield slot
+    finally:
+        if gate is not None:
+            try:
+                gate.release()
+            except Exception:
+                pass
+        entry = _IO_STATS.setdefault(dev, [0, 0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += slot['bytes']
+        entry[2] += time.perf_counter() - started
+        entry[3] += waited
+
+
+def _read_image_bytes(path: str, dev: int) -> Optional[bytes]:
+    with _io_slot(dev) as slot:
         if _is_virtual_path(path):
             archive_path, inner_path = _parse_virtual_path(path)
+            data = None
             if archive_path and inner_path and archive_handler:
-                return archive_handler.get_image_bytes(archive_path, inner_path)
-            return None
-        if os.path.exists(path):
+                data = archive_handler.get_image_bytes(archive_path, inner_path)
+        else:
             with open(path, 'rb') as f:
-                return f.read()
-        return None
+                data = f.read()
+        slot['bytes'] = len(data) if data else 0
+    return data
 
-    try:
-        lock = getattr(sys.modules[__name__], 'SHARED_IO_LOCK', None)
-        if lock is not None:
-            with lock:
-                image_bytes = _read_data()
-        else:
-            image_bytes = _read_data()
 
+@contextmanager
+def _open_image_lazy(path: str):
+    """
+    延遲開啟圖片：只解析檔頭、尚未解碼，離開 with 區塊時關閉檔案。
+    開檔時一併以已讀入的檔頭計算 qd64，存於 img.info[QUICK_DIGEST_INFO_KEY]。
+    一般檔案直接以檔案把手串流解碼，不先讀成 bytes；呼叫端可在 load() 前呼叫 draft() 縮放解碼。
+    位於限流裝置 (機械硬碟) 的檔案則在閘門內整檔讀入後立即放行，解碼不佔用裝置名額。
+    """
+    if Image is None:
+        yield None
+        return
+
+    dev = _io_device(path)
+    if dev is None:
+        yield None
+        return
+
+    if _is_virtual_path(path) or dev in _IO_GATES:
+        image_bytes = _read_image_bytes(path, dev)
         if image_bytes is None:
+            yield None
+            return
+        digest = _quick_digest_from_bytes(image_bytes)
+        # BytesIO 以 bytes 初始化時共用緩衝，不會複製內容
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.info[QUICK_DIGEST_INFO_KEY] = digest
+            img.info[CONTENT_SIZE_INFO_KEY] = len(image_bytes)
+            yield img
+        return
+
+    with _io_slot(dev) as slot, open(path, 'rb') as f:
+        slot['bytes'] = os.fstat(f.fileno()).st_size
+        # 檔頭 64KB 解碼時本來就要讀，先取來算 qd64 再倒回開頭
+        digest = _quick_digest_from_bytes(f.read(QUICK_DIGEST_BYTES)) if xxhash else None
+        f.seek(0)
+        with Image.open(f) as img:
+            img.info[QUICK_DIGEST_INFO_KEY] = digest
+            img.info[CONTENT_SIZE_INFO_KEY] = slot['bytes']
+            yield img
+
+
+def _load_detached(img: Image.Image, draft_size: Optional[int] = None) -> Image.Image:
+    if draft_size and img.format == "JPEG":
+        # 讓 libjpeg 直接以 1/2、1/4、1/8 DCT 縮放解碼，短邊仍保證不小於 draft_size
+        source_size = img.size
+        img.draft(None, (draft_size, draft_size))
+        if img.size != source_size:
+            img.info["draft_source_size"] = source_size
+    img.load()
+    if getattr(img, "is_animated", False):
+        # 多影格圖片 load() 後仍持有檔案供 seek，需複製一份脫離檔案
+        return img.copy()
+    # 單影格 load() 後已不再引用檔案，直接回傳解碼結果，不再 copy()
+    return img
+
+
+def _open_image_from_any_path(path: str, read_bytes: bool = False, draft_size: Optional[int] = None) -> Optional[Union[Image.Image, bytes]]:
+    if Image is None:
+        return None
+
+    if read_bytes:
+        dev = _io_device(path)
+        if dev is None:
+            return None
+        try:
+            return _read_image_bytes(path, dev)
+        except (IOError, Exception):
             return None
-        if read_bytes:
-            return image_bytes
 
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            img.load()
-            return img.copy()
+    try:
+        with _open_image_lazy(path) as img:
+            if img is None:
+                return None
+            # 部分格式 load() 時會重設 info，先取出 qd64 與內容大小再補回
+            digest = img.info.get(QUICK_DIGEST_INFO_KEY)
+            content_size = img.info.get(CONTENT_SIZE_INFO_KEY)
+            loaded = _load_detached(img, draft_size)
+            loaded.info[QUICK_DIGEST_INFO_KEY] = digest
+            loaded.info[CONTENT_SIZE_INFO_KEY] = content_size
+            return loaded
     except (UnidentifiedImageError, IOError, Exception):
         return None
 
@@ -472,12 +615,8 @@ def hamming_from_sim(sim: float, bits: int) -> int:
 
 def _avg_hsv(img: Image.Image) -> Optional[Tuple[float, float, float]]:
     try:
-        import numpy as np
-        small = img.convert("RGB").resize((32, 32), Image.Resampling.BILINEAR)
-        arr = np.asarray(small, dtype=np.float32) / 255.0
-        hsv_arr = np.apply_along_axis(lambda p: colorsys.rgb_to_hsv(p[0], p[1], p[2]), 2, arr)
-        h, s, v = hsv_arr[:, :, 0], hsv_arr[:, :, 1], hsv_arr[:, :, 2]
-        return float(np.mean(h) * 360.0), float(np.mean(s)), float(np.mean(v))
+        from core.features import compute_color_features
+        return compute_color_features(img, with_colorful=False)["avg_hsv"]
     except (ImportError, ValueError, Exception):
         return None
 